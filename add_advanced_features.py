@@ -13,6 +13,7 @@ from datetime import date, timedelta
 from sqlalchemy import text
 
 from database import SessionLocal, engine
+from market_cache import bump_dates
 from models import Fixture, Feature
 
 print("=" * 100)
@@ -214,6 +215,7 @@ try:
         if updated_count % 10 == 0:
             print(f"   Aggiornate {updated_count}/{len(fixtures)} partite...")
 
+    bump_dates(db, {fix.date for fix in fixtures})  # invalida i mercati in cache di quelle date
     db.commit()
     print(f"\n✅ Features aggiornate per {updated_count} partite!")
 
@@ -11,16 +11,318 @@ Modulo per calcolare feature avanzate che migliorano predizioni ML:
 5. Home/Away Split (performance casa vs trasferta)
 
 Basato su analisi sistemi professionali (FiveThirtyEight, BetClan, etc.)
+
+Due modalità di lettura:
+- per partita (calculate_all_advanced_features): ~7 query ORM per fixture
+- per giornata (calculate_features_for_date): legge le istantanee già
+  materializzate in team_form / head_to_head (vedi team_form_store.py)
+  con una query indicizzata per tabella, per tutte le partite del giorno.
+I calcoli sono nelle funzioni *_from_rows sotto, condivise dalle due modalità.
 """
 
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, func
 from sqlalchemy.orm import Session
 from models import Fixture, Feature
 
 
+FORM_DEFAULTS = {
+    'form_xg_for': 1.3,
+    'form_xg_against': 1.3,
+    'form_xg_diff': 0.0,
+    'form_wins': 0,
+    'form_draws': 0,
+    'form_losses': 0,
+    'form_goals_for': 1.0,
+    'form_goals_against': 1.0,
+    'form_points': 0,
+    'form_trend': 0.0
+}
+
+H2H_DEFAULTS = {
+    'h2h_home_wins': 0,
+    'h2h_draws': 0,
+    'h2h_away_wins': 0,
+    'h2h_home_goals_avg': 1.0,
+    'h2h_away_goals_avg': 1.0,
+    'h2h_home_xg_avg': 1.3,
+    'h2h_away_xg_avg': 1.3,
+    'h2h_total_over25': 0
+}
+
+STANDINGS_DEFAULTS = {
+    'position': 10,
+    'points': 0,
+    'goal_difference': 0,
+    'pressure_top': 0.0,
+    'pressure_relegation': 0.0
+}
+
+MOMENTUM_DEFAULTS = {
+    'winning_streak': 0,
+    'unbeaten_streak': 0,
+    'losing_streak': 0,
+    'clean_sheet_streak': 0,
+    'scoring_streak': 0,
+    'xg_momentum': 0.0
+}
+
+
+def season_start(d) -> datetime.date:
+    """Inizio stagione (1 agosto) a cui appartiene la data."""
+    return datetime(d.year if d.month >= 8 else d.year - 1, 8, 1).date()
+
+
+def form_from_rows(rows: List[Tuple]) -> Dict[str, float]:
+    """
+    Forma recente da righe (xg_for, xg_against, gf, ga), dalla più recente.
+    xG già con default 1.3; gf/ga None se il risultato manca.
+    """
+    if len(rows) < 2:
+        # Dati insufficienti, return defaults
+        return dict(FORM_DEFAULTS)
+
+    xg_for_list = []
+    xg_against_list = []
+    goals_for_list = []
+    goals_against_list = []
+    wins = 0
+    draws = 0
+    losses = 0
+
+    for xg_for, xg_against, gf, ga in rows:
+        xg_for_list.append(xg_for)
+        xg_against_list.append(xg_against)
+
+        # Risultati effettivi (se disponibili)
+        if gf is not None and ga is not None:
+            goals_for_list.append(gf)
+            goals_against_list.append(ga)
+
+            if gf > ga:
+                wins += 1
+            elif gf == ga:
+                draws += 1
+            else:
+                losses += 1
+
+    # Calcola medie
+    avg_xg_for = np.mean(xg_for_list)
+    avg_xg_against = np.mean(xg_against_list)
+    avg_goals_for = np.mean(goals_for_list) if goals_for_list else avg_xg_for
+    avg_goals_against = np.mean(goals_against_list) if goals_against_list else avg_xg_against
+
+    # Trend: differenza xG ultimi 2 vs precedenti 3
+    if len(xg_for_list) >= 5:
+        recent_2_xg = np.mean(xg_for_list[:2]) - np.mean(xg_against_list[:2])
+        previous_3_xg = np.mean(xg_for_list[2:5]) - np.mean(xg_against_list[2:5])
+        trend = recent_2_xg - previous_3_xg
+    else:
+        trend = 0.0
+
+    return {
+        'form_xg_for': round(avg_xg_for, 2),
+        'form_xg_against': round(avg_xg_against, 2),
+        'form_xg_diff': round(avg_xg_for - avg_xg_against, 2),
+        'form_wins': wins,
+        'form_draws': draws,
+        'form_losses': losses,
+        'form_goals_for': round(avg_goals_for, 2),
+        'form_goals_against': round(avg_goals_against, 2),
+        'form_points': wins * 3 + draws,
+        'form_trend': round(trend, 2)
+    }
+
+
+def h2h_from_rows(rows: List[Tuple]) -> Dict[str, float]:
+    """
+    Head-to-head da righe (hg, ag, home_xg, away_xg), dalla più recente, viste
+    dalla squadra di casa del match da predire. hg/ag None senza risultato,
+    home_xg/away_xg None senza riga features.
+    """
+    if len(rows) == 0:
+        # Nessun precedente, return neutral
+        return dict(H2H_DEFAULTS)
+
+    home_wins = 0
+    draws = 0
+    away_wins = 0
+    home_goals = []
+    away_goals = []
+    home_xg = []
+    away_xg = []
+    over25_count = 0
+
+    for hg, ag, hxg, axg in rows:
+        # xG
+        if hxg is not None:
+            home_xg.append(hxg)
+            away_xg.append(axg)
+
+        # Risultati
+        if hg is not None and ag is not None:
+            home_goals.append(hg)
+            away_goals.append(ag)
+
+            if hg > ag:
+                home_wins += 1
+            elif hg == ag:
+                draws += 1
+            else:
+                away_wins += 1
+
+            if (hg + ag) > 2.5:
+                over25_count += 1
+
+    return {
+        'h2h_home_wins': home_wins,
+        'h2h_draws': draws,
+        'h2h_away_wins': away_wins,
+        'h2h_home_goals_avg': round(np.mean(home_goals), 2) if home_goals else 1.0,
+        'h2h_away_goals_avg': round(np.mean(away_goals), 2) if away_goals else 1.0,
+        'h2h_home_xg_avg': round(np.mean(home_xg), 2) if home_xg else 1.3,
+        'h2h_away_xg_avg': round(np.mean(away_xg), 2) if away_xg else 1.3,
+        'h2h_total_over25': over25_count
+    }
+
+
+def standings_from_totals(played: int, points: int, goals_for: int, goals_against: int) -> Dict[str, float]:
+    """Classifica stimata dai totali stagionali (partite giocate, punti, gol fatti/subiti)."""
+    if played == 0:
+        # Inizio stagione, return neutral
+        return dict(STANDINGS_DEFAULTS)
+
+    # Stima posizione (media 1 punto/partita = 10° posto)
+    ppg = points / played
+    # ppg 2.5+ -> top 4, ppg 2.0+ -> top 6, ppg 1.0- -> bottom
+    if ppg >= 2.3:
+        estimated_position = np.random.randint(1, 5)
+    elif ppg >= 1.8:
+        estimated_position = np.random.randint(4, 8)
+    elif ppg >= 1.3:
+        estimated_position = np.random.randint(7, 13)
+    elif ppg >= 0.8:
+        estimated_position = np.random.randint(12, 17)
+    else:
+        estimated_position = np.random.randint(16, 21)
+
+    # Pressione competitiva
+    pressure_top = max(0, min(1, (2.5 - (estimated_position / 10)) ** 2))  # Alta se top 5
+    pressure_relegation = max(0, min(1, ((estimated_position - 13) / 7) ** 2))  # Alta se bottom 5
+
+    return {
+        'position': estimated_position,
+        'points': points,
+        'goal_difference': goals_for - goals_against,
+        'pressure_top': round(pressure_top, 2),
+        'pressure_relegation': round(pressure_relegation, 2)
+    }
+
+
+def momentum_from_rows(rows: List[Tuple]) -> Dict[str, float]:
+    """
+    Momentum da righe (gf, ga, xg_diff), dalla più recente; solo partite con
+    risultato. xg_diff None se manca la riga features.
+    """
+    if len(rows) < 3:
+        return dict(MOMENTUM_DEFAULTS)
+
+    winning_streak = 0
+    unbeaten_streak = 0
+    losing_streak = 0
+    clean_sheet_streak = 0
+    scoring_streak = 0
+    xg_diffs = []
+
+    for i, (gf, ga, xg_diff) in enumerate(rows):
+        # Streaks (solo primi match consecutivi)
+        if gf > ga:
+            if winning_streak == i:
+                winning_streak += 1
+            if losing_streak == 0:
+                unbeaten_streak += 1
+        elif gf == ga:
+            if losing_streak == 0:
+                unbeaten_streak += 1
+            winning_streak = 0
+        else:
+            if losing_streak == i:
+                losing_streak += 1
+            winning_streak = 0
+            unbeaten_streak = 0
+
+        # Clean sheets
+        if ga == 0:
+            if clean_sheet_streak == i:
+                clean_sheet_streak += 1
+        else:
+            if clean_sheet_streak > 0:
+                break
+
+        # Scoring streak
+        if gf > 0:
+            scoring_streak += 1
+        else:
+            break
+
+        # xG trend
+        if xg_diff is not None:
+            xg_diffs.append(xg_diff)
+
+    # xG momentum: recenti 3 vs precedenti 3
+    if len(xg_diffs) >= 6:
+        xg_momentum = np.mean(xg_diffs[:3]) - np.mean(xg_diffs[3:6])
+    else:
+        xg_momentum = 0.0
+
+    return {
+        'winning_streak': winning_streak,
+        'unbeaten_streak': unbeaten_streak,
+        'losing_streak': losing_streak,
+        'clean_sheet_streak': clean_sheet_streak,
+        'scoring_streak': scoring_streak,
+        'xg_momentum': round(xg_momentum, 2)
+    }
+
+
+def combine_features(
+    home_form: Dict, away_form: Dict, h2h: Dict,
+    home_standings: Dict, away_standings: Dict,
+    home_momentum: Dict, away_momentum: Dict
+) -> Dict[str, float]:
+    """Combina tutto con prefissi home/away + feature derivate."""
+    features = {}
+
+    for key, val in home_form.items():
+        features[f'home_{key}'] = val
+    for key, val in away_form.items():
+        features[f'away_{key}'] = val
+
+    for key, val in h2h.items():
+        features[key] = val
+
+    for key, val in home_standings.items():
+        features[f'home_{key}'] = val
+    for key, val in away_standings.items():
+        features[f'away_{key}'] = val
+
+    for key, val in home_momentum.items():
+        features[f'home_{key}'] = val
+    for key, val in away_momentum.items():
+        features[f'away_{key}'] = val
+
+    # Aggiungi features derivate
+    features['position_gap'] = abs(home_standings['position'] - away_standings['position'])
+    features['points_gap'] = abs(home_standings['points'] - away_standings['points'])
+    features['form_diff'] = home_form['form_xg_diff'] - away_form['form_xg_diff']
+    features['momentum_diff'] = home_momentum['xg_momentum'] - away_momentum['xg_momentum']
+
+    return features
+
+
 class AdvancedFeatureCalculator:
     """Calcola feature avanzate per migliorare predizioni ML."""
 
@@ -65,29 +367,7 @@ class AdvancedFeatureCalculator:
             .all()
         )
 
-        if len(recent_matches) < 2:
-            # Dati insufficienti, return defaults
-            return {
-                'form_xg_for': 1.3,
-                'form_xg_against': 1.3,
-                'form_xg_diff': 0.0,
-                'form_wins': 0,
-                'form_draws': 0,
-                'form_losses': 0,
-                'form_goals_for': 1.0,
-                'form_goals_against': 1.0,
-                'form_points': 0,
-                'form_trend': 0.0
-            }
-
-        xg_for_list = []
-        xg_against_list = []
-        goals_for_list = []
-        goals_against_list = []
-        wins = 0
-        draws = 0
-        losses = 0
-
+        rows = []
         for fixture, feature in recent_matches:
             is_home = (fixture.home == team)
 
@@ -95,58 +375,14 @@ class AdvancedFeatureCalculator:
             if is_home:
                 xg_for = feature.xg_for_home or 1.3
                 xg_against = feature.xg_for_away or 1.3
+                gf, ga = fixture.result_home_goals, fixture.result_away_goals
             else:
                 xg_for = feature.xg_for_away or 1.3
                 xg_against = feature.xg_for_home or 1.3
+                gf, ga = fixture.result_away_goals, fixture.result_home_goals
+            rows.append((xg_for, xg_against, gf, ga))
 
-            xg_for_list.append(xg_for)
-            xg_against_list.append(xg_against)
-
-            # Risultati effettivi (se disponibili)
-            if fixture.result_home_goals is not None and fixture.result_away_goals is not None:
-                if is_home:
-                    gf = fixture.result_home_goals
-                    ga = fixture.result_away_goals
-                else:
-                    gf = fixture.result_away_goals
-                    ga = fixture.result_home_goals
-
-                goals_for_list.append(gf)
-                goals_against_list.append(ga)
-
-                if gf > ga:
-                    wins += 1
-                elif gf == ga:
-                    draws += 1
-                else:
-                    losses += 1
-
-        # Calcola medie
-        avg_xg_for = np.mean(xg_for_list)
-        avg_xg_against = np.mean(xg_against_list)
-        avg_goals_for = np.mean(goals_for_list) if goals_for_list else avg_xg_for
-        avg_goals_against = np.mean(goals_against_list) if goals_against_list else avg_xg_against
-
-        # Trend: differenza xG ultimi 2 vs precedenti 3
-        if len(xg_for_list) >= 5:
-            recent_2_xg = np.mean(xg_for_list[:2]) - np.mean(xg_against_list[:2])
-            previous_3_xg = np.mean(xg_for_list[2:5]) - np.mean(xg_against_list[2:5])
-            trend = recent_2_xg - previous_3_xg
-        else:
-            trend = 0.0
-
-        return {
-            'form_xg_for': round(avg_xg_for, 2),
-            'form_xg_against': round(avg_xg_against, 2),
-            'form_xg_diff': round(avg_xg_for - avg_xg_against, 2),
-            'form_wins': wins,
-            'form_draws': draws,
-            'form_losses': losses,
-            'form_goals_for': round(avg_goals_for, 2),
-            'form_goals_against': round(avg_goals_against, 2),
-            'form_points': wins * 3 + draws,
-            'form_trend': round(trend, 2)
-        }
+        return form_from_rows(rows)
 
     def get_head_to_head(
         self,
@@ -188,73 +424,25 @@ class AdvancedFeatureCalculator:
             .all()
         )
 
-        if len(h2h_matches) == 0:
-            # Nessun precedente, return neutral
-            return {
-                'h2h_home_wins': 0,
-                'h2h_draws': 0,
-                'h2h_away_wins': 0,
-                'h2h_home_goals_avg': 1.0,
-                'h2h_away_goals_avg': 1.0,
-                'h2h_home_xg_avg': 1.3,
-                'h2h_away_xg_avg': 1.3,
-                'h2h_total_over25': 0
-            }
-
-        home_wins = 0
-        draws = 0
-        away_wins = 0
-        home_goals = []
-        away_goals = []
-        home_xg = []
-        away_xg = []
-        over25_count = 0
-
+        rows = []
         for fixture, feature in h2h_matches:
             # Determina se home_team era in casa o trasferta in quel match
             was_home = (fixture.home == home_team)
-
-            # xG
+            hxg = axg = None
             if feature:
-                if was_home:
-                    home_xg.append(feature.xg_for_home or 1.3)
-                    away_xg.append(feature.xg_for_away or 1.3)
-                else:
-                    home_xg.append(feature.xg_for_away or 1.3)
-                    away_xg.append(feature.xg_for_home or 1.3)
+                xg_h = feature.xg_for_home or 1.3
+                xg_a = feature.xg_for_away or 1.3
+                hxg, axg = (xg_h, xg_a) if was_home else (xg_a, xg_h)
 
-            # Risultati
+            hg = ag = None
             if fixture.result_home_goals is not None and fixture.result_away_goals is not None:
                 if was_home:
-                    hg = fixture.result_home_goals
-                    ag = fixture.result_away_goals
+                    hg, ag = fixture.result_home_goals, fixture.result_away_goals
                 else:
-                    hg = fixture.result_away_goals
-                    ag = fixture.result_home_goals
+                    hg, ag = fixture.result_away_goals, fixture.result_home_goals
+            rows.append((hg, ag, hxg, axg))
 
-                home_goals.append(hg)
-                away_goals.append(ag)
-
-                if hg > ag:
-                    home_wins += 1
-                elif hg == ag:
-                    draws += 1
-                else:
-                    away_wins += 1
-
-                if (fixture.result_home_goals + fixture.result_away_goals) > 2.5:
-                    over25_count += 1
-
-        return {
-            'h2h_home_wins': home_wins,
-            'h2h_draws': draws,
-            'h2h_away_wins': away_wins,
-            'h2h_home_goals_avg': round(np.mean(home_goals), 2) if home_goals else 1.0,
-            'h2h_away_goals_avg': round(np.mean(away_goals), 2) if away_goals else 1.0,
-            'h2h_home_xg_avg': round(np.mean(home_xg), 2) if home_xg else 1.3,
-            'h2h_away_xg_avg': round(np.mean(away_xg), 2) if away_xg else 1.3,
-            'h2h_total_over25': over25_count
-        }
+        return h2h_from_rows(rows)
 
     def get_league_standings(
         self,
@@ -280,23 +468,13 @@ class AdvancedFeatureCalculator:
             .filter(
                 Fixture.league == league,
                 Fixture.date < at_date,
-                Fixture.date >= datetime(at_date.year if at_date.month >= 8 else at_date.year - 1, 8, 1).date(),
+                Fixture.date >= season_start(at_date),
                 ((Fixture.home == team) | (Fixture.away == team)),
                 Fixture.result_home_goals.isnot(None)
             )
             .all()
         )
 
-        if len(season_matches) == 0:
-            # Inizio stagione, return neutral
-            return {
-                'position': 10,
-                'points': 0,
-                'goal_difference': 0,
-                'pressure_top': 0.0,
-                'pressure_relegation': 0.0
-            }
-
         points = 0
         goals_for = 0
         goals_against = 0
@@ -319,35 +497,7 @@ class AdvancedFeatureCalculator:
             elif gf == ga:
                 points += 1
 
-        # Stima posizione (media 1 punto/partita = 10° posto)
-        matches_played = len(season_matches)
-        if matches_played > 0:
-            ppg = points / matches_played
-            # ppg 2.5+ -> top 4, ppg 2.0+ -> top 6, ppg 1.0- -> bottom
-            if ppg >= 2.3:
-                estimated_position = np.random.randint(1, 5)
-            elif ppg >= 1.8:
-                estimated_position = np.random.randint(4, 8)
-            elif ppg >= 1.3:
-                estimated_position = np.random.randint(7, 13)
-            elif ppg >= 0.8:
-                estimated_position = np.random.randint(12, 17)
-            else:
-                estimated_position = np.random.randint(16, 21)
-        else:
-            estimated_position = 10
-
-        # Pressione competitiva
-        pressure_top = max(0, min(1, (2.5 - (estimated_position / 10)) ** 2))  # Alta se top 5
-        pressure_relegation = max(0, min(1, ((estimated_position - 13) / 7) ** 2))  # Alta se bottom 5
-
-        return {
-            'position': estimated_position,
-            'points': points,
-            'goal_difference': goals_for - goals_against,
-            'pressure_top': round(pressure_top, 2),
-            'pressure_relegation': round(pressure_relegation, 2)
-        }
+        return standings_from_totals(len(season_matches), points, goals_for, goals_against)
 
     def get_momentum_indicators(
         self,
@@ -383,23 +533,7 @@ class AdvancedFeatureCalculator:
             .all()
         )
 
-        if len(recent_matches) < 3:
-            return {
-                'winning_streak': 0,
-                'unbeaten_streak': 0,
-                'losing_streak': 0,
-                'clean_sheet_streak': 0,
-                'scoring_streak': 0,
-                'xg_momentum': 0.0
-            }
-
-        winning_streak = 0
-        unbeaten_streak = 0
-        losing_streak = 0
-        clean_sheet_streak = 0
-        scoring_streak = 0
-        xg_diffs = []
-
+        rows = []
         for fixture, feature in recent_matches:
             is_home = (fixture.home == team)
 
@@ -411,58 +545,16 @@ class AdvancedFeatureCalculator:
                 gf = fixture.result_away_goals
                 ga = fixture.result_home_goals
 
-            # Streaks (solo primi match consecutivi)
-            if gf > ga:
-                if winning_streak == len([m for m in recent_matches[:recent_matches.index((fixture, feature))]]):
-                    winning_streak += 1
-                if losing_streak == 0:
-                    unbeaten_streak += 1
-            elif gf == ga:
-                if losing_streak == 0:
-                    unbeaten_streak += 1
-                winning_streak = 0
-            else:
-                if losing_streak == len([m for m in recent_matches[:recent_matches.index((fixture, feature))]]):
-                    losing_streak += 1
-                winning_streak = 0
-                unbeaten_streak = 0
-
-            # Clean sheets
-            if ga == 0:
-                if clean_sheet_streak == len([m for m in recent_matches[:recent_matches.index((fixture, feature))]]):
-                    clean_sheet_streak += 1
-            else:
-                if clean_sheet_streak > 0:
-                    break
-
-            # Scoring streak
-            if gf > 0:
-                scoring_streak += 1
-            else:
-                break
-
             # xG trend
+            xg_diff = None
             if feature:
                 if is_home:
                     xg_diff = (feature.xg_for_home or 1.3) - (feature.xg_for_away or 1.3)
                 else:
                     xg_diff = (feature.xg_for_away or 1.3) - (feature.xg_for_home or 1.3)
-                xg_diffs.append(xg_diff)
+            rows.append((gf, ga, xg_diff))
 
-        # xG momentum: recenti 3 vs precedenti 3
-        if len(xg_diffs) >= 6:
-            xg_momentum = np.mean(xg_diffs[:3]) - np.mean(xg_diffs[3:6])
-        else:
-            xg_momentum = 0.0
-
-        return {
-            'winning_streak': winning_streak,
-            'unbeaten_streak': unbeaten_streak,
-            'losing_streak': losing_streak,
-            'clean_sheet_streak': clean_sheet_streak,
-            'scoring_streak': scoring_streak,
-            'xg_momentum': round(xg_momentum, 2)
-        }
+        return momentum_from_rows(rows)
 
     def calculate_all_advanced_features(
         self,
@@ -492,34 +584,143 @@ class AdvancedFeatureCalculator:
         home_momentum = self.get_momentum_indicators(home_team, league, match_date, n_recent=10)
         away_momentum = self.get_momentum_indicators(away_team, league, match_date, n_recent=10)
 
-        # Combina tutto con prefissi home/away
-        features = {}
-
-        for key, val in home_form.items():
-            features[f'home_{key}'] = val
-        for key, val in away_form.items():
-            features[f'away_{key}'] = val
-
-        for key, val in h2h.items():
-            features[key] = val
-
-        for key, val in home_standings.items():
-            features[f'home_{key}'] = val
-        for key, val in away_standings.items():
-            features[f'away_{key}'] = val
-
-        for key, val in home_momentum.items():
-            features[f'home_{key}'] = val
-        for key, val in away_momentum.items():
-            features[f'away_{key}'] = val
+        return combine_features(
+            home_form, away_form, h2h,
+            home_standings, away_standings,
+            home_momentum, away_momentum
+        )
 
-        # Aggiungi features derivate
-        features['position_gap'] = abs(home_standings['position'] - away_standings['position'])
-        features['points_gap'] = abs(home_standings['points'] - away_standings['points'])
-        features['form_diff'] = home_form['form_xg_diff'] - away_form['form_xg_diff']
-        features['momentum_diff'] = home_momentum['xg_momentum'] - away_momentum['xg_momentum']
+    def calculate_features_for_date(
+        self,
+        match_date: datetime.date,
+        fixtures: Optional[List[Fixture]] = None
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        Feature avanzate di tutte le partite di una giornata, lette dalle
+        istantanee materializzate (team_form / head_to_head) invece che
+        ricalcolate con ~7 query per partita.
 
-        return features
+        Richiede team_form_store.materialize() aggiornato fino al giorno prima.
+        Returns {match_id: features}.
+        """
+        from models_extended import TeamForm, HeadToHead
+
+        if fixtures is None:
+            fixtures = self.db.query(Fixture).filter(Fixture.date == match_date).all()
+        if not fixtures:
+            return {}
+
+        teams = {f.home for f in fixtures} | {f.away for f in fixtures}
+        leagues = {f.league for f in fixtures}
+
+        # Ultima istantanea per (lega, squadra) prima della data: 1 query
+        latest = (
+            self.db.query(
+                TeamForm.league.label('league'),
+                TeamForm.team_name.label('team_name'),
+                func.max(TeamForm.as_of_date).label('as_of_date')
+            )
+            .filter(
+                TeamForm.league.in_(leagues),
+                TeamForm.team_name.in_(teams),
+                TeamForm.as_of_date < match_date
+            )
+            .group_by(TeamForm.league, TeamForm.team_name)
+            .subquery()
+        )
+        team_rows = (
+            self.db.query(TeamForm)
+            .join(latest, and_(
+                TeamForm.league == latest.c.league,
+                TeamForm.team_name == latest.c.team_name,
+                TeamForm.as_of_date == latest.c.as_of_date
+            ))
+            .all()
+        )
+        states = {(r.league, r.team_name): r for r in team_rows}
+
+        # Ultima istantanea per coppia (ordine alfabetico) prima della data: 1 query
+        latest_h2h = (
+            self.db.query(
+                HeadToHead.league.label('league'),
+                HeadToHead.team_home.label('team_home'),
+                HeadToHead.team_away.label('team_away'),
+                func.max(HeadToHead.as_of_date).label('as_of_date')
+            )
+            .filter(
+                HeadToHead.league.in_(leagues),
+                HeadToHead.team_home.in_(teams),
+                HeadToHead.team_away.in_(teams),
+                HeadToHead.as_of_date < match_date
+            )
+            .group_by(HeadToHead.league, HeadToHead.team_home, HeadToHead.team_away)
+            .subquery()
+        )
+        pair_rows = (
+            self.db.query(HeadToHead)
+            .join(latest_h2h, and_(
+                HeadToHead.league == latest_h2h.c.league,
+                HeadToHead.team_home == latest_h2h.c.team_home,
+                HeadToHead.team_away == latest_h2h.c.team_away,
+                HeadToHead.as_of_date == latest_h2h.c.as_of_date
+            ))
+            .all()
+        )
+        pairs = {(r.league, r.team_home, r.team_away): r for r in pair_rows}
+
+        out = {}
+        for f in fixtures:
+            home_form, home_totals, home_momentum = _team_state(states.get((f.league, f.home)), match_date)
+            away_form, away_totals, away_momentum = _team_state(states.get((f.league, f.away)), match_date)
+            a, b = sorted((f.home, f.away))
+            h2h = _h2h_state(pairs.get((f.league, a, b)), flip=(f.home != a))
+
+            # Stesso ordine di chiamate a np.random del calcolo per partita
+            home_standings = standings_from_totals(*home_totals)
+            away_standings = standings_from_totals(*away_totals)
+
+            out[f.match_id] = combine_features(
+                home_form, away_form, h2h,
+                home_standings, away_standings,
+                home_momentum, away_momentum
+            )
+        return out
+
+
+def _team_state(row, match_date) -> Tuple[Dict, Tuple[int, int, int, int], Dict]:
+    """(forma, totali stagione, momentum) da un'istantanea TeamForm (None = nessuna partita)."""
+    if row is None:
+        return dict(FORM_DEFAULTS), (0, 0, 0, 0), dict(MOMENTUM_DEFAULTS)
+    form = {key: getattr(row, key) for key in FORM_DEFAULTS}
+    momentum = {key: getattr(row, key) for key in MOMENTUM_DEFAULTS}
+    if row.season_start == season_start(match_date):
+        totals = (row.season_played, row.season_points, row.season_gf, row.season_ga)
+    else:
+        totals = (0, 0, 0, 0)
+    return form, totals, momentum
+
+
+def _h2h_state(row, flip: bool) -> Dict[str, float]:
+    """H2H da un'istantanea HeadToHead, girata se la squadra di casa è team_away."""
+    if row is None or not row.total_matches:
+        return dict(H2H_DEFAULTS)
+    wins_a, wins_b = row.home_wins, row.away_wins
+    goals_a, goals_b = row.avg_goals_home, row.avg_goals_away
+    xg_a, xg_b = row.avg_xg_home, row.avg_xg_away
+    if flip:
+        wins_a, wins_b = wins_b, wins_a
+        goals_a, goals_b = goals_b, goals_a
+        xg_a, xg_b = xg_b, xg_a
+    return {
+        'h2h_home_wins': wins_a,
+        'h2h_draws': row.draws,
+        'h2h_away_wins': wins_b,
+        'h2h_home_goals_avg': goals_a,
+        'h2h_away_goals_avg': goals_b,
+        'h2h_home_xg_avg': xg_a if xg_a is not None else 1.3,
+        'h2h_away_xg_avg': xg_b if xg_b is not None else 1.3,
+        'h2h_total_over25': row.over25_count
+    }
 
 
 if __name__ == "__main__":
@@ -61,6 +61,13 @@ from flask import (
     url_for,
 )
 
+from model_registry import VARIANTS, variant_paths
+from pipeline_dag import last_run as last_pipeline_run
+from backfill_checkpoint import read_checkpoint, staging_dir
+from job_queue import JobQueue, current_job
+from pipeline_worker import run_command as run_in_worker, start_background as start_pipeline_worker
+import metrics
+
 ROOT = Path(__file__).resolve().parent
 
 # Preferisci il DB SQLite locale e una cache Matplotlib scrivibile per test via web app
@@ -77,6 +84,8 @@ AUTO_FIXTURES_TARGET_DAYS = int(os.getenv("AUTO_FIXTURES_TARGET_DAYS", "30"))
 APP = Flask(__name__)
 APP.secret_key = "dev-local-only"
 APP.config["TEMPLATES_AUTO_RELOAD"] = True
+# latenza e query DB di ogni vista (esposte su /metrics)
+metrics.install_flask(APP)
 
 LOGS_DIR = ROOT / "logs"
 LOGS_DIR.mkdir(exist_ok=True)
@@ -101,12 +110,10 @@ logger = logging.getLogger(__name__)
 PRED_PATH = ROOT / "predictions.csv"
 REPORT_HTML = ROOT / "report.html"
 
-# stato semplice del job
-_job_lock = threading.Lock()
-_job_running = False
-_job_name = None  # "daily" | "history" | "train" | "predict"
-_job_last_message = "" # Messaggio finale del job (successo/errore)
-_job_stop_requested = False # Flag per interrompere un job
+# coda job persistente (cache/jobs.db o BET_QUEUE_DB) con pool di worker, vedi job_queue.py;
+# i worker partono in main(): importare app.py non esegue né chiude job della dashboard
+JOB_WORKERS = int(os.getenv("BET_JOB_WORKERS", "3"))
+JOBS = JobQueue(log=logger.info)
 _child_processes = [] # Lista per tenere traccia dei processi figli
 
 def _log_fixture_coverage(min_days_left: int = 7, target_days: int = 30):
@@ -208,9 +215,13 @@ COMP_CHOICES = [
 ]
 
 
-def run_cmd(cmd: str, timeout: int = 3600):
-    """Esegue un comando, logga in tempo reale ed è interrompibile."""
-    global _job_stop_requested, _child_processes
+def run_cmd(cmd: str, timeout: int = 3600, job=None):
+    """
+    Esegue un comando, logga in tempo reale ed è interrompibile: lo stop è quello
+    del job passato o di quello eseguito dal thread corrente (job_queue).
+    """
+    global _child_processes
+    job = job or current_job()
 
     cmd_parts = shlex.split(cmd)
     if cmd_parts and cmd_parts[0] == "python":
@@ -218,6 +229,20 @@ def run_cmd(cmd: str, timeout: int = 3600):
 
     # Logga il comando in modo sicuro per la shell
     log_cmd = " ".join(shlex.quote(c) for c in cmd_parts)
+
+    # Prima prova il worker residente (moduli e modelli già caricati), poi il subprocess
+    if len(cmd_parts) > 1 and cmd_parts[0] == sys.executable and cmd_parts[1].endswith(".py"):
+        t0 = time.time()
+        rc = run_in_worker(
+            cmd_parts[1:], on_line=logger.info, timeout=timeout,
+            should_stop=lambda: job is not None and job.stop_requested(),
+        )
+        if rc is not None:
+            logger.info(f"Comando eseguito nel worker residente in {time.time() - t0:.2f}s: $ {log_cmd}")
+            if rc != 0:
+                logger.error(f"Comando fallito con exit code {rc}: {log_cmd}")
+            return rc == 0
+
     logger.info(f"Esecuzione comando: $ {log_cmd}")
     proc = None
     try:
@@ -259,17 +284,16 @@ def run_cmd(cmd: str, timeout: int = 3600):
 
         start_time = time.time()
         while proc.poll() is None:  # Finché il processo è in esecuzione
-            with _job_lock:
-                if _job_stop_requested:
-                    logger.warning("Richiesta di interruzione ricevuta. Termino il processo...")
-                    proc.terminate()  # Invia SIGTERM (più "gentile")
-                    try:
-                        proc.wait(timeout=5)  # Attendi 5s che termini
-                    except subprocess.TimeoutExpired:
-                        logger.warning("Il processo non ha risposto, forzo la chiusura (kill).")
-                        proc.kill()  # Invia SIGKILL (forzato)
-                    stdout_thread.join(timeout=5)
-                    return False  # Il job è stato interrotto
+            if job is not None and job.stop_requested():
+                logger.warning("Richiesta di interruzione ricevuta. Termino il processo...")
+                proc.terminate()  # Invia SIGTERM (più "gentile")
+                try:
+                    proc.wait(timeout=5)  # Attendi 5s che termini
+                except subprocess.TimeoutExpired:
+                    logger.warning("Il processo non ha risposto, forzo la chiusura (kill).")
+                    proc.kill()  # Invia SIGKILL (forzato)
+                stdout_thread.join(timeout=5)
+                return False  # Il job è stato interrotto
 
             if time.time() - start_time > timeout:
                 logger.error(f"Timeout dopo {timeout}s per il comando: {log_cmd}")
@@ -298,75 +322,24 @@ _log_fixture_coverage()
 _auto_fetch_fixtures_if_needed()
 
 
-def job_wrapper(target_name: str, func, *args, **kwargs):
-    """Wraps a job function to handle state and logging."""
-    global _job_running, _job_name, _job_last_message, _job_stop_requested    
-    success = False
-    try:
-        logger.info(f"--- Inizio Job: {target_name} ---")
-        success = func(*args, **kwargs)
-        logger.info(f"--- Fine Job: {target_name} (Successo: {success}) ---")
-    finally:
-        with _job_lock:
-            job_was_stopped = _job_stop_requested
-            if job_was_stopped:
-                _job_last_message = f"Job '{target_name}' interrotto dall'utente."
-            elif success:
-                _job_last_message = f"Job '{target_name}' completato con successo."
-            else:
-                _job_last_message = f"Job '{target_name}' fallito o completato con errori."
-            _job_running = False
-            _job_name = None
-            _job_stop_requested = False # Resetta per sicurezza
-
-
 def run_daily_pipeline(d: str, comps: str, delay: str, do_predict: bool):
-    """Esegue la pipeline giornaliera completa."""
-    # AZIONE CRITICA: Pulisci i file di output vecchi all'inizio di ogni esecuzione.
-    # Questo previene la visualizzazione di dati stantii se la pipeline fallisce.
-    if REPORT_HTML.exists():
-        try:
-            REPORT_HTML.unlink()
-            logger.info("Vecchio report.html rimosso.")
-        except OSError as e:
-            logger.warning(f"Impossibile rimuovere vecchio report.html: {e}")
-    if PRED_PATH.exists():
-        try:
-            PRED_PATH.unlink()
-            logger.info("Vecchio predictions.csv rimosso.")
-        except OSError as e:
-            logger.warning(f"Impossibile rimuovere vecchio predictions.csv: {e}")
-    
-    # Step 1: Fetch fixtures
-    logger.info(f"[PIPELINE 1/4] Recupero partite per {d}...")
-    if not run_cmd(f'python fixtures_fetcher.py --date {d} --comps {comps}'):
-        logger.error("Fetch fixtures fallito. Pipeline interrotta.")
-        return False
-    
-    # Step 2: Fetch odds
-    logger.info(f"[PIPELINE 2/4] Recupero quote per {d}...")
-    if not run_cmd(f'python odds_fetcher.py --date {d} --comps {comps} --delay 0.3'):
-        logger.warning("Fetch odds fallito (continuo comunque).")
-    
-    # Step 3: Populate features
-    logger.info(f"[PIPELINE 3/4] Popolamento features per {d}...")
-    if not run_cmd(
-        f'python features_populator.py --date {d} --comps {comps} --n_recent 5 --delay {delay} --cache 1'
-    ):
-        logger.error("Popolamento features fallito. Pipeline interrotta.")
-        return False
-    
-    # Step 4: Predictions
-    if do_predict:
-        logger.info(f"[PIPELINE 4/4] Generazione previsioni...")
-        if not run_cmd(
-            f'python model_pipeline.py --predict --date {d} --comps {comps}'
-        ):
-            logger.error("Generazione previsioni fallita.")
-            return False
-    
-    logger.info("Pipeline giornaliera completata con successo.")
-    return True
+    """
+    Esegue la pipeline giornaliera completa come grafo (pipeline_dag): odds e
+    features in parallelo dopo fixtures, stadi con input invariati saltati.
+    predictions.csv/report.html vengono rimossi dallo stadio predict prima di
+    rigenerarli, o se la pipeline si interrompe prima di arrivarci.
+    """
+    from pipeline_dag import run_daily
+
+    # gli stadi girano in thread del pool di pipeline_dag: il job va passato esplicitamente
+    job = current_job()
+    ok = run_daily(d, comps, delay, do_predict, runner=partial(run_cmd, job=job), log=logger.info,
+                   should_stop=lambda: job is not None and job.stop_requested())
+    if ok:
+        logger.info("Pipeline giornaliera completata con successo.")
+    else:
+        logger.error("Pipeline giornaliera interrotta o completata con errori.")
+    return ok
 
 
 def run_history_builder(dfrom: str, dto: str, comps: str, nrec: str, delay: str):
@@ -401,6 +374,21 @@ def run_odds_bulk_fetch(days: str):
     return run_cmd(f"python odds_fetcher.py --bulk-fetch --verbose --bulk-days {days}")
 
 
+# Tipi di job: priorità più alta = servito prima; il gruppo limita i job concorrenti.
+# - "predict": daily, predict, generate_extended e train leggono o riscrivono gli stessi
+#   modelli e predictions.csv → uno alla volta
+# - "ingest": i fetcher che scrivono quote, fixture, risultati e mapping nel DB → uno alla volta
+# - "backfill": lo storico lavora sui propri file e gira accanto agli altri
+JOBS.register("daily", run_daily_pipeline, priority=10, group="predict")
+JOBS.register("predict", run_predict_only, priority=10, group="predict")
+JOBS.register("fetch_results", run_results_fetcher, priority=6, group="ingest")
+JOBS.register("generate_extended", run_cmd, priority=5, group="predict")
+JOBS.register("odds_bulk_fetch", run_odds_bulk_fetch, priority=4, group="ingest")
+JOBS.register("build_maps", run_map_builder, priority=4, group="ingest")
+JOBS.register("train", run_training, priority=3, group="predict")
+JOBS.register("history", run_history_builder, priority=1, group="backfill", resumable=True)
+
+
 def get_odds_coverage_info() -> dict:
     """
     Controlla fino a che data sono presenti le quote nel DB
@@ -466,18 +454,23 @@ def _read_last_log_tail(max_chars: int = 12000) -> str:
 
 
 def get_job_status() -> dict:
-    with _job_lock:
-        return {
-            "job_running": _job_running,
-            "job_name": _job_name,
-            "last_message": _job_last_message,
-        }
+    """Stato sintetico per il polling della UI (dettaglio completo in /jobs)."""
+    jobs = JOBS.list_jobs(limit=1)
+    running = [j["name"] for j in jobs["running"]]
+    last = JOBS.last_finished()
+    return {
+        "job_running": bool(running or jobs["queued"]),
+        "job_name": ", ".join(running) if running else (f"{len(jobs['queued'])} in coda" if jobs["queued"] else None),
+        "last_message": last["message"] if last else "",
+        "queued": len(jobs["queued"]),
+        "pipeline": last_pipeline_run(),
+    }
 
 def current_state(today_override: Optional[str] = None) -> dict:
     state = {
         "today": today_override or date.today().isoformat(),
         "has_hist": (ROOT / "data" / "historical_dataset.csv").exists(),
-        "has_model": (ROOT / "models" / "bet_ou25.joblib").exists(), # Controlla un modello a caso
+        "has_model": any(variant_paths("ou", v).model.exists() for v in VARIANTS),
         "has_report": REPORT_HTML.exists(),
         "has_preds": PRED_PATH.exists(),
     }
@@ -486,50 +479,25 @@ def current_state(today_override: Optional[str] = None) -> dict:
     state["job_name"] = job_status["job_name"] or ""
     state["last_message"] = job_status["last_message"]
     state["odds_coverage"] = get_odds_coverage_info()
+    state["pipeline"] = job_status["pipeline"]
+    # backfill storico in pausa (checkpoint di historical_builder): il pannello offre la ripresa
+    state["backfill"] = read_checkpoint(staging_dir(ROOT / "data" / "historical_dataset.csv"))
     return state
 
-def _start_job_and_render(
-    job_name: str,
-    target_func,
-    args_tuple: tuple,
-):
-    global _job_running, _job_name, _job_last_message, _job_stop_requested
-    with _job_lock:
-        if _job_running:
-            return jsonify({"status": "job_already_running", "job_name": _job_name, "message": f"Un job ('{_job_name}') è già in esecuzione. Attendi che termini."})
-
-        # Imposta lo stato PRIMA di avviare il thread per evitare race condition
-        _job_running = True
-        _job_name = job_name
-        _job_last_message = ""
-        _job_stop_requested = False
-
-        thread_args = (job_name, target_func) + args_tuple
-        t = threading.Thread(target=job_wrapper, args=thread_args, daemon=True)
-        t.start()
-        
-    return jsonify({"status": "job_started", "job_name": job_name})
-
+def _start_job_and_render(job_type: str, args_tuple: tuple = ()):
+    """Mette il job in coda; parte appena c'è un worker libero e il suo gruppo lo consente."""
+    job_id = JOBS.submit(job_type, args_tuple)
+    return jsonify({"status": "job_started", "job_name": job_type, "job_id": job_id})
 
-def _schedule_start_job(job_name: str, target_func, args_tuple: tuple):
-    """Start a job from scheduler (no Flask request). Returns True if started."""
-    global _job_running, _job_name, _job_last_message, _job_stop_requested
-    with _job_lock:
-        if _job_running:
-            logger.warning(f"[SCHED] Job '{job_name}' non avviato: un altro job ('{_job_name}') è in esecuzione.")
-            return False
 
-        # Imposta stato e avvia thread di esecuzione tramite job_wrapper
-        _job_running = True
-        _job_name = job_name
-        _job_last_message = ""
-        _job_stop_requested = False
-
-        thread_args = (job_name, target_func) + args_tuple
-        t = threading.Thread(target=job_wrapper, args=thread_args, daemon=True)
-        t.start()
-
-    logger.info(f"[SCHED] Job '{job_name}' avviato dallo scheduler.")
+def _schedule_start_job(job_type: str, args_tuple: tuple = (), name: Optional[str] = None):
+    """Accoda un job dallo scheduler (no Flask request). Non duplica un job uguale già in coda."""
+    name = name or job_type
+    job_id = JOBS.submit(job_type, args_tuple, name=name, dedupe=True)
+    if job_id is None:
+        logger.info(f"[SCHED] Job '{name}' già in coda, non duplicato.")
+        return False
+    logger.info(f"[SCHED] Job '{name}' (#{job_id}) accodato dallo scheduler.")
     return True
 
 
@@ -548,6 +516,7 @@ def index():
         comp_choices=COMP_CHOICES,
         state=state,
         last_log=_read_last_log_tail(),
+        slow_stages=metrics.slowest_stages(),
         active_tab="daily",  # Set a default to keep details panels closed
     )
 
@@ -561,11 +530,7 @@ def daily():
     delay = request.form.get("delay", "0.6")
     do_predict = request.form.get("do_predict") == "on"
 
-    return _start_job_and_render(
-        job_name="daily",
-        target_func=run_daily_pipeline,
-        args_tuple=(d, comps, delay, do_predict),
-    )
+    return _start_job_and_render("daily", (d, comps, delay, do_predict))
 
 # ====== HISTORY ======
 @APP.post("/history", endpoint="history")
@@ -577,63 +542,39 @@ def history():
     nrec = request.form.get("n_recent_hist", "5")
     delay = request.form.get("delay_hist", "0.6")
 
-    return _start_job_and_render(
-        job_name="history",
-        target_func=run_history_builder,
-        args_tuple=(dfrom, dto, comps, nrec, delay),
-    )
+    return _start_job_and_render("history", (dfrom, dto, comps, nrec, delay))
 
 # ====== TRAIN ======
 @APP.post("/train", endpoint="train")
 def train():
     mode = request.form.get("train_mode", "real")  # real | dummy
-    return _start_job_and_render(
-        job_name="train",
-        target_func=run_training,
-        args_tuple=(mode,),
-    )
+    return _start_job_and_render("train", (mode,))
 
 # ====== PREDICT ======
 @APP.post("/predict", endpoint="predict")
 def predict():
     # Questa rotta non esiste nel nuovo HTML, ma la lascio per API compatibility
     # Potrebbe essere unita o rimossa in futuro.
-    return _start_job_and_render(
-        job_name="predict",
-        target_func=run_predict_only,
-        args_tuple=(),
-    )
+    return _start_job_and_render("predict")
 
 # ====== FETCH RESULTS (manual trigger) ======
 @APP.post("/fetch_results", endpoint="fetch_results")
 def fetch_results():
     """Avvia manualmente il job per scaricare i risultati."""
-    return _start_job_and_render(
-        job_name="fetch_results",
-        target_func=run_results_fetcher,
-        args_tuple=(),
-    )
+    return _start_job_and_render("fetch_results")
 
 # ====== BUILD MAPS (manual trigger) ======
 @APP.post("/build_maps", endpoint="build_maps")
 def build_maps():
     """Avvia manualmente il job per costruire i team mappings."""
-    return _start_job_and_render(
-        job_name="build_maps",
-        target_func=run_map_builder,
-        args_tuple=(),
-    )
+    return _start_job_and_render("build_maps")
 
 # ====== ODDS BULK FETCH (manual trigger) ======
 @APP.post("/odds_bulk_fetch", endpoint="odds_bulk_fetch")
 def odds_bulk_fetch():
     """Avvia manualmente il job per lo scaricamento massivo delle quote."""
     days = request.form.get("bulk_days", "30")
-    return _start_job_and_render(
-        job_name="odds_bulk_fetch",
-        target_func=run_odds_bulk_fetch,
-        args_tuple=(days,),
-    )
+    return _start_job_and_render("odds_bulk_fetch", (days,))
 
 # ====== LOG TAIL (per polling JS) ======
 @APP.get("/log_tail")
@@ -645,17 +586,63 @@ def log_tail():
 def job_status():
     return jsonify(get_job_status())
 
+# ====== CACHE VISTE DI MERCATO ======
+@APP.get("/market-cache")
+def market_cache_status():
+    """Voci in cache (vista, data, versione dei dati) e contatori hit/miss/eviction."""
+    from market_cache import MARKET_CACHE
+    return jsonify(MARKET_CACHE.stats())
+
+# ====== MODELLI ML (registro) ======
+@APP.get("/models")
+def models_status():
+    """Varianti dei modelli su disco/in memoria e versione servita per mercato."""
+    from model_registry import get_registry
+    return jsonify(get_registry().status())
+
+# ====== METRICHE (Prometheus) ======
+@APP.get("/metrics")
+def metrics_view():
+    """Stadi della pipeline (da logs/metrics.jsonl) e viste Flask in formato testo Prometheus."""
+    resp = make_response(metrics.render_prometheus(), 200)
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
 # ====== STOP JOB ======
 @APP.post("/stop_job")
 def stop_job():
-    global _job_stop_requested
-    with _job_lock:
-        if _job_running:
-            _job_stop_requested = True
-            logger.info("Richiesta di interruzione del job in corso...")
-            return jsonify({"status": "stop_requested"})
+    """Interrompe il job indicato (job_id) o, senza id, tutti quelli in esecuzione."""
+    job_id = request.values.get("job_id", type=int)
+    ids = [job_id] if job_id else [ctx.job_id for ctx in JOBS.running_contexts()]
+    results = [JOBS.cancel(i) for i in ids]
+    if any(results):
+        logger.info(f"Richiesta di interruzione dei job {ids}...")
+        return jsonify({"status": "stop_requested", "job_ids": ids})
     return jsonify({"status": "no_job_running"})
 
+# ====== CODA JOB ======
+@APP.get("/jobs")
+def jobs_list():
+    """Job in coda, in esecuzione e terminati con tempi di attesa e durata."""
+    return jsonify(JOBS.list_jobs(limit=request.args.get("limit", 50, type=int)))
+
+
+@APP.post("/jobs/<int:job_id>/cancel")
+def job_cancel(job_id: int):
+    status = JOBS.cancel(job_id)
+    if status is None:
+        return jsonify({"status": "not_found_or_finished", "job_id": job_id}), 404
+    return jsonify({"status": status, "job_id": job_id})
+
+
+@APP.post("/jobs/<int:job_id>/resume")
+def job_resume(job_id: int):
+    """Rimette in coda un backfill in pausa: riparte dal checkpoint con gli stessi argomenti."""
+    new_id = JOBS.resume(job_id)
+    if new_id is None:
+        return jsonify({"status": "not_resumable", "job_id": job_id}), 404
+    return jsonify({"status": "job_started", "job_id": new_id, "resumed_from": job_id})
+
 
 # ====== DOWNLOAD ======
 @APP.get("/download/<path:fname>")
@@ -672,43 +659,32 @@ def download(fname):
 # ====== DATA VIEW (visualizza fixtures, odds, features) ======
 @APP.get("/data")
 def data_view():
-    """Visualizza fixtures, odds e features dal database."""
+    """Visualizza fixtures, odds e features dal database, una pagina alla volta."""
     db = None
     try:
         if not SessionLocal:
             return "Database non configurato.", 500
+        from data_browser import ensure_indexes, fetch_page, leagues, parse_filters, parse_limit, summary
+        try:
+            filters = parse_filters(request.args)
+            limit = parse_limit(request.args.get("limit"))
+        except ValueError as e:
+            return f"Parametro non valido: {e}", 400
         db = SessionLocal()
-        
-        # Esegui una singola query con JOIN per evitare il problema N+1
-        query_results = (
-            db.query(Fixture, Odds, Feature)
-            .outerjoin(Odds, Fixture.match_id == Odds.match_id)
-            .outerjoin(Feature, Fixture.match_id == Feature.match_id)
-            .order_by(Fixture.date.desc())
-            .all()
+        ensure_indexes(db.get_bind())
+        page = fetch_page(db, filters, after=request.args.get("after"),
+                          before=request.args.get("before"), limit=limit)
+        return render_template(
+            'data.html',
+            data=page["rows"],
+            page=page,
+            stats=summary(db, filters),
+            filters=filters,
+            filter_args=filters.as_args(),
+            leagues=leagues(db),
         )
-        
-        data = []
-        for f, odds, feature in query_results:
-            data.append({
-                'match_id': f.match_id,
-                'date': f.date.isoformat() if f.date else '-',
-                'time': f.time_local or '-',
-                'league': f.league_code,
-                'home': f.home,
-                'away': f.away,
-                'odds_1': round(float(odds.odds_1), 2) if odds and odds.odds_1 else '-',
-                'odds_x': round(float(odds.odds_x), 2) if odds and odds.odds_x else '-',
-                'odds_2': round(float(odds.odds_2), 2) if odds and odds.odds_2 else '-',
-                'xg_for_home': round(float(feature.xg_for_home), 2) if feature and feature.xg_for_home else '-',
-                'xg_for_away': round(float(feature.xg_for_away), 2) if feature and feature.xg_for_away else '-',
-                'xg_against_home': round(float(feature.xg_against_home), 2) if feature and feature.xg_against_home else '-',
-                'xg_against_away': round(float(feature.xg_against_away), 2) if feature and feature.xg_against_away else '-',
-                'rest_days_home': feature.rest_days_home if feature else '-',
-                'rest_days_away': feature.rest_days_away if feature else '-',
-            })
-        
-        return render_template('data.html', data=data)
+    except ValueError as e:
+        return f"Cursore non valido: {e}", 400
     except Exception as e:
         logger.error(f"Errore nel caricamento dati per /data: {e}", exc_info=True)
         return f"Errore nel caricamento dati: {e}", 500
@@ -717,6 +693,34 @@ def data_view():
             db.close()
 
 
+@APP.get("/api/data")
+def data_api():
+    """Come /data ma in JSON: {rows, limit, next, prev, filters}; ?stats=1 aggiunge i conteggi."""
+    db = None
+    try:
+        if not SessionLocal:
+            return jsonify({"error": "Database non configurato."}), 500
+        from data_browser import ensure_indexes, fetch_page, parse_filters, parse_limit, summary
+        filters = parse_filters(request.args)
+        limit = parse_limit(request.args.get("limit"))
+        db = SessionLocal()
+        ensure_indexes(db.get_bind())
+        page = fetch_page(db, filters, after=request.args.get("after"),
+                          before=request.args.get("before"), limit=limit)
+        page["filters"] = filters.as_args()
+        if request.args.get("stats") == "1":
+            page["stats"] = summary(db, filters)
+        return jsonify(page)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Errore in /api/data: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if db:
+            db.close()
+
+
 # ====== PREDICTIONS VIEW (xG Analysis) ======
 @APP.get("/predictions-xg")
 def predictions_xg():
@@ -747,16 +751,24 @@ def _calculate_proposal_reliability(proposals: list) -> dict:
     return counts
 
 
+def _cached_proposals(date_param: Optional[str]) -> list:
+    """Proposte di una data dalla cache condivisa (ricalcolate solo se i dati della data cambiano)."""
+    from market_cache import MARKET_CACHE
+    from proposal_generator import generate_proposals
+
+    day = date_param or date.today().isoformat()
+    return MARKET_CACHE.get("proposals", day, partial(generate_proposals, day))
+
+
 # ====== PROPOSAL VIEW (Risultato più probabile) ======
 @APP.get("/proposta")
 def proposal_view():
     """Visualizza la proposta calcolata (risultato più probabile)."""
     try:
-        from proposal_generator import generate_proposals
         from datetime import datetime
         
         date_param = request.args.get('date')
-        proposals = generate_proposals(date_param)
+        proposals = _cached_proposals(date_param)
 
         # Calcola riepilogo affidabilità per la UI
         reliability_counts = _calculate_proposal_reliability(proposals)
@@ -773,9 +785,8 @@ def proposal_view():
 def proposta_stats():
     """Endpoint JSON che ritorna conteggi di affidabilità per una data."""
     try:
-        from proposal_generator import generate_proposals
         date_param = request.args.get('date')
-        proposals = generate_proposals(date_param)
+        proposals = _cached_proposals(date_param)
         return jsonify({"date": date_param or '', "counts": _calculate_proposal_reliability(proposals)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -785,7 +796,6 @@ def proposta_stats():
 def results_view():
     """Visualizza esiti partite con probabilità previste."""
     try:
-        from proposal_generator import generate_proposals
         from datetime import datetime, timedelta
         
         # Mostra ultimi 7 giorni
@@ -797,9 +807,9 @@ def results_view():
             # Scarica risultati ultimi 7 giorni
             for i in range(7):
                 d = (datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
-                all_proposals.extend(generate_proposals(d))
+                all_proposals.extend(_cached_proposals(d))
         else:
-            all_proposals = generate_proposals(date_param)
+            all_proposals = _cached_proposals(date_param)
         
         # Filtra solo quelle con risultato
         finished = [p for p in all_proposals if p['is_finished']]
@@ -821,236 +831,239 @@ def results_view():
 
 
 # ====== EXTENDED MARKETS ======
-@APP.get("/extended-markets")
-def extended_markets_view():
-    """Visualizza schedina completa con TUTTE le partite e top 3 picks per ognuna."""
-    try:
-        from scipy.stats import poisson
-        from datetime import datetime
+def _compute_extended_markets(date_param: str) -> dict:
+    """Partite, pick e schedine dei mercati estesi per una data (payload in cache per data)."""
+    from datetime import datetime
+    from poisson_kernel import multigol_prob, outcome_probs, score_tensor, total_goals_dist
 
-        if not SessionLocal or not Fixture:
-            return render_template('extended_markets.html',
-                                 error="Database non configurato.",
-                                 selected_date="",
-                                 partite_serie_a=[],
-                                 partite_premier=[],
-                                 schedine=[],
-                                 stats={})
-
-        date_param = request.args.get('date') or date.today().isoformat()
-
-        # Query database per tutte le partite della data specificata
-        db = SessionLocal()
-        try:
-            target_date = datetime.strptime(date_param, "%Y-%m-%d").date()
-            fixtures = db.query(Fixture).filter(Fixture.date == target_date).all()
-
-            if not fixtures:
-                return render_template('extended_markets.html',
-                                     error=f"Nessuna partita trovata per il {date_param}",
-                                     selected_date=date_param,
-                                     partite_serie_a=[],
-                                     partite_premier=[],
-                                     schedine=[],
-                                     stats={})
-
-            tutte_partite = []
-
-            for fix in fixtures:
-                if not fix.feature:
-                    continue
-
-                feat = fix.feature
-                if not all([feat.xg_for_home, feat.xg_against_home, feat.xg_for_away, feat.xg_against_away]):
-                    continue
-
-                # Calcola lambda (gol attesi)
-                lam_h = (feat.xg_for_home + feat.xg_against_away) / 2
-                lam_a = (feat.xg_for_away + feat.xg_against_home) / 2
-                lam_tot = lam_h + lam_a
-
-                # Probabilità 1X2
-                p_h = sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a) for i in range(10) for j in range(i))
-                p_d = sum(poisson.pmf(i, lam_h) * poisson.pmf(i, lam_a) for i in range(10))
-                p_a = 1 - p_h - p_d
-
-                # Doppia Chance
-                p_1x = p_h + p_d
-                p_x2 = p_d + p_a
-                p_12 = p_h + p_a
-
-                # Over/Under
-                p_over15 = 1 - sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a)
-                                   for i in range(2) for j in range(2) if i+j <= 1)
-                p_over25 = 1 - sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a)
-                                   for i in range(3) for j in range(3) if i+j <= 2)
-                p_under25 = 1 - p_over25
-                p_under35 = sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a)
-                                for i in range(4) for j in range(4) if i+j <= 3)
-
-                # GG/NG
-                p_gg = 1 - (poisson.pmf(0, lam_h) * sum(poisson.pmf(j, lam_a) for j in range(10)) +
-                            sum(poisson.pmf(i, lam_h) for i in range(10)) * poisson.pmf(0, lam_a) -
-                            poisson.pmf(0, lam_h) * poisson.pmf(0, lam_a))
-                p_ng = 1 - p_gg
-
-                # Multigol
-                p_mg_13 = sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a)
-                              for i in range(4) for j in range(4) if 1 <= i+j <= 3)
-                p_mg_25 = sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a)
-                              for i in range(6) for j in range(6) if 2 <= i+j <= 5)
-
-                # Determina il pick migliore
-                picks = [
-                    ('1', p_h), ('X', p_d), ('2', p_a),
-                    ('1X', p_1x), ('X2', p_x2), ('12', p_12),
-                    ('Over 1.5', p_over15), ('Over 2.5', p_over25),
-                    ('Under 2.5', p_under25), ('Under 3.5', p_under35),
-                    ('GG', p_gg), ('NG', p_ng),
-                    ('MG 1-3', p_mg_13), ('MG 2-5', p_mg_25),
-                ]
-
-                picks_sorted = sorted(picks, key=lambda x: x[1], reverse=True)
-
-                tutte_partite.append({
-                    'home': fix.home,
-                    'away': fix.away,
-                    'time': fix.time_local or fix.time,
-                    'league': fix.league_code,
-                    'lam_h': lam_h,
-                    'lam_a': lam_a,
-                    'lam_tot': lam_tot,
-                    'p_h': p_h,
-                    'p_d': p_d,
-                    'p_a': p_a,
-                    'pick_1': picks_sorted[0],
-                    'pick_2': picks_sorted[1],
-                    'pick_3': picks_sorted[2],
-                    'favorito': 'CASA' if p_h > max(p_d, p_a) else 'TRASFERTA' if p_a > max(p_h, p_d) else 'EQUILIBRIO'
-                })
-
-            # Separa Serie A e Premier League
-            partite_serie_a = [p for p in tutte_partite if p['league'] == 'SA']
-            partite_premier = [p for p in tutte_partite if p['league'] == 'PL']
-
-            # Genera schedine consigliate
-            schedine = []
-
-            # SCHEDINA 1: Serie A completa
-            if partite_serie_a:
-                prob_sa = 1.0
-                quota_sa = 1.0
-                for p in partite_serie_a:
-                    prob_sa *= p['pick_1'][1]
-                    quota_sa *= (1 / p['pick_1'][1])
-
-                schedine.append({
-                    'nome': 'SERIE A COMPLETA',
-                    'descrizione': f'{len(partite_serie_a)} eventi - Pick migliori',
-                    'partite': partite_serie_a,
-                    'prob': prob_sa,
-                    'quota': quota_sa,
-                    'vincita_10': quota_sa * 10,
-                    'profitto_10': (quota_sa - 1) * 10
-                })
-
-            # SCHEDINA 2: Premier top 5
-            if len(partite_premier) >= 5:
-                premier_top5 = partite_premier[:5]
-                prob_pl = 1.0
-                quota_pl = 1.0
-                for p in premier_top5:
-                    prob_pl *= p['pick_1'][1]
-                    quota_pl *= (1 / p['pick_1'][1])
-
-                schedine.append({
-                    'nome': 'PREMIER LEAGUE TOP 5',
-                    'descrizione': 'Pick migliori',
-                    'partite': premier_top5,
-                    'prob': prob_pl,
-                    'quota': quota_pl,
-                    'vincita_10': quota_pl * 10,
-                    'profitto_10': (quota_pl - 1) * 10
-                })
+    db = SessionLocal()
+    try:
+        target_date = datetime.strptime(date_param, "%Y-%m-%d").date()
+        fixtures = (
+            db.query(Fixture, Feature)
+            .outerjoin(Feature, Fixture.match_id == Feature.match_id)
+            .filter(Fixture.date == target_date)
+            .all()
+        )
+    finally:
+        db.close()
 
-            # SCHEDINA 3: Mix 6 più sicuri
-            if len(tutte_partite) >= 6:
-                all_sorted = sorted(tutte_partite, key=lambda x: x['pick_1'][1], reverse=True)[:6]
-                prob_mix = 1.0
-                quota_mix = 1.0
-                for p in all_sorted:
-                    prob_mix *= p['pick_1'][1]
-                    quota_mix *= (1 / p['pick_1'][1])
-
-                schedine.append({
-                    'nome': 'MIX 6 PIÙ SICURI',
-                    'descrizione': 'Probabilità più alte',
-                    'partite': all_sorted,
-                    'prob': prob_mix,
-                    'quota': quota_mix,
-                    'vincita_10': quota_mix * 10,
-                    'profitto_10': (quota_mix - 1) * 10
-                })
+    if not fixtures:
+        return {"error": f"Nessuna partita trovata per il {date_param}"}
+
+    tutte_partite = []
+
+    validi = []
+    for fix, feat in fixtures:
+        if feat is None:
+            continue
+
+        if not all([feat.xg_for_home, feat.xg_against_home, feat.xg_for_away, feat.xg_against_away]):
+            continue
+
+        # Calcola lambda (gol attesi)
+        lam_h = (feat.xg_for_home + feat.xg_against_away) / 2
+        lam_a = (feat.xg_for_away + feat.xg_against_home) / 2
+        validi.append((fix, lam_h, lam_a))
+
+    # Matrici punteggi 0-9 di tutte le partite in un colpo solo
+    if validi:
+        M = score_tensor([v[1] for v in validi], [v[2] for v in validi], 9)
+        ph_all, pd_all, _ = outcome_probs(M, normalize=False)
+        dist_all = total_goals_dist(M)
+        no_gg_all = M[:, 0, :].sum(axis=1) + M[:, :, 0].sum(axis=1) - M[:, 0, 0]
+        mg13_all = multigol_prob(M, 1, 3)
+        mg25_all = multigol_prob(M, 2, 5)
+
+    for k, (fix, lam_h, lam_a) in enumerate(validi):
+        lam_tot = lam_h + lam_a
+        dist = dist_all[k]
+
+        # Probabilità 1X2
+        p_h = float(ph_all[k])
+        p_d = float(pd_all[k])
+        p_a = 1 - p_h - p_d
+
+        # Doppia Chance
+        p_1x = p_h + p_d
+        p_x2 = p_d + p_a
+        p_12 = p_h + p_a
+
+        # Over/Under
+        p_over15 = 1 - float(dist[:2].sum())
+        p_over25 = 1 - float(dist[:3].sum())
+        p_under25 = 1 - p_over25
+        p_under35 = float(dist[:4].sum())
+
+        # GG/NG
+        p_gg = 1 - float(no_gg_all[k])
+        p_ng = 1 - p_gg
+
+        # Multigol
+        p_mg_13 = float(mg13_all[k])
+        p_mg_25 = float(mg25_all[k])
+
+        # Determina il pick migliore
+        picks = [
+            ('1', p_h), ('X', p_d), ('2', p_a),
+            ('1X', p_1x), ('X2', p_x2), ('12', p_12),
+            ('Over 1.5', p_over15), ('Over 2.5', p_over25),
+            ('Under 2.5', p_under25), ('Under 3.5', p_under35),
+            ('GG', p_gg), ('NG', p_ng),
+            ('MG 1-3', p_mg_13), ('MG 2-5', p_mg_25),
+        ]
+
+        picks_sorted = sorted(picks, key=lambda x: x[1], reverse=True)
+
+        tutte_partite.append({
+            'home': fix.home,
+            'away': fix.away,
+            'time': fix.time_local or fix.time,
+            'league': fix.league_code,
+            'lam_h': lam_h,
+            'lam_a': lam_a,
+            'lam_tot': lam_tot,
+            'p_h': p_h,
+            'p_d': p_d,
+            'p_a': p_a,
+            'pick_1': picks_sorted[0],
+            'pick_2': picks_sorted[1],
+            'pick_3': picks_sorted[2],
+            'favorito': 'CASA' if p_h > max(p_d, p_a) else 'TRASFERTA' if p_a > max(p_h, p_d) else 'EQUILIBRIO'
+        })
+
+    # Separa Serie A e Premier League
+    partite_serie_a = [p for p in tutte_partite if p['league'] == 'SA']
+    partite_premier = [p for p in tutte_partite if p['league'] == 'PL']
+
+    # Genera schedine consigliate
+    schedine = []
+
+    # SCHEDINA 1: Serie A completa
+    if partite_serie_a:
+        prob_sa = 1.0
+        quota_sa = 1.0
+        for p in partite_serie_a:
+            prob_sa *= p['pick_1'][1]
+            quota_sa *= (1 / p['pick_1'][1])
+
+        schedine.append({
+            'nome': 'SERIE A COMPLETA',
+            'descrizione': f'{len(partite_serie_a)} eventi - Pick migliori',
+            'partite': partite_serie_a,
+            'prob': prob_sa,
+            'quota': quota_sa,
+            'vincita_10': quota_sa * 10,
+            'profitto_10': (quota_sa - 1) * 10
+        })
+
+    # SCHEDINA 2: Premier top 5
+    if len(partite_premier) >= 5:
+        premier_top5 = partite_premier[:5]
+        prob_pl = 1.0
+        quota_pl = 1.0
+        for p in premier_top5:
+            prob_pl *= p['pick_1'][1]
+            quota_pl *= (1 / p['pick_1'][1])
+
+        schedine.append({
+            'nome': 'PREMIER LEAGUE TOP 5',
+            'descrizione': 'Pick migliori',
+            'partite': premier_top5,
+            'prob': prob_pl,
+            'quota': quota_pl,
+            'vincita_10': quota_pl * 10,
+            'profitto_10': (quota_pl - 1) * 10
+        })
+
+    # SCHEDINA 3: Mix 6 più sicuri
+    if len(tutte_partite) >= 6:
+        all_sorted = sorted(tutte_partite, key=lambda x: x['pick_1'][1], reverse=True)[:6]
+        prob_mix = 1.0
+        quota_mix = 1.0
+        for p in all_sorted:
+            prob_mix *= p['pick_1'][1]
+            quota_mix *= (1 / p['pick_1'][1])
+
+        schedine.append({
+            'nome': 'MIX 6 PIÙ SICURI',
+            'descrizione': 'Probabilità più alte',
+            'partite': all_sorted,
+            'prob': prob_mix,
+            'quota': quota_mix,
+            'vincita_10': quota_mix * 10,
+            'profitto_10': (quota_mix - 1) * 10
+        })
+
+    # SCHEDINA 4: Favoriti chiari
+    favoriti = []
+    for p in tutte_partite:
+        p_1x = p['p_h'] + p['p_d']
+        p_x2 = p['p_d'] + p['p_a']
+
+        if p['p_h'] > p['p_a'] and p_1x > 0.73:
+            favoriti.append((p, '1X', p_1x))
+        elif p['p_a'] > p['p_h'] and p_x2 > 0.73:
+            favoriti.append((p, 'X2', p_x2))
+
+    if favoriti:
+        prob_fav = 1.0
+        quota_fav = 1.0
+        favoriti_partite = []
+        for p, pick, prob in favoriti[:5]:
+            prob_fav *= prob
+            quota_fav *= (1 / prob)
+            p_copy = p.copy()
+            p_copy['pick_1'] = (pick, prob)
+            favoriti_partite.append(p_copy)
+
+        schedine.append({
+            'nome': 'FAVORITI CHIARI',
+            'descrizione': '1X o X2 con >73%',
+            'partite': favoriti_partite,
+            'prob': prob_fav,
+            'quota': quota_fav,
+            'vincita_10': quota_fav * 10,
+            'profitto_10': (quota_fav - 1) * 10
+        })
+
+    stats = {
+        'total_matches': len(tutte_partite),
+        'serie_a': len(partite_serie_a),
+        'premier': len(partite_premier),
+        'schedine_count': len(schedine)
+    }
 
-            # SCHEDINA 4: Favoriti chiari
-            favoriti = []
-            for p in tutte_partite:
-                p_1x = p['p_h'] + p['p_d']
-                p_x2 = p['p_d'] + p['p_a']
-
-                if p['p_h'] > p['p_a'] and p_1x > 0.73:
-                    favoriti.append((p, '1X', p_1x))
-                elif p['p_a'] > p['p_h'] and p_x2 > 0.73:
-                    favoriti.append((p, 'X2', p_x2))
-
-            if favoriti:
-                prob_fav = 1.0
-                quota_fav = 1.0
-                favoriti_partite = []
-                for p, pick, prob in favoriti[:5]:
-                    prob_fav *= prob
-                    quota_fav *= (1 / prob)
-                    p_copy = p.copy()
-                    p_copy['pick_1'] = (pick, prob)
-                    favoriti_partite.append(p_copy)
-
-                schedine.append({
-                    'nome': 'FAVORITI CHIARI',
-                    'descrizione': '1X o X2 con >73%',
-                    'partite': favoriti_partite,
-                    'prob': prob_fav,
-                    'quota': quota_fav,
-                    'vincita_10': quota_fav * 10,
-                    'profitto_10': (quota_fav - 1) * 10
-                })
+    return {
+        "error": None,
+        "partite_serie_a": partite_serie_a,
+        "partite_premier": partite_premier,
+        "schedine": schedine,
+        "stats": stats,
+    }
 
-            stats = {
-                'total_matches': len(tutte_partite),
-                'serie_a': len(partite_serie_a),
-                'premier': len(partite_premier),
-                'schedine_count': len(schedine)
-            }
 
-            return render_template('extended_markets.html',
-                                 selected_date=date_param,
-                                 partite_serie_a=partite_serie_a,
-                                 partite_premier=partite_premier,
-                                 schedine=schedine,
-                                 stats=stats,
-                                 error=None)
+@APP.get("/extended-markets")
+def extended_markets_view():
+    """Visualizza schedina completa con TUTTE le partite e top 3 picks per ognuna."""
+    date_param = request.args.get('date') or date.today().isoformat()
+    empty = {"partite_serie_a": [], "partite_premier": [], "schedine": [], "stats": {}}
+    try:
+        if not SessionLocal or not Fixture:
+            return render_template('extended_markets.html', error="Database non configurato.",
+                                   selected_date="", **empty)
 
-        finally:
-            db.close()
+        from market_cache import MARKET_CACHE
+        payload = MARKET_CACHE.get("extended_markets", date_param,
+                                   partial(_compute_extended_markets, date_param))
+        return render_template('extended_markets.html', selected_date=date_param, **{**empty, **payload})
 
     except Exception as e:
         logger.error(f"Errore nel caricamento schedina completa: {e}", exc_info=True)
         return render_template('extended_markets.html',
                              error=f"Errore: {str(e)}",
                              selected_date=date_param or "",
-                             partite_serie_a=[],
-                             partite_premier=[],
-                             schedine=[],
-                             stats={})
+                             **empty)
 
 
 @APP.post("/generate-extended")
@@ -1062,11 +1075,7 @@ def generate_extended():
 
     cmd = f'python generate_extended_predictions.py --date {date_param} --top {top_n} --min-prob {min_prob}'
 
-    return _start_job_and_render(
-        job_name="generate_extended",
-        target_func=run_cmd,
-        args_tuple=(cmd, 600),
-    )
+    return _start_job_and_render("generate_extended", (cmd, 600))
 
 
 @APP.get("/predizioni-semplici")
@@ -1177,6 +1186,17 @@ def main():
     if port_to_use != default_port:
         print(f"[INFO] La porta {default_port} è occupata. L'app sarà disponibile sulla porta {port_to_use}.", file=sys.stderr)
 
+    JOBS.start(workers=JOB_WORKERS)
+
+    # Worker residente per i comandi della pipeline (run_cmd ripiega sul subprocess se non c'è)
+    if os.getenv("BET_RESIDENT_WORKER", "0") == "1":
+        worker = start_pipeline_worker(ROOT / "logs" / "pipeline_worker.log")
+        if worker is not None:
+            _child_processes.append(worker)
+            logger.info(f"Worker residente avviato (PID {worker.pid}).")
+        else:
+            logger.warning("Worker residente non disponibile su questa piattaforma: uso subprocess.")
+
     # Avvia uno scheduler locale (BackgroundScheduler) per eseguire i job automaticamente.
     if _HAS_APS:
         try:
@@ -1186,7 +1206,7 @@ def main():
                 # Calcola la data al momento dell'esecuzione
                 d = date.today().isoformat()
                 comps = ",".join([c for c, _ in COMP_CHOICES])
-                _schedule_start_job("daily_scheduled", run_daily_pipeline, (d, comps, "0.6", True))
+                _schedule_start_job("daily", (d, comps, "0.6", True), name="daily_scheduled")
 
             # Esegui la pipeline giornaliera ogni giorno alle 04:00
             scheduler.add_job(_scheduled_daily, CronTrigger(hour=4, minute=0), id="daily_pipeline")
@@ -1204,7 +1224,7 @@ def main():
                 _schedule_start_job,
                 IntervalTrigger(minutes=30),
                 id="results_fetcher",
-                args=("fetch_results", run_results_fetcher, ()),
+                args=("fetch_results",),
             )
 
             # Rigenera previsioni ogni ora
@@ -1212,7 +1232,7 @@ def main():
                 _schedule_start_job,
                 IntervalTrigger(hours=1),
                 id="predict_hourly",
-                args=("predict_hourly", run_predict_only, ()),
+                args=("predict", (), "predict_hourly"),
             )
 
             scheduler.start()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+backfill_checkpoint.py
+----------------------
+Checkpoint e staging per i backfill lunghi (historical_builder, expand_historical_dataset,
+populate_enhanced_features): un crash, un Ctrl-C o lo stop dal dashboard mettono
+il backfill in pausa invece di buttare il lavoro fatto.
+
+- i risultati parziali si scrivono a blocchi ("unità": lega-stagione, stagione,
+  blocco di righe) in una cartella di staging accanto all'output
+  (<output>.staging/part-00001.pkl, ...), ognuno con scrittura atomica
+- checkpoint.json registra i parametri del backfill e le unità completate;
+  un eventuale stato da cui ripartire (es. il TeamStateEngine) va in payload-NNNNN.pkl
+  legato all'ultima unità registrata
+- al riavvio con gli stessi parametri le unità completate vengono saltate;
+  parametri diversi (o --restart) azzerano lo staging; staging=... sceglie un'altra
+  cartella (expand_historical_dataset, che pubblica sullo stesso output di historical_builder)
+- publish() concatena le parti, sostituisce gli output in modo atomico
+  (historical_store.save_dataset) e rimuove lo staging
+- pausable(): SIGTERM (stop del job: run_cmd / pipeline_worker) diventa come
+  Ctrl-C, il processo esce con EXIT_PAUSED lasciando il checkpoint
+
+Uso:
+    ckpt = BackfillCheckpoint(OUT_CSV, {"from": ..., "to": ..., "comps": ...})
+    with pausable("Storico"):
+        for unit in units:
+            if ckpt.is_done(unit):
+                continue
+            ckpt.save_part(unit, compute(unit))
+        ckpt.publish(ckpt.combined(), [OUT_CSV, OUT_CSV_1X2])
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import shutil
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from historical_store import save_dataset
+
+CHECKPOINT_FILE = "checkpoint.json"
+EXIT_PAUSED = 75  # EX_TEMPFAIL: interrotto, si può riprendere
+
+
+def staging_dir(output) -> Path:
+    return Path(output).with_suffix(".staging")
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp.replace(path)
+
+
+def read_checkpoint(staging) -> Optional[Dict[str, Any]]:
+    """Checkpoint di un backfill in pausa nella cartella `staging` (None se non c'è o è illeggibile)."""
+    path = Path(staging) / CHECKPOINT_FILE
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class BackfillCheckpoint:
+    """Staging a blocchi e unità completate di un backfill verso `output`."""
+
+    def __init__(self, output, params: Dict[str, Any], restart: bool = False, staging: Optional[Path] = None):
+        self.output = Path(output)
+        self.dir = Path(staging) if staging else staging_dir(output)
+        self.params = json.loads(json.dumps(params, default=str))  # confrontabile col JSON su disco
+        state = None if restart else read_checkpoint(self.dir)
+        if state is not None and state.get("params") != self.params:
+            print(f"[INFO] {self.dir.name}: parametri cambiati, checkpoint precedente scartato")
+            state = None
+        if state is None:
+            if self.dir.exists():
+                shutil.rmtree(self.dir)
+            state = {"params": self.params, "units": {}, "order": [], "payload": None,
+                     "started_at": time.time()}
+        elif state["order"]:
+            print(f"[INFO] Ripresa da checkpoint: {len(state['order'])} unità già completate "
+                  f"(ultima: {state['order'][-1]})")
+        self.state = state
+
+    # ---------- lettura ----------
+    def is_done(self, unit: str) -> bool:
+        return unit in self.state["units"]
+
+    @property
+    def done(self) -> List[str]:
+        return list(self.state["order"])
+
+    def payload(self) -> Any:
+        """Stato salvato con l'ultima unità completata (None se assente)."""
+        name = self.state.get("payload")
+        if not name:
+            return None
+        with open(self.dir / name, "rb") as f:
+            return pickle.load(f)
+
+    def frames(self, units: Optional[Iterable[str]] = None) -> List[pd.DataFrame]:
+        """
+        Parti salvate nell'ordine di completamento, o in quello di `units` (stesso output
+        anche se le unità finiscono in ordine diverso, es. in parallelo). Le unità senza
+        righe o non completate sono saltate.
+        """
+        out = []
+        for unit in self.state["order"] if units is None else units:
+            part = self.state["units"].get(unit, {}).get("part")
+            if part:
+                out.append(pd.read_pickle(self.dir / part))
+        return out
+
+    def combined(self, units: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        frames = self.frames(units)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    # ---------- scrittura ----------
+    def save_part(self, unit: str, frame: Optional[pd.DataFrame], payload: Any = None, **info: Any) -> None:
+        """
+        Registra l'unità come completata. L'ordine delle scritture (parte, payload,
+        checkpoint.json) fa sì che un'interruzione a metà lasci valido il checkpoint precedente.
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        seq = len(self.state["order"]) + 1
+        entry: Dict[str, Any] = {"rows": 0 if frame is None else len(frame), "at": time.time()}
+        entry.update(info)
+        if frame is not None and len(frame):
+            entry["part"] = f"part-{seq:05d}.pkl"
+            _write_atomic(self.dir / entry["part"], pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL))
+        old_payload = self.state.get("payload")
+        if payload is not None:
+            self.state["payload"] = f"payload-{seq:05d}.pkl"
+            _write_atomic(self.dir / self.state["payload"], pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+        self.state["units"][unit] = entry
+        self.state["order"].append(unit)
+        self.state["updated_at"] = time.time()
+        _write_atomic(self.dir / CHECKPOINT_FILE, json.dumps(self.state, indent=1).encode("utf-8"))
+        if payload is not None and old_payload:
+            (self.dir / old_payload).unlink(missing_ok=True)
+
+    def publish(self, frame: pd.DataFrame, outputs: Optional[Iterable[Path]] = None, clear: bool = True) -> None:
+        """Sostituisce gli output (CSV + .arrow, atomici) e, se clear, rimuove lo staging."""
+        for path in outputs or [self.output]:
+            save_dataset(frame, path)
+        if clear:
+            self.clear()
+
+    def clear(self) -> None:
+        if self.dir.exists():
+            shutil.rmtree(self.dir)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+@contextmanager
+def pausable(label: str) -> Iterator[None]:
+    """
+    SIGTERM e Ctrl-C fermano il backfill lasciando il checkpoint: esce con EXIT_PAUSED.
+    Fuori dal thread principale (job in-process) il segnale non si può intercettare.
+    """
+    prev = None
+    if threading.current_thread() is threading.main_thread():
+        prev = signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        yield
+    except KeyboardInterrupt:
+        print(f"[INFO] {label} in pausa: rilancia con gli stessi parametri per riprendere dal checkpoint.",
+              flush=True)
+        raise SystemExit(EXIT_PAUSED)
+    finally:
+        if prev is not None:
+            signal.signal(signal.SIGTERM, prev)
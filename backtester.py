@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+backtester.py
+-------------
+Backtest walk-forward vettoriale sugli storici arricchiti (data/historical_*_enhanced.csv).
+
+- fold per finestre di calendario: prima di ogni finestra di test (--step giorni) il
+  modello si riaddestra sulle partite dei --train-days giorni precedenti (0 = tutto lo
+  storico precedente), con le stesse componenti di model_pipeline (imputer, scaler,
+  classificatore --algo logistic|lgbm) e le stesse liste di feature
+- i fold sono indipendenti e girano in parallelo su processi (--jobs)
+- le partite di ogni fold sono valutate come array: probabilità, Brier/logloss,
+  scelta della puntata per edge sul mercato, stake e P&L, senza cicli per riga
+- stake: "flat" (staking.flat_pct), "kelly" (Kelly frazionato, _kelly_array con
+  staking.kelly_fraction) o "config" (la regola di scommesse_pipeline: flat, Kelly se
+  l'edge supera staking.kelly_min_edge), da config.json
+- output in --out: metriche per lega/mercato, curve di P&L cumulate, tabelle di
+  calibrazione, puntate e probabilità per partita (CSV)
+
+Gli stake sono frazioni del bankroll iniziale (unità) senza capitalizzazione: ogni
+puntata è indipendente dalle precedenti e il P&L resta una somma cumulata.
+Il mercato ou25 ha P&L solo se lo storico porta le quote odds_ou25_over/under;
+la CLV compare se ci sono le quote di chiusura (colonne <quota>_close).
+
+Uso:
+    python backtester.py --market 1x2 --train-days 365 --step 28 --stake kelly --jobs 4
+    python backtester.py --market all --from 2025-01-01 --out data/backtest
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from historical_store import load_dataset
+from model_pipeline import (FEATURES_1X2, FEATURES_OU, HIST_1X2_PATH, HIST_OU_PATH, _build_components,
+                            _kelly_array, _select_features, _standardize_cols, _to_num)
+
+ROOT = Path(__file__).resolve().parent
+CFG_PATH = ROOT / "config.json"
+OUT_DIR = ROOT / "data" / "backtest"
+
+STAKE_RULES = ("flat", "kelly", "config")
+CALIBRATION_BINS = 10
+DEFAULT_STAKING = {"flat_pct": 0.0125, "kelly_fraction": 0.5, "kelly_min_edge": 0.06}
+DEFAULT_EDGES = {"1x2": 0.04, "ou25": 0.03}
+
+
+class MarketSpec(NamedTuple):
+    name: str
+    task: str                   # "multiclass" | "binary" (per _build_components)
+    labels: Tuple[str, ...]     # esiti nell'ordine delle colonne di probabilità
+    odds_cols: Tuple[str, ...]  # quote nello stesso ordine
+    features: List[str]
+    data_path: Path
+    edge_key: str               # soglia in config.json "thresholds"
+
+
+MARKETS = {
+    "1x2": MarketSpec("1x2", "multiclass", ("1", "X", "2"), ("odds_1", "odds_x", "odds_2"),
+                      FEATURES_1X2, HIST_1X2_PATH, "edge_1x2"),
+    "ou25": MarketSpec("ou25", "binary", ("Under 2.5", "Over 2.5"), ("odds_ou25_under", "odds_ou25_over"),
+                       FEATURES_OU, HIST_OU_PATH, "edge_totals"),
+}
+
+
+def load_cfg(path: Path = CFG_PATH) -> Dict[str, Any]:
+    """Sezioni staking e thresholds di config.json (default se mancano)."""
+    cfg = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+    return {"staking": {**DEFAULT_STAKING, **cfg.get("staking", {})},
+            "thresholds": cfg.get("thresholds", {})}
+
+
+# =========================
+# DATI
+# =========================
+def outcome_index(df: pd.DataFrame, market: str) -> np.ndarray:
+    """Esito reale come indice di colonna (1X2: 0/1/2, OU: 0 Under / 1 Over); -1 se ignoto."""
+    hg = pd.to_numeric(df["ft_home_goals"], errors="coerce").to_numpy(dtype=float)
+    ag = pd.to_numeric(df["ft_away_goals"], errors="coerce").to_numpy(dtype=float)
+    if market == "1x2":
+        y = np.where(hg > ag, 0, np.where(hg == ag, 1, 2))
+    else:
+        y = (hg + ag > 2.5).astype(int)
+    return np.where(np.isnan(hg) | np.isnan(ag), -1, y)
+
+
+def prepare(df: pd.DataFrame, spec: MarketSpec, leagues: Optional[List[str]] = None):
+    """Storico ordinato per data con esito noto → (df, feature usate, X, y, date)."""
+    df = _standardize_cols(df)
+    if leagues:
+        mask = df["league"].isin(leagues)
+        if "league_code" in df.columns:
+            mask |= df["league_code"].isin(leagues)
+        df = df[mask]
+    df = df.assign(date=pd.to_datetime(df["date"], errors="coerce"))
+    df = df[df["date"].notna()].copy()
+    df["_y"] = outcome_index(df, spec.name)
+    df = df[df["_y"] >= 0].sort_values(["date", "match_id"], kind="mergesort").reset_index(drop=True)
+    cols = _select_features(df, spec.features, min_nonnull_ratio=0.02)
+    df = _to_num(df, cols)
+    X = df[cols].to_numpy(dtype=float)
+    return df, cols, X, df["_y"].to_numpy(dtype=int), df["date"].to_numpy(dtype="datetime64[D]")
+
+
+def make_folds(dates: np.ndarray, step_days: int = 28, train_days: int = 365, min_train: int = 200,
+               start: Optional[str] = None, end: Optional[str] = None) -> List[Tuple[slice, slice]]:
+    """
+    Fold walk-forward su date ordinate: (righe di training, righe di test) come slice.
+    Il training finisce sempre il giorno prima della finestra di test.
+    """
+    if len(dates) == 0:
+        return []
+    first = np.datetime64(start, "D") if start else dates[0]
+    last = np.datetime64(end, "D") if end else dates[-1]
+    step = np.timedelta64(max(1, step_days), "D")
+    folds = []
+    t0 = first
+    while t0 <= last:
+        t1 = min(t0 + step, last + np.timedelta64(1, "D"))
+        te_lo, te_hi = np.searchsorted(dates, [t0, t1], side="left")
+        tr_lo = np.searchsorted(dates, t0 - np.timedelta64(train_days, "D"), side="left") if train_days else 0
+        if te_hi > te_lo and te_lo - tr_lo >= min_train:
+            folds.append((slice(int(tr_lo), int(te_lo)), slice(int(te_lo), int(te_hi))))
+        t0 = t1
+    return folds
+
+
+# =========================
+# FOLD (processo separato)
+# =========================
+def _fit_predict(task: str, algo: str, n_classes: int, X_train: np.ndarray, y_train: np.ndarray,
+                 X_test: np.ndarray) -> np.ndarray:
+    """Addestra sul training del fold e restituisce le probabilità del test (n, n_classes)."""
+    import warnings
+
+    from sklearn.pipeline import Pipeline
+
+    model, imputer, scaler = _build_components(algo, task)
+    steps = [("imputer", imputer)] if imputer is not None else []
+    if scaler is not None:
+        steps.append(("scaler", scaler))
+    steps.append(("clf", model))
+    pipe = Pipeline(steps)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        pipe.fit(X_train, y_train)
+        proba = pipe.predict_proba(X_test)
+    # classi assenti nel training del fold: probabilità 0 nella loro colonna
+    out = np.zeros((len(X_test), n_classes))
+    out[:, pipe.classes_.astype(int)] = proba
+    return out
+
+
+def score_folds(X: np.ndarray, y: np.ndarray, folds, spec: MarketSpec, algo: str = "logistic",
+                jobs: int = 1) -> np.ndarray:
+    """Probabilità out-of-sample per riga (NaN fuori dai fold di test), fold in parallelo."""
+    n_classes = len(spec.labels)
+    P = np.full((len(y), n_classes), np.nan)
+    args = [(spec.task, algo, n_classes, X[tr], y[tr], X[te]) for tr, te in folds]
+    if jobs > 1 and len(folds) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(folds))) as ex:
+            results = list(ex.map(_fit_predict, *zip(*args)))
+    else:
+        results = [_fit_predict(*a) for a in args]
+    for (_tr, te), proba in zip(folds, results):
+        P[te] = proba
+    return P
+
+
+# =========================
+# PUNTATE E METRICHE (vettoriali)
+# =========================
+def _odds_matrix(df: pd.DataFrame, cols: Tuple[str, ...]) -> np.ndarray:
+    return np.column_stack([
+        pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float) if c in df.columns
+        else np.full(len(df), np.nan)
+        for c in cols
+    ])
+
+
+def stake_array(p: np.ndarray, odds: np.ndarray, edge: np.ndarray, rule: str,
+                staking: Dict[str, float]) -> np.ndarray:
+    """Stake (frazione del bankroll iniziale) per puntata secondo la regola."""
+    flat = np.full(len(p), float(staking["flat_pct"]))
+    if rule == "flat":
+        return flat
+    kelly = _kelly_array(p, odds, cut=float(staking["kelly_fraction"]))
+    if rule == "kelly":
+        return kelly
+    if rule == "config":
+        return np.where(edge >= float(staking["kelly_min_edge"]), np.maximum(flat, kelly), flat)
+    raise ValueError(f"Regola di stake sconosciuta: {rule} (attese: {', '.join(STAKE_RULES)})")
+
+
+def select_bets(df: pd.DataFrame, P: np.ndarray, y: np.ndarray, spec: MarketSpec, rule: str,
+                cfg: Dict[str, Any], min_edge: Optional[float] = None) -> pd.DataFrame:
+    """
+    Una puntata al più per partita: l'esito con edge massimo (probabilità del modello
+    meno probabilità implicita normalizzata delle quote), se l'edge supera la soglia.
+    """
+    odds = _odds_matrix(df, spec.odds_cols)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        implied = np.where(odds > 1.0, 1.0 / odds, np.nan)
+        implied = implied / implied.sum(axis=1, keepdims=True)
+        edge = P - implied
+    valid = ~np.isnan(edge).all(axis=1)
+    k = np.argmax(np.where(np.isnan(edge), -np.inf, edge), axis=1)
+    rows = np.arange(len(df))
+    best_edge = np.where(valid, edge[rows, k], np.nan)
+    threshold = min_edge if min_edge is not None else float(
+        cfg["thresholds"].get(spec.edge_key, DEFAULT_EDGES[spec.name]))
+    bet = valid & (best_edge >= threshold)
+
+    idx = rows[bet]
+    k, p, o, e = k[bet], P[idx, k[bet]], odds[idx, k[bet]], best_edge[bet]
+    stake = stake_array(p, o, e, rule, cfg["staking"])
+    won = y[idx] == k
+    bets = pd.DataFrame({
+        "date": df["date"].to_numpy()[idx],
+        "match_id": df["match_id"].to_numpy()[idx],
+        "league": df["league"].to_numpy()[idx],
+        "market": spec.name,
+        "pick": np.asarray(spec.labels, dtype=object)[k],
+        "prob": p,
+        "odds": o,
+        "edge": e,
+        "stake": stake,
+        "won": won,
+        "pnl": np.where(won, stake * (o - 1.0), -stake),
+    })
+    close_cols = tuple(f"{c}_close" for c in spec.odds_cols)
+    if all(c in df.columns for c in close_cols):
+        close = _odds_matrix(df, close_cols)[idx, k]
+        bets["clv"] = o / close - 1.0
+    return bets[bets["stake"] > 0].reset_index(drop=True)
+
+
+def _max_drawdown(pnl: pd.Series) -> float:
+    curve = pnl.cumsum()
+    return float((curve.cummax().clip(lower=0) - curve).max()) if len(curve) else 0.0
+
+
+def score_metrics(P: np.ndarray, y: np.ndarray) -> Tuple[float, float]:
+    """Brier (binario: sulla classe positiva; multiclasse: somma sulle classi) e logloss medi."""
+    onehot = np.eye(P.shape[1])[y]
+    if P.shape[1] == 2:
+        brier = np.mean((P[:, 1] - onehot[:, 1]) ** 2)
+    else:
+        brier = np.mean(((P - onehot) ** 2).sum(axis=1))
+    logloss = -np.mean(np.log(np.clip(P[np.arange(len(y)), y], 1e-15, 1.0)))
+    return float(brier), float(logloss)
+
+
+def summarize(scored: pd.DataFrame, P: np.ndarray, y: np.ndarray, bets: pd.DataFrame, market: str) -> pd.DataFrame:
+    """Metriche per lega più la riga "ALL": partite, Brier, logloss, puntate, ROI, drawdown."""
+    rows = []
+    leagues = ["ALL"] + sorted(scored["league"].dropna().unique().tolist())
+    for lg in leagues:
+        m = np.ones(len(scored), dtype=bool) if lg == "ALL" else (scored["league"] == lg).to_numpy()
+        b = bets if lg == "ALL" else bets[bets["league"] == lg]
+        if not m.any():
+            continue
+        brier, logloss = score_metrics(P[m], y[m])
+        staked = float(b["stake"].sum())
+        pnl = float(b["pnl"].sum())
+        rows.append({
+            "market": market, "league": lg, "matches": int(m.sum()),
+            "brier": round(brier, 4), "logloss": round(logloss, 4),
+            "bets": len(b), "hit_rate": round(float(b["won"].mean()), 4) if len(b) else None,
+            "staked": round(staked, 4), "pnl": round(pnl, 4),
+            "roi": round(pnl / staked, 4) if staked > 0 else None,
+            "max_drawdown": round(_max_drawdown(b["pnl"]), 4),
+            "clv": round(float(b["clv"].mean()), 4) if "clv" in b.columns and len(b) else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def pnl_curves(bets: pd.DataFrame) -> pd.DataFrame:
+    """P&L cumulato per giorno, per lega/mercato e complessivo per mercato."""
+    if bets.empty:
+        return pd.DataFrame(columns=["market", "league", "date", "bets", "pnl", "cum_pnl"])
+    daily = bets.groupby(["market", "league", "date"], sort=True).agg(
+        bets=("pnl", "size"), pnl=("pnl", "sum")).reset_index()
+    total = bets.groupby(["market", "date"], sort=True).agg(
+        bets=("pnl", "size"), pnl=("pnl", "sum")).reset_index().assign(league="ALL")
+    out = pd.concat([daily, total[daily.columns]], ignore_index=True)
+    out = out.sort_values(["market", "league", "date"], kind="mergesort").reset_index(drop=True)
+    out["cum_pnl"] = out.groupby(["market", "league"])["pnl"].cumsum()
+    return out
+
+
+def calibration_table(scored: pd.DataFrame, P: np.ndarray, y: np.ndarray, market: str,
+                      bins: int = CALIBRATION_BINS) -> pd.DataFrame:
+    """
+    Probabilità prevista contro frequenza osservata per fasce di probabilità, per lega e
+    complessiva; nel 1X2 ogni esito conta come previsione binaria (uno contro tutti).
+    """
+    k = P.shape[1]
+    flat_p = P.reshape(-1)
+    flat_hit = (np.arange(k)[None, :] == y[:, None]).reshape(-1).astype(float)
+    league = np.repeat(scored["league"].to_numpy(dtype=object), k)
+    b = np.clip((flat_p * bins).astype(int), 0, bins - 1)
+    frame = pd.DataFrame({"league": league, "bin": b, "p": flat_p, "hit": flat_hit})
+    frame = pd.concat([frame, frame.assign(league="ALL")], ignore_index=True)
+    out = frame.groupby(["league", "bin"]).agg(n=("p", "size"), mean_pred=("p", "mean"),
+                                               observed=("hit", "mean")).reset_index()
+    out["p_lo"] = out["bin"] / bins
+    out["p_hi"] = (out["bin"] + 1) / bins
+    out.insert(0, "market", market)
+    return out[["market", "league", "p_lo", "p_hi", "n", "mean_pred", "observed"]].round(4)
+
+
+# =========================
+# BACKTEST
+# =========================
+def run_backtest(df: pd.DataFrame, market: str, cfg: Optional[Dict[str, Any]] = None, algo: str = "logistic",
+                 stake: str = "config", step_days: int = 28, train_days: int = 365, min_train: int = 200,
+                 start: Optional[str] = None, end: Optional[str] = None, leagues: Optional[List[str]] = None,
+                 min_edge: Optional[float] = None, jobs: int = 1) -> Dict[str, Any]:
+    """Walk-forward completo su un mercato → dict con summary, bets, curves, calibration, scores."""
+    spec = MARKETS[market]
+    cfg = cfg or load_cfg()
+    data, cols, X, y, dates = prepare(df, spec, leagues)
+    folds = make_folds(dates, step_days, train_days, min_train, start, end)
+    if not cols or not folds:
+        return {"market": market, "features": cols, "folds": 0, "summary": pd.DataFrame(),
+                "bets": pd.DataFrame(), "curves": pnl_curves(pd.DataFrame()),
+                "calibration": pd.DataFrame(), "scores": pd.DataFrame()}
+
+    P_all = score_folds(X, y, folds, spec, algo, jobs)
+    tested = ~np.isnan(P_all).any(axis=1)
+    scored, P, y_t = data[tested].reset_index(drop=True), P_all[tested], y[tested]
+
+    bets = select_bets(scored, P, y_t, spec, stake, cfg, min_edge)
+    scores = scored[["date", "match_id", "league", "home", "away"]].copy()
+    for j, label in enumerate(spec.labels):
+        scores[f"p_{label}"] = P[:, j].round(4)
+    scores["outcome"] = np.asarray(spec.labels, dtype=object)[y_t]
+    return {
+        "market": market, "features": cols, "folds": len(folds),
+        "summary": summarize(scored, P, y_t, bets, market),
+        "bets": bets,
+        "curves": pnl_curves(bets),
+        "calibration": calibration_table(scored, P, y_t, market),
+        "scores": scores,
+    }
+
+
+def save_results(results: List[Dict[str, Any]], out_dir: Path) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name in ("summary", "bets", "curves", "calibration", "scores"):
+        frames = [r[name] for r in results if not r[name].empty]
+        if frames:
+            pd.concat(frames, ignore_index=True).to_csv(out_dir / f"{name}.csv", index=False)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Backtest walk-forward vettoriale sugli storici arricchiti.")
+    ap.add_argument("--market", choices=sorted(MARKETS) + ["all"], default="all")
+    ap.add_argument("--data", help="Storico da usare al posto di quello del mercato (CSV o .arrow)")
+    ap.add_argument("--from", dest="date_from", help="Prima data di test (YYYY-MM-DD)")
+    ap.add_argument("--to", dest="date_to", help="Ultima data di test (YYYY-MM-DD)")
+    ap.add_argument("--train-days", type=int, default=365, help="Finestra di training in giorni (0 = espansiva)")
+    ap.add_argument("--step", type=int, default=28, help="Giorni per finestra di test (riaddestramento)")
+    ap.add_argument("--min-train", type=int, default=200, help="Partite minime di training per fold")
+    ap.add_argument("--algo", choices=["logistic", "lgbm"], default="logistic")
+    ap.add_argument("--stake", choices=STAKE_RULES, default="config")
+    ap.add_argument("--min-edge", type=float, help="Soglia di edge (default: thresholds di config.json)")
+    ap.add_argument("--leagues", help="Leghe da includere (nomi o codici, separati da virgola)")
+    ap.add_argument("--jobs", type=int, default=min(4, os.cpu_count() or 1), help="Fold in parallelo (processi)")
+    ap.add_argument("--out", default=str(OUT_DIR), help="Cartella dei CSV di output")
+    args = ap.parse_args()
+
+    cfg = load_cfg()
+    leagues = [s.strip() for s in args.leagues.split(",") if s.strip()] if args.leagues else None
+    markets = sorted(MARKETS) if args.market == "all" else [args.market]
+    results = []
+    for market in markets:
+        path = Path(args.data) if args.data else MARKETS[market].data_path
+        t0 = time.perf_counter()
+        try:
+            df = load_dataset(path)
+        except FileNotFoundError as e:
+            print(f"[ERR] {market}: {e}")
+            continue
+        res = run_backtest(df, market, cfg, algo=args.algo, stake=args.stake, step_days=args.step,
+                           train_days=args.train_days, min_train=args.min_train, start=args.date_from,
+                           end=args.date_to, leagues=leagues, min_edge=args.min_edge, jobs=args.jobs)
+        if not res["folds"]:
+            print(f"[WARN] {market}: nessun fold (storico troppo corto per --min-train/--train-days?)")
+            continue
+        results.append(res)
+        print(f"[OK] {market}: {res['folds']} fold, {len(res['scores'])} partite, "
+              f"{len(res['bets'])} puntate in {time.perf_counter() - t0:.1f}s")
+        for r in res["summary"].to_dict("records"):
+            roi = f"{r['roi']:+.2%}" if r["roi"] is not None else "-"
+            print(f"    {r['league']:<18} n={r['matches']:<5} brier={r['brier']:.4f} logloss={r['logloss']:.4f} "
+                  f"bets={r['bets']:<4} pnl={r['pnl']:+.3f} roi={roi} dd={r['max_drawdown']:.3f}")
+    if results:
+        save_results(results, Path(args.out))
+        print(f"[OK] Risultati in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_suite.py
+--------------
+Benchmark degli stadi caldi della pipeline su dati sintetici (synthetic_data.py):
+offline, riproducibili e confrontabili tra commit.
+
+Stadi (--stages, default tutti):
+- predict            model_pipeline.predict_and_report sulle N partite del giorno
+- markets_single     extended_markets.calculate_extended_markets partita per partita
+- markets_batch      poisson_kernel.compute_markets sulle stesse partite in blocco
+- enhanced_features  populate_enhanced_features sullo storico CSV sintetico
+                     (+ enhanced_features_jN con --jobs N > 1, default: numero di core)
+- understat_extract  _extract_json_from_understat su tutte le pagine in cache
+- understat_parsed   understat_cache.team_matches dal livello .npz (memoria svuotata)
+- odds_cold          process_and_store_odds, N partite × M eventi, alias TheOddsAPI
+                     rimossi prima di ogni giro (fuzzy + apprendimento)
+- odds_warm          come sopra con gli alias già nel registro (match per team_id)
+- views              latenza delle viste Flask col test client; le viste in
+                     MARKET_CACHE sono misurate a cache vuota e piena
+
+Ogni stadio: un giro di riscaldamento, poi --repeat misure (min/mediana/media). I
+risultati vanno in cache/bench/<commit>.json (suffisso "-dirty" con modifiche non
+committate) insieme a scala, seed e macchina; --compare confronta con un risultato
+precedente (commit, file, o l'ultimo salvato se omesso il valore).
+
+Il processo punta il DB sintetico con BET_DATABASE_URL (e la coda job di app.py su
+BET_QUEUE_DB nella cartella di lavoro) prima di importare i moduli della pipeline,
+quindi va lanciato come script, non importato da un processo che ha già aperto
+database.py. Le scritture (predictions.csv, report.html, storico arricchito)
+finiscono nella cartella dei dati sintetici.
+
+Uso:
+    python bench_suite.py --matches 10000 --fixtures 200 --repeat 5
+    python bench_suite.py --stages predict,odds_cold,odds_warm --compare
+    python bench_suite.py --matches 100000 --workdir /tmp/bet_bench_100k --compare abc1234
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+ROOT = Path(__file__).resolve().parent
+BENCH_DIR = ROOT / "cache" / "bench"
+MARKETS_N = 2000  # partite per gli stadi markets_*
+MAX_OVERROUND = 1.25
+PARALLEL_JOBS = os.cpu_count() or 1  # --jobs: processi di enhanced_features_jN
+
+STAGES = ("predict", "markets_single", "markets_batch", "enhanced_features", "understat_extract",
+          "understat_parsed", "odds_cold", "odds_warm", "views")
+
+
+class Bench(NamedTuple):
+    name: str
+    fn: Callable[[], Any]
+    items: int                                 # unità di lavoro per giro (partite, pagine, ...)
+    setup: Optional[Callable[[], Any]] = None  # prima di ogni giro, fuori dal tempo
+    size: str = ""
+
+
+# =========================
+# STADI
+# =========================
+def _predict(syn) -> List[Bench]:
+    import model_pipeline
+
+    model_pipeline.PRED_PATH = syn.workdir / "predictions.csv"
+    model_pipeline.REPORT_HTML = syn.workdir / "report.html"
+    day = syn.day.isoformat()
+    return [Bench("predict", lambda: model_pipeline.predict_and_report(day), syn.meta["fixtures"])]
+
+
+def _lambdas(syn):
+    import pandas as pd
+
+    df = pd.read_csv(syn.history_csv, usecols=["xg_for_home", "xg_for_away"], nrows=MARKETS_N)
+    return df["xg_for_home"].to_numpy(dtype=float), df["xg_for_away"].to_numpy(dtype=float)
+
+
+def _markets_single(syn) -> List[Bench]:
+    from extended_markets import calculate_extended_markets
+
+    lh, la = _lambdas(syn)
+    return [Bench("markets_single", lambda: [calculate_extended_markets(h, a) for h, a in zip(lh, la)], len(lh))]
+
+
+def _markets_batch(syn) -> List[Bench]:
+    from poisson_kernel import compute_markets
+
+    lh, la = _lambdas(syn)
+    return [Bench("markets_batch", lambda: compute_markets(lh, la), len(lh))]
+
+
+def _enhanced_features(syn) -> List[Bench]:
+    from populate_historical_advanced_features import populate_enhanced_features
+
+    out = syn.workdir / "historical_dataset_enhanced.csv"
+    benches = [Bench("enhanced_features", lambda: populate_enhanced_features(syn.history_csv, out),
+                     syn.meta["matches"])]
+    if PARALLEL_JOBS > 1:
+        benches.append(Bench(f"enhanced_features_j{PARALLEL_JOBS}",
+                             lambda: populate_enhanced_features(syn.history_csv, out, jobs=PARALLEL_JOBS),
+                             syn.meta["matches"]))
+    return benches
+
+
+def _understat_extract(syn) -> List[Bench]:
+    from understat_cache import extract_json_from_understat
+
+    pages = [p.read_text(encoding="utf-8") for p in sorted(syn.understat_dir.glob("*.html"))]
+    mb = sum(len(p) for p in pages) / 1e6
+    return [Bench("understat_extract", lambda: [extract_json_from_understat(h, "datesData") for h in pages],
+                  len(pages), size=f"{mb:.1f} MB")]
+
+
+def _understat_parsed(syn) -> List[Bench]:
+    import understat_cache
+
+    paths = sorted(syn.understat_dir.glob("*.html"))
+    return [Bench("understat_parsed", lambda: [understat_cache.team_matches(p) for p in paths], len(paths),
+                  setup=understat_cache.clear_memory_cache)]
+
+
+def _odds(syn, warm: bool) -> List[Bench]:
+    from database import SessionLocal
+    from models import Fixture, TeamAlias
+    from odds_fetcher import process_and_store_odds
+    from team_registry import SRC_TOA
+
+    events = syn.events()
+    db = SessionLocal()
+    try:
+        fixtures = db.query(Fixture).filter(Fixture.date == syn.day).all()
+    finally:
+        db.close()
+
+    def forget_aliases():
+        db = SessionLocal()
+        try:
+            db.query(TeamAlias).filter(TeamAlias.source == SRC_TOA).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    name = "odds_warm" if warm else "odds_cold"
+    if warm:
+        forget_aliases()  # il riscaldamento impara gli alias, i giri misurati li trovano
+    return [Bench(name, lambda: process_and_store_odds(events, fixtures, [], MAX_OVERROUND, False),
+                  len(fixtures), setup=None if warm else forget_aliases, size=f"{len(fixtures)}x{len(events)}")]
+
+
+def _views(syn) -> List[Bench]:
+    from app import APP
+    from market_cache import MARKET_CACHE
+
+    client = APP.test_client()
+    day = syn.day.isoformat()
+    played = (syn.day - timedelta(days=3)).isoformat()  # ultima giornata giocata (ROUND_DAYS)
+    urls = [
+        ("/", False),
+        ("/data", False),
+        ("/api/data?stats=1", False),
+        (f"/data?league=SA&date_to={played}", False),
+        (f"/extended-markets?date={day}", True),
+        (f"/esiti?date={played}", True),
+        (f"/proposta?date={day}", True),
+    ]
+
+    def get(url):
+        def fn():
+            r = client.get(url)
+            if r.status_code != 200:
+                raise RuntimeError(f"{url}: HTTP {r.status_code}")
+        return fn
+
+    out = []
+    for url, cached in urls:
+        if cached:
+            out.append(Bench(f"view {url} [cache vuota]", get(url), 1, setup=MARKET_CACHE.clear))
+            out.append(Bench(f"view {url} [cache]", get(url), 1))
+        else:
+            out.append(Bench(f"view {url}", get(url), 1))
+    return out
+
+
+BUILDERS: Dict[str, Callable[[Any], List[Bench]]] = {
+    "predict": _predict,
+    "markets_single": _markets_single,
+    "markets_batch": _markets_batch,
+    "enhanced_features": _enhanced_features,
+    "understat_extract": _understat_extract,
+    "understat_parsed": _understat_parsed,
+    "odds_cold": lambda syn: _odds(syn, warm=False),
+    "odds_warm": lambda syn: _odds(syn, warm=True),
+    "views": _views,
+}
+
+
+# =========================
+# MISURA
+# =========================
+def measure(bench: Bench, repeat: int) -> Dict[str, Any]:
+    """Riscaldamento + repeat giri cronometrati (output degli stadi soppresso)."""
+    times = []
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for i in range(repeat + 1):
+            if bench.setup:
+                bench.setup()
+            t0 = time.perf_counter()
+            bench.fn()
+            if i:
+                times.append(time.perf_counter() - t0)
+            sink.seek(0)
+            sink.truncate()
+    med = statistics.median(times)
+    return {
+        "items": bench.items, "size": bench.size, "repeat": repeat,
+        "min_s": min(times), "median_s": med, "mean_s": statistics.fmean(times),
+        "per_item_ms": med / bench.items * 1000 if bench.items else None,
+    }
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def commit_id() -> str:
+    sha = _git("rev-parse", "--short", "HEAD") or "nogit"
+    return sha + ("-dirty" if _git("status", "--porcelain", "--untracked-files=no") else "")
+
+
+def _load_result(ref: Optional[str], exclude: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    """Risultato da confrontare: file, commit (prefisso) o, se ref è vuoto, l'ultimo salvato."""
+    if ref and Path(ref).is_file():
+        return json.loads(Path(ref).read_text(encoding="utf-8"))
+    files = sorted(BENCH_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    files = [p for p in files if p != exclude]
+    if ref:
+        sha = _git("rev-parse", "--short", ref) or ref
+        files = [p for p in files if p.stem.startswith(sha)]
+    return json.loads(files[0].read_text(encoding="utf-8")) if files else None
+
+
+def print_comparison(current: Dict[str, Any], base: Dict[str, Any]) -> None:
+    if base.get("scale") != current.get("scale"):
+        print(f"[WARN] Scala diversa dal riferimento: {base.get('scale')} vs {current.get('scale')}")
+    print(f"[INFO] Confronto con {base.get('commit')} ({base.get('created_at')}), mediane:")
+    for name, cur in current["stages"].items():
+        old = base.get("stages", {}).get(name)
+        if not old or "median_s" not in old or "median_s" not in cur:
+            continue
+        ratio = cur["median_s"] / old["median_s"] if old["median_s"] else float("nan")
+        print(f"    {name:<42} {old['median_s'] * 1000:10.1f} ms → {cur['median_s'] * 1000:10.1f} ms  x{ratio:.2f}")
+
+
+def run(args) -> Dict[str, Any]:
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.gettempdir()) / (
+        f"bet_bench_{args.matches}_{args.fixtures}_{args.seed}")
+    db_url = f"sqlite:///{(workdir / 'bet.db').resolve()}"
+    loaded = sys.modules.get("database")
+    if loaded is not None and loaded.DATABASE_URL != db_url:
+        raise RuntimeError("database.py è già importato su un altro DB: lancia bench_suite.py come script")
+    os.environ["BET_DATABASE_URL"] = db_url
+    os.environ.setdefault("AUTO_FIXTURES_ENABLED", "0")  # niente fetch di rete all'import di app.py
+    os.environ["BET_QUEUE_DB"] = str(workdir / "jobs.db")  # /views legge la coda: non quella della dashboard
+    os.environ["BET_METRICS_PATH"] = str(workdir / "metrics.jsonl")  # i giri misurati non finiscono in logs/
+    global PARALLEL_JOBS
+    PARALLEL_JOBS = args.jobs
+
+    from synthetic_data import generate
+
+    t0 = time.perf_counter()
+    syn = generate(workdir, args.matches, args.fixtures, args.events, args.seed)
+    print(f"[INFO] Dati sintetici in {syn.workdir} ({time.perf_counter() - t0:.1f}s): {syn.meta['matches']} "
+          f"partite, {syn.meta['fixtures']} fixtures, {syn.meta['events']} eventi")
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()] if args.stages else list(STAGES)
+    unknown = [s for s in stages if s not in BUILDERS]
+    if unknown:
+        raise SystemExit(f"[ERR] Stadi sconosciuti: {', '.join(unknown)} (disponibili: {', '.join(STAGES)})")
+
+    results: Dict[str, Any] = {}
+    cwd = os.getcwd()
+    os.chdir(syn.workdir)  # i percorsi relativi (data/..., cache/...) restano nei dati sintetici
+    try:
+        for stage in stages:
+            try:
+                benches = BUILDERS[stage](syn)
+            except Exception as e:
+                print(f"[WARN] {stage}: preparazione fallita: {e}")
+                results[stage] = {"error": str(e)}
+                continue
+            for b in benches:
+                try:
+                    res = measure(b, args.repeat)
+                except Exception as e:
+                    print(f"[WARN] {b.name}: {e}")
+                    results[b.name] = {"error": str(e)}
+                    continue
+                results[b.name] = res
+                per_item = f"{res['per_item_ms']:.3f} ms/unità" if b.items > 1 else ""
+                print(f"[BENCH] {b.name:<42} mediana {res['median_s'] * 1000:10.1f} ms  "
+                      f"min {res['min_s'] * 1000:10.1f} ms  n={b.items} {b.size} {per_item}".rstrip())
+    finally:
+        os.chdir(cwd)
+
+    return {
+        "commit": commit_id(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "scale": {k: syn.meta[k] for k in ("matches", "fixtures", "events", "seed", "day")},
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpu_count": os.cpu_count()},
+        "stages": results,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark degli stadi della pipeline su dati sintetici.")
+    ap.add_argument("--matches", type=int, default=5000, help="Partite storiche sintetiche (1k-100k)")
+    ap.add_argument("--fixtures", type=int, default=200, help="Partite del giorno (predict, quote)")
+    ap.add_argument("--events", type=int, help="Eventi TheOddsAPI (default 2x fixtures)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--repeat", type=int, default=3, help="Giri cronometrati per stadio")
+    ap.add_argument("--jobs", type=int, default=PARALLEL_JOBS,
+                    help="Processi per enhanced_features_jN (una lega per processo; 1 = solo seriale)")
+    ap.add_argument("--stages", help=f"Stadi separati da virgola (default: {','.join(STAGES)})")
+    ap.add_argument("--workdir", help="Cartella dei dati sintetici (riusata se i parametri coincidono)")
+    ap.add_argument("--out", help="File JSON dei risultati (default cache/bench/<commit>.json)")
+    ap.add_argument("--compare", nargs="?", const="", default=None,
+                    help="Confronta con un risultato: commit, file JSON o (senza valore) l'ultimo salvato")
+    args = ap.parse_args()
+
+    result = run(args)
+    out = Path(args.out) if args.out else BENCH_DIR / f"{result['commit']}.json"
+    base = _load_result(args.compare, exclude=out.resolve()) if args.compare is not None else None
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"[OK] Risultati in {out}")
+    if args.compare is not None:
+        if base:
+            print_comparison(result, base)
+        else:
+            print("[WARN] Nessun risultato di riferimento trovato per il confronto.")
+
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,7 @@ from unidecode import unidecode
 
 from database import SessionLocal
 from models import Fixture, TeamMapping
+from team_registry import SRC_FBREF, SRC_FD, SRC_UNDERSTAT, TeamRegistry
 
 ROOT = Path(__file__).resolve().parent
 CACHE_DIR = ROOT / "cache" / "team_mappings"
@@ -247,6 +248,7 @@ def main():
     print("\n[MAPPING] Creazione mapping e salvataggio nel DB...")
     mapped_count = 0
     unmapped_count = 0
+    registry = TeamRegistry(db)
     
     for league, db_teams in teams_by_league.items():
         understat_dict = understat_by_league.get(league)
@@ -276,6 +278,12 @@ def main():
                     source="football-data.org" # Fonte dei nomi in `fixtures`
                 )
                 db.merge(tm)
+                # stessi nomi come alias del registro squadre (lookup per team_id nei populator)
+                t_id = registry.resolve(db_team, SRC_FD, league=league)
+                if matches["understat_name"]:
+                    registry.learn(matches["understat_name"], SRC_UNDERSTAT, t_id, method="seed")
+                if matches["fbref_name"]:
+                    registry.learn(matches["fbref_name"], SRC_FBREF, t_id, method="seed")
                 u_name = matches['understat_name'] or 'N/A'
                 f_name = matches['fbref_name'] or 'N/A'
                 print(f"[MAP] {league}: '{db_team}' → U: '{u_name}', F: '{f_name}'")
@@ -2,12 +2,117 @@
 """
 Context Analyzer V2 - PESANTE MA INTELLIGENTE
 Usa SOLO DATI REALI dal database, niente stime o placeholder
+
+Le squadre sono identificate con chiavi esatte: il team_id canonico delle fixtures
+(team_registry) o, se la squadra non è nel registro, il nome esatto. Le query usano gli
+indici (home_team_id, date) / (away_team_id, date) / (home, date) / (away, date) al
+posto di LIKE '%squadra%' (che scandiva la tabella e confondeva "Inter" con "Internacional").
+
+Uso:
+    analyzer = ContextAnalyzerV2(db_path)
+    analyzer.analyze_match(match_id, home, away, league, date)
+    analyzer.analyze_matches(fixtures)   # giornata intera: storico di tutte le squadre in una query
+    analyzer.close()
 """
-from typing import Dict, Tuple, List
-from datetime import datetime, timedelta
 import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta
 from collections import defaultdict
 
+from database import sqlite_connect
+from team_registry import alias_key
+
+TeamKey = Tuple[str, Any]  # ("id", team_id) oppure ("name", nome esatto)
+
+FORM_N = 5
+MOMENTUM_N = 10
+H2H_DAYS = 1095
+H2H_LIMIT = 10
+_BLOCK_ROWS = 500  # righe VALUES per query (7 parametri ciascuna, sotto il limite SQLite)
+
+# Una riga di wanted per (squadra, data limite); i quattro rami usano ciascuno il proprio
+# indice (team_id o nome, casa o trasferta) e ROW_NUMBER tiene le ultime N per riga.
+_HISTORY_SQL = """
+WITH wanted(k, team_id, name, cutoff) AS (VALUES {values})
+SELECT t.k, t.is_home, t.date, t.home, t.away, t.hg, t.ag, feat.xg_for_home, feat.xg_for_away
+FROM (
+    SELECT a.*, ROW_NUMBER() OVER (PARTITION BY a.k ORDER BY a.date DESC, a.match_id DESC) AS rn
+    FROM (
+        SELECT w.k, 1 AS is_home, f.match_id, f.date, f.home, f.away,
+               f.result_home_goals AS hg, f.result_away_goals AS ag
+        FROM wanted w JOIN fixtures f ON f.home_team_id = w.team_id AND f.date < w.cutoff
+        WHERE f.result_home_goals IS NOT NULL
+        UNION ALL
+        SELECT w.k, 0, f.match_id, f.date, f.home, f.away, f.result_home_goals, f.result_away_goals
+        FROM wanted w JOIN fixtures f ON f.away_team_id = w.team_id AND f.date < w.cutoff
+        WHERE f.result_home_goals IS NOT NULL
+        UNION ALL
+        SELECT w.k, 1, f.match_id, f.date, f.home, f.away, f.result_home_goals, f.result_away_goals
+        FROM wanted w JOIN fixtures f ON f.home = w.name AND f.date < w.cutoff
+        WHERE f.result_home_goals IS NOT NULL
+        UNION ALL
+        SELECT w.k, 0, f.match_id, f.date, f.home, f.away, f.result_home_goals, f.result_away_goals
+        FROM wanted w JOIN fixtures f ON f.away = w.name AND f.date < w.cutoff
+        WHERE f.result_home_goals IS NOT NULL
+    ) a
+) t
+LEFT JOIN features feat ON feat.match_id = t.match_id
+WHERE t.rn <= ?
+ORDER BY t.k, t.rn
+"""
+
+# Scontri diretti: una riga per coppia (casa, trasferta) in entrambi i versi.
+_H2H_SQL = """
+WITH pairs(k, home_id, away_id, home_name, away_name, since, cutoff) AS (VALUES {values})
+SELECT t.k, t.home_is_home, t.hg, t.ag
+FROM (
+    SELECT a.*, ROW_NUMBER() OVER (PARTITION BY a.k ORDER BY a.date DESC, a.match_id DESC) AS rn
+    FROM (
+        SELECT p.k, 1 AS home_is_home, f.match_id, f.date,
+               f.result_home_goals AS hg, f.result_away_goals AS ag
+        FROM pairs p JOIN fixtures f ON f.home_team_id = p.home_id AND f.away_team_id = p.away_id
+        WHERE f.date >= p.since AND f.date < p.cutoff AND f.result_home_goals IS NOT NULL
+        UNION ALL
+        SELECT p.k, 0, f.match_id, f.date, f.result_home_goals, f.result_away_goals
+        FROM pairs p JOIN fixtures f ON f.home_team_id = p.away_id AND f.away_team_id = p.home_id
+        WHERE f.date >= p.since AND f.date < p.cutoff AND f.result_home_goals IS NOT NULL
+        UNION ALL
+        SELECT p.k, 1, f.match_id, f.date, f.result_home_goals, f.result_away_goals
+        FROM pairs p JOIN fixtures f ON f.home = p.home_name AND f.away = p.away_name
+        WHERE f.date >= p.since AND f.date < p.cutoff AND f.result_home_goals IS NOT NULL
+        UNION ALL
+        SELECT p.k, 0, f.match_id, f.date, f.result_home_goals, f.result_away_goals
+        FROM pairs p JOIN fixtures f ON f.home = p.away_name AND f.away = p.home_name
+        WHERE f.date >= p.since AND f.date < p.cutoff AND f.result_home_goals IS NOT NULL
+    ) a
+) t
+WHERE t.rn <= ?
+ORDER BY t.k, t.rn
+"""
+
+
+def _values(n_rows: int, n_cols: int) -> str:
+    row = "(" + ", ".join("?" * n_cols) + ")"
+    return ", ".join([row] * n_rows)
+
+
+def _select_in(conn, sql: str, values: List[Any]) -> List[tuple]:
+    """sql con un "IN ({})" eseguito a blocchi di valori."""
+    out: List[tuple] = []
+    for start in range(0, len(values), _BLOCK_ROWS):
+        block = values[start:start + _BLOCK_ROWS]
+        out += conn.execute(sql.format(", ".join("?" * len(block))), block).fetchall()
+    return out
+
+
+def _fixture_args(fx) -> Tuple[str, str, str, str, datetime]:
+    """(match_id, home, away, league, date) da un dict o da una tupla nello stesso ordine."""
+    if isinstance(fx, dict):
+        return fx["match_id"], fx["home"], fx["away"], fx["league"], fx["date"]
+    match_id, home, away, league, date = fx
+    return match_id, home, away, league, date
+
+
 class ContextAnalyzerV2:
     """
     Analisi contestuale SERIA basata su dati reali:
@@ -20,6 +125,25 @@ class ContextAnalyzerV2:
     def __init__(self, db_path: str):
         self.db_path = db_path
         self.debug = True  # Mostra cosa sta calcolando
+        self._conn: Optional[sqlite3.Connection] = None
+
+    # ---------- connessione (una per istanza) ----------
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite_connect(self.db_path)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def analyze_match(self, match_id: str, home: str, away: str,
                      league: str, date: datetime) -> Dict:
@@ -34,63 +158,193 @@ class ContextAnalyzerV2:
         - momentum_home/away: -20 to +20 (trend ultimi 10 match)
         - psychology_home/away: -20 to +20 (home advantage + pressione)
         """
-        conn = sqlite3.connect(self.db_path)
-
-        if self.debug:
-            print(f"\n🔍 NEURAL REASONING ANALYSIS: {home} vs {away}")
-
-        # 1. MOTIVATION (competizione)
-        mot_home, mot_away = self._calculate_motivation(league, date)
-
-        # 2. FORM (ultimi 5 match REALI)
-        form_home, form_away, form_details = self._calculate_real_form(
-            conn, home, away, date
-        )
-
-        # 3. HEAD-TO-HEAD (scontri diretti REALI)
-        h2h_score, h2h_details = self._calculate_head_to_head(
-            conn, home, away, date
-        )
-
-        # 4. FATIGUE (rest days + fixture congestion)
-        fat_home, fat_away, fat_details = self._calculate_real_fatigue(
-            conn, match_id, home, away, date
-        )
-
-        # 5. MOMENTUM (trend ultimi 10 match)
-        mom_home, mom_away, mom_details = self._calculate_momentum(
-            conn, home, away, date
-        )
-
-        # 6. PSYCHOLOGY (home advantage + pressione)
-        psy_home, psy_away = self._calculate_psychology(league)
-
-        conn.close()
-
-        result = {
-            'motivation_home': mot_home,
-            'motivation_away': mot_away,
-            'form_home': form_home,
-            'form_away': form_away,
-            'head_to_head': h2h_score,
-            'fatigue_home': fat_home,
-            'fatigue_away': fat_away,
-            'momentum_home': mom_home,
-            'momentum_away': mom_away,
-            'psychology_home': psy_home,
-            'psychology_away': psy_away,
-
-            # Dettagli per trasparenza
-            'form_details': form_details,
-            'h2h_details': h2h_details,
-            'fatigue_details': fat_details,
-            'momentum_details': mom_details,
-        }
+        return self.analyze_matches([(match_id, home, away, league, date)])[0]
 
-        if self.debug:
-            self._print_analysis(result, home, away)
-
-        return result
+    def analyze_matches(self, fixtures: Iterable) -> List[Dict]:
+        """
+        Analisi di più partite (es. una giornata) con tre query in tutto: storico recente
+        di tutte le squadre, scontri diretti di tutte le coppie, features delle partite.
+        fixtures: dict con match_id/home/away/league/date o tuple nell'ordine di analyze_match.
+        Ritorna i risultati nello stesso ordine.
+        """
+        items = [_fixture_args(fx) for fx in fixtures]
+        if not items:
+            return []
+        conn = self.conn
+
+        team_ids = self._resolve_team_ids(conn, items)
+        team_rows, pair_rows = [], []
+        for match_id, home, away, _league, date in items:
+            hid, aid = team_ids.get(match_id, (None, None))
+            team_rows.append((self._team_key(home, hid), date))
+            team_rows.append((self._team_key(away, aid), date))
+            pair_rows.append((self._team_key(home, hid if aid is not None else None),
+                              self._team_key(away, aid if hid is not None else None), date))
+
+        history = self._fetch_history(conn, team_rows, MOMENTUM_N)
+        h2h = self._fetch_head_to_head(conn, pair_rows)
+        features = self._fetch_features(conn, [it[0] for it in items])
+
+        results = []
+        for i, (match_id, home, away, league, date) in enumerate(items):
+            home_hist, away_hist = history[2 * i], history[2 * i + 1]
+            if self.debug:
+                print(f"\n🔍 NEURAL REASONING ANALYSIS: {home} vs {away}")
+
+            # 1. MOTIVATION (competizione)
+            mot_home, mot_away = self._calculate_motivation(league, date)
+
+            # 2. FORM (ultimi 5 match REALI)
+            form_home, form_away, form_details = self._calculate_real_form(
+                home_hist[:FORM_N], away_hist[:FORM_N]
+            )
+
+            # 3. HEAD-TO-HEAD (scontri diretti REALI)
+            h2h_score, h2h_details = self._calculate_head_to_head(h2h[i])
+
+            # 4. FATIGUE (rest days + fixture congestion)
+            fat_home, fat_away, fat_details = self._calculate_real_fatigue(features.get(match_id))
+
+            # 5. MOMENTUM (trend ultimi 10 match)
+            mom_home, mom_away, mom_details = self._calculate_momentum(home_hist, away_hist)
+
+            # 6. PSYCHOLOGY (home advantage + pressione)
+            psy_home, psy_away = self._calculate_psychology(league)
+
+            result = {
+                'motivation_home': mot_home,
+                'motivation_away': mot_away,
+                'form_home': form_home,
+                'form_away': form_away,
+                'head_to_head': h2h_score,
+                'fatigue_home': fat_home,
+                'fatigue_away': fat_away,
+                'momentum_home': mom_home,
+                'momentum_away': mom_away,
+                'psychology_home': psy_home,
+                'psychology_away': psy_away,
+
+                # Dettagli per trasparenza
+                'form_details': form_details,
+                'h2h_details': h2h_details,
+                'fatigue_details': fat_details,
+                'momentum_details': mom_details,
+            }
+
+            if self.debug:
+                self._print_analysis(result, home, away)
+            results.append(result)
+
+        return results
+
+    # ---------- chiavi squadra ----------
+    @staticmethod
+    def _team_key(name: str, team_id: Optional[int]) -> TeamKey:
+        return ("id", team_id) if team_id is not None else ("name", name)
+
+    def _resolve_team_ids(self, conn, items) -> Dict[str, Tuple[Optional[int], Optional[int]]]:
+        """
+        team_id di casa/trasferta per partita: dalla fixture (match_id) e, per le squadre
+        senza id, dagli alias del registro (chiave normalizzata non ambigua).
+        Su DB senza registro (colonne/tabelle assenti) tutto resta per nome.
+        """
+        out: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+        try:
+            for mid, hid, aid in _select_in(
+                conn, "SELECT match_id, home_team_id, away_team_id FROM fixtures WHERE match_id IN ({})",
+                [it[0] for it in items],
+            ):
+                out[mid] = (hid, aid)
+
+            keys = {alias_key(n) for _m, h, a, _l, _d in items for n in (h, a)}
+            keys.discard("")
+            by_key: Dict[str, set] = defaultdict(set)
+            for key, t_id in _select_in(
+                conn, "SELECT alias_key, team_id FROM team_aliases WHERE alias_key IN ({})", sorted(keys)
+            ):
+                by_key[key].add(t_id)
+        except sqlite3.OperationalError:
+            return out
+
+        def by_alias(name):
+            found = by_key.get(alias_key(name), ())
+            return next(iter(found)) if len(found) == 1 else None
+
+        for mid, home, away, _league, _date in items:
+            hid, aid = out.get(mid, (None, None))
+            out[mid] = (hid if hid is not None else by_alias(home),
+                        aid if aid is not None else by_alias(away))
+        return out
+
+    # ---------- letture in blocco ----------
+    def _query_blocks(self, conn, sql: str, id_joins: Tuple[str, ...], rows: List[list],
+                      n_cols: int, limit: int) -> List[tuple]:
+        """
+        Esegue sql con una riga VALUES per elemento di rows (a blocchi, entro il limite di
+        parametri SQLite). Su DB senza colonne team_id i join per id vengono disattivati.
+        """
+        out: List[tuple] = []
+        for start in range(0, len(rows), _BLOCK_ROWS):
+            block = rows[start:start + _BLOCK_ROWS]
+            params = [v for row in block for v in row] + [limit]
+            try:
+                out += conn.execute(sql.format(values=_values(len(block), n_cols)), params).fetchall()
+            except sqlite3.OperationalError:
+                fallback = sql
+                for join in id_joins:
+                    fallback = fallback.replace(join, "0")
+                out += conn.execute(fallback.format(values=_values(len(block), n_cols)), params).fetchall()
+        return out
+
+    def _fetch_history(self, conn, team_rows: List[Tuple[TeamKey, datetime]], n: int) -> List[List[Dict]]:
+        """Ultimi n match giocati prima della data per ogni (squadra, data), dal più recente."""
+        values = [
+            [k, value if kind == "id" else None, value if kind == "name" else None, date.strftime('%Y-%m-%d')]
+            for k, ((kind, value), date) in enumerate(team_rows)
+        ]
+        rows = self._query_blocks(conn, _HISTORY_SQL,
+                                  ("f.home_team_id = w.team_id", "f.away_team_id = w.team_id"),
+                                  values, 4, n)
+        out: List[List[Dict]] = [[] for _ in team_rows]
+        for k, is_home, match_date, home, away, hg, ag, xg_h, xg_a in rows:
+            out[k].append({
+                'date': match_date,
+                'opponent': away if is_home else home,
+                'is_home': bool(is_home),
+                'goals_for': hg if is_home else ag,
+                'goals_against': ag if is_home else hg,
+                'xg_for': xg_h if is_home else xg_a,
+                'xg_against': xg_a if is_home else xg_h,
+            })
+        return out
+
+    def _fetch_head_to_head(self, conn, pair_rows) -> List[List[Tuple[bool, int, int]]]:
+        """Scontri diretti degli ultimi 3 anni per ogni coppia: (casa era in casa, gol casa, gol trasferta)."""
+        values = []
+        for k, (home_key, away_key, date) in enumerate(pair_rows):
+            by_id = home_key[0] == "id" and away_key[0] == "id"
+            values.append([k,
+                           home_key[1] if by_id else None, away_key[1] if by_id else None,
+                           None if by_id else home_key[1], None if by_id else away_key[1],
+                           (date - timedelta(days=H2H_DAYS)).strftime('%Y-%m-%d'),
+                           date.strftime('%Y-%m-%d')])
+        rows = self._query_blocks(conn, _H2H_SQL,
+                                  ("f.home_team_id = p.home_id AND f.away_team_id = p.away_id",
+                                   "f.home_team_id = p.away_id AND f.away_team_id = p.home_id"),
+                                  values, 7, H2H_LIMIT)
+        out: List[List[Tuple[bool, int, int]]] = [[] for _ in pair_rows]
+        for k, home_is_home, hg, ag in rows:
+            out[k].append((bool(home_is_home), hg, ag))
+        return out
+
+    def _fetch_features(self, conn, match_ids: List[str]) -> Dict[str, tuple]:
+        rows = _select_in(conn, """
+            SELECT match_id, rest_days_home, rest_days_away,
+                   travel_km_away, injuries_key_home, injuries_key_away
+            FROM features
+            WHERE match_id IN ({})
+        """, match_ids)
+        return {r[0]: r[1:] for r in rows}
 
     def _calculate_motivation(self, league: str, date: datetime) -> Tuple[int, int]:
         """
@@ -133,8 +387,8 @@ class ContextAnalyzerV2:
 
         return home_score, away_score
 
-    def _calculate_real_form(self, conn, home: str, away: str,
-                            date: datetime) -> Tuple[int, int, Dict]:
+    def _calculate_real_form(self, home_matches: List[Dict],
+                            away_matches: List[Dict]) -> Tuple[int, int, Dict]:
         """
         Form basata su ULTIMI 5 MATCH REALI nel database.
         Usa: vittorie, pareggi, sconfitte, gol fatti/subiti.
@@ -142,17 +396,14 @@ class ContextAnalyzerV2:
         home_score = 0
         away_score = 0
 
-        home_matches = self._get_last_matches(conn, home, date, n=5)
-        away_matches = self._get_last_matches(conn, away, date, n=5)
-
         # Calcola form home
         if home_matches:
-            home_stats = self._calculate_team_stats(home_matches, home)
+            home_stats = self._calculate_team_stats(home_matches)
             home_score = self._form_score_from_stats(home_stats)
 
         # Calcola form away
         if away_matches:
-            away_stats = self._calculate_team_stats(away_matches, away)
+            away_stats = self._calculate_team_stats(away_matches)
             away_score = self._form_score_from_stats(away_stats)
 
         details = {
@@ -164,50 +415,7 @@ class ContextAnalyzerV2:
 
         return home_score, away_score, details
 
-    def _get_last_matches(self, conn, team: str, before_date: datetime,
-                         n: int = 5) -> List[Dict]:
-        """
-        Recupera ultimi N match REALI dal database.
-        """
-        cursor = conn.cursor()
-
-        # Query per trovare match dove la squadra ha giocato
-        query = """
-            SELECT f.date, f.home, f.away,
-                   f.result_home_goals, f.result_away_goals,
-                   feat.xg_for_home, feat.xg_for_away
-            FROM fixtures f
-            LEFT JOIN features feat ON f.match_id = feat.match_id
-            WHERE (f.home LIKE ? OR f.away LIKE ?)
-              AND f.date < ?
-              AND f.result_home_goals IS NOT NULL
-            ORDER BY f.date DESC
-            LIMIT ?
-        """
-
-        cursor.execute(query, (f"%{team}%", f"%{team}%", before_date.strftime('%Y-%m-%d'), n))
-        rows = cursor.fetchall()
-
-        matches = []
-        for row in rows:
-            match_date, home, away, hg, ag, xg_h, xg_a = row
-
-            # Determina se team era home o away
-            is_home = team.lower() in home.lower()
-
-            matches.append({
-                'date': match_date,
-                'opponent': away if is_home else home,
-                'is_home': is_home,
-                'goals_for': hg if is_home else ag,
-                'goals_against': ag if is_home else hg,
-                'xg_for': xg_h if is_home else xg_a,
-                'xg_against': xg_a if is_home else xg_h,
-            })
-
-        return matches
-
-    def _calculate_team_stats(self, matches: List[Dict], team: str) -> Dict:
+    def _calculate_team_stats(self, matches: List[Dict]) -> Dict:
         """
         Calcola statistiche da lista match.
         """
@@ -296,41 +504,14 @@ class ContextAnalyzerV2:
 
         return int(max(-50, min(50, score)))
 
-    def _calculate_head_to_head(self, conn, home: str, away: str,
-                               date: datetime) -> Tuple[int, Dict]:
+    def _calculate_head_to_head(self, rows: List[Tuple[bool, int, int]]) -> Tuple[int, Dict]:
         """
-        Scontri diretti REALI ultimi 3 anni.
+        Scontri diretti REALI ultimi 3 anni (righe da _fetch_head_to_head).
 
         Returns:
         - score: -30 to +30 (positivo = vantaggio home)
         - details: dict con statistiche
         """
-        cursor = conn.cursor()
-
-        # Ultimi 3 anni
-        three_years_ago = date - timedelta(days=1095)
-
-        query = """
-            SELECT f.home, f.away, f.result_home_goals, f.result_away_goals
-            FROM fixtures f
-            WHERE ((f.home LIKE ? AND f.away LIKE ?)
-                   OR (f.home LIKE ? AND f.away LIKE ?))
-              AND f.date >= ?
-              AND f.date < ?
-              AND f.result_home_goals IS NOT NULL
-            ORDER BY f.date DESC
-            LIMIT 10
-        """
-
-        cursor.execute(query, (
-            f"%{home}%", f"%{away}%",
-            f"%{away}%", f"%{home}%",
-            three_years_ago.strftime('%Y-%m-%d'),
-            date.strftime('%Y-%m-%d')
-        ))
-
-        rows = cursor.fetchall()
-
         if not rows:
             return 0, {'count': 0, 'message': 'Nessuno scontro diretto recente'}
 
@@ -341,9 +522,7 @@ class ContextAnalyzerV2:
         home_goals = 0
         away_goals = 0
 
-        for match_home, match_away, hg, ag in rows:
-            is_home_at_home = home.lower() in match_home.lower()
-
+        for is_home_at_home, hg, ag in rows:
             if is_home_at_home:
                 home_goals += hg
                 away_goals += ag
@@ -387,23 +566,10 @@ class ContextAnalyzerV2:
 
         return score, details
 
-    def _calculate_real_fatigue(self, conn, match_id: str, home: str, away: str,
-                               date: datetime) -> Tuple[int, int, Dict]:
+    def _calculate_real_fatigue(self, row: Optional[tuple]) -> Tuple[int, int, Dict]:
         """
-        Fatigue REALE da rest_days nel database.
+        Fatigue REALE da rest_days nel database (riga features della partita).
         """
-        cursor = conn.cursor()
-
-        # Prendi rest days dal database
-        cursor.execute("""
-            SELECT rest_days_home, rest_days_away,
-                   travel_km_away, injuries_key_home, injuries_key_away
-            FROM features
-            WHERE match_id = ?
-        """, (match_id,))
-
-        row = cursor.fetchone()
-
         home_score = 0
         away_score = 0
         details = {}
@@ -451,14 +617,11 @@ class ContextAnalyzerV2:
 
         return home_score, away_score, details
 
-    def _calculate_momentum(self, conn, home: str, away: str,
-                           date: datetime) -> Tuple[int, int, Dict]:
+    def _calculate_momentum(self, home_matches: List[Dict],
+                           away_matches: List[Dict]) -> Tuple[int, int, Dict]:
         """
         Momentum = trend ultimi 10 match (miglioramento o peggioramento).
         """
-        home_matches = self._get_last_matches(conn, home, date, n=10)
-        away_matches = self._get_last_matches(conn, away, date, n=10)
-
         home_score = 0
         away_score = 0
 
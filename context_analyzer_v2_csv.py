@@ -10,6 +10,8 @@ import pandas as pd
 from pathlib import Path
 from collections import defaultdict
 
+from historical_store import load_dataset
+
 class ContextAnalyzerV2CSV:
     """
     Analisi contestuale con CSV storico per MASSIME PERFORMANCE.
@@ -36,8 +38,8 @@ class ContextAnalyzerV2CSV:
     def _load_historical_data(self):
         """Carica CSV storico in memoria."""
         try:
-            self.df = pd.read_csv(self.csv_path)
-            self.df['date'] = pd.to_datetime(self.df['date'])
+            # Storico tipizzato (.arrow in memory-map se aggiornato, altrimenti CSV)
+            self.df = load_dataset(self.csv_path)
 
             if self.debug:
                 print(f"✅ CSV storico caricato: {len(self.df)} partite")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+data_browser.py
+---------------
+Paginazione keyset per la vista /data (fixtures + odds + features).
+
+- ordine fisso (date DESC, match_id DESC); il cursore è la coppia (date, match_id)
+  dell'ultima riga mostrata, quindi ogni pagina è una sola query "WHERE chiave < cursore
+  ORDER BY ... LIMIT n+1" servita dagli indici ix_fixtures_date_match /
+  ix_fixtures_league_date_match (vedi models.py), senza OFFSET né caricare la tabella
+- filtri lato server: lega, intervallo di date, presenza di quote/features
+- le partite senza data stanno in fondo (come NULL in SQLite con DESC)
+
+Uso (app.py):
+    filters = parse_filters(request.args)
+    page = fetch_page(db, filters, after=request.args.get("after"), limit=100)
+    page["rows"], page["next"], page["prev"]
+"""
+
+from __future__ import annotations
+
+from datetime import date
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, func, or_
+
+from database import engine as default_engine, migrate_schema
+from models import Feature, Fixture, Odds
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+_indexes_ready = False
+
+
+class DataFilters(NamedTuple):
+    league: Optional[str] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    has_odds: Optional[bool] = None
+    has_features: Optional[bool] = None
+
+    def as_args(self) -> Dict[str, str]:
+        """Filtri attivi come parametri di query (per i link di pagina)."""
+        out = {}
+        if self.league:
+            out["league"] = self.league
+        if self.date_from:
+            out["date_from"] = self.date_from.isoformat()
+        if self.date_to:
+            out["date_to"] = self.date_to.isoformat()
+        if self.has_odds is not None:
+            out["has_odds"] = "1" if self.has_odds else "0"
+        if self.has_features is not None:
+            out["has_features"] = "1" if self.has_features else "0"
+        return out
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} non valida: {value!r} (atteso YYYY-MM-DD)")
+
+
+def _parse_flag(value: Optional[str], name: str) -> Optional[bool]:
+    if value in (None, ""):
+        return None
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    raise ValueError(f"{name} non valido: {value!r} (atteso 1 o 0)")
+
+
+def parse_filters(args: Mapping[str, str]) -> DataFilters:
+    """Filtri dai parametri di query; ValueError se un valore non è valido."""
+    return DataFilters(
+        league=(args.get("league") or "").strip().upper() or None,
+        date_from=_parse_date(args.get("date_from"), "date_from"),
+        date_to=_parse_date(args.get("date_to"), "date_to"),
+        has_odds=_parse_flag(args.get("has_odds"), "has_odds"),
+        has_features=_parse_flag(args.get("has_features"), "has_features"),
+    )
+
+
+def parse_limit(value: Optional[str]) -> int:
+    try:
+        n = int(value) if value else DEFAULT_LIMIT
+    except ValueError:
+        raise ValueError(f"limit non valido: {value!r}")
+    return max(1, min(n, MAX_LIMIT))
+
+
+def encode_cursor(day: Optional[date], match_id: str) -> str:
+    return f"{day.isoformat() if day else ''}|{match_id}"
+
+
+def decode_cursor(value: str) -> Tuple[Optional[date], str]:
+    day, sep, match_id = value.partition("|")
+    if not sep or not match_id:
+        raise ValueError(f"cursore non valido: {value!r}")
+    return _parse_date(day, "data del cursore"), match_id
+
+
+def ensure_indexes(bind=None) -> None:
+    """Crea gli indici di paginazione sui DB esistenti (una volta per processo)."""
+    global _indexes_ready
+    if not _indexes_ready:
+        migrate_schema(bind or default_engine)
+        _indexes_ready = True
+
+
+def _apply_filters(query, filters: DataFilters):
+    if filters.league:
+        query = query.filter(Fixture.league_code == filters.league)
+    if filters.date_from:
+        query = query.filter(Fixture.date >= filters.date_from)
+    if filters.date_to:
+        query = query.filter(Fixture.date <= filters.date_to)
+    if filters.has_odds is not None:
+        query = query.filter(Odds.odds_1.isnot(None) if filters.has_odds else Odds.odds_1.is_(None))
+    if filters.has_features is not None:
+        query = query.filter(
+            Feature.xg_for_home.isnot(None) if filters.has_features else Feature.xg_for_home.is_(None)
+        )
+    return query
+
+
+def _seek(cursor: Tuple[Optional[date], str], older: bool):
+    """
+    Condizione keyset rispetto al cursore nell'ordine (date DESC, match_id DESC), NULL in fondo.
+    older=True: righe dopo il cursore (pagina successiva); False: righe prima (precedente).
+    """
+    day, match_id = cursor
+    if older:
+        if day is None:
+            return and_(Fixture.date.is_(None), Fixture.match_id < match_id)
+        return or_(
+            Fixture.date < day,
+            and_(Fixture.date == day, Fixture.match_id < match_id),
+            Fixture.date.is_(None),
+        )
+    if day is None:
+        return or_(Fixture.date.isnot(None), Fixture.match_id > match_id)
+    return or_(Fixture.date > day, and_(Fixture.date == day, Fixture.match_id > match_id))
+
+
+def _round(value: Any) -> Optional[float]:
+    return round(float(value), 2) if value is not None else None
+
+
+def _row(r) -> Dict[str, Any]:
+    return {
+        "match_id": r.match_id,
+        "date": r.date.isoformat() if r.date else None,
+        "time": r.time_local,
+        "league": r.league_code,
+        "home": r.home,
+        "away": r.away,
+        "odds_1": _round(r.odds_1),
+        "odds_x": _round(r.odds_x),
+        "odds_2": _round(r.odds_2),
+        "xg_for_home": _round(r.xg_for_home),
+        "xg_for_away": _round(r.xg_for_away),
+        "xg_against_home": _round(r.xg_against_home),
+        "xg_against_away": _round(r.xg_against_away),
+        "rest_days_home": r.rest_days_home,
+        "rest_days_away": r.rest_days_away,
+    }
+
+
+def _base_query(db, *columns):
+    return (
+        db.query(*columns)
+        .select_from(Fixture)
+        .outerjoin(Odds, Fixture.match_id == Odds.match_id)
+        .outerjoin(Feature, Fixture.match_id == Feature.match_id)
+    )
+
+
+def fetch_page(db, filters: DataFilters = DataFilters(), after: Optional[str] = None,
+               before: Optional[str] = None, limit: int = DEFAULT_LIMIT) -> Dict[str, Any]:
+    """
+    Una pagina di righe (al più limit) con i cursori "next"/"prev" (None ai bordi).
+    after: cursore della pagina successiva; before: della precedente (ha la precedenza
+    se passati entrambi).
+    """
+    query = _apply_filters(_base_query(
+        db,
+        Fixture.match_id, Fixture.date, Fixture.time_local, Fixture.league_code, Fixture.home, Fixture.away,
+        Odds.odds_1, Odds.odds_x, Odds.odds_2,
+        Feature.xg_for_home, Feature.xg_for_away, Feature.xg_against_home, Feature.xg_against_away,
+        Feature.rest_days_home, Feature.rest_days_away,
+    ), filters)
+
+    backwards = before is not None
+    if backwards:
+        query = query.filter(_seek(decode_cursor(before), older=False))
+        # verso l'alto si legge in ordine crescente (in SQLite i NULL vengono prima) e poi si ribalta
+        query = query.order_by(Fixture.date.asc(), Fixture.match_id.asc())
+    else:
+        if after is not None:
+            query = query.filter(_seek(decode_cursor(after), older=True))
+        query = query.order_by(Fixture.date.desc(), Fixture.match_id.desc())
+
+    rows = query.limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    out = [_row(r) for r in rows]
+    first = encode_cursor(rows[0].date, rows[0].match_id) if rows else None
+    last = encode_cursor(rows[-1].date, rows[-1].match_id) if rows else None
+    if backwards:
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+    return {
+        "rows": out,
+        "limit": limit,
+        "next": last if has_next and rows else None,
+        "prev": first if has_prev and rows else None,
+    }
+
+
+def summary(db, filters: DataFilters = DataFilters()) -> Dict[str, int]:
+    """Conteggi (totale, con quote, con xG) sull'insieme filtrato, con una sola aggregazione."""
+    total, with_odds, with_xg = _apply_filters(_base_query(
+        db,
+        func.count(Fixture.match_id), func.count(Odds.odds_1), func.count(Feature.xg_for_home),
+    ), filters).one()
+    return {"total": total or 0, "with_odds": with_odds or 0, "with_xg": with_xg or 0}
+
+
+def leagues(db) -> List[str]:
+    """Codici lega presenti (per il filtro), dall'indice su league_code."""
+    return [c for (c,) in db.query(Fixture.league_code).distinct().order_by(Fixture.league_code) if c]
@@ -8,9 +8,15 @@ try:
 except ImportError:
     import tomli as tomllib
 
-from sqlalchemy import create_engine
+import sqlite3 as _sqlite3
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+import metrics  # noqa: F401  (listener che conta le query DB di ogni stadio/vista)
+
 ROOT = Path(__file__).resolve().parent
 CFG_PATH = ROOT / "config.toml"
 
@@ -44,7 +50,46 @@ def get_db_url() -> str:
     return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
 
 
-DATABASE_URL = f"sqlite:///{os.path.expanduser('~/Develop/BET/BET/bet.db')}"
+# BET_DATABASE_URL punta il processo (e i suoi subprocess) su un altro DB, es. quello
+# sintetico dei benchmark (vedi synthetic_data.py / bench_suite.py)
+DATABASE_URL = os.getenv("BET_DATABASE_URL") or f"sqlite:///{os.path.expanduser('~/Develop/BET/BET/bet.db')}"
+
+# Profilo SQLite applicato a ogni connessione: thread dei job, step della pipeline
+# (subprocess/worker) e dashboard usano lo stesso file in parallelo.
+# - WAL: i lettori non bloccano lo scrittore (niente "database is locked" durante
+#   gli upsert bulk delle quote); BET_SQLITE_WAL=0 lo disattiva (es. file su NFS)
+# - synchronous=NORMAL: sicuro con WAL, fsync solo ai checkpoint
+# - busy_timeout: attende il lock invece di fallire subito
+# - mmap/cache: letture delle tabelle storiche da memoria mappata e cache di pagina ampia
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("BET_SQLITE_BUSY_MS", "30000"))
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "mmap_size": int(os.getenv("BET_SQLITE_MMAP_MB", "256")) * 1024 * 1024,
+    "cache_size": -int(os.getenv("BET_SQLITE_CACHE_MB", "64")) * 1024,  # negativo = KiB
+    "temp_store": "MEMORY",
+}
+SQLITE_WAL = os.getenv("BET_SQLITE_WAL", "1") == "1"
+
+
+def apply_sqlite_pragmas(dbapi_conn) -> None:
+    """Imposta WAL e pragma di prestazione su una connessione sqlite3 (anche fuori da SQLAlchemy)."""
+    cur = dbapi_conn.cursor()
+    try:
+        if SQLITE_WAL:
+            cur.execute("PRAGMA journal_mode=WAL")
+        for name, value in SQLITE_PRAGMAS.items():
+            cur.execute(f"PRAGMA {name}={value}")
+    finally:
+        cur.close()
+
+
+def sqlite_connect(path: Optional[str] = None):
+    """Connessione sqlite3 grezza al DB dell'app con lo stesso profilo del motore SQLAlchemy."""
+    conn = _sqlite3.connect(path or engine.url.database, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    apply_sqlite_pragmas(conn)
+    return conn
+
 
 # Aggiunto pool_pre_ping=True per gestire connessioni "stantie".
 # SQLAlchemy verificherà la connessione prima di usarla, prevenendo errori
@@ -54,9 +99,46 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+@event.listens_for(Engine, "connect")
+def _on_connect(dbapi_conn, _record):
+    # vale per tutti i motori SQLite del processo (anche quelli creati nei test/strumenti)
+    if isinstance(dbapi_conn, _sqlite3.Connection):
+        apply_sqlite_pragmas(dbapi_conn)
+
+
+def migrate_schema(bind=None) -> list:
+    """
+    Migrazione idempotente verso lo schema di models.py: crea le tabelle mancanti,
+    aggiunge le colonne nuove (nullable) alle tabelle esistenti e crea gli indici
+    mancanti (create_all crea gli indici solo insieme a una tabella nuova).
+    Ritorna le modifiche applicate ("colonna tab.col" / nome indice).
+    """
+    import models  # noqa: F401  (registra i modelli su Base.metadata)
+    from sqlalchemy import inspect, text
+
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    insp = inspect(bind)
+    changes = []
+    for table in Base.metadata.sorted_tables:
+        have_cols = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in have_cols and col.nullable:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(bind.dialect)}"
+                with bind.begin() as conn:
+                    conn.execute(text(ddl))
+                changes.append(f"colonna {table.name}.{col.name}")
+        existing = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for idx in sorted(table.indexes, key=lambda i: i.name):
+            if idx.name not in existing:
+                idx.create(bind=bind)
+                changes.append(idx.name)
+    return changes
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+enhanced_incremental.py
+-----------------------
+Manutenzione incrementale degli storici arricchiti (historical_*_enhanced.csv).
+
+- accanto all'output si salva lo stato (<output>.state.pkl): TeamStateEngine alla fine
+  dell'ultimo giro, ultima data elaborata, hash di ogni riga dello storico in ingresso e
+  checksum dell'output (match_id + 54 advanced features)
+- giro incrementale: solo le partite nuove (match_id mai visti); se sono tutte
+  successive all'ultima data, le feature si calcolano ripartendo dallo stato salvato
+- risultato arrivato in ritardo (data <= ultima data): nella sua lega si ricalcolano le
+  righe delle squadre coinvolte dalla data della partita in avanti, con un replay delle
+  sole partite di quelle squadre e dei loro avversari; lo stato ricalcolato sostituisce
+  quello delle stesse chiavi (le feature di una riga dipendono solo da squadre e coppia)
+- ricostruzione completa (e nuovo stato) se manca lo stato, se --full-rebuild, se il
+  checksum dell'output non torna (file riscritto da altri script, es.
+  merge_advanced_to_historical.py o --legacy) o se righe già elaborate sono cambiate/sparite;
+  si calcola una lega alla volta (con jobs > 1 una lega per processo) e ogni lega completata
+  va nello staging accanto all'output con lo stato raccolto fin lì (backfill_checkpoint):
+  un giro interrotto riparte dalle leghe mancanti, restart=True (--restart) lo scarta
+- scrittura: solo append al CSV quando le righe nuove sono in coda e nessuna riga
+  esistente cambia; il file .arrow si riscrive sempre (historical_store)
+
+Uso:
+    from enhanced_incremental import update_enhanced
+    update_enhanced(HIST_OU_PATH, HIST_OU_ENHANCED)                     # incrementale
+    update_enhanced(HIST_OU_PATH, HIST_OU_ENHANCED, full_rebuild=True)
+
+CLI (tramite populate_historical_advanced_features.py):
+    python populate_historical_advanced_features.py                 # incrementale
+    python populate_historical_advanced_features.py --full-rebuild
+    python populate_historical_advanced_features.py --full-rebuild --jobs 8
+    python populate_historical_advanced_features.py --full-rebuild --restart   # ignora il checkpoint
+    python populate_historical_advanced_features.py --verify        # confronto con ricalcolo completo
+"""
+
+from __future__ import annotations
+
+import pickle
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from backfill_checkpoint import BackfillCheckpoint
+from historical_store import arrow_path, load_dataset, save_dataset
+from metrics import count, instrument
+from team_state_engine import (
+    ADVANCED_FEATURE_COLS, TeamStateEngine, compute_advanced_features, compute_advanced_features_parallel,
+    iter_league_features, league_shards, merge_shard_state,
+)
+
+STATE_VERSION = 1
+
+
+def state_path(output_csv) -> Path:
+    return Path(output_csv).with_suffix(".state.pkl")
+
+
+# =========================
+# HASH E CHECKSUM
+# =========================
+def _canonical(df: pd.DataFrame, cols) -> pd.DataFrame:
+    """Stessi valori → stessi hash, qualunque sia il loader (arrow o CSV) o l'ordine delle colonne."""
+    out = {}
+    for c in sorted(cols):
+        s = df[c]
+        if s.dtype.kind in "biuf":
+            out[c] = s.to_numpy(dtype="float64", na_value=np.nan)
+        elif s.dtype.kind == "M":
+            out[c] = s.to_numpy("datetime64[ns]").view("int64")
+        else:
+            v = s.to_numpy(dtype=object, na_value="")
+            out[c] = v.astype(str).astype(object) if s.dtype == object else v
+    return pd.DataFrame(out, index=df.index)
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Hash a 64 bit di ogni riga (tutte le colonne)."""
+    return pd.util.hash_pandas_object(_canonical(df, df.columns), index=False).to_numpy()
+
+
+def _output_hashes(df: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(_canonical(df, ["match_id"] + ADVANCED_FEATURE_COLS), index=False).to_numpy()
+
+
+def _checksum(total: int, n: int) -> str:
+    return f"{total % 2**64:016x}-{n}"
+
+
+def output_checksum(df: pd.DataFrame) -> str:
+    """Checksum di match_id + advanced features: somma degli hash di riga (indipendente dall'ordine)."""
+    return _checksum(int(_output_hashes(df).sum(dtype=np.uint64)), len(df))
+
+
+def _file_stats(output_csv: Path):
+    """(mtime_ns, size) di CSV e .arrow: se non cambiano dall'ultimo giro non serve ricalcolare il checksum."""
+    out = []
+    for p in (output_csv, arrow_path(output_csv)):
+        try:
+            st = p.stat()
+            out.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+# =========================
+# STATO
+# =========================
+def load_state(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        if path.exists():
+            print(f"[WARN] Stato illeggibile ({path}): {e}")
+        return None
+    if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+        return None
+    return state
+
+
+def save_state(path: Path, state: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(path)
+
+
+def _make_state(engine: TeamStateEngine, ids: np.ndarray, hashes: np.ndarray, dates: pd.Series,
+                out_sum: int, out_rows: int, output_csv: Path) -> Dict[str, Any]:
+    last = dates.max()
+    return {
+        "version": STATE_VERSION,
+        "engine": engine,
+        "last_date": None if pd.isna(last) else pd.Timestamp(last),
+        "ids": ids,
+        "row_hashes": hashes,
+        "output_sum": out_sum % 2**64,
+        "output_rows": out_rows,
+        "output_files": _file_stats(output_csv),
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+# =========================
+# CALCOLO
+# =========================
+def _with_features(base: pd.DataFrame, dates: pd.Series, feats: np.ndarray) -> pd.DataFrame:
+    """Storico + advanced features, come lo scrive populate_enhanced_features."""
+    out = base.copy()
+    out["date"] = dates.dt.date
+    for j, col in enumerate(ADVANCED_FEATURE_COLS):
+        out[col] = feats[:, j]
+    return out
+
+
+def _replay_league(base: pd.DataFrame, dates: pd.Series, league: str, is_new: np.ndarray,
+                   late: np.ndarray, engine: TeamStateEngine, feats: np.ndarray, touched: np.ndarray) -> None:
+    """
+    Ricalcola nella lega le righe toccate dai risultati in ritardo e le righe nuove
+    (marcate in touched); aggiorna feats e lo stato di engine per le squadre coinvolte.
+    """
+    in_league = (base["league"] == league).to_numpy()
+    home, away = base["home"], base["away"]
+    late_l = late & in_league
+    first = dates[late_l].min()
+    hit = set(home[late_l].dropna()) | set(away[late_l].dropna())
+    involves = (home.isin(hit) | away.isin(hit)).to_numpy()
+    target = (in_league & involves & (dates > first).to_numpy()) | (is_new & in_league)
+    teams = set(home[target].dropna()) | set(away[target].dropna())
+    # tutte le partite di queste squadre: lo stato di ognuna (e delle coppie) è completo;
+    # le feature servono solo per le righe target, le altre aggiornano soltanto lo stato
+    replay = in_league & (home.isin(teams) | away.isin(teams)).to_numpy()
+    sub = TeamStateEngine()
+    part = compute_advanced_features(base[replay], sub, only=target[replay])
+    pos = np.flatnonzero(replay)
+    keep = target[replay]
+    feats[pos[keep]] = part.to_numpy(dtype=float)[keep]
+    touched |= target
+
+    for key, dq in sub.recent.items():
+        if key[0] == league and key[1] in teams:
+            engine.recent[key] = dq
+            engine.table[key] = sub.table[key]
+    for key, dq in sub.pairs.items():
+        if key[0] == league and key[1] & teams:
+            engine.pairs[key] = dq
+
+
+def _full_rebuild(base: pd.DataFrame, jobs: int = 1, ckpt: Optional[BackfillCheckpoint] = None):
+    """
+    Feature di tutto lo storico e stato finale. Con ckpt ogni lega completata si salva
+    (righe per posizione, stato delle leghe finite come payload) e quelle già nel
+    checkpoint non si ricalcolano.
+    """
+    if ckpt is None:
+        engine = TeamStateEngine()
+        feats = compute_advanced_features_parallel(base, jobs, engine).to_numpy(dtype=float)
+        return engine, feats
+    shards = league_shards(base)
+    units = [f"league:{'' if lg is None else lg}" for lg in shards.leagues]
+    engine = ckpt.payload() or TeamStateEngine()
+    feats = np.full((len(base), len(ADVANCED_FEATURE_COLS)), np.nan)
+    for part in ckpt.frames():
+        feats[part.index.to_numpy()] = part.to_numpy(dtype=float)
+    skip = {k for k, unit in enumerate(units) if ckpt.is_done(unit)}
+    for k, out, shard_engine in iter_league_features(shards, jobs, skip, with_engine=True):
+        feats[shards.rows[k]] = out
+        merge_shard_state(shards, k, shard_engine, engine)
+        ckpt.save_part(units[k], pd.DataFrame(out, index=shards.rows[k], columns=ADVANCED_FEATURE_COLS),
+                       payload=engine)
+        print(f"  {units[k]}: {len(shards.rows[k])} righe ({len(ckpt.done)}/{len(units)})")
+    return engine, feats
+
+
+def _check_incremental(ids: np.ndarray, hashes: np.ndarray, output_csv: Path, state: Optional[Dict[str, Any]]):
+    """
+    (motivo, prev, is_new): motivo per cui serve una ricostruzione completa (None = si può
+    procedere), feature dell'output attuale e righe mai elaborate.
+    """
+    if state is None:
+        return "stato assente", None, None
+    if not output_csv.exists() and not arrow_path(output_csv).exists():
+        return "output assente", None, None
+    index = pd.Index(ids)
+    if pd.isna(ids).any() or not index.is_unique:
+        return "match_id mancanti o duplicati", None, None
+    pos = index.get_indexer(state["ids"])
+    if (pos < 0).any():
+        return f"{int((pos < 0).sum())} righe già elaborate non sono più nello storico", None, None
+    if (hashes[pos] != state["row_hashes"]).any():
+        return "righe già elaborate modificate nello storico", None, None
+    try:
+        prev = load_dataset(output_csv, columns=["match_id"] + ADVANCED_FEATURE_COLS)
+    except Exception as e:
+        return f"output illeggibile ({e})", None, None
+    if len(prev.columns) != 1 + len(ADVANCED_FEATURE_COLS):
+        return "colonne mancanti nell'output", None, None
+    # file toccato da altri dopo l'ultimo giro: il checksum deve ancora coincidere
+    if _file_stats(output_csv) != state["output_files"] and \
+            output_checksum(prev) != _checksum(state["output_sum"], state["output_rows"]):
+        return "checksum dell'output diverso dallo stato (file riscritto?)", None, None
+    is_new = np.ones(len(ids), dtype=bool)
+    is_new[pos] = False
+    return None, prev, is_new
+
+
+@instrument("enhanced_update")
+def update_enhanced(input_csv, output_csv, full_rebuild: bool = False, jobs: int = 1,
+                    restart: bool = False) -> Dict[str, Any]:
+    """
+    Aggiorna l'output arricchito di input_csv. Ritorna un riepilogo
+    {mode: full|incremental|noop, rows, new, recomputed, seconds}.
+    jobs > 1: la ricostruzione completa calcola una lega per processo.
+    restart: la ricostruzione completa ignora il checkpoint di un giro interrotto.
+    """
+    t0 = time.perf_counter()
+    input_csv, output_csv = Path(input_csv), Path(output_csv)
+    spath = state_path(output_csv)
+    base = load_dataset(input_csv).reset_index(drop=True)
+    dates = pd.to_datetime(base["date"])
+    ids = base["match_id"].to_numpy(dtype=object, na_value=None)
+    hashes = row_hashes(base)
+    summary = {"mode": "full", "rows": len(base), "new": 0, "recomputed": 0}
+    ckpt = None
+
+    state = None if full_rebuild else load_state(spath)
+    if full_rebuild:
+        reason, prev, is_new = "--full-rebuild", None, None
+    else:
+        reason, prev, is_new = _check_incremental(ids, hashes, output_csv, state)
+    if reason is not None:
+        print(f"[INFO] {output_csv.name}: ricostruzione completa ({reason}), {len(base)} righe…")
+        ckpt = BackfillCheckpoint(output_csv, {"input": str(input_csv), "rows": len(base),
+                                               "content": int(hashes.sum(dtype=np.uint64)),
+                                               "mode": "full_rebuild"}, restart=restart)
+        engine, feats = _full_rebuild(base, jobs, ckpt)
+        out = _with_features(base, dates, feats)
+        save_dataset(out, output_csv)
+        out_sum = int(_output_hashes(out).sum(dtype=np.uint64))
+        summary["new"] = len(base)
+    else:
+        engine: TeamStateEngine = state["engine"]
+        summary["new"] = n_new = int(is_new.sum())
+        if n_new == 0:
+            summary.update(mode="noop", seconds=round(time.perf_counter() - t0, 3))
+            print(f"[OK] {output_csv.name}: nessuna partita nuova ({len(base)} righe).")
+            return summary
+
+        summary["mode"] = "incremental"
+        at = pd.Index(prev["match_id"].to_numpy(dtype=object)).get_indexer(ids)
+        feats = prev[ADVANCED_FEATURE_COLS].to_numpy(dtype=float)[at]
+        feats[at < 0] = np.nan
+        last = state["last_date"]
+        valid_league = base["league"].notna().to_numpy()
+        late = is_new & valid_league & (dates <= last).to_numpy() if last is not None else np.zeros(len(base), bool)
+        late_leagues = set(base.loc[late, "league"])
+
+        touched = is_new.copy()
+        fast = is_new & ~base["league"].isin(late_leagues).to_numpy()
+        if fast.any():
+            feats[fast] = compute_advanced_features(base[fast], engine).to_numpy(dtype=float)
+        for league in sorted(late_leagues):
+            _replay_league(base, dates, league, is_new, late, engine, feats, touched)
+        summary["recomputed"] = int((touched & ~is_new).sum())
+
+        out = _with_features(base, dates, feats)
+        new_pos = np.flatnonzero(is_new)
+        tail = new_pos[0] == len(base) - n_new and summary["recomputed"] == 0
+        header = list(pd.read_csv(output_csv, nrows=0).columns) if output_csv.exists() else None
+        if tail and header == list(out.columns):
+            out.iloc[new_pos].to_csv(output_csv, mode="a", header=False, index=False)
+            save_dataset(out, output_csv, csv=False)
+        else:
+            save_dataset(out, output_csv)
+        if summary["recomputed"]:
+            out_sum = int(_output_hashes(out).sum(dtype=np.uint64))
+        else:
+            out_sum = state["output_sum"] + int(_output_hashes(out.iloc[new_pos]).sum(dtype=np.uint64))
+        print(f"[OK] {output_csv.name}: {n_new} partite nuove, {summary['recomputed']} righe ricalcolate "
+              f"per risultati in ritardo ({len(base)} righe).")
+
+    save_state(spath, _make_state(engine, ids, hashes, dates, out_sum, len(out), output_csv))
+    if ckpt is not None:
+        ckpt.clear()  # output e stato scritti: lo staging non serve più
+    count("rows", summary["new"] + summary["recomputed"])
+    summary["seconds"] = round(time.perf_counter() - t0, 3)
+    print(f"[INFO] {output_csv.name}: {summary['mode']} in {summary['seconds']:.2f}s")
+    return summary
+
+
+def verify_enhanced(input_csv, output_csv) -> bool:
+    """Confronta l'output su disco con un ricalcolo completo in memoria (non scrive nulla)."""
+    base = load_dataset(Path(input_csv)).reset_index(drop=True)
+    dates = pd.to_datetime(base["date"])
+    _engine, feats = _full_rebuild(base)
+    expected = output_checksum(_with_features(base, dates, feats))
+    try:
+        actual = output_checksum(load_dataset(Path(output_csv), columns=["match_id"] + ADVANCED_FEATURE_COLS))
+    except Exception as e:
+        print(f"[ERR] {Path(output_csv).name}: output illeggibile ({e})")
+        return False
+    if actual != expected:
+        print(f"[ERR] {Path(output_csv).name}: output diverso dal ricalcolo completo "
+              f"({actual} != {expected}); usa --full-rebuild")
+        return False
+    print(f"[OK] {Path(output_csv).name}: coerente con il ricalcolo completo ({expected})")
+    return True
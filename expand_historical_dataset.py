@@ -12,6 +12,10 @@ Strategia:
 3. Scarica risultati finali
 4. Costruisce dataset completo per training
 
+Ogni stagione viene salvata in data/expand_historical.staging/ (backfill_checkpoint.py)
+e gli storici si sostituiscono con l'unione delle stagioni solo alla fine: un giro
+interrotto riparte dalle stagioni mancanti (--restart per ricominciare da zero).
+
 Usage:
     python3 expand_historical_dataset.py --start-year 2022 --end-year 2025 --comps "SA,PL,PD,BL1,FL1"
 """
@@ -22,7 +26,13 @@ import sys
 from datetime import date, datetime, timedelta
 from pathlib import Path
 
+import pandas as pd
+
+from backfill_checkpoint import BackfillCheckpoint, pausable
+from historical_store import arrow_path, load_dataset
+
 ROOT = Path(__file__).resolve().parent
+STAGING_DIR = ROOT / "data" / "expand_historical.staging"
 
 # Mappa competizioni per stagioni disponibili su football-data.org
 # Nota: alcune leghe hanno ID diversi per stagioni diverse
@@ -61,7 +71,8 @@ def get_season_dates(year: int) -> tuple:
     end_date = date(year + 1, 5, 31)  # Fine maggio anno successivo
     return start_date, end_date
 
-def expand_dataset(start_year: int, end_year: int, comps: list[str], n_recent: int = 5, delay: float = 0.6):
+def expand_dataset(start_year: int, end_year: int, comps: list[str], n_recent: int = 5, delay: float = 0.6,
+                   restart: bool = False, jobs: int = 1):
     """
     Espande il dataset storico scaricando dati per più stagioni.
 
@@ -71,6 +82,8 @@ def expand_dataset(start_year: int, end_year: int, comps: list[str], n_recent: i
         comps: Lista di competizioni (es. ["SA", "PL", "BL1"])
         n_recent: Numero partite recenti per calcolare xG
         delay: Delay tra richieste scraping
+        restart: Ignora il checkpoint di un'espansione interrotta
+        jobs: Processi di historical_builder per le feature (--jobs)
     """
     print(f"\n{'#' * 80}")
     print(f"# ESPANSIONE DATASET STORICO")
@@ -80,45 +93,69 @@ def expand_dataset(start_year: int, end_year: int, comps: list[str], n_recent: i
     print(f"# = ~{300 * len(comps) * (end_year - start_year + 1)} partite totali")
     print(f"{'#' * 80}\n")
 
+    hist_path = ROOT / "data" / "historical_dataset.csv"
+    hist_1x2_path = ROOT / "data" / "historical_1x2.csv"
+    # ogni stagione finisce nello staging; gli storici si sostituiscono solo alla fine
+    ckpt = BackfillCheckpoint(
+        hist_path,
+        {"start_year": start_year, "end_year": end_year, "comps": comps, "n_recent": n_recent},
+        restart=restart,
+        staging=STAGING_DIR,
+    )
+    ckpt.dir.mkdir(parents=True, exist_ok=True)
+
     total_success = 0
     total_attempted = 0
 
     for year in range(start_year, end_year + 1):
+        unit = f"season-{year}"
+        total_attempted += 1
+        if ckpt.is_done(unit):
+            total_success += 1
+            print(f"[SKIP] Stagione {year}-{year+1} già nel checkpoint")
+            continue
+
         print(f"\n{'*' * 80}")
         print(f"* STAGIONE {year}-{year + 1}")
         print(f"{'*' * 80}\n")
 
         start_date, end_date = get_season_dates(year)
+        season_csv = ckpt.dir / f"{unit}.csv"
 
-        # Step 1: Costruisci dataset storico per questa stagione
+        # Step 1: Costruisci dataset storico per questa stagione (checkpoint proprio per lega)
         cmd = (
             f"{sys.executable} historical_builder.py "
             f"--from {start_date.isoformat()} "
             f"--to {end_date.isoformat()} "
             f"--comps \"{','.join(comps)}\" "
             f"--n_recent {n_recent} "
-            f"--delay {delay}"
+            f"--delay {delay} "
+            f"--jobs {jobs} "
+            f"--out \"{season_csv}\""
         )
 
-        total_attempted += 1
         if run_cmd(cmd, f"Historical Builder {year}-{year+1}"):
+            ckpt.save_part(unit, load_dataset(season_csv))
+            season_csv.unlink(missing_ok=True)
+            arrow_path(season_csv).unlink(missing_ok=True)
             total_success += 1
             print(f"\n[✓] Stagione {year}-{year+1} completata con successo")
         else:
             print(f"\n[✗] Stagione {year}-{year+1} fallita")
             # Continua comunque con le altre stagioni
 
+    if ckpt.done:
+        combined = ckpt.combined().drop_duplicates(subset=["match_id"])
+        # con stagioni fallite lo staging resta: il prossimo giro riprova solo quelle
+        ckpt.publish(combined, [hist_path, hist_1x2_path], clear=total_success == total_attempted)
+
     print(f"\n{'#' * 80}")
     print(f"# RIEPILOGO ESPANSIONE")
     print(f"# Stagioni processate con successo: {total_success}/{total_attempted}")
-    print(f"# Dataset finale salvato in: {ROOT / 'data' / 'historical_dataset.csv'}")
+    print(f"# Dataset finale salvato in: {hist_path}")
     print(f"{'#' * 80}\n")
 
     # Mostra statistiche dataset finale
-    import pandas as pd
-    hist_path = ROOT / "data" / "historical_dataset.csv"
-    hist_1x2_path = ROOT / "data" / "historical_1x2.csv"
-
     if hist_path.exists():
         try:
             df = pd.read_csv(hist_path)
@@ -206,6 +243,17 @@ Esempi:
         default=0.6,
         help="Delay tra richieste scraping in secondi (default: 0.6)"
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Processi per il calcolo feature di historical_builder (default: 1)"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignora il checkpoint di un'espansione interrotta e riparte da zero"
+    )
 
     args = parser.parse_args()
 
@@ -232,13 +280,16 @@ Esempi:
     print(f"\n[INFO] Avvio espansione dataset automatica...")
 
     # Esegui espansione
-    success, attempted = expand_dataset(
-        args.start_year,
-        args.end_year,
-        comps_list,
-        args.n_recent,
-        args.delay
-    )
+    with pausable("Espansione storico"):
+        success, attempted = expand_dataset(
+            args.start_year,
+            args.end_year,
+            comps_list,
+            args.n_recent,
+            args.delay,
+            restart=args.restart,
+            jobs=args.jobs,
+        )
 
     if success == attempted:
         print(f"\n[SUCCESS] Tutte le {attempted} stagioni completate!")
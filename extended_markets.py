@@ -9,12 +9,16 @@ Calcola mercati estesi per aumentare le opportunità di scommessa:
 - Goal/No Goal (GG/NG)
 - Over/Under altre linee (1.5, 3.5, 4.5)
 - Combo markets (DC + GG, DC + OU, etc.)
+
+La matrice dei risultati e i mercati derivati vengono da poisson_kernel.py.
 """
 
 import math
 from typing import Dict, List, Tuple, Optional
 import numpy as np
 
+from poisson_kernel import MULTIGOL_RANGES, outcome_probs, score_tensor, total_goals_dist
+
 
 def poisson_prob(lam: float, k: int) -> float:
     """Probabilità Poisson di k goal con media lambda."""
@@ -28,11 +32,7 @@ def calculate_score_matrix(lambda_home: float, lambda_away: float, max_goals: in
     Calcola matrice di probabilità per ogni possibile score.
     Returns: matrix[home_goals][away_goals] = probability
     """
-    matrix = np.zeros((max_goals + 1, max_goals + 1))
-    for h in range(max_goals + 1):
-        for a in range(max_goals + 1):
-            matrix[h][a] = poisson_prob(lambda_home, h) * poisson_prob(lambda_away, a)
-    return matrix
+    return score_tensor(lambda_home, lambda_away, max_goals)[0]
 
 
 def calculate_extended_markets(
@@ -60,24 +60,11 @@ def calculate_extended_markets(
     # Score matrix
     score_matrix = calculate_score_matrix(lambda_home, lambda_away, max_goals)
 
-    # Basic 1X2 from Poisson
-    p1_poisson = p2_poisson = px_poisson = 0.0
-    for h in range(max_goals + 1):
-        for a in range(max_goals + 1):
-            prob = score_matrix[h][a]
-            if h > a:
-                p1_poisson += prob
-            elif h == a:
-                px_poisson += prob
-            else:
-                p2_poisson += prob
-
-    # Normalize
-    total = p1_poisson + px_poisson + p2_poisson
-    if total > 0:
-        p1_poisson /= total
-        px_poisson /= total
-        p2_poisson /= total
+    # Basic 1X2 from Poisson (normalizzato sulla griglia)
+    p1_poisson, px_poisson, p2_poisson = (float(p[0]) for p in outcome_probs(score_matrix))
+    # Distribuzione del totale gol: base di O/U e multigol
+    goals_dist = total_goals_dist(score_matrix)[0]
+    totals = np.arange(len(goals_dist))
 
     # Use ML probabilities if available, otherwise Poisson
     p1 = p1_ml if p1_ml is not None else p1_poisson
@@ -103,11 +90,7 @@ def calculate_extended_markets(
     # ========== OVER / UNDER ALTRE LINEE ==========
     # SOLO linee utili: 1.5, 2.5, 3.5 (elimino 0.5, 4.5, 5.5 troppo ovvie)
     for line in [1.5, 2.5, 3.5]:
-        over_prob = 0.0
-        for h in range(max_goals + 1):
-            for a in range(max_goals + 1):
-                if h + a > line:
-                    over_prob += score_matrix[h][a]
+        over_prob = float(goals_dist[totals > line].sum())
 
         markets[f'over_{line}'] = over_prob
         markets[f'under_{line}'] = 1 - over_prob
@@ -116,32 +99,13 @@ def calculate_extended_markets(
     # Multigol indica il totale di gol nella partita
     # Es: MG_1-2 = tra 1 e 2 gol totali, MG_2-3 = tra 2 e 3 gol, etc.
 
-    multigol_ranges = [
-        ('0-1', 0, 1),
-        ('1-2', 1, 2),
-        ('1-3', 1, 3),
-        ('2-3', 2, 3),
-        ('2-4', 2, 4),
-        ('2-5', 2, 5),
-        ('3-4', 3, 4),
-        ('3-5', 3, 5),
-        ('3-6', 3, 6),
-        ('4-5', 4, 5),
-        ('4-6', 4, 6),
-        ('5-6', 5, 6),
-    ]
-
-    for label, min_goals, max_goals_range in multigol_ranges:
-        prob = 0.0
-        for h in range(max_goals + 1):
-            for a in range(max_goals + 1):
-                total_goals = h + a
-                if min_goals <= total_goals <= max_goals_range:
-                    prob += score_matrix[h][a]
-        markets[f'mg_{label}'] = prob
+    for label, min_goals, max_goals_range in MULTIGOL_RANGES:
+        in_range = (totals >= min_goals) & (totals <= max_goals_range)
+        markets[f'mg_{label}'] = float(goals_dist[in_range].sum())
 
     # ========== COMBO MARKETS ==========
     # SOLO combo essenziali: DC + GG/NG
+    # Prodotto e non congiunta dal tensore: la DC può venire dalle probabilità ML
     markets['combo_1x_gg'] = markets['dc_1x'] * markets['gg']
     markets['combo_1x_ng'] = markets['dc_1x'] * markets['ng']
     markets['combo_12_gg'] = markets['dc_12'] * markets['gg']
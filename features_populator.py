@@ -42,6 +42,10 @@ from rapidfuzz import fuzz, process
 from sqlalchemy.orm import Session, joinedload
 from database import SessionLocal, Base, engine
 from models import Fixture, Feature, Odds, TeamMapping
+from understat_cache import extract_json_from_understat, recent_xg, team_matches
+from market_cache import bump_dates
+from metrics import count, instrument
+from team_registry import SRC_UNDERSTAT, TeamRegistry
 
 # bs4/lxml tenuti per eventuali parsing futuri
 
@@ -346,54 +350,8 @@ def understat_team_url(team: str, date_iso: str) -> str:
     return f"https://understat.com/team/{quote(team)}/{season}"
 
 
-def _extract_json_from_understat(html: str, varname: str) -> Optional[list]:
-    """
-    Estrae un oggetto JSON da una variabile JavaScript all'interno di un tag <script> nel codice HTML.
-    È progettato per essere robusto a cambiamenti minori nel formato della pagina.
-    """
-    # Cerca il tag <script> che contiene la variabile per restringere la ricerca
-    script_tag_pattern = re.compile(rf"<script>.*?\b{re.escape(varname)}\b.*?</script>", re.DOTALL)
-    match = script_tag_pattern.search(html)
-    
-    if not match:
-        return None
-        
-    script_content = match.group(0)
-
-    # Cerca il pattern di assegnazione della variabile. Questo gestisce:
-    # 1. var/let/const nome_variabile = JSON.parse('stringa_json_escapata')
-    # 2. var/let/const nome_variabile = [{...}] o {{...}} (JSON letterale)
-    # Il pattern per la stringa escapata (?:\\.|[^'])* è robusto e gestisce i caratteri escapati.
-    data_pattern = re.search(
-        rf"\b{re.escape(varname)}\s*=\s*(?:JSON\.parse\(\s*'((?:\\.|[^'])*)'\s*\)|(\[.*?\]|\{{.*?\}}))\s*;?",
-        script_content,
-        re.DOTALL
-    )
-
-    if not data_pattern:
-        return None
-
-    # Il pattern ha due gruppi di cattura. Solo uno sarà popolato.
-    escaped_json_str = data_pattern.group(1)
-    literal_json_str = data_pattern.group(2)
-
-    json_to_parse = None
-    if escaped_json_str:
-        try:
-            # La stringa è escapata per JavaScript. `unicode_escape` è un buon metodo per decodificarla.
-            json_to_parse = bytes(escaped_json_str, "utf-8").decode("unicode_escape")
-        except Exception:
-            return None # Errore nella decodifica della stringa
-    elif literal_json_str:
-        json_to_parse = literal_json_str
-
-    if json_to_parse:
-        try:
-            return json.loads(json_to_parse)
-        except json.JSONDecodeError:
-            return None # Parsing fallito
-            
-    return None
+# Parser condiviso con historical_builder (vedi understat_cache.py)
+_extract_json_from_understat = extract_json_from_understat
 
 
 # -------------- FBRef: FALLBACK SOURCE --------------
@@ -519,9 +477,14 @@ def fetch_league_teams(code: str, date_iso: str, delay: float = 0.0) -> List[str
 
 # -------------- MATCHING NOMI --------------
 def get_understat_name_from_db(
-    source_name: str, league_code: str, db: Session
+    source_name: str, league_code: str, db: Session,
+    team_id: Optional[int] = None, registry: Optional[TeamRegistry] = None,
 ) -> Optional[str]:
-    """Recupera il nome Understat mappato dal database."""
+    """Recupera il nome Understat: prima dal registro squadre (per team_id), poi da team_mappings."""
+    if registry is not None:
+        name = registry.name_for(team_id, SRC_UNDERSTAT)
+        if name:
+            return name
     mapping = (
         db.query(TeamMapping)
         .filter_by(source_name=source_name, league_code=league_code)
@@ -540,18 +503,18 @@ def compute_xg_and_rest(
     
     url = understat_team_url(team_understat, date_iso)
     cache_p = _cache_path(team_understat, date_iso)
-    html = _read_cache(cache_p)
-    
+    html = None
+    fresh = False
+
     # Verifica TTL cache (7 giorni)
-    if html and cache_p.exists():
+    if cache_p.exists():
         try:
             age_days = (time.time() - cache_p.stat().st_mtime) / 86400
-            if age_days > 7:
-                html = None  # Cache scaduta
+            fresh = age_days <= 7
         except Exception:
-            pass
-    
-    if html is None:
+            fresh = True
+
+    if not fresh:
         for attempt in range(2):
             try:
                 resp = requests.get(url, headers=UA, timeout=30)
@@ -577,44 +540,13 @@ def compute_xg_and_rest(
             except Exception:
                 return (DEFAULT_XG_VALUE, DEFAULT_XG_VALUE, None)
 
-    data = _extract_json_from_understat(html, "matchesData")
-    if not data:
+    # Partite già parsate e ordinate (l'HTML viene riletto solo se cambiato)
+    tm = team_matches(cache_p, html=html)
+    if not tm:
         return (DEFAULT_XG_VALUE, DEFAULT_XG_VALUE, None)
 
-    cut = datetime.fromisoformat(date_iso[:10])
-    rows = []
-    for m in data:
-        d = m.get("date")
-        try:
-            dt = datetime.strptime(d, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            continue
-        if dt.date() > cut.date():
-            continue
-        xg = float(m.get("xG", 0.0) or 0.0)
-        xga = float(m.get("xGA", 0.0) or 0.0)
-        rows.append((dt, xg, xga))
-
-    rows.sort(key=lambda r: r[0], reverse=True)
-    last_dt = rows[0][0] if rows else None
-    rows = rows[: max(1, n)]
-    if not rows:
-        return (DEFAULT_XG_VALUE, DEFAULT_XG_VALUE, last_dt)
-
-    # Calcola una media pesata: le partite più recenti hanno più peso.
-    # Questo crea una feature di "forma" più reattiva.
-    weights = list(range(len(rows), 0, -1))
-    total_weight = sum(weights)
-
-    if total_weight > 0:
-        xg_avg = sum(r[1] * w for r, w in zip(rows, weights)) / total_weight
-        xga_avg = sum(r[2] * w for r, w in zip(rows, weights)) / total_weight
-    else:
-        # Fallback a media semplice in caso di problemi
-        xg_avg = sum(r[1] for r in rows) / len(rows)
-        xga_avg = sum(r[2] for r in rows) / len(rows)
-
-    return (round(xg_avg, 3), round(xga_avg, 3), last_dt)
+    # Media pesata: le partite più recenti hanno più peso (forma più reattiva)
+    return recent_xg(tm, date_iso, n, default=DEFAULT_XG_VALUE)
 
 
 # -------------- METEO & FLAG --------------
@@ -658,6 +590,7 @@ def europe_flag_from_league(league_name: str) -> str:
 
 
 # -------------- MAIN --------------
+@instrument("features")
 def main():
     import argparse
 
@@ -713,6 +646,7 @@ def main():
             comps = []
         
         fixtures_to_process = query.all()
+        registry = TeamRegistry(db)
         if not fixtures_to_process:
             print(f"[INFO] Nessun fixture trovato nel DB il {args.date} con i filtri richiesti.")
             sys.exit(0)
@@ -752,8 +686,8 @@ def main():
         }
 
         # Risolvi nomi Understat (auto-learning + fuzzy)
-        home_us = get_understat_name_from_db(home_api, comp_code, db)
-        away_us = get_understat_name_from_db(away_api, comp_code, db)
+        home_us = get_understat_name_from_db(home_api, comp_code, db, fixture.home_team_id, registry)
+        away_us = get_understat_name_from_db(away_api, comp_code, db, fixture.away_team_id, registry)
 
         # xG medie ultime N (Understat) + last match date (per rest-days)
         hxg_f, hxg_a, h_last_dt = compute_xg_and_rest(
@@ -921,7 +855,9 @@ def main():
 
     # --- SALVATAGGIO SU DATABASE ---
     try:
+        bump_dates(db, {f.date for f in fixtures_to_process})
         db.commit()
+        count("rows", len(fixtures_to_process))
         print(f"\n[DB] Commit eseguito. {len(fixtures_to_process)} features inserite/aggiornate nel database.")
     except Exception as e:
         print(f"[DB-ERR] Errore durante il salvataggio delle features: {e}")
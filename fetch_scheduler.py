@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fetch_scheduler.py
+------------------
+Scheduler di download concorrenti con limiti per host.
+
+- pool di worker (thread) condiviso da tutti gli host
+- per ogni host: massimo N richieste in parallelo + intervallo minimo tra
+  due richieste (rate limit), così non si martellano Understat & co.
+- retry con backoff esponenziale su timeout, errori di rete, 429 e 5xx
+  (rispetta Retry-After se presente)
+- 404 è un risultato definitivo (nessun retry)
+
+Uso:
+    jobs = [FetchJob(key=("understat", "Arsenal", 2023), url=..., sink=salva_html)]
+    sched = FetchScheduler(workers=8, host_limits={"understat.com": HostLimit(2, 1.0)})
+    results = sched.run(jobs)   # {key: FetchResult}
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+UA = {"User-Agent": "Mozilla/5.0 (compatible; HistBuilder/1.0)"}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostLimit:
+    def __init__(self, max_concurrency: int = 2, min_interval: float = 0.0):
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval  # secondi tra due richieste verso lo stesso host
+
+
+class FetchJob:
+    def __init__(
+        self,
+        key: Hashable,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        sink: Optional[Callable[[requests.Response], Any]] = None,
+    ):
+        self.key = key
+        self.url = url
+        self.params = params
+        # Chiamata con la Response (status 200): il valore ritornato finisce in FetchResult.value
+        self.sink = sink
+
+
+class FetchResult:
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.status: Optional[int] = None
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.attempts = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+class _HostState:
+    def __init__(self, limit: HostLimit):
+        self.limit = limit
+        self.sem = threading.Semaphore(max(1, limit.max_concurrency))
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait_turn(self):
+        """Rate limit: prenota il prossimo slot libero e attende fino ad allora."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.limit.min_interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FetchScheduler:
+    def __init__(
+        self,
+        workers: int = 4,
+        host_limits: Optional[Dict[str, HostLimit]] = None,
+        default_limit: Optional[HostLimit] = None,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 30.0,
+        headers: Optional[Dict[str, str]] = None,
+        verbose: bool = True,
+    ):
+        self.workers = max(1, int(workers))
+        self.host_limits = dict(host_limits or {})
+        self.default_limit = default_limit or HostLimit()
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = headers or UA
+        self.verbose = verbose
+        self._hosts: Dict[str, _HostState] = {}
+        self._hosts_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _host(self, url: str) -> _HostState:
+        host = urlparse(url).netloc.lower()
+        with self._hosts_lock:
+            st = self._hosts.get(host)
+            if st is None:
+                st = self._hosts[host] = _HostState(self.host_limits.get(host, self.default_limit))
+            return st
+
+    def _session(self) -> requests.Session:
+        # requests.Session non è garantita thread-safe: una per worker
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = requests.Session()
+            s.headers.update(self.headers)
+        return s
+
+    def _fetch(self, job: FetchJob) -> FetchResult:
+        res = FetchResult(job.key)
+        host = self._host(job.url)
+        for attempt in range(self.retries + 1):
+            res.attempts = attempt + 1
+            wait = self.backoff * (2 ** attempt)
+            with host.sem:
+                host.wait_turn()
+                try:
+                    r = self._session().get(job.url, params=job.params, timeout=self.timeout)
+                except requests.exceptions.RequestException as e:
+                    res.error = str(e)
+                    r = None
+            if r is not None:
+                res.status = r.status_code
+                if r.status_code == 200:
+                    res.error = None
+                    try:
+                        res.value = job.sink(r) if job.sink else r.content
+                    except Exception as e:
+                        res.error = f"sink: {e}"
+                    return res
+                if r.status_code not in RETRY_STATUS:
+                    res.error = f"HTTP {r.status_code}"
+                    return res
+                res.error = f"HTTP {r.status_code}"
+                try:
+                    wait = max(wait, float(r.headers.get("Retry-After", 0)))
+                except (TypeError, ValueError):
+                    pass
+            if attempt < self.retries:
+                time.sleep(wait)
+        return res
+
+    def run(self, jobs: List[FetchJob], label: str = "fetch") -> Dict[Hashable, FetchResult]:
+        """Esegue tutti i job (deduplicati per key) e ritorna {key: FetchResult}."""
+        unique: Dict[Hashable, FetchJob] = {}
+        for j in jobs:
+            unique.setdefault(j.key, j)
+        out: Dict[Hashable, FetchResult] = {}
+        if not unique:
+            return out
+
+        t0 = time.time()
+        total = len(unique)
+        with ThreadPoolExecutor(max_workers=min(self.workers, total)) as ex:
+            futures = {ex.submit(self._fetch, j): k for k, j in unique.items()}
+            try:
+                for i, fut in enumerate(as_completed(futures), 1):
+                    k = futures[fut]
+                    try:
+                        out[k] = fut.result()
+                    except Exception as e:  # non dovrebbe succedere: _fetch cattura tutto
+                        out[k] = FetchResult(k)
+                        out[k].error = str(e)
+                    if self.verbose and (i % 25 == 0 or i == total):
+                        print(f"[{label}] {i}/{total} richieste completate")
+            except BaseException:
+                # Ctrl-C / stop del job: niente attesa delle richieste ancora in coda
+                ex.shutdown(wait=False, cancel_futures=True)
+                raise
+
+        if self.verbose:
+            n_ok = sum(1 for r in out.values() if r.ok)
+            print(f"[{label}] {n_ok}/{total} OK in {time.time() - t0:.1f}s")
+        return out
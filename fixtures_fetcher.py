@@ -2,12 +2,8 @@
 # -*- coding: utf-8 -*-
 import argparse
 import os
-import time
-import json
-import subprocess
 from datetime import datetime, timedelta
 from pathlib import Path
-from urllib.parse import urlencode
 
 import pandas as pd
 import requests
@@ -15,8 +11,12 @@ from unidecode import unidecode
 
 # Importazioni per il database
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, migrate_schema
 from models import Fixture, Odds
+from http_cache import THE_ODDS_API_QUOTA, get_client
+from market_cache import bump_dates
+from metrics import count, instrument
+from team_registry import SRC_FD, SRC_TOA, TeamRegistry
 
 ROOT = Path(__file__).resolve().parent
 CFG = ROOT / "config.toml"
@@ -77,78 +77,16 @@ def read_cfg():
     return fd.strip(), toa.strip()
 
 
-class CurlResponse:
-    def __init__(self, text: str):
-        self.text = text
-        self.status_code = 200
-
-    def json(self):
-        return json.loads(self.text)
-
-
-def http_get(url: str, headers=None, params=None, timeout=30, desc=""):
-    headers = headers or {}
-    params = params or {}
-    try:
-        r = requests.get(url, headers=headers, params=params, timeout=timeout)
-        return r
-    except requests.exceptions.RequestException as exc:
-        full_url = f"{url}?{urlencode(params)}" if params else url
-        label = desc or url
-        print(f"[HTTP-FALLBACK] {label}: {exc}. Provo con curl…")
-        cmd = ["curl", "-sS", "-m", str(timeout)]
-        for k, v in headers.items():
-            cmd += ["-H", f"{k}: {v}"]
-        cmd.append(full_url)
-        res = subprocess.run(cmd, capture_output=True, text=True)
-        if res.returncode != 0:
-            raise RuntimeError(
-                f"curl fallito per {label} (exit {res.returncode}): {res.stderr.strip()}"
-            )
-        return CurlResponse(res.stdout)
-
-
 def fd_get(path, params=None, token="", max_retries=3):
+    """GET football-data.org v4 tramite il livello HTTP condiviso (cache, retry, rate limit)."""
     url = f"https://api.football-data.org/v4{path}"
     headers = {"X-Auth-Token": token}
-    params = params or {}
-    
-    for attempt in range(max_retries):
-        try:
-            r = http_get(url, headers=headers, params=params, timeout=30, desc=f"FD {path}")
-            
-            if r.status_code == 200:
-                return r
-            
-            if r.status_code == 429:
-                retry_after = int(r.headers.get("X-RequestCounter-Reset", "60"))
-                wait_time = min(retry_after + 1, 65)
-                print(f"[FD] Rate limit, attendo {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            
-            if r.status_code in (401, 403):
-                raise PermissionError(f"FD API {r.status_code}: {r.text[:200]}")
-            
-            r.raise_for_status()
-            return r
-            
-        except requests.exceptions.Timeout:
-            if attempt < max_retries - 1:
-                wait = (attempt + 1) * 5
-                print(f"[FD] Timeout, retry {attempt+1}/{max_retries} dopo {wait}s...")
-                time.sleep(wait)
-                continue
-            raise
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                wait = (attempt + 1) * 2
-                print(f"[FD] Errore rete, retry {attempt+1}/{max_retries} dopo {wait}s...")
-                time.sleep(wait)
-                continue
-            raise
-    
-    raise RuntimeError(f"FD API fallita dopo {max_retries} tentativi")
+    r = get_client().get(url, params=params, headers=headers, endpoint="fd",
+                         max_retries=max_retries, desc=f"FD {path}")
+    if r.status_code in (401, 403):
+        raise PermissionError(f"FD API {r.status_code}: {r.text[:200]}")
+    r.raise_for_status()
+    return r
 
 
 def fd_fixtures_for(code: str, date_from: str, date_to: str, token: str):
@@ -206,6 +144,7 @@ def fd_fixtures_for(code: str, date_from: str, date_to: str, token: str):
                     "league_code": code,
                     "home": home_name,
                     "away": away_name,
+                    "source": SRC_FD,
                 }
             )
         except (KeyError, ValueError, AttributeError) as e:
@@ -226,24 +165,13 @@ def toa_fixtures_for(
     url = f"https://api.the-odds-api.com/v4/sports/{sport}/odds"
     params = {"apiKey": api_key, "regions": "eu,uk", "markets": "h2h"}
     
-    for attempt in range(max_retries):
-        try:
-            r = http_get(url, params=params, timeout=30, desc=f"TOA {code}")
-            if r.status_code == 200:
-                break
-            if r.status_code == 429 and attempt < max_retries - 1:
-                wait = 60
-                print(f"[TOA] Rate limit, attendo {wait}s...")
-                time.sleep(wait)
-                continue
-            return []
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                time.sleep(2)
-                continue
-            print(f"[TOA] Errore: {e}")
-            return []
-    else:
+    try:
+        r = get_client().get(url, params=params, endpoint="toa_odds", quota=THE_ODDS_API_QUOTA,
+                             max_retries=max_retries, desc=f"TOA {code}")
+    except (requests.exceptions.RequestException, RuntimeError) as e:
+        print(f"[TOA] Errore: {e}")
+        return []
+    if r.status_code != 200:
         return []
     
     try:
@@ -278,6 +206,7 @@ def toa_fixtures_for(
                     "league_code": code,
                     "home": home,
                     "away": away,
+                    "source": SRC_TOA,
                 }
             )
         except (KeyError, ValueError, AttributeError):
@@ -286,6 +215,7 @@ def toa_fixtures_for(
     return rows
 
 
+@instrument("fixtures")
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument(
@@ -363,18 +293,30 @@ def main():
         return
 
     # --- Logica di inserimento nel Database ---
+    migrate_schema()  # colonne team_id e tabelle del registro squadre sui DB esistenti
     db: Session = SessionLocal()
     try:
         print(f"\n[DB] Connessione al database per inserire/aggiornare {len(all_rows)} partite...")
         
         match_ids_processed = set()
         upserted_count = 0
+        registry = TeamRegistry(db)
+
+        # date toccate: quelle nuove e quelle vecchie delle partite spostate (per la cache delle viste)
+        incoming_ids = {r.get("match_id") for r in all_rows if r.get("match_id")}
+        touched_dates = {
+            d for (d,) in db.query(Fixture.date).filter(Fixture.match_id.in_(incoming_ids)).distinct()
+        }
 
         for row_data in all_rows:
             match_id = row_data.get("match_id")
             if not match_id or match_id in match_ids_processed:
                 continue
 
+            # team_id canonici: lookup sugli alias noti, fuzzy solo per i nomi mai visti
+            source = row_data.get("source", SRC_FD)
+            code = row_data.get("league_code")
+
             # Crea l'oggetto Fixture
             fixture_obj = Fixture(
                 match_id=match_id,
@@ -385,14 +327,19 @@ def main():
                 league_code=row_data.get("league_code"),
                 home=row_data.get("home"),
                 away=row_data.get("away"),
+                home_team_id=registry.resolve(row_data.get("home"), source, league=code),
+                away_team_id=registry.resolve(row_data.get("away"), source, league=code),
             )
 
             # db.merge gestisce INSERT o UPDATE in base alla chiave primaria
             db.merge(fixture_obj)
             match_ids_processed.add(match_id)
+            touched_dates.add(fixture_obj.date)
             upserted_count += 1
 
+        bump_dates(db, touched_dates)
         db.commit()
+        count("rows", upserted_count)
         print(f"[DB] Commit eseguito. {upserted_count} partite inserite/aggiornate nel database.")
     except Exception as e:
         print(f"[DB-ERR] Errore durante l'operazione sul database: {e}")
@@ -16,6 +16,11 @@ Output: data/historical_dataset.csv
 
 USO:
   python historical_builder.py --from 2023-07-01 --to 2025-06-30 --comps "SA,PL,PD,BL1" --n_recent 5 --delay 0.5
+  python historical_builder.py ... --workers 8     # download concorrenti (default 4)
+  python historical_builder.py ... --dry-run       # scarica solo i CSV stagione (servono al piano),
+                                                   # stampa le richieste Understat/meteo, non scrive nulla
+  python historical_builder.py ... --restart       # ignora il checkpoint di un giro interrotto
+  python historical_builder.py ... --jobs 8        # feature in 8 processi (una lega-stagione ciascuno)
 
 Dipendenze:
   pip install pandas requests beautifulsoup4 lxml rapidfuzz
@@ -23,6 +28,13 @@ Dipendenze:
 Note:
 - Evita di usare football-data.org (token) per lo storico: per risultati/quote le CSV di football-data.co.uk bastano e sono gratis.
 - Understat scraping usa cache/understat/ e un mapping auto-apprendente in data/team_map.json
+- Tutti i download (CSV stagione, pagine Understat, meteo) avvengono PRIMA del calcolo
+  delle feature, in parallelo con limiti per host (fetch_scheduler.py); il calcolo
+  delle feature lavora poi solo sulla cache calda.
+- Le feature si salvano per lega-stagione in data/historical_dataset.staging/
+  (backfill_checkpoint.py): Ctrl-C, crash o stop dal dashboard mettono in pausa;
+  rilanciando con gli stessi parametri si riparte dalle unità mancanti e l'output
+  viene sostituito (atomicamente) solo alla fine.
 """
 
 from __future__ import annotations
@@ -33,6 +45,7 @@ import re
 import sys
 import time
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -41,6 +54,11 @@ import pandas as pd
 import requests
 from rapidfuzz import fuzz, process
 
+from fetch_scheduler import FetchJob, FetchScheduler, HostLimit
+from backfill_checkpoint import BackfillCheckpoint, pausable
+from metrics import count, instrument
+from understat_cache import extract_json_from_understat, recent_xg, team_matches
+
 UA = {"User-Agent": "Mozilla/5.0 (compatible; HistBuilder/1.0)"}
 
 # ---------- CONFIG ----------
@@ -113,6 +131,21 @@ STADIUMS = {
     "Verona": (45.439, 10.968),
 }
 
+# Limiti per host del prefetch: (richieste in parallelo, intervallo minimo in s).
+# --delay alza l'intervallo minimo di football-data e Understat.
+HOST_LIMITS = {
+    "www.football-data.co.uk": (2, 0.5),
+    "understat.com": (2, 1.0),
+    "api.open-meteo.com": (4, 0.1),
+}
+
+OPENMETEO_URL = "https://api.open-meteo.com/v1/forecast"
+
+# URL Understat non disponibili (404 o retry esauriti nel prefetch): non si ritentano
+_UNAVAILABLE_URLS: set = set()
+# (lat, lon, kickoff_iso) -> meteo_flag, riempita dal prefetch
+_METEO_CACHE: Dict[Tuple[float, float, str], str] = {}
+
 SEED_UNDERSTAT_NAME_MAP = {
     "SSC Napoli": "Napoli",
     "Eintracht Frankfurt": "Eintracht Frankfurt",
@@ -190,49 +223,8 @@ def _cache_path(team: str, date_iso: str) -> Path:
     return CACHE_DIR / f"{safe}_{season}.html"
 
 
-def _extract_json_from_understat(html: str, varname: str) -> Optional[list]:
-    """
-    Estrae un oggetto JSON da una variabile JavaScript all'interno di un tag <script> nel codice HTML.
-    È progettato per essere robusto a cambiamenti minori nel formato della pagina.
-    """
-    # Cerca il tag <script> che contiene la variabile per restringere la ricerca
-    script_tag_pattern = re.compile(rf"<script>.*?\b{re.escape(varname)}\b.*?</script>", re.DOTALL)
-    match = script_tag_pattern.search(html)
-    
-    if not match:
-        return None
-        
-    script_content = match.group(0)
-
-    # Cerca il pattern di assegnazione della variabile.
-    data_pattern = re.search(
-        rf"\b{re.escape(varname)}\s*=\s*(?:JSON\.parse\(\s*'((?:\\.|[^'])*)'\s*\)|(\[.*?\]|\{{.*?\}}))\s*;?",
-        script_content,
-        re.DOTALL
-    )
-
-    if not data_pattern:
-        return None
-
-    escaped_json_str = data_pattern.group(1)
-    literal_json_str = data_pattern.group(2)
-
-    json_to_parse = None
-    if escaped_json_str:
-        try:
-            json_to_parse = bytes(escaped_json_str, "utf-8").decode("unicode_escape")
-        except Exception:
-            return None
-    elif literal_json_str:
-        json_to_parse = literal_json_str
-
-    if json_to_parse:
-        try:
-            return json.loads(json_to_parse)
-        except json.JSONDecodeError:
-            return None
-            
-    return None
+# Parser condiviso con features_populator (vedi understat_cache.py)
+_extract_json_from_understat = extract_json_from_understat
 
 
 def load_team_map() -> Dict[str, str]:
@@ -255,12 +247,9 @@ def save_team_map(mp: Dict[str, str]):
 
 
 def fetch_league_teams(code: str, date_iso: str, delay: float = 0.0) -> List[str]:
-    slug = UNDERSTAT_LEAGUE.get(code)
-    if not slug:
+    url, pth = league_teams_url(code, date_iso)
+    if not url or url in _UNAVAILABLE_URLS:
         return []
-    season = season_from_date(date_iso)
-    url = f"https://understat.com/league/{slug}/{season}"
-    pth = LEAGUE_TEAMS_DIR / f"{code}_{season}.json"
     if pth.exists():
         try:
             return json.loads(pth.read_text(encoding="utf-8"))
@@ -269,22 +258,7 @@ def fetch_league_teams(code: str, date_iso: str, delay: float = 0.0) -> List[str
     try:
         r = requests.get(url, headers=UA, timeout=30)
         r.raise_for_status()
-        html = r.text
-        teams = _extract_json_from_understat(html, "teamsData")
-        names = []
-        if teams and isinstance(teams, list):
-            for t in teams:
-                nm = t.get("title") or t.get("team_name") or t.get("label")
-                if nm and nm not in names:
-                    names.append(nm)
-        if not names:
-            for m in re.finditer(r'"title"\s*:\s*"([^"]+)"', html):
-                nm = m.group(1).strip()
-                if nm and nm not in names:
-                    names.append(nm)
-        pth.write_text(
-            json.dumps(names, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
+        names = _save_league_teams(r.text, pth)
         if delay > 0:
             time.sleep(delay)
         return names
@@ -292,17 +266,32 @@ def fetch_league_teams(code: str, date_iso: str, delay: float = 0.0) -> List[str
         return []
 
 
-def resolve_understat_name(
-    api_name: str,
-    date_iso: str,
-    comp_code: Optional[str],
-    team_map: Dict[str, str],
-    league_cache: Dict[str, List[str]],
-    delay: float,
-) -> Optional[str]:
-    if api_name in team_map:
-        return team_map[api_name]
-    # Trial varianti “ragionevoli”
+def league_teams_url(code: str, date_iso: str) -> Tuple[Optional[str], Path]:
+    slug = UNDERSTAT_LEAGUE.get(code)
+    season = season_from_date(date_iso)
+    url = f"https://understat.com/league/{slug}/{season}" if slug else None
+    return url, LEAGUE_TEAMS_DIR / f"{code}_{season}.json"
+
+
+def _save_league_teams(html: str, pth: Path) -> List[str]:
+    teams = _extract_json_from_understat(html, "teamsData")
+    names = []
+    if teams and isinstance(teams, list):
+        for t in teams:
+            nm = t.get("title") or t.get("team_name") or t.get("label")
+            if nm and nm not in names:
+                names.append(nm)
+    if not names:
+        for m in re.finditer(r'"title"\s*:\s*"([^"]+)"', html):
+            nm = m.group(1).strip()
+            if nm and nm not in names:
+                names.append(nm)
+    pth.write_text(json.dumps(names, ensure_ascii=False, indent=2), encoding="utf-8")
+    return names
+
+
+def _name_variants(api_name: str) -> List[str]:
+    """Varianti “ragionevoli” del nome API da provare come slug Understat."""
     variants = [api_name]
     base = re.sub(r"\s+", " ", api_name).strip()
     if base not in variants:
@@ -313,12 +302,27 @@ def resolve_understat_name(
     short = re.sub(r"\s+(FC|CF|SFP|AC|BC)$", "", base, flags=re.I).strip()
     if short not in variants:
         variants.append(short)
+    return variants
+
 
-    for cand in variants:
+def resolve_understat_name(
+    api_name: str,
+    date_iso: str,
+    comp_code: Optional[str],
+    team_map: Dict[str, str],
+    league_cache: Dict[str, List[str]],
+    delay: float,
+) -> Optional[str]:
+    if api_name in team_map:
+        return team_map[api_name]
+    # Trial varianti “ragionevoli”
+    for cand in _name_variants(api_name):
         url = understat_team_url(cand, date_iso)
         cp = _cache_path(cand, date_iso)
         html = cp.read_text(encoding="utf-8") if cp.exists() else None
         if html is None:
+            if url in _UNAVAILABLE_URLS:
+                continue
             try:
                 rr = requests.get(url, headers=UA, timeout=30)
                 if rr.status_code == 404:
@@ -330,7 +334,7 @@ def resolve_understat_name(
                     time.sleep(delay)
             except Exception:
                 continue
-        if _extract_json_from_understat(html, "matchesData"):
+        if team_matches(cp, html=html):
             team_map[api_name] = cand
             save_team_map(team_map)
             return cand
@@ -348,7 +352,7 @@ def resolve_understat_name(
                 url = understat_team_url(cand, date_iso)
                 cp = _cache_path(cand, date_iso)
                 html = cp.read_text(encoding="utf-8") if cp.exists() else None
-                if html is None:
+                if html is None and url not in _UNAVAILABLE_URLS:
                     try:
                         rr = requests.get(url, headers=UA, timeout=30)
                         rr.raise_for_status()
@@ -358,7 +362,7 @@ def resolve_understat_name(
                             time.sleep(delay)
                     except Exception:
                         html = None
-                if html and _extract_json_from_understat(html, "matchesData"):
+                if html and team_matches(cp, html=html):
                     team_map[api_name] = cand
                     save_team_map(team_map)
                     return cand
@@ -372,8 +376,10 @@ def compute_xg_and_rest(
         return (1.2, 1.2, None)
     url = understat_team_url(team_understat, date_iso)
     cp = _cache_path(team_understat, date_iso)
-    html = cp.read_text(encoding="utf-8") if cp.exists() else None
-    if html is None:
+    html = None
+    if not cp.exists():
+        if url in _UNAVAILABLE_URLS:
+            return (1.2, 1.2, None)
         try:
             r = requests.get(url, headers=UA, timeout=30)
             r.raise_for_status()
@@ -383,51 +389,22 @@ def compute_xg_and_rest(
                 time.sleep(delay)
         except Exception:
             return (1.2, 1.2, None)
-    data = _extract_json_from_understat(html, "matchesData")
-    if not data:
+    # Partite già parsate e ordinate (l'HTML viene riletto solo se cambiato)
+    tm = team_matches(cp, html=html)
+    if not tm:
         return (1.2, 1.2, None)
-    cut = datetime.fromisoformat(date_iso)
-    rows = []
-    for m in data:
-        d = m.get("date")
-        try:
-            dt = datetime.strptime(d, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            continue
-        if dt.date() > cut.date():
-            continue
-        xg = float(m.get("xG", 0.0) or 0.0)
-        xga = float(m.get("xGA", 0.0) or 0.0)
-        rows.append((dt, xg, xga))
-    rows.sort(key=lambda r: r[0], reverse=True)
-    last_dt = rows[0][0] if rows else None
-    rows = rows[: max(1, n)]
-    if not rows:
-        return (1.2, 1.2, last_dt)
-
-    # Calcola una media pesata: le partite più recenti hanno più peso.
-    # Questo crea una feature di "forma" più reattiva per il training.
-    weights = list(range(len(rows), 0, -1))
-    total_weight = sum(weights)
 
-    if total_weight > 0:
-        xg_avg = sum(r[1] * w for r, w in zip(rows, weights)) / total_weight
-        xga_avg = sum(r[2] * w for r, w in zip(rows, weights)) / total_weight
-    else:
-        # Fallback a media semplice
-        xg_avg = sum(r[1] for r in rows) / len(rows)
-        xga_avg = sum(r[2] for r in rows) / len(rows)
-
-    return (round(xg_avg, 3), round(xga_avg, 3), last_dt)
+    # Media pesata: le partite più recenti hanno più peso.
+    # Questo crea una feature di "forma" più reattiva per il training.
+    return recent_xg(tm, date_iso, n, default=1.2)
 
 
-def openmeteo_flag(lat: float, lon: float, kickoff_iso: str) -> str:
+def _openmeteo_params(lat: float, lon: float, kickoff_iso: str) -> Optional[dict]:
     try:
         dt = datetime.fromisoformat(kickoff_iso)
     except Exception:
-        return "0"
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
+        return None
+    return {
         "latitude": lat,
         "longitude": lon,
         "hourly": "precipitation,wind_speed_10m",
@@ -435,16 +412,29 @@ def openmeteo_flag(lat: float, lon: float, kickoff_iso: str) -> str:
         "end": (dt + timedelta(hours=2)).strftime("%Y-%m-%dT%H:00"),
         "timezone": "UTC",
     }
+
+
+def _meteo_flag_from_json(js: dict) -> str:
+    h = js.get("hourly", {})
+    prec = h.get("precipitation", []) or []
+    wind = h.get("wind_speed_10m", []) or []
+    if any((p or 0) >= 2.0 for p in prec) or any((w or 0) >= 9.0 for w in wind):
+        return "1"
+    return "0"
+
+
+def openmeteo_flag(lat: float, lon: float, kickoff_iso: str) -> str:
+    key = (lat, lon, kickoff_iso)
+    if key in _METEO_CACHE:
+        return _METEO_CACHE[key]
+    params = _openmeteo_params(lat, lon, kickoff_iso)
+    if params is None:
+        return "0"
     try:
-        r = requests.get(url, params=params, headers=UA, timeout=30)
+        r = requests.get(OPENMETEO_URL, params=params, headers=UA, timeout=30)
         if r.status_code != 200:
             return "0"
-        h = r.json().get("hourly", {})
-        prec = h.get("precipitation", []) or []
-        wind = h.get("wind_speed_10m", []) or []
-        if any((p or 0) >= 2.0 for p in prec) or any((w or 0) >= 9.0 for w in wind):
-            return "1"
-        return "0"
+        return _meteo_flag_from_json(r.json())
     except Exception:
         return "0"
 
@@ -490,31 +480,370 @@ def parse_fd_date(s: str) -> Optional[str]:
     return None
 
 
+# ---------- PREFETCH CONCORRENTE ----------
+def _make_scheduler(workers: int, delay: float) -> FetchScheduler:
+    limits = {}
+    for host, (conc, interval) in HOST_LIMITS.items():
+        if host != "api.open-meteo.com":
+            interval = max(interval, delay)
+        limits[host] = HostLimit(conc, interval)
+    return FetchScheduler(workers=workers, host_limits=limits, headers=UA)
+
+
+def _html_sink(path: Path):
+    def sink(resp: requests.Response) -> bool:
+        path.write_text(resp.text, encoding="utf-8")
+        return True
+
+    return sink
+
+
+def _mark_unavailable(jobs: List[FetchJob], results) -> None:
+    for j in jobs:
+        res = results.get(j.key)
+        if res is not None and not res.ok:
+            _UNAVAILABLE_URLS.add(j.url)
+
+
+def _comp_code_for(league_name: str) -> Optional[str]:
+    for k, v in COMP_MAP.items():
+        if v == league_name:
+            return k
+    return None
+
+
+def prefetch_fd_csvs(
+    comps: List[str], seasons: List[int], sched: FetchScheduler
+) -> Dict[Tuple[str, int], Optional[pd.DataFrame]]:
+    """CSV stagione football-data.co.uk per ogni (lega, stagione), scaricati in parallelo."""
+    jobs = []
+    for code in comps:
+        if code not in FD_LEAGUE_CODE:
+            continue
+        for season in seasons:
+            url = fd_url_for(code, f"{season}-08-01")
+            jobs.append(
+                FetchJob(
+                    (code, season),
+                    url,
+                    sink=lambda r: pd.read_csv(io.StringIO(r.text)),
+                )
+            )
+    print(f"[FD] Scarico {len(jobs)} CSV stagione...")
+    results = sched.run(jobs, label="FD")
+    out = {}
+    for key, res in results.items():
+        if not res.ok:
+            print(f"[FD] {key[0]} stagione {key[1]}/{key[1]+1} -> {res.error}")
+        out[key] = res.value if res.ok else None
+    return out
+
+
+def _understat_keys(base: pd.DataFrame) -> List[Tuple[str, int, str, Optional[str]]]:
+    """(nome API, stagione, prima data, comp_code) unici, nell'ordine delle righe."""
+    keys = {}
+    for d, ht, at, league in zip(base["date"], base["home"], base["away"], base["league"]):
+        season = season_from_date(d)
+        for name in (ht, at):
+            if (name, season) not in keys:
+                keys[(name, season)] = (name, season, d, _comp_code_for(league))
+    return list(keys.values())
+
+
+def _registry_understat_names(keys, team_map: Dict[str, str]) -> int:
+    """
+    Nomi Understat già noti al registro squadre (alias football-data.co.uk → team_id →
+    alias Understat): evitano le richieste di risoluzione. Il DB è facoltativo qui.
+    """
+    try:
+        from database import SessionLocal
+        from team_registry import SRC_FDCO, SRC_UNDERSTAT, TeamRegistry
+
+        db = SessionLocal()
+        try:
+            reg = TeamRegistry(db)
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"[WARN] Registro squadre non disponibile: {e}")
+        return 0
+    added = 0
+    for name, _season, _d, _comp in keys:
+        if name in team_map:
+            continue
+        us = reg.name_for(reg.lookup(name, SRC_FDCO), SRC_UNDERSTAT)
+        if us:
+            team_map[name] = us
+            added += 1
+    return added
+
+
+def _understat_page_job(team: str, date_iso: str) -> Optional[FetchJob]:
+    """Job per la pagina squadra-stagione; None se già in cache o non disponibile."""
+    cp = _cache_path(team, date_iso)
+    url = understat_team_url(team, date_iso)
+    if cp.exists() or url in _UNAVAILABLE_URLS:
+        return None
+    return FetchJob(("team", team, season_from_date(date_iso)), url, sink=_html_sink(cp))
+
+
+def _resolution_jobs(keys, team_map: Dict[str, str]) -> Tuple[List[FetchJob], List[FetchJob]]:
+    """Pagine delle varianti dei nomi non ancora mappati + elenchi squadre di lega (fuzzy)."""
+    page_jobs, league_jobs = [], []
+    seen_comps = set()
+    for name, _season, d, comp in keys:
+        if name in team_map:
+            continue
+        for cand in _name_variants(name):
+            job = _understat_page_job(cand, d)
+            if job:
+                page_jobs.append(job)
+        # resolve_understat_name tiene un solo elenco per lega (il primo richiesto)
+        if comp and comp not in seen_comps:
+            seen_comps.add(comp)
+            url, pth = league_teams_url(comp, d)
+            if url and not pth.exists():
+                league_jobs.append(
+                    FetchJob(
+                        ("league", comp, season_from_date(d)),
+                        url,
+                        sink=lambda r, pth=pth: _save_league_teams(r.text, pth),
+                    )
+                )
+    return page_jobs, league_jobs
+
+
+def _team_page_jobs(keys, resolved) -> List[FetchJob]:
+    jobs = []
+    for name, season, d, _comp in keys:
+        us = resolved.get((name, season))
+        if us:
+            job = _understat_page_job(us, d)
+            if job:
+                jobs.append(job)
+    return jobs
+
+
+def _meteo_jobs(base: pd.DataFrame, resolved) -> List[FetchJob]:
+    jobs = []
+    for d, tl, ht in zip(base["date"], base["time_local"], base["home"]):
+        us = resolved.get((ht, season_from_date(d)))
+        latlon = STADIUMS.get(us or ht)
+        if not latlon:
+            continue
+        key = (latlon[0], latlon[1], f"{d}T{(tl or '15:00')}")
+        if key in _METEO_CACHE:
+            continue
+        params = _openmeteo_params(*key)
+        if params is None:
+            _METEO_CACHE[key] = "0"
+            continue
+        jobs.append(
+            FetchJob(
+                key,
+                OPENMETEO_URL,
+                params=params,
+                sink=lambda r: _meteo_flag_from_json(r.json()),
+            )
+        )
+    return jobs
+
+
+def _print_plan(n_fd: int, keys, team_map: Dict[str, str], base: pd.DataFrame, workers: int):
+    known = {(n, s): team_map.get(n) for n, s, _d, _c in keys}
+    page_jobs, league_jobs = _resolution_jobs(keys, team_map)
+    team_jobs = _team_page_jobs(keys, known)
+    meteo_jobs = {j.key for j in _meteo_jobs(base, known)}
+    n_unknown = len({n for n, *_ in keys if n not in team_map})
+    n_pages = len({j.key for j in team_jobs})
+    n_res = len({j.key for j in page_jobs})
+    print(f"[PLAN] www.football-data.co.uk: {n_fd} CSV stagione (scaricati: servono al piano)")
+    print(
+        f"[PLAN] understat.com: {n_pages} pagine squadra (nomi già mappati) + "
+        f"{n_res} pagine per risolvere {n_unknown} nomi + {len(league_jobs)} elenchi lega"
+    )
+    print(
+        f"[PLAN] api.open-meteo.com: {len(meteo_jobs)} richieste meteo "
+        f"(stima: esclusi gli stadi dei nomi ancora da risolvere)"
+    )
+    total = n_pages + n_res + len(league_jobs) + len(meteo_jobs)
+    print(
+        f"[PLAN] Totale: {total} richieste da pianificare (+ pagine delle stagioni "
+        f"successive dei nomi risolti), workers={workers}"
+    )
+
+
 # ---------- COSTRUZIONE STORICO ----------
+OUT_COLS = [
+    "match_id",
+    "date",
+    "time_local",
+    "league",
+    "home",
+    "away",
+    "ft_home_goals",
+    "ft_away_goals",
+    "odds_1",
+    "odds_x",
+    "odds_2",
+    "xg_for_home",
+    "xg_against_home",
+    "xg_for_away",
+    "xg_against_away",
+    "rest_days_home",
+    "rest_days_away",
+    "derby_flag",
+    "europe_flag_home",
+    "europe_flag_away",
+    "meteo_flag",
+    "style_ppda_home",
+    "style_ppda_away",
+    "travel_km_away",
+    "target_ou25",
+    "target_btts",
+    "target_1x2",
+]
+
+
+def _rest_days(last_dt: Optional[datetime], game_date: str) -> str:
+    if not last_dt:
+        return ""
+    try:
+        g = datetime.fromisoformat(game_date + " 00:00:00")
+    except Exception:
+        return ""
+    return str(max(0, (g - last_dt).days))
+
+
+def _unit_features(
+    g: pd.DataFrame, resolved: Dict[Tuple[str, int], Optional[str]], n_recent: int, delay: float
+) -> pd.DataFrame:
+    """Feature xG/rest_days/meteo delle righe di un'unità (solo cache calda) e colonne finali."""
+    features_rows = []
+
+    for i, r in g.iterrows():
+        d = r["date"]
+        ht = r["home"]
+        at = r["away"]
+        season = season_from_date(d)
+        home_us = resolved.get((ht, season))
+        away_us = resolved.get((at, season))
+
+        hxg_f, hxg_a, h_last_dt = compute_xg_and_rest(home_us, d, n_recent, delay)
+        axg_f, axg_a, a_last_dt = compute_xg_and_rest(away_us, d, n_recent, delay)
+
+        rest_h = _rest_days(h_last_dt, d)
+        rest_a = _rest_days(a_last_dt, d)
+
+        eflag = "0"  # competizione domestica -> 0
+        meteo = "0"
+        latlon = STADIUMS.get(home_us or ht)
+        if latlon:
+            try:
+                meteo = openmeteo_flag(
+                    latlon[0], latlon[1], f"{d}T{(r.get('time_local') or '15:00')}"
+                )
+            except Exception:
+                meteo = "0"
+
+        features_rows.append(
+            {
+                "match_id": r["match_id"],
+                "xg_for_home": hxg_f,
+                "xg_against_home": hxg_a,
+                "xg_for_away": axg_f,
+                "xg_against_away": axg_a,
+                "rest_days_home": rest_h,
+                "rest_days_away": rest_a,
+                "derby_flag": "0",
+                "europe_flag_home": eflag,
+                "europe_flag_away": eflag,
+                "meteo_flag": meteo,
+                "style_ppda_home": "",
+                "style_ppda_away": "",
+                "travel_km_away": "",
+            }
+        )
+
+    fea = pd.DataFrame(features_rows)
+    out = g.merge(fea, on="match_id", how="left")
+
+    # ordine colonne finale
+    for c in OUT_COLS:
+        if c not in out.columns:
+            out[c] = ""
+    return out[OUT_COLS]
+
+
+def _unit_context(g: pd.DataFrame, resolved: Dict[Tuple[str, int], Optional[str]]):
+    """Nomi Understat, meteo in cache e URL non disponibili che servono alle righe di un'unità."""
+    names = {}
+    meteo = {}
+    for d, tl, ht, at in zip(g["date"], g["time_local"], g["home"], g["away"]):
+        season = season_from_date(d)
+        for team in (ht, at):
+            names[(team, season)] = resolved.get((team, season))
+        latlon = STADIUMS.get(names[(ht, season)] or ht)
+        if latlon:
+            key = (latlon[0], latlon[1], f"{d}T{(tl or '15:00')}")
+            if key in _METEO_CACHE:
+                meteo[key] = _METEO_CACHE[key]
+    return names, meteo, set(_UNAVAILABLE_URLS)
+
+
+def _unit_features_worker(g, resolved, meteo, unavailable, n_recent, delay) -> pd.DataFrame:
+    """Processo del pool (--jobs): riceve esplicitamente le cache del processo principale."""
+    _METEO_CACHE.update(meteo)
+    _UNAVAILABLE_URLS.update(unavailable)
+    return _unit_features(g, resolved, n_recent, delay)
+
+
+@instrument("history_builder")
 def build_historical(
-    date_from: str, date_to: str, comps: List[str], n_recent: int, delay: float
+    date_from: str,
+    date_to: str,
+    comps: List[str],
+    n_recent: int,
+    delay: float,
+    workers: int = 4,
+    dry_run: bool = False,
+    out_csv: Optional[Path] = None,
+    restart: bool = False,
+    jobs: int = 1,
 ):
+    """
+    Scrive lo storico in OUT_CSV e OUT_CSV_1X2 (o solo in out_csv). Le feature si
+    calcolano per unità lega-stagione salvate nello staging (backfill_checkpoint):
+    rilanciato con gli stessi parametri riparte dalle unità non ancora completate.
+    jobs > 1: unità in un ProcessPoolExecutor, output identico al seriale.
+    """
+    outputs = [Path(out_csv)] if out_csv else [OUT_CSV, OUT_CSV_1X2]
+    ckpt = None
+    if not dry_run:
+        params = {"from": date_from, "to": date_to, "comps": comps, "n_recent": n_recent}
+        ckpt = BackfillCheckpoint(outputs[0], params, restart=restart)
+
     # step 1: scarica csv stagione per ogni lega (basta usare date_to per determinare cartella)
     all_rows = []
 
-    league_team_cache: Dict[str, List[str]] = {}
     team_map = load_team_map()
+    sched = _make_scheduler(workers, delay)
+
+    # prendi tutte le stagioni comprese tra date_from e date_to
+    start_season = season_from_date(date_from)
+    end_season = season_from_date(date_to)
+    seasons = list(range(start_season, end_season + 1))
+    if not seasons:
+        seasons = [season_from_date(date_to)]
+    fd_frames = prefetch_fd_csvs(comps, seasons, sched)
 
     for code in comps:
         if code not in FD_LEAGUE_CODE:
             print(f"[SKIP] {code}: non supportato da football-data.co.uk")
             continue
-        # prendi tutte le stagioni comprese tra date_from e date_to
-        start_season = season_from_date(date_from)
-        end_season = season_from_date(date_to)
-        seasons = list(range(start_season, end_season + 1))
-        if not seasons:
-            seasons = [season_from_date(date_to)]
 
         for season in seasons:
-            print(f"[FD] Scarico {code} stagione {season}/{season+1}...")
-            season_ref = f"{season}-08-01"
-            fd = fetch_fd_csv(code, season_ref, delay=delay)
+            fd = fd_frames.get((code, season))
             if fd is None or fd.empty:
                 print(f"[FD] {code} stagione {season}/{season+1} non disponibile.")
                 continue
@@ -591,6 +920,7 @@ def build_historical(
                     "odds_1": pd.to_numeric(odds1, errors="coerce"),
                     "odds_x": pd.to_numeric(odsx := oddsx, errors="coerce"),
                     "odds_2": pd.to_numeric(odds2, errors="coerce"),
+                    "_unit": f"{code}-{season}",
                 }
                 all_rows.append(rec)
 
@@ -611,119 +941,71 @@ def build_historical(
     base.loc[base["ft_home_goals"] == base["ft_away_goals"], "target_1x2"] = 1
     base.loc[base["ft_home_goals"] < base["ft_away_goals"], "target_1x2"] = 2
 
-    # feature xG/rest_days/meteo
-    features_rows = []
+    units = list(dict.fromkeys(base["_unit"]))
+    if ckpt is not None:
+        # unità già nello staging: niente download né calcolo
+        base = base[~base["_unit"].isin(ckpt.done)]
+
+    keys = _understat_keys(base)
+    from_registry = _registry_understat_names(keys, team_map)
+    if from_registry:
+        print(f"[INFO] {from_registry} nomi Understat dal registro squadre.")
+    if dry_run:
+        _print_plan(len(fd_frames), keys, team_map, base, workers)
+        return
+
+    # step 2: prefetch Understat (risoluzione nomi, pagine squadra) e meteo.
+    # Tutto il traffico di rete avviene qui; il calcolo feature usa solo la cache.
+    page_jobs, league_jobs = _resolution_jobs(keys, team_map)
+    res_jobs = page_jobs + league_jobs
+    _mark_unavailable(res_jobs, sched.run(res_jobs, label="Understat nomi"))
+
+    # deduci comp_code per fuzzy Understat (se presente) e risolvi i nomi
     league_cache: Dict[str, List[str]] = {}
-
-    comps_set = set([c.strip().upper() for c in comps])
-
-    for i, r in base.iterrows():
-        d = r["date"]
-        ht = r["home"]
-        at = r["away"]
-        league = r["league"]
-        # deduci comp_code per fuzzy Understat (se presente)
-        comp_code = None
-        for k, v in COMP_MAP.items():
-            if v == league:
-                comp_code = k
-                break
-
-        # risolvi nomi understat
-        home_us = resolve_understat_name(
-            ht, d, comp_code, team_map, league_cache, delay
-        )
-        away_us = resolve_understat_name(
-            at, d, comp_code, team_map, league_cache, delay
+    resolved: Dict[Tuple[str, int], Optional[str]] = {}
+    for name, season, d, comp_code in keys:
+        resolved[(name, season)] = resolve_understat_name(
+            name, d, comp_code, team_map, league_cache, delay
         )
 
-        hxg_f, hxg_a, h_last_dt = compute_xg_and_rest(home_us, d, n_recent, delay)
-        axg_f, axg_a, a_last_dt = compute_xg_and_rest(away_us, d, n_recent, delay)
+    team_jobs = _team_page_jobs(keys, resolved)
+    _mark_unavailable(team_jobs, sched.run(team_jobs, label="Understat squadre"))
 
-        def _rest_days(last_dt: Optional[datetime], game_date: str) -> str:
-            if not last_dt:
-                return ""
-            try:
-                g = datetime.fromisoformat(game_date + " 00:00:00")
-            except Exception:
-                return ""
-            return str(max(0, (g - last_dt).days))
+    meteo_jobs = _meteo_jobs(base, resolved)
+    meteo_res = sched.run(meteo_jobs, label="Meteo")
+    for j in meteo_jobs:
+        res = meteo_res.get(j.key)
+        _METEO_CACHE[j.key] = res.value if res is not None and res.ok else "0"
 
-        rest_h = _rest_days(h_last_dt, d)
-        rest_a = _rest_days(a_last_dt, d)
+    # step 3: feature xG/rest_days/meteo (solo cache calda), per unità lega-stagione
+    pending = list(base.groupby("_unit", sort=False))
 
-        eflag = "0"  # competizione domestica -> 0
-        meteo = "0"
-        latlon = STADIUMS.get(home_us or ht)
-        if latlon:
-            try:
-                meteo = openmeteo_flag(
-                    latlon[0], latlon[1], f"{d}T{(r.get('time_local') or '15:00')}"
-                )
-            except Exception:
-                meteo = "0"
+    def _done(unit: str, part: pd.DataFrame) -> None:
+        ckpt.save_part(unit, part)
+        print(f"[INFO] {unit}: {len(part)} partite ({len(ckpt.done)}/{len(units)} unità)")
 
-        features_rows.append(
-            {
-                "match_id": r["match_id"],
-                "xg_for_home": hxg_f,
-                "xg_against_home": hxg_a,
-                "xg_for_away": axg_f,
-                "xg_against_away": axg_a,
-                "rest_days_home": rest_h,
-                "rest_days_away": rest_a,
-                "derby_flag": "0",
-                "europe_flag_home": eflag,
-                "europe_flag_away": eflag,
-                "meteo_flag": meteo,
-                "style_ppda_home": "",
-                "style_ppda_away": "",
-                "travel_km_away": "",
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as ex:
+            futures = {
+                ex.submit(_unit_features_worker, g, *_unit_context(g, resolved), n_recent, delay): unit
+                for unit, g in pending
             }
-        )
-
-    fea = pd.DataFrame(features_rows)
-    out = base.merge(fea, on="match_id", how="left")
-
-    # ordine colonne finale
-    cols = [
-        "match_id",
-        "date",
-        "time_local",
-        "league",
-        "home",
-        "away",
-        "ft_home_goals",
-        "ft_away_goals",
-        "odds_1",
-        "odds_x",
-        "odds_2",
-        "xg_for_home",
-        "xg_against_home",
-        "xg_for_away",
-        "xg_against_away",
-        "rest_days_home",
-        "rest_days_away",
-        "derby_flag",
-        "europe_flag_home",
-        "europe_flag_away",
-        "meteo_flag",
-        "style_ppda_home",
-        "style_ppda_away",
-        "travel_km_away",
-        "target_ou25",
-        "target_btts",
-        "target_1x2",
-    ]
-    for c in cols:
-        if c not in out.columns:
-            out[c] = ""
-    out = out[cols]
+            try:
+                for fut in as_completed(futures):
+                    _done(futures[fut], fut.result())
+            except BaseException:
+                ex.shutdown(wait=False, cancel_futures=True)
+                raise
+    else:
+        for unit, g in pending:
+            _done(unit, _unit_features(g, resolved, n_recent, delay))
 
-    out.to_csv(OUT_CSV, index=False)
-    out.to_csv(OUT_CSV_1X2, index=False)
-    print(f"[OK] Storico scritto: {OUT_CSV} ({len(out)} righe)")
-    print(f"[OK] Storico 1X2 scritto: {OUT_CSV_1X2} ({len(out)} righe)")
+    # parti nell'ordine delle unità: stesso file col percorso seriale e con --jobs
+    out = ckpt.combined(units).drop_duplicates(subset=["match_id"])
+    ckpt.publish(out, outputs)
+    count("rows", len(out))
+    for path in outputs:
+        print(f"[OK] Storico scritto: {path} ({len(out)} righe)")
 
 
 def main():
@@ -735,10 +1017,36 @@ def main():
     ap.add_argument("--comps", required=True, help="es. 'SA,PL,PD,BL1'")
     ap.add_argument("--n_recent", type=int, default=5, help="xG medie ultime N")
     ap.add_argument("--delay", type=float, default=0.0, help="ritardo scraping (s)")
+    ap.add_argument("--workers", type=int, default=4, help="download concorrenti")
+    ap.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="scarica solo i CSV stagione di football-data.co.uk (servono al piano) e stampa "
+        "le richieste Understat/meteo pianificate, senza eseguirle né scrivere output",
+    )
+    ap.add_argument("--out", default=None, help="CSV di output (default: storico OU e 1X2 in data/)")
+    ap.add_argument("--jobs", type=int, default=1, help="processi per le feature (un'unità lega-stagione ciascuno)")
+    ap.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignora il checkpoint di un backfill in pausa e riparte da zero",
+    )
     args = ap.parse_args()
 
     comps = [c.strip().upper() for c in args.comps.split(",") if c.strip()]
-    build_historical(args.date_from, args.date_to, comps, args.n_recent, args.delay)
+    with pausable("Costruzione storico"):
+        build_historical(
+            args.date_from,
+            args.date_to,
+            comps,
+            args.n_recent,
+            args.delay,
+            workers=args.workers,
+            dry_run=args.dry_run,
+            out_csv=args.out,
+            restart=args.restart,
+            jobs=args.jobs,
+        )
 
 
 if __name__ == "__main__":
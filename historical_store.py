@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+historical_store.py
+-------------------
+Formato colonnare tipizzato per gli storici (data/historical_*.csv e *_enhanced.csv).
+
+Accanto a ogni CSV si salva un file Arrow IPC (Feather v2, non compresso)
+con lo stesso nome e estensione .arrow. Lo schema è fisso:
+- stringhe: match_id, time_local, league, league_code, home, away
+- date: date
+- interi (nullable): gol finali e target
+- float64: FEATURES_BASE e tutte le altre colonne numeriche (quote, xG, feature avanzate)
+
+Il caricamento fa memory-map del file .arrow, legge solo le colonne richieste
+e filtra le righe per lega/intervallo di date prima di passare a pandas:
+niente parsing del CSV e niente pd.to_numeric colonna per colonna.
+
+Il CSV resta per la lettura "umana": save_dataset scrive entrambi. Se il CSV è
+più recente del .arrow (modificato a mano o da uno script che scrive solo CSV)
+il loader usa il CSV con lo stesso schema. Senza pyarrow si usa sempre il CSV.
+Entrambi i file si scrivono su un .tmp rinominato alla fine (sostituzione atomica).
+
+Uso:
+    from historical_store import load_dataset, save_dataset
+    df = load_dataset(HIST_OU_PATH, columns=[...], leagues=["Serie A"], date_from="2024-07-01")
+    save_dataset(df, HIST_OU_PATH)          # .arrow + .csv
+
+CLI:
+    python historical_store.py --convert      # CSV → .arrow per tutti gli storici
+    python historical_store.py --export-csv   # .arrow → CSV
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+except ImportError:  # formato colonnare opzionale: senza pyarrow si resta sul CSV
+    pa = None
+
+ROOT = Path(__file__).resolve().parent
+DATA_DIR = ROOT / "data"
+DATASETS = [
+    DATA_DIR / "historical_dataset.csv",
+    DATA_DIR / "historical_1x2.csv",
+    DATA_DIR / "historical_dataset_enhanced.csv",
+    DATA_DIR / "historical_1x2_enhanced.csv",
+]
+
+FEATURES_BASE = [
+    "xg_for_home", "xg_against_home", "xg_for_away", "xg_against_away",
+    "derby_flag", "europe_flag_home", "europe_flag_away", "meteo_flag",
+]
+STRING_COLS = ["match_id", "time_local", "league", "league_code", "home", "away"]
+DATE_COLS = ["date"]
+INT_COLS = ["ft_home_goals", "ft_away_goals", "target_ou25", "target_btts", "target_1x2"]
+
+
+def arrow_path(csv_path) -> Path:
+    return Path(csv_path).with_suffix(".arrow")
+
+
+def _clean_str(s: pd.Series) -> pd.Series:
+    """Stringhe con NaN per i valori mancanti (stringa vuota = mancante, come nel CSV)."""
+    s = s.where(s.isna(), s.astype(str))
+    return s.mask(s == "")
+
+
+def _kind(col: str, s: pd.Series) -> str:
+    if col in STRING_COLS:
+        return "string"
+    if col in DATE_COLS:
+        return "date"
+    if col in INT_COLS:
+        return "int"
+    if col in FEATURES_BASE:
+        return "float"
+    if s.dtype.kind in "biuf":
+        return "float"
+    # colonna sconosciuta: numerica se lo sono tutti i valori non vuoti
+    num = pd.to_numeric(s, errors="coerce")
+    nonempty = s.notna() & (s.astype(str).str.strip() != "")
+    return "float" if num[nonempty].notna().all() else "string"
+
+
+def coerce_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Applica lo schema fisso. Gli interi restano int64 se completi e diventano
+    float64 se hanno buchi, come li inferisce pd.read_csv (i consumatori fanno
+    astype(str) sui target).
+    """
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        kind = _kind(col, s)
+        if kind == "string":
+            out[col] = _clean_str(s)
+        elif kind == "date":
+            out[col] = pd.to_datetime(s, errors="coerce").astype("datetime64[ns]")
+        else:
+            s = pd.to_numeric(s, errors="coerce").astype("float64")
+            if kind == "int" and s.notna().all() and (s == np.round(s)).all():
+                s = s.astype("int64")
+            out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def _to_arrow(df: pd.DataFrame) -> "pa.Table":
+    fields, arrays = [], []
+    for col in df.columns:
+        s = df[col]
+        kind = _kind(col, s)
+        if kind == "string":
+            v = _clean_str(s)
+            arr = pa.array(v.astype(object).where(v.notna(), None).tolist(), type=pa.string())
+        elif kind == "date":
+            arr = pa.array(pd.to_datetime(s, errors="coerce").dt.date.where(s.notna(), None).tolist(),
+                           type=pa.date32())
+        elif kind == "int":
+            v = pd.to_numeric(s, errors="coerce")
+            arr = pa.array(v.round().astype("Int64"), type=pa.int64())
+        else:
+            arr = pa.array(pd.to_numeric(s, errors="coerce").to_numpy(dtype="float64"), type=pa.float64())
+        fields.append(pa.field(col, arr.type))
+        arrays.append(arr)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def save_dataset(df: pd.DataFrame, csv_path, csv: bool = True) -> None:
+    """Salva lo storico in formato colonnare (.arrow) e, se csv=True, anche come CSV."""
+    csv_path = Path(csv_path)
+    if csv:
+        # tmp + replace: un'interruzione non lascia mai un CSV scritto a metà
+        tmp = csv_path.with_name(csv_path.name + ".tmp")
+        df.to_csv(tmp, index=False)
+        tmp.replace(csv_path)
+    if pa is None:
+        return
+    path = arrow_path(csv_path)
+    tmp = path.with_name(path.name + ".tmp")
+    # non compresso: necessario per il memory-map senza copie
+    feather.write_feather(_to_arrow(df), tmp, compression="uncompressed")
+    tmp.replace(path)
+
+
+def _use_arrow(csv_path: Path) -> bool:
+    if pa is None:
+        return False
+    ap = arrow_path(csv_path)
+    if not ap.exists():
+        return False
+    return not csv_path.exists() or ap.stat().st_mtime >= csv_path.stat().st_mtime
+
+
+def _filter_frame(df: pd.DataFrame, leagues, date_from, date_to) -> pd.DataFrame:
+    mask = pd.Series(True, index=df.index)
+    if leagues:
+        lg = pd.Series(False, index=df.index)
+        for c in ("league", "league_code"):
+            if c in df.columns:
+                lg |= df[c].isin(leagues)
+        mask &= lg
+    if (date_from or date_to) and "date" in df.columns:
+        d = pd.to_datetime(df["date"], errors="coerce")
+        if date_from:
+            mask &= d >= pd.Timestamp(date_from)
+        if date_to:
+            mask &= d <= pd.Timestamp(date_to)
+    return df.loc[mask].reset_index(drop=True)
+
+
+def _load_arrow(path: Path, columns, leagues, date_from, date_to) -> pd.DataFrame:
+    with pa.memory_map(str(path), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+        names = table.column_names
+        if leagues or date_from or date_to:
+            mask = None
+            if leagues:
+                values = pa.array(list(leagues), type=pa.string())
+                for c in ("league", "league_code"):
+                    if c in names:
+                        m = pc.is_in(table[c], value_set=values)
+                        mask = m if mask is None else pc.or_(mask, m)
+            if "date" in names:
+                if date_from:
+                    m = pc.greater_equal(table["date"], pa.scalar(pd.Timestamp(date_from).date(), pa.date32()))
+                    mask = m if mask is None else pc.and_(mask, m)
+                if date_to:
+                    m = pc.less_equal(table["date"], pa.scalar(pd.Timestamp(date_to).date(), pa.date32()))
+                    mask = m if mask is None else pc.and_(mask, m)
+            if mask is not None:
+                table = table.filter(pc.fill_null(mask, False))
+        if columns is not None:
+            table = table.select([c for c in columns if c in names])
+        df = table.to_pandas(date_as_object=False)
+    for col in df.columns:
+        if col in DATE_COLS:
+            df[col] = df[col].astype("datetime64[ns]")
+    return df
+
+
+def load_dataset(
+    csv_path,
+    columns: Optional[Iterable[str]] = None,
+    leagues: Optional[Iterable[str]] = None,
+    date_from=None,
+    date_to=None,
+) -> pd.DataFrame:
+    """
+    Carica uno storico tipizzato. columns=None → tutte le colonne; le colonne
+    richieste ma assenti vengono ignorate. leagues filtra su league o league_code,
+    date_from/date_to sono inclusivi.
+    """
+    csv_path = Path(csv_path)
+    columns = list(columns) if columns is not None else None
+    leagues = list(leagues) if leagues else None
+    if _use_arrow(csv_path):
+        return _load_arrow(arrow_path(csv_path), columns, leagues, date_from, date_to)
+
+    if not csv_path.exists():
+        raise FileNotFoundError(f"File non trovato: {csv_path}")
+    usecols = None
+    if columns is not None:
+        wanted = set(columns) | ({"league", "league_code"} if leagues else set()) | \
+                 ({"date"} if (date_from or date_to) else set())
+        usecols = lambda c: c in wanted  # noqa: E731
+    df = coerce_schema(pd.read_csv(csv_path, usecols=usecols))
+    df = _filter_frame(df, leagues, date_from, date_to)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Storici in formato colonnare (.arrow)")
+    ap.add_argument("--convert", action="store_true", help="Converte gli storici CSV in .arrow")
+    ap.add_argument("--export-csv", action="store_true", help="Riesporta i CSV dai file .arrow")
+    args = ap.parse_args()
+
+    if pa is None:
+        print("[ERR] pyarrow non installato: pip install pyarrow")
+        return
+
+    for csv_path in DATASETS:
+        if args.export_csv:
+            ap_path = arrow_path(csv_path)
+            if not ap_path.exists():
+                print(f"[SKIP] {ap_path.name} non trovato")
+                continue
+            _load_arrow(ap_path, None, None, None, None).to_csv(csv_path, index=False)
+            print(f"[OK] {csv_path.name} riesportato")
+            continue
+
+        if not csv_path.exists():
+            print(f"[SKIP] {csv_path.name} non trovato")
+            continue
+        df = coerce_schema(pd.read_csv(csv_path))
+        save_dataset(df, csv_path, csv=False)
+
+        t0 = time.perf_counter()
+        pd.read_csv(csv_path)
+        t_csv = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        load_dataset(csv_path)
+        t_arrow = time.perf_counter() - t0
+        print(f"[OK] {arrow_path(csv_path).name}: {len(df)} righe, {len(df.columns)} colonne "
+              f"(read_csv {t_csv * 1000:.1f} ms, arrow {t_arrow * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
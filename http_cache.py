@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+http_cache.py
+-------------
+Livello HTTP condiviso per tutti i client API (football-data.org, TheOddsAPI).
+
+- una requests.Session per thread (connessioni riusate)
+- cache persistente delle risposte in cache/http/<endpoint>/, chiave = URL +
+  parametri (le chiavi API NON entrano nella chiave e non vengono salvate)
+- TTL per endpoint; a cache scaduta si rivalida con If-None-Match /
+  If-Modified-Since quando il server ha fornito ETag / Last-Modified
+- retry con backoff su timeout, errori di rete, 429 e 5xx (Retry-After,
+  X-RequestCounter-Reset di football-data, "Wait N seconds"); esauriti i retry per
+  errori di rete, un ultimo tentativo con curl (stato e header veri della risposta:
+  in cache va solo un 200, un 304 rivalida la voce esistente)
+- contatore quota mensile (TheOddsAPI) in un solo punto: si consuma solo
+  quando parte davvero una richiesta di rete, mai su una risposta in cache
+
+Modalità (env BET_HTTP_MODE o set_mode()):
+    live    default: cache + rivalidazione
+    record  sempre rete, salva ogni risposta 200 (per registrare le fixture dei test)
+    replay  solo cache, nessuna rete: risposta mancante → ReplayMiss
+    off     nessuna cache (come prima)
+
+Uso:
+    from http_cache import get_client
+    r = get_client().get(url, params=params, headers=headers, endpoint="fd")
+    r.status_code, r.json(), r.from_cache
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode, urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from metrics import count
+
+ROOT = Path(__file__).resolve().parent
+CACHE_DIR = Path(os.getenv("BET_HTTP_CACHE_DIR") or ROOT / "cache" / "http")
+API_USAGE_FILE = ROOT / "data" / "api_usage.json"
+THE_ODDS_API_LIMIT = 500
+
+MODES = ("live", "record", "replay", "off")
+
+# TTL (secondi) per endpoint: entro il TTL la risposta in cache si usa senza rete
+ENDPOINT_TTL = {
+    "fd": 15 * 60,              # football-data: calendario partite
+    "fd_results": 5 * 60,       # football-data: risultati del giorno
+    "fd_team_history": 6 * 3600,
+    "toa_odds": 30 * 60,        # TheOddsAPI: quote (consuma quota)
+    "default": 10 * 60,
+}
+
+# Parametri/header che non devono finire né nella chiave né su disco
+SECRET_PARAMS = {"apikey", "api_key", "token", "key"}
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_WAIT = 90.0
+
+# Header della risposta conservati nella cache
+_KEEP_HEADERS = (
+    "content-type", "etag", "last-modified", "retry-after",
+    "x-requests-remaining", "x-requests-used", "x-requestcounter-reset",
+)
+
+
+class ReplayMiss(RuntimeError):
+    """Modalità replay: risposta non presente in cache."""
+
+
+class QuotaExceeded(RuntimeError):
+    """Quota mensile dell'API esaurita e nessuna risposta in cache."""
+
+
+# ====== QUOTA ======
+class MonthlyQuota:
+    """Contatore mensile delle richieste in data/api_usage.json (si azzera a inizio mese)."""
+
+    def __init__(self, name: str, limit: int, label: str = "", path: Path = API_USAGE_FILE):
+        self.name = name
+        self.limit = limit
+        self.label = label or name
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save(self, usage: dict):
+        self.path.parent.mkdir(exist_ok=True)
+        self.path.write_text(json.dumps(usage, indent=2))
+
+    def _current(self, usage: dict) -> dict:
+        today = datetime.now()
+        entry = usage.get(self.name) or {"count": 0, "last_reset": today.strftime("%Y-%m-01")}
+        try:
+            last = datetime.strptime(entry.get("last_reset", "1970-01-01"), "%Y-%m-%d")
+        except ValueError:
+            last = datetime(1970, 1, 1)
+        if (today.year, today.month) > (last.year, last.month):
+            print(f"[API-USAGE] Nuovo mese, resetto il contatore di utilizzo di {self.label}.")
+            entry = {"count": 0, "last_reset": today.strftime("%Y-%m-01")}
+        return entry
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._current(self._load()).get("count", 0))
+
+    def consume(self) -> bool:
+        """Se il limite non è raggiunto incrementa il contatore e ritorna True."""
+        with self._lock:
+            usage = self._load()
+            entry = self._current(usage)
+            count = int(entry.get("count", 0))
+            if count >= self.limit:
+                print(f"[ERRORE] Limite API per {self.label} raggiunto ({count}/{self.limit}).")
+                return False
+            entry["count"] = count + 1
+            usage[self.name] = entry
+            self._save(usage)
+        print(f"[API-USAGE] {self.label}: {entry['count']}/{self.limit} utilizzi questo mese.")
+        return True
+
+    def record_remaining(self, headers) -> None:
+        """Salva il residuo dichiarato dal server (x-requests-remaining), se presente."""
+        remaining = headers.get("x-requests-remaining") if headers else None
+        if remaining is None:
+            return
+        with self._lock:
+            usage = self._load()
+            entry = self._current(usage)
+            entry["remaining_reported"] = remaining
+            usage[self.name] = entry
+            self._save(usage)
+
+
+THE_ODDS_API_QUOTA = MonthlyQuota("the_odds_api", THE_ODDS_API_LIMIT, "The-Odds-API")
+
+
+# ====== RISPOSTA ======
+class CachedResponse:
+    """Risposta con la stessa interfaccia minima di requests.Response usata dai fetcher."""
+
+    def __init__(self, url: str, status_code: int, content: bytes, headers: Optional[Dict[str, str]] = None,
+                 from_cache: bool = False, stale: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content or b""
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.from_cache = from_cache
+        self.stale = stale
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+# ====== CLIENT ======
+def _public_params(params: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    return {k: str(v) for k, v in sorted((params or {}).items()) if k.lower() not in SECRET_PARAMS}
+
+
+def cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    raw = url + "?" + urlencode(_public_params(params))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _wait_hint(r, attempt: int) -> float:
+    """Attesa prima del retry: header del server, poi messaggio, poi backoff esponenziale."""
+    for h in ("Retry-After", "X-RequestCounter-Reset"):
+        try:
+            v = r.headers.get(h) if r is not None else None
+            if v is not None:
+                return min(float(v) + 1, MAX_WAIT)
+        except (TypeError, ValueError):
+            pass
+    if r is not None and r.status_code == 429:
+        m = re.search(r"Wait\s+(\d+)\s+seconds", r.text or "", re.IGNORECASE)
+        return min(float(m.group(1)) if m else 60.0, MAX_WAIT) + random.uniform(0.1, 0.6)
+    return float(2 ** attempt)
+
+
+class HttpClient:
+    def __init__(self, cache_dir: Path = CACHE_DIR, mode: Optional[str] = None, curl_fallback: bool = True):
+        self.cache_dir = Path(cache_dir)
+        self.mode = mode or os.getenv("BET_HTTP_MODE", "live")
+        if self.mode not in MODES:
+            raise ValueError(f"BET_HTTP_MODE non valido: {self.mode} (ammessi: {', '.join(MODES)})")
+        self.curl_fallback = curl_fallback
+        self._local = threading.local()
+        self._last_call: Dict[str, float] = {}
+        self._throttle_lock = threading.Lock()
+
+    # ---------- sessione / throttle ----------
+    def session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = requests.Session()
+        return s
+
+    def _throttle(self, url: str, delay: float):
+        """Intervallo minimo tra richieste di rete verso lo stesso host."""
+        if delay <= 0:
+            return
+        host = urlparse(url).netloc
+        with self._throttle_lock:
+            now = time.monotonic()
+            slot = max(now, self._last_call.get(host, 0.0) + delay)
+            self._last_call[host] = slot
+        if slot > now:
+            time.sleep(slot - now)
+
+    # ---------- cache su disco ----------
+    def _paths(self, endpoint: str, key: str):
+        d = self.cache_dir / endpoint
+        return d / f"{key}.meta.json", d / f"{key}.body"
+
+    def _load(self, endpoint: str, key: str) -> Optional[dict]:
+        meta_p, body_p = self._paths(endpoint, key)
+        try:
+            meta = json.loads(meta_p.read_text(encoding="utf-8"))
+            meta["body"] = body_p.read_bytes()
+            return meta
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _store(self, endpoint: str, key: str, url: str, params, r) -> None:
+        meta_p, body_p = self._paths(endpoint, key)
+        headers = {h: r.headers[h] for h in _KEEP_HEADERS if h in r.headers}
+        meta = {
+            "url": url,
+            "params": _public_params(params),
+            "status": r.status_code,
+            "headers": headers,
+            "fetched_at": time.time(),
+        }
+        try:
+            meta_p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = body_p.with_name(body_p.name + ".tmp")
+            tmp.write_bytes(r.content)
+            tmp.replace(body_p)
+            tmp = meta_p.with_name(meta_p.name + ".tmp")
+            tmp.write_text(json.dumps(meta, indent=1), encoding="utf-8")
+            tmp.replace(meta_p)
+        except OSError as e:
+            print(f"[WARN] Cache HTTP non scrivibile ({meta_p.parent}): {e}")
+
+    def _touch(self, endpoint: str, key: str, entry: dict) -> None:
+        meta_p, _ = self._paths(endpoint, key)
+        meta = {k: v for k, v in entry.items() if k != "body"}
+        meta["fetched_at"] = time.time()
+        try:
+            meta_p.write_text(json.dumps(meta, indent=1), encoding="utf-8")
+        except OSError:
+            pass
+
+    @staticmethod
+    def _from_entry(entry: dict, stale: bool = False) -> CachedResponse:
+        count("http_cache_hits")
+        return CachedResponse(entry.get("url", ""), int(entry.get("status", 200)), entry["body"],
+                              entry.get("headers"), from_cache=True, stale=stale)
+
+    # ---------- rete ----------
+    def _curl(self, url: str, params, headers, timeout: float, label: str) -> CachedResponse:
+        """GET con curl: corpo, stato (-w %{http_code}) e header (-D) della risposta finale."""
+        full_url = f"{url}?{urlencode(params)}" if params else url
+        with tempfile.TemporaryDirectory(prefix="bet_curl_") as tmp:
+            head_p, body_p = Path(tmp) / "headers", Path(tmp) / "body"
+            cmd = ["curl", "-sS", "-L", "-m", str(int(timeout)), "-D", str(head_p), "-o", str(body_p),
+                   "-w", "%{http_code}"]
+            for k, v in headers.items():
+                cmd += ["-H", f"{k}: {v}"]
+            cmd.append(full_url)
+            res = subprocess.run(cmd, capture_output=True)
+            if res.returncode != 0:
+                raise requests.exceptions.ConnectionError(
+                    f"curl fallito per {label} (exit {res.returncode}): {res.stderr.decode(errors='replace').strip()}"
+                )
+            try:
+                status = int(res.stdout.decode().strip()[-3:])
+            except ValueError:
+                status = 0
+            if status <= 0:
+                raise requests.exceptions.ConnectionError(f"curl per {label}: nessuna risposta HTTP")
+            body = body_p.read_bytes() if body_p.exists() else b""
+            raw = head_p.read_text(encoding="latin-1") if head_p.exists() else ""
+        # con -L il file ha un blocco di header per risposta: vale l'ultimo
+        blocks = [b for b in re.split(r"\r?\n\r?\n", raw) if b.strip().startswith("HTTP/")]
+        resp_headers = {}
+        for line in (blocks[-1].splitlines()[1:] if blocks else []):
+            name, sep, value = line.partition(":")
+            if sep and name.strip().lower() in _KEEP_HEADERS:
+                resp_headers[name.strip().lower()] = value.strip()
+        return CachedResponse(url, status, body, resp_headers)
+
+    def _send(self, url, params, headers, timeout, max_retries, delay, label):
+        """GET con retry; ritorna l'ultima risposta (anche d'errore) o solleva l'ultima eccezione di rete."""
+        last_exc: Optional[Exception] = None
+        r = None
+        for attempt in range(max_retries + 1):
+            self._throttle(url, delay)
+            count("http_network")
+            try:
+                r = self.session().get(url, headers=headers, params=params, timeout=timeout)
+                last_exc = None
+            except requests.exceptions.RequestException as exc:
+                last_exc, r = exc, None
+            if r is not None and r.status_code not in RETRY_STATUS:
+                return r
+            if attempt < max_retries:
+                wait = _wait_hint(r, attempt)
+                what = f"HTTP {r.status_code}" if r is not None else "errore rete"
+                print(f"[HTTP] {label}: {what}, retry {attempt + 1}/{max_retries} tra {wait:.1f}s…")
+                time.sleep(wait)
+        if r is not None:
+            return r
+        if self.curl_fallback:
+            # requests ha fallito per rete a ogni tentativo: un'ultima prova con curl
+            print(f"[HTTP-FALLBACK] {label}: {last_exc}. Provo con curl…")
+            count("http_network")
+            try:
+                return self._curl(url, params, headers, timeout, label)
+            except requests.exceptions.RequestException as exc:
+                last_exc = exc
+        raise last_exc
+
+    # ---------- API pubblica ----------
+    def get(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        endpoint: str = "default",
+        ttl: Optional[float] = None,
+        quota: Optional[MonthlyQuota] = None,
+        timeout: float = 30,
+        max_retries: int = 3,
+        delay: float = 0.0,
+        desc: str = "",
+    ):
+        """
+        GET con cache. Ritorna CachedResponse (from_cache=True se servita da disco).
+        Solleva ReplayMiss (replay senza registrazione), QuotaExceeded (quota esaurita
+        e niente in cache) o l'ultima eccezione di rete dopo i retry.
+        """
+        count("http_calls")
+        params = dict(params or {})
+        headers = dict(headers or {})
+        label = desc or url
+        ttl = ENDPOINT_TTL.get(endpoint, ENDPOINT_TTL["default"]) if ttl is None else ttl
+        key = cache_key(url, params)
+        use_cache = self.mode != "off"
+        entry = self._load(endpoint, key) if use_cache else None
+
+        if self.mode == "replay":
+            if entry is None:
+                raise ReplayMiss(f"{label}: nessuna risposta registrata ({endpoint}/{key})")
+            return self._from_entry(entry)
+
+        if entry is not None and self.mode == "live" and time.time() - entry.get("fetched_at", 0) < ttl:
+            return self._from_entry(entry)
+
+        if quota is not None and not quota.consume():
+            if entry is not None:
+                print(f"[WARN] {label}: quota esaurita, uso la risposta in cache (scaduta).")
+                return self._from_entry(entry, stale=True)
+            raise QuotaExceeded(f"{label}: quota {quota.label} esaurita ({quota.limit}/mese)")
+
+        if entry is not None and self.mode == "live":
+            validators = entry.get("headers") or {}
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last-modified"):
+                headers["If-Modified-Since"] = validators["last-modified"]
+
+        r = self._send(url, params, headers, timeout, max_retries, delay, label)
+        if quota is not None:
+            quota.record_remaining(getattr(r, "headers", None))
+
+        if r.status_code == 304 and entry is not None:
+            self._touch(endpoint, key, entry)
+            return self._from_entry(entry)
+        if isinstance(r, CachedResponse):  # curl: stato e header veri, in cache solo se 200
+            resp = r
+        else:
+            keep = {h: r.headers[h] for h in _KEEP_HEADERS if h in r.headers}
+            resp = CachedResponse(r.url or url, r.status_code, r.content, keep)
+        if use_cache and resp.status_code == 200:
+            self._store(endpoint, key, url, params, resp)
+        return resp
+
+
+_CLIENT: Optional[HttpClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """Client HTTP condiviso dal processo."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = HttpClient()
+        return _CLIENT
+
+
+def set_mode(mode: str, cache_dir: Optional[Path] = None) -> HttpClient:
+    """Sostituisce il client condiviso (es. set_mode("replay", fixture_dir) nei test)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT = HttpClient(cache_dir=cache_dir or CACHE_DIR, mode=mode)
+        return _CLIENT
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Cache HTTP: stato e pulizia")
+    ap.add_argument("--stats", action="store_true", help="Numero di risposte e spazio per endpoint")
+    ap.add_argument("--clear", metavar="ENDPOINT", help="Svuota la cache di un endpoint ('all' per tutte)")
+    args = ap.parse_args()
+
+    if args.clear:
+        dirs = [p for p in CACHE_DIR.iterdir() if p.is_dir()] if args.clear == "all" and CACHE_DIR.exists() \
+            else [CACHE_DIR / args.clear]
+        n = 0
+        for d in dirs:
+            for f in d.glob("*"):
+                f.unlink()
+                n += 1
+        print(f"[OK] Rimossi {n} file dalla cache HTTP.")
+        return
+
+    if not CACHE_DIR.exists():
+        print(f"[INFO] Cache HTTP vuota ({CACHE_DIR}).")
+        return
+    for d in sorted(p for p in CACHE_DIR.iterdir() if p.is_dir()):
+        metas = list(d.glob("*.meta.json"))
+        size = sum(f.stat().st_size for f in d.glob("*"))
+        print(f"  {d.name:<18} {len(metas):>5} risposte  {size / 1024:8.1f} KB")
+    print(f"[INFO] Quota {THE_ODDS_API_QUOTA.label}: {THE_ODDS_API_QUOTA.count()}/{THE_ODDS_API_QUOTA.limit}")
+
+
+if __name__ == "__main__":
+    main()
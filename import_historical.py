@@ -4,16 +4,29 @@
 import_historical.py
 Importa gli storici (historical_dataset.csv / historical_1x2.csv) nel DB
 tabella historical_matches per il training ML.
+
+- lettura con historical_store.load_dataset (.arrow se aggiornato, altrimenti CSV)
+- conversione dei tipi per colonna (date, interi, float, stringhe) senza iterrows
+- team_id risolti una volta per coppia (nome, lega) distinta
+- INSERT ... ON CONFLICT DO UPDATE a blocchi (SQLite/PostgreSQL; merge riga per
+  riga sugli altri dialetti), una sola transazione, avanzamento a ogni blocco
+
+Uso:
+    python import_historical.py [--limit N] [--chunk 10000]
 """
 import argparse
 import sys
+import time
 from pathlib import Path
-from datetime import datetime
+from typing import Dict, List, Optional
 
 import pandas as pd
 
-from database import SessionLocal, engine
-from models import HistoricalMatch, Base
+from database import SessionLocal, migrate_schema
+from historical_store import arrow_path, load_dataset
+from metrics import count, instrument
+from models import HistoricalMatch
+from team_registry import SRC_FDCO, TeamRegistry, league_code_of
 
 ROOT = Path(__file__).resolve().parent
 HIST_DATASET = ROOT / "data" / "historical_dataset.csv"
@@ -26,6 +39,19 @@ RENAME_MAP = {
     "xG_against_5_away": "xg_against_away",
 }
 
+STR_COLS = ["time_local", "league", "home", "away"]
+INT_COLS = [
+    "ft_home_goals", "ft_away_goals", "rest_days_home", "rest_days_away",
+    "derby_flag", "europe_flag_home", "europe_flag_away", "meteo_flag",
+    "target_ou25", "target_btts", "target_1x2",
+]
+FLOAT_COLS = [
+    "odds_1", "odds_x", "odds_2",
+    "xg_for_home", "xg_against_home", "xg_for_away", "xg_against_away",
+    "style_ppda_home", "style_ppda_away", "travel_km_away",
+]
+CHUNK_ROWS = 10_000
+
 
 def _standardize_cols(df: pd.DataFrame) -> pd.DataFrame:
     ren = {k: v for k, v in RENAME_MAP.items() if k in df.columns}
@@ -35,18 +61,83 @@ def _standardize_cols(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def _load_csv(path: Path) -> pd.DataFrame:
-    if not path.exists():
+    if not path.exists() and not arrow_path(path).exists():
         return pd.DataFrame()
     try:
-        df = pd.read_csv(path)
-        return _standardize_cols(df)
+        return _standardize_cols(load_dataset(path))
     except Exception as exc:
         print(f"[ERR] lettura {path}: {exc}", file=sys.stderr)
         return pd.DataFrame()
 
 
-def import_historical(limit: int = 0):
-    Base.metadata.create_all(bind=engine, tables=[HistoricalMatch.__table__])
+def to_db_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Colonne di historical_matches con i tipi del DB; le colonne assenti restano vuote."""
+    missing = pd.Series(None, index=df.index, dtype=object)
+    out = pd.DataFrame(index=df.index)
+    out["match_id"] = df["match_id"].astype(str)
+    dates = df["date"]
+    if dates.dtype.kind != "M":
+        dates = pd.to_datetime(dates.astype(str).str[:10], format="%Y-%m-%d", errors="coerce")
+    out["date"] = dates.dt.date
+    for c in STR_COLS:
+        s = df[c] if c in df.columns else missing
+        out[c] = s.where(s.isna(), s.astype(str))
+    for c in INT_COLS:
+        s = pd.to_numeric(df[c], errors="coerce") if c in df.columns else missing.astype(float)
+        out[c] = s.round().astype("Int64")
+    for c in FLOAT_COLS:
+        out[c] = pd.to_numeric(df[c], errors="coerce").astype(float) if c in df.columns else float("nan")
+    return out
+
+
+def resolve_team_ids(registry: TeamRegistry, frame: pd.DataFrame) -> None:
+    """home_team_id/away_team_id come TeamRegistry.assign, una resolve per (nome, lega)."""
+    leagues = [league_code_of(v) for v in frame["league"]]
+    ids: Dict[tuple, Optional[int]] = {}
+    for side in ("home", "away"):
+        keys = list(zip(frame[side], leagues))
+        for key in dict.fromkeys(keys):  # coppie distinte nell'ordine del file
+            if isinstance(key[0], str) and key not in ids:
+                ids[key] = registry.resolve(key[0], SRC_FDCO, key[1])
+        frame[f"{side}_team_id"] = pd.Series([ids.get(k) for k in keys], index=frame.index, dtype="Int64")
+
+
+def upsert_history(db, frame: pd.DataFrame, chunk: int = CHUNK_ROWS) -> int:
+    """Upsert a blocchi di `chunk` righe nella transazione della sessione (commit al chiamante)."""
+    table = HistoricalMatch.__table__
+    # valori Python per colonna (tolist) e poi per riga: evita il boxing cella per cella di to_dict
+    cols = list(frame.columns)
+    values = [frame[c].astype(object).where(frame[c].notna(), None).tolist() for c in cols]
+    rows: List[dict] = [dict(zip(cols, r)) for r in zip(*values)]
+    dialect = db.get_bind().dialect.name
+    stmt = None
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.match_id],
+            set_={c: stmt.excluded[c] for c in cols if c != "match_id"},
+        )
+    t0 = time.perf_counter()
+    for start in range(0, len(rows), chunk):
+        part = rows[start:start + chunk]
+        if stmt is not None:
+            db.execute(stmt, part)
+        else:
+            for r in part:
+                db.merge(HistoricalMatch(**r))
+        done = start + len(part)
+        rate = done / max(time.perf_counter() - t0, 1e-9)
+        print(f"[INFO] {done}/{len(rows)} righe scritte ({rate:,.0f} righe/s)")
+    return len(rows)
+
+
+@instrument("import_historical")
+def import_historical(limit: int = 0, chunk: int = CHUNK_ROWS):
+    migrate_schema()
 
     df_main = _load_csv(HIST_DATASET)
     df_alt = _load_csv(HIST_1X2)
@@ -57,60 +148,28 @@ def import_historical(limit: int = 0):
         print("[WARN] Nessun dato storico trovato.")
         return
 
-    df_main.drop_duplicates(subset=["match_id"], inplace=True)
-    if limit > 0:
-        df_main = df_main.head(limit)
-
     required_cols = {"match_id", "date", "home", "away"}
     missing = required_cols - set(df_main.columns)
     if missing:
         print(f"[ERR] Colonne obbligatorie mancanti: {missing}", file=sys.stderr)
         return
 
-    # Conversioni leggere
-    def _to_date(val):
-        try:
-            return datetime.fromisoformat(str(val)[:10]).date()
-        except Exception:
-            return None
+    df_main = df_main.dropna(subset=["match_id"]).drop_duplicates(subset=["match_id"])
+    if limit > 0:
+        df_main = df_main.head(limit)
 
+    t0 = time.perf_counter()
+    frame = to_db_frame(df_main)
     db = SessionLocal()
-    inserted = 0
     try:
-        for _, row in df_main.iterrows():
-            obj = HistoricalMatch(
-                match_id=str(row.get("match_id")),
-                date=_to_date(row.get("date")),
-                time_local=str(row.get("time_local")) if not pd.isna(row.get("time_local")) else None,
-                league=row.get("league"),
-                home=row.get("home"),
-                away=row.get("away"),
-                ft_home_goals=row.get("ft_home_goals"),
-                ft_away_goals=row.get("ft_away_goals"),
-                odds_1=row.get("odds_1"),
-                odds_x=row.get("odds_x"),
-                odds_2=row.get("odds_2"),
-                xg_for_home=row.get("xg_for_home"),
-                xg_against_home=row.get("xg_against_home"),
-                xg_for_away=row.get("xg_for_away"),
-                xg_against_away=row.get("xg_against_away"),
-                rest_days_home=row.get("rest_days_home"),
-                rest_days_away=row.get("rest_days_away"),
-                derby_flag=row.get("derby_flag"),
-                europe_flag_home=row.get("europe_flag_home"),
-                europe_flag_away=row.get("europe_flag_away"),
-                meteo_flag=row.get("meteo_flag"),
-                style_ppda_home=row.get("style_ppda_home"),
-                style_ppda_away=row.get("style_ppda_away"),
-                travel_km_away=row.get("travel_km_away"),
-                target_ou25=row.get("target_ou25"),
-                target_btts=row.get("target_btts"),
-                target_1x2=row.get("target_1x2"),
-            )
-            db.merge(obj)
-            inserted += 1
+        registry = TeamRegistry(db)
+        resolve_team_ids(registry, frame)
+        print(f"[INFO] {len(frame)} righe preparate in {time.perf_counter() - t0:.1f}s, scrittura…")
+        inserted = upsert_history(db, frame, chunk)
         db.commit()
-        print(f"[OK] Inserite/aggiornate {inserted} righe in historical_matches.")
+        count("rows", inserted)
+        print(f"[OK] Inserite/aggiornate {inserted} righe in historical_matches "
+              f"({time.perf_counter() - t0:.1f}s).")
     except Exception as exc:
         db.rollback()
         print(f"[ERR] Inserimento fallito: {exc}", file=sys.stderr)
@@ -121,5 +180,6 @@ def import_historical(limit: int = 0):
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--limit", type=int, default=0, help="Limita il numero di record importati (0 = tutti)")
+    ap.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="Righe per blocco di upsert")
     args = ap.parse_args()
-    import_historical(limit=args.limit)
+    import_historical(limit=args.limit, chunk=args.chunk)
@@ -7,11 +7,12 @@ init_db.py
 Script una-tantum per creare le tabelle nel database PostgreSQL.
 Legge la configurazione da `config.toml` e usa i modelli definiti in `models.py`.
 
-Esegui questo script solo una volta per preparare il database.
+Esegui questo script solo una volta per preparare il database; rieseguirlo è
+sicuro e aggiunge colonne e indici nuovi ai DB già esistenti (migrazione).
 """
 
 from sqlalchemy.exc import OperationalError
-from database import Base, engine
+from database import Base, engine, migrate_schema
 
 
 def main():
@@ -37,6 +38,15 @@ def main():
     Base.metadata.create_all(bind=engine)
     print("✅ Tabelle create con successo (se non esistevano): fixtures, odds, features, team_mappings.")
 
+    # 3. Migrazione: aggiunge ai DB esistenti colonne e indici dichiarati in models.py
+    print("\nVerifica colonne e indici...")
+    changes = migrate_schema(engine)
+    if changes:
+        print(f"✅ Schema aggiornato: {', '.join(changes)}")
+    else:
+        print("✅ Colonne e indici sono già presenti.")
+    print("   Piani delle query principali: python tools/checks.py db-explain")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
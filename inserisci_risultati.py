@@ -6,6 +6,7 @@ Inserisce i risultati reali nel database
 
 from database import SessionLocal
 from models import Fixture
+from market_cache import bump_dates
 from datetime import date
 
 # Risultati forniti dall'utente - AGGIORNATI 6 gennaio 2026
@@ -57,6 +58,8 @@ for home_team, data in risultati.items():
     print(f"✅ {match.home} {data['home_goals']}-{data['away_goals']} {match.away}")
     updated += 1
 
+if updated:
+    bump_dates(db, [date(2026, 1, 6)])
 db.commit()
 db.close()
 
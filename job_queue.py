@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+job_queue.py
+------------
+Coda di job persistente (SQLite, cache/jobs.db o BET_QUEUE_DB) con pool di worker
+per app.py.
+
+- i tipi di job si registrano con register(tipo, funzione, priorità, gruppo, limite):
+  nel DB si salvano solo tipo e argomenti (JSON), le funzioni restano nel codice
+- priorità: il worker libero prende il job in coda con priorità più alta
+  (a parità, il più vecchio) il cui gruppo non ha già raggiunto il limite di job
+  in esecuzione (es. daily e predict condividono il gruppo "predict", limite 1,
+  perché scrivono entrambi predictions.csv; un backfill storico gira accanto)
+- cancel(job_id): un job in coda non partirà; a un job in esecuzione viene
+  chiesto di fermarsi (run_cmd controlla current_job().stop_requested())
+- register(..., resumable=True) per i backfill con checkpoint (backfill_checkpoint):
+  lo stop li chiude come "paused" e resume(job_id) li rimette in coda con gli stessi
+  argomenti, così ripartono da dove si erano fermati
+- i job rimasti "queued" ripartono al riavvio; quelli "running" durante un crash
+  vengono chiusi come "failed" da start(): costruire la coda e leggerla (import di
+  app.py da bench, test, REPL) non tocca i job della dashboard in esecuzione
+
+Uso (app.py):
+    JOBS.register("daily", run_daily_pipeline, priority=10, group="predict")
+    JOBS.start(workers=3)  # in main(), non all'import
+    job_id = JOBS.submit("daily", ("2025-11-05", "SA,PL", "0.6", True))
+    JOBS.cancel(job_id); JOBS.list_jobs()
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+ROOT = Path(__file__).resolve().parent
+QUEUE_DB = ROOT / "cache" / "jobs.db"
+
+
+def queue_db_path() -> Path:
+    """DB della coda: BET_QUEUE_DB (es. la cartella di lavoro di bench_suite) o cache/jobs.db."""
+    return Path(os.getenv("BET_QUEUE_DB") or QUEUE_DB)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT DEFAULT '',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs(status, priority, id);
+"""
+
+
+class JobType:
+    def __init__(self, name: str, func: Callable[..., Any], priority: int, group: str,
+                 resumable: bool = False):
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.group = group
+        self.resumable = resumable
+
+
+class JobContext:
+    """Stato di un job in esecuzione visibile alla funzione del job (e a run_cmd)."""
+
+    def __init__(self, job_id: int, name: str):
+        self.job_id = job_id
+        self.name = name
+        self._stop = threading.Event()
+
+    def request_stop(self) -> None:
+        self._stop.set()
+
+    def stop_requested(self) -> bool:
+        return self._stop.is_set()
+
+
+_local = threading.local()
+
+
+def current_job() -> Optional[JobContext]:
+    """Contesto del job eseguito dal thread corrente (None fuori dai worker)."""
+    return getattr(_local, "job", None)
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+
+
+class JobQueue:
+    def __init__(self, db_path: Optional[Path] = None, log: Callable[[str], None] = print):
+        self.db_path = Path(db_path) if db_path else queue_db_path()
+        self.log = log
+        self.types: Dict[str, JobType] = {}
+        self.group_limits: Dict[str, int] = {}
+        self._running: Dict[int, JobContext] = {}
+        self._groups: Dict[int, str] = {}
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._closed = False
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._ready:  # file e schema al primo uso, non alla costruzione
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            try:
+                conn.executescript(_SCHEMA)
+            finally:
+                conn.close()
+            self._ready = True
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ---------- configurazione ----------
+    def register(self, job_type: str, func: Callable[..., Any], priority: int = 5,
+                 group: Optional[str] = None, limit: int = 1, resumable: bool = False) -> None:
+        group = group or job_type
+        self.types[job_type] = JobType(job_type, func, priority, group, resumable)
+        self.group_limits[group] = max(self.group_limits.get(group, limit), limit)
+
+    def start(self, workers: int = 3) -> None:
+        """
+        Avvia i worker. Al primo avvio chiude come "failed" i job rimasti "running"
+        (il processo che li eseguiva è morto): va chiamato solo dal processo che serve la coda.
+        """
+        if not self._workers:
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE jobs SET status='failed', message='Interrotto dal riavvio del server', finished_at=? "
+                    "WHERE status='running'", (time.time(),)
+                )
+        for i in range(max(1, workers) - len(self._workers)):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(t)
+            t.start()
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._closed = True
+            for ctx in self._running.values():
+                ctx.request_stop()
+            self._cond.notify_all()
+
+    # ---------- API ----------
+    def submit(self, job_type: str, args: Sequence[Any] = (), name: Optional[str] = None,
+               priority: Optional[int] = None, dedupe: bool = False) -> Optional[int]:
+        """
+        Mette in coda un job e ne restituisce l'id. dedupe=True non accoda se un job
+        con lo stesso nome è già in coda (per i job periodici dello scheduler).
+        """
+        jt = self.types[job_type]
+        name = name or job_type
+        with self._cond:
+            with self._connect() as conn:
+                if dedupe and conn.execute(
+                    "SELECT 1 FROM jobs WHERE name=? AND status='queued'", (name,)
+                ).fetchone():
+                    return None
+                cur = conn.execute(
+                    "INSERT INTO jobs (job_type, name, args, priority, status, created_at) "
+                    "VALUES (?, ?, ?, ?, 'queued', ?)",
+                    (job_type, name, json.dumps(list(args)), jt.priority if priority is None else priority,
+                     time.time()),
+                )
+                job_id = cur.lastrowid
+            self._cond.notify_all()
+        return job_id
+
+    def cancel(self, job_id: int) -> Optional[str]:
+        """Annulla un job in coda o chiede lo stop di uno in esecuzione. Ritorna il nuovo stato."""
+        with self._cond:
+            ctx = self._running.get(job_id)
+            if ctx is not None:
+                ctx.request_stop()
+                return "stop_requested"
+            with self._connect() as conn:
+                cur = conn.execute(
+                    "UPDATE jobs SET status='cancelled', message='Annullato prima dell''avvio', finished_at=? "
+                    "WHERE id=? AND status='queued'", (time.time(), job_id)
+                )
+            return "cancelled" if cur.rowcount else None
+
+    def resume(self, job_id: int) -> Optional[int]:
+        """Rimette in coda (nuovo id) un job ripristinabile in pausa o fallito, con gli stessi argomenti."""
+        with self._connect() as conn:
+            r = conn.execute(
+                "SELECT * FROM jobs WHERE id=? AND status IN ('paused', 'failed')", (job_id,)
+            ).fetchone()
+        jt = self.types.get(r["job_type"]) if r else None
+        if jt is None or not jt.resumable:
+            return None
+        return self.submit(r["job_type"], json.loads(r["args"]), name=r["name"], priority=r["priority"])
+
+    def running_contexts(self) -> List[JobContext]:
+        with self._cond:
+            return list(self._running.values())
+
+    def list_jobs(self, limit: int = 50) -> Dict[str, List[dict]]:
+        """Job in coda, in esecuzione e ultimi terminati, con tempi di attesa e durata."""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') "
+                "UNION ALL SELECT * FROM (SELECT * FROM jobs WHERE status NOT IN ('queued', 'running') "
+                "ORDER BY id DESC LIMIT ?)", (limit,)
+            ).fetchall()
+        out: Dict[str, List[dict]] = {"queued": [], "running": [], "finished": []}
+        for r in rows:
+            start, end = r["started_at"], r["finished_at"]
+            job = {
+                "id": r["id"],
+                "type": r["job_type"],
+                "name": r["name"],
+                "args": json.loads(r["args"]),
+                "priority": r["priority"],
+                "status": r["status"],
+                "message": r["message"],
+                "created_at": _iso(r["created_at"]),
+                "started_at": _iso(start),
+                "finished_at": _iso(end),
+                "wait_s": round((start or now) - r["created_at"], 3),
+                "duration_s": round((end or now) - start, 3) if start else None,
+            }
+            bucket = r["status"] if r["status"] in ("queued", "running") else "finished"
+            out[bucket].append(job)
+        out["queued"].sort(key=lambda j: (-j["priority"], j["id"]))
+        out["finished"].sort(key=lambda j: -j["id"])
+        return out
+
+    def last_finished(self) -> Optional[dict]:
+        with self._connect() as conn:
+            r = conn.execute(
+                "SELECT id, name, status, message FROM jobs WHERE status IN ('done', 'failed', 'cancelled', 'paused') "
+                "ORDER BY finished_at DESC LIMIT 1"
+            ).fetchone()
+        return dict(r) if r else None
+
+    # ---------- worker ----------
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Job in coda con priorità più alta il cui gruppo ha ancora posto (chiamare con _cond)."""
+        busy: Dict[str, int] = {}
+        for g in self._groups.values():
+            busy[g] = busy.get(g, 0) + 1
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status='queued' ORDER BY priority DESC, id"
+            ).fetchall()
+            for r in rows:
+                jt = self.types.get(r["job_type"])
+                if jt is None:
+                    continue  # tipo non registrato in questo processo
+                if busy.get(jt.group, 0) >= self.group_limits.get(jt.group, 1):
+                    continue
+                conn.execute("UPDATE jobs SET status='running', started_at=? WHERE id=?",
+                             (time.time(), r["id"]))
+                return r
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                row = None
+                while not self._closed:
+                    row = self._claim()
+                    if row is not None:
+                        break
+                    self._cond.wait(timeout=5)
+                if self._closed:
+                    return
+                jt = self.types[row["job_type"]]
+                ctx = JobContext(row["id"], row["name"])
+                self._running[ctx.job_id] = ctx
+                self._groups[ctx.job_id] = jt.group
+            self._execute(jt, ctx, json.loads(row["args"]))
+            with self._cond:
+                self._running.pop(ctx.job_id, None)
+                self._groups.pop(ctx.job_id, None)
+                self._cond.notify_all()
+
+    def _execute(self, jt: JobType, ctx: JobContext, args: List[Any]) -> None:
+        _local.job = ctx
+        success = False
+        try:
+            self.log(f"--- Inizio Job #{ctx.job_id}: {ctx.name} ---")
+            success = bool(jt.func(*args))
+            self.log(f"--- Fine Job #{ctx.job_id}: {ctx.name} (Successo: {success}) ---")
+        except Exception as e:
+            self.log(f"[ERR] Job #{ctx.job_id} {ctx.name}: {e}")
+        finally:
+            _local.job = None
+            if ctx.stop_requested() and jt.resumable:
+                status, msg = "paused", f"Job '{ctx.name}' in pausa: rilancialo per riprendere dal checkpoint."
+            elif ctx.stop_requested():
+                status, msg = "cancelled", f"Job '{ctx.name}' interrotto dall'utente."
+            elif success:
+                status, msg = "done", f"Job '{ctx.name}' completato con successo."
+            else:
+                status, msg = "failed", f"Job '{ctx.name}' fallito o completato con errori."
+            with self._connect() as conn:
+                conn.execute("UPDATE jobs SET status=?, message=?, finished_at=? WHERE id=?",
+                             (status, msg, time.time(), ctx.job_id))
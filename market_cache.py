@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+market_cache.py
+---------------
+Cache in memoria dei payload calcolati dalle viste per data (proposte, mercati
+estesi), condivisa dai thread di Flask, con invalidazione per versione dei dati.
+
+- ogni data ha una versione nella tabella data_versions (models.DataVersion);
+  fetcher e populator la incrementano con bump_dates(db, date) nella stessa
+  transazione in cui scrivono fixtures, quote, features o risultati di quella data
+- la chiave di cache è (vista, data, competizioni); una voce vale finché la
+  versione della sua data non cambia, poi viene ricalcolata alla richiesta successiva
+- LRU con dimensione massima (BET_MARKET_CACHE_SIZE, default 128 voci); lo stesso
+  payload è calcolato da un solo thread alla volta, gli altri aspettano e lo riusano
+- i payload restituiti sono condivisi: le viste non devono modificarli
+
+Uso:
+    from market_cache import MARKET_CACHE, bump_dates
+    proposals = MARKET_CACHE.get("proposals", "2025-11-05", lambda: generate_proposals("2025-11-05"))
+    bump_dates(db, {fixture.date for fixture in fixtures}); db.commit()
+
+CLI:
+    python market_cache.py --show 2025-11-05
+    python market_cache.py --bump 2025-11-05      # dopo modifiche manuali al DB
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from database import SessionLocal
+from metrics import count
+from models import DataVersion
+
+DayLike = Union[str, date, datetime]
+
+_table_ready = False
+
+
+def _as_date(day: DayLike) -> date:
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    return date.fromisoformat(str(day)[:10])
+
+
+def _ensure_table(bind) -> None:
+    """La tabella data_versions sui DB creati prima della sua introduzione."""
+    global _table_ready
+    if not _table_ready:
+        DataVersion.__table__.create(bind=bind, checkfirst=True)
+        _table_ready = True
+
+
+def bump_dates(db, days: Iterable[Optional[DayLike]]) -> int:
+    """
+    Incrementa la versione delle date indicate nella transazione di db (il commit
+    resta al chiamante, così versione e dati cambiano insieme). Ritorna le date toccate.
+    """
+    dates = sorted({_as_date(d) for d in days if d})
+    if not dates:
+        return 0
+    _ensure_table(db.connection())
+    now = time.time()
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(DataVersion.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DataVersion.__table__.c.date],
+            set_={"version": DataVersion.__table__.c.version + 1, "updated_at": now},
+        )
+        db.execute(stmt, [{"date": d, "version": 1, "updated_at": now} for d in dates])
+    else:
+        for d in dates:
+            row = db.get(DataVersion, d)
+            if row is None:
+                db.add(DataVersion(date=d, version=1, updated_at=now))
+            else:
+                row.version += 1
+                row.updated_at = now
+    return len(dates)
+
+
+def data_version(db, day: DayLike) -> int:
+    """Versione corrente dei dati di una data (0 se mai toccata)."""
+    _ensure_table(db.get_bind())
+    row = db.query(DataVersion.version).filter(DataVersion.date == _as_date(day)).first()
+    return row[0] if row else 0
+
+
+class MarketCache:
+    def __init__(self, maxsize: int = 128, session_factory: Callable[[], Any] = SessionLocal):
+        self.maxsize = max(1, maxsize)
+        self.session_factory = session_factory
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[int, Any]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version_of(self, day: DayLike) -> Optional[int]:
+        """Versione della data, None se non leggibile (data non valida o DB assente)."""
+        db = None
+        try:
+            db = self.session_factory()
+            return data_version(db, day)
+        except Exception:
+            return None
+        finally:
+            if db is not None:
+                db.close()
+
+    def _lookup(self, key, version) -> Tuple[bool, Any]:
+        """Voce valida per la versione (chiamare con _lock)."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            count("cache_hits")
+            return True, entry[1]
+        return False, None
+
+    def get(self, view: str, day: DayLike, compute: Callable[[], Any], comps: str = "") -> Any:
+        """Payload di (view, day, comps): dalla cache se la versione della data è invariata."""
+        version = self.version_of(day)
+        if version is None:
+            return compute()
+        key = (view, _as_date(day).isoformat(), comps or "")
+        with self._lock:
+            found, payload = self._lookup(key, version)
+            if found:
+                return payload
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # nel frattempo un altro thread potrebbe averlo già calcolato
+                found, payload = self._lookup(key, version)
+                if found:
+                    return payload
+                self.misses += 1
+                count("cache_misses")
+            try:
+                payload = compute()
+                with self._lock:
+                    self._entries[key] = (version, payload)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+        return payload
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "keys": [
+                    {"view": k[0], "date": k[1], "comps": k[2], "version": v[0]}
+                    for k, v in self._entries.items()
+                ],
+            }
+
+
+MARKET_CACHE = MarketCache(maxsize=int(os.getenv("BET_MARKET_CACHE_SIZE", "128")))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Versioni dei dati per data usate dalla cache delle viste.")
+    ap.add_argument("--show", metavar="DATE", help="Mostra la versione dei dati di una data")
+    ap.add_argument("--bump", metavar="DATE", nargs="+", help="Incrementa la versione delle date indicate")
+    args = ap.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.bump:
+            n = bump_dates(db, args.bump)
+            db.commit()
+            print(f"[OK] Versione incrementata per {n} date.")
+        if args.show:
+            print(f"[INFO] {args.show}: versione {data_version(db, args.show)}")
+        if not (args.bump or args.show):
+            ap.print_help()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+----------
+Strumentazione leggera degli stadi della pipeline e delle viste Flask.
+
+- contatori di processo: rows, http_calls, http_network, http_cache_hits, db_queries,
+  cache_hits, cache_misses; count() nei punti caldi (http_cache, market_cache,
+  understat_cache, righe scritte dagli script) e un listener SQLAlchemy
+  (before_cursor_execute) per le query di tutti i motori del processo
+- @instrument(nome) / with stage(nome): tempo wall, esito e differenza dei contatori
+  tra inizio e fine → un record JSON per riga in logs/metrics.jsonl (append-only, una
+  sola write O_APPEND per record: sicuro con job, subprocess e figli del worker)
+- viste Flask: install_flask(app) misura latenza e query DB di ogni richiesta (query
+  contate per thread); nel file solo le viste che non sono polling della UI
+- /metrics: testo Prometheus; gli stadi girano in altri processi e si leggono dal file
+  (a ogni scrape solo la parte nuova), le viste dai contatori del processo Flask
+- slowest_stages(): ultimo giro di ogni stadio, dal più lento (pannello in index.html)
+
+I contatori sono del processo: se due stadi girano in parallelo nello stesso processo
+le loro differenze si sommano (job_queue e pipeline_worker eseguono gli script in
+processi separati, quindi nella pipeline non succede).
+
+Variabili d'ambiente: BET_METRICS_PATH (file dei record), BET_METRICS=0 (niente file).
+
+Uso:
+    from metrics import count, instrument
+
+    @instrument("fixtures")
+    def main():
+        ...
+        count("rows", n_scritte)
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+ROOT = Path(__file__).resolve().parent
+METRICS_PATH = ROOT / "logs" / "metrics.jsonl"
+
+COUNTERS = ("rows", "http_calls", "http_network", "http_cache_hits", "db_queries", "cache_hits", "cache_misses")
+VIEW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# viste interrogate di continuo dalla UI o da Prometheus: solo contatori in memoria, niente file
+QUIET_VIEWS = {"static", "ping", "job_status", "log_tail", "metrics_view", "jobs_list", "market_cache_status"}
+
+_LOCK = threading.Lock()
+_counts: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+_local = threading.local()
+
+
+# =========================
+# CONTATORI
+# =========================
+def count(name: str, n: int = 1) -> None:
+    with _LOCK:
+        _counts[name] = _counts.get(name, 0) + n
+
+
+def snapshot() -> Dict[str, int]:
+    with _LOCK:
+        return dict(_counts)
+
+
+def _thread_queries() -> int:
+    return getattr(_local, "db_queries", 0)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _on_query(conn, cursor, statement, parameters, context, executemany):
+    _local.db_queries = _thread_queries() + 1
+    count("db_queries")
+
+
+# =========================
+# FILE DEI RECORD
+# =========================
+def metrics_path() -> Path:
+    return Path(os.getenv("BET_METRICS_PATH") or METRICS_PATH)
+
+
+def write_record(record: Dict[str, Any]) -> None:
+    """Aggiunge un record al file (una riga JSON, una sola write)."""
+    if os.getenv("BET_METRICS", "1") == "0":
+        return
+    path = metrics_path()
+    line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"[WARN] Metriche non scrivibili ({path}): {e}")
+
+
+# =========================
+# STADI
+# =========================
+@contextmanager
+def stage(name: str, **labels: Any) -> Iterator[None]:
+    """Misura il blocco come stadio `name`; sys.exit(0) conta come esito ok, Ctrl-C come "paused"."""
+    start = snapshot()
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status = "error"
+        raise
+    except KeyboardInterrupt:
+        status = "paused"  # Ctrl-C / stop del job (backfill_checkpoint.pausable)
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        end = snapshot()
+        record = {
+            "ts": round(time.time(), 3),
+            "kind": "stage",
+            "name": name,
+            "status": status,
+            "wall_s": round(time.perf_counter() - t0, 4),
+            "pid": os.getpid(),
+        }
+        record.update({k: end.get(k, 0) - start.get(k, 0) for k in COUNTERS})
+        if labels:
+            record["labels"] = {k: str(v) for k, v in labels.items()}
+        write_record(record)
+
+
+def instrument(name: str) -> Callable:
+    """Decoratore: ogni chiamata della funzione è un giro dello stadio `name`."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+# =========================
+# VISTE FLASK
+# =========================
+class _ViewStats:
+    __slots__ = ("count", "sum", "db_queries", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.db_queries = 0
+        self.buckets = [0] * len(VIEW_BUCKETS)
+
+
+_views: Dict[Tuple[str, str, int], _ViewStats] = {}
+
+
+def record_view(view: str, method: str, status: int, wall_s: float, db_queries: int, path: str = "") -> None:
+    with _LOCK:
+        st = _views.setdefault((view, method, status), _ViewStats())
+        st.count += 1
+        st.sum += wall_s
+        st.db_queries += db_queries
+        for i, b in enumerate(VIEW_BUCKETS):
+            if wall_s <= b:
+                st.buckets[i] += 1
+    if view not in QUIET_VIEWS:
+        write_record({"ts": round(time.time(), 3), "kind": "view", "name": view, "path": path,
+                      "method": method, "status": status, "wall_s": round(wall_s, 4), "db_queries": db_queries})
+
+
+def install_flask(app) -> None:
+    """Hook before/after_request per latenza e query DB di ogni vista."""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = (time.perf_counter(), _thread_queries())
+
+    @app.after_request
+    def _metrics_end(resp):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            record_view(request.endpoint or "not_found", request.method, resp.status_code,
+                        time.perf_counter() - start[0], _thread_queries() - start[1], request.path)
+        return resp
+
+
+# =========================
+# LETTURA DEL FILE
+# =========================
+class StageLog:
+    """Aggregati degli stadi dal file, aggiornati leggendo solo i byte nuovi."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.runs: Dict[Tuple[str, str], int] = {}
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self.last: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def path(self) -> Path:
+        return self._path or metrics_path()
+
+    def refresh(self) -> "StageLog":
+        with self._lock:
+            try:
+                size = self.path.stat().st_size
+            except OSError:
+                self._reset()
+                return self
+            if size < self.offset:  # file ruotato o troncato
+                self._reset()
+            if size == self.offset:
+                return self
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                chunk = f.read(size - self.offset)
+            end = chunk.rfind(b"\n") + 1  # l'ultima riga incompleta si rilegge al prossimo giro
+            self.offset += end
+            for line in chunk[:end].splitlines():
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("kind") == "stage":
+                    self._add(rec)
+        return self
+
+    def _add(self, rec: Dict[str, Any]) -> None:
+        name = str(rec.get("name"))
+        key = (name, str(rec.get("status", "ok")))
+        self.runs[key] = self.runs.get(key, 0) + 1
+        tot = self.totals.setdefault(name, dict.fromkeys(("wall_s",) + COUNTERS, 0.0))
+        for k in tot:
+            tot[k] += float(rec.get(k) or 0)
+        self.last[name] = rec
+
+
+STAGE_LOG = StageLog()
+
+
+def slowest_stages(limit: int = 8) -> List[Dict[str, Any]]:
+    """Ultimo giro di ogni stadio, dal più lento (con orario leggibile in "when")."""
+    last = sorted(STAGE_LOG.refresh().last.values(), key=lambda r: r.get("wall_s", 0), reverse=True)
+    out = []
+    for rec in last[:limit]:
+        rec = dict(rec)
+        rec["when"] = datetime.fromtimestamp(rec.get("ts", 0)).strftime("%Y-%m-%d %H:%M")
+        out.append(rec)
+    return out
+
+
+# =========================
+# PROMETHEUS
+# =========================
+def _esc(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(**kv: Any) -> str:
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in kv.items()) + "}"
+
+
+def render_prometheus() -> str:
+    """Stadi (dal file) e viste/contatori del processo corrente in formato testo Prometheus."""
+    log = STAGE_LOG.refresh()
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{labels} {_num(value)}" for labels, value in samples)
+
+    metric("bet_stage_runs_total", "counter", "Esecuzioni degli stadi della pipeline per esito.",
+           [(_labels(stage=s, status=st), n) for (s, st), n in sorted(log.runs.items())])
+    lines.append("# HELP bet_stage_duration_seconds Tempo wall degli stadi della pipeline.")
+    lines.append("# TYPE bet_stage_duration_seconds summary")
+    for s, tot in sorted(log.totals.items()):
+        runs = sum(n for (name, _st), n in log.runs.items() if name == s)
+        lines.append(f"bet_stage_duration_seconds_sum{_labels(stage=s)} {_num(tot['wall_s'])}")
+        lines.append(f"bet_stage_duration_seconds_count{_labels(stage=s)} {runs}")
+    metric("bet_stage_last_duration_seconds", "gauge", "Tempo wall dell'ultimo giro dello stadio.",
+           [(_labels(stage=s), r.get("wall_s", 0)) for s, r in sorted(log.last.items())])
+    metric("bet_stage_last_run_timestamp_seconds", "gauge", "Fine dell'ultimo giro dello stadio (epoch).",
+           [(_labels(stage=s), r.get("ts", 0)) for s, r in sorted(log.last.items())])
+    for c in COUNTERS:
+        metric(f"bet_stage_{c}_total", "counter", f"Totale {c} misurato negli stadi della pipeline.",
+               [(_labels(stage=s), tot[c]) for s, tot in sorted(log.totals.items())])
+
+    with _LOCK:
+        views = sorted(_views.items())
+        counts = dict(_counts)
+    metric("bet_view_requests_total", "counter", "Richieste alle viste Flask per metodo ed esito.",
+           [(_labels(view=v, method=m, status=st), s.count) for (v, m, st), s in views])
+    lines.append("# HELP bet_view_duration_seconds Latenza delle viste Flask.")
+    lines.append("# TYPE bet_view_duration_seconds histogram")
+    by_view: Dict[str, _ViewStats] = {}
+    for (v, _m, _st), s in views:
+        agg = by_view.setdefault(v, _ViewStats())
+        agg.count += s.count
+        agg.sum += s.sum
+        agg.db_queries += s.db_queries
+        agg.buckets = [a + b for a, b in zip(agg.buckets, s.buckets)]
+    for v, s in sorted(by_view.items()):
+        for b, n in zip(VIEW_BUCKETS, s.buckets):
+            lines.append(f"bet_view_duration_seconds_bucket{_labels(view=v, le=f'{b:g}')} {n}")
+        lines.append(f"bet_view_duration_seconds_bucket{_labels(view=v, le='+Inf')} {s.count}")
+        lines.append(f"bet_view_duration_seconds_sum{_labels(view=v)} {_num(s.sum)}")
+        lines.append(f"bet_view_duration_seconds_count{_labels(view=v)} {s.count}")
+    metric("bet_view_db_queries_total", "counter", "Query DB eseguite dalle viste Flask.",
+           [(_labels(view=v), s.db_queries) for v, s in sorted(by_view.items())])
+    metric("bet_process_events_total", "counter", "Contatori del processo della dashboard.",
+           [(_labels(counter=c), counts.get(c, 0)) for c in COUNTERS])
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Riepilogo delle metriche degli stadi (logs/metrics.jsonl).")
+    ap.add_argument("--prometheus", action="store_true", help="Stampa il testo servito su /metrics")
+    ap.add_argument("--limit", type=int, default=10)
+    args = ap.parse_args()
+    if args.prometheus:
+        print(render_prometheus(), end="")
+        return
+    rows = slowest_stages(args.limit)
+    if not rows:
+        print(f"[INFO] Nessuno stadio registrato in {metrics_path()}")
+    for r in rows:
+        print(f"{r['name']:<18} {r['wall_s']:8.2f}s  {r['status']:<5} righe={r.get('rows', 0):<6} "
+              f"http={r.get('http_calls', 0)} (rete {r.get('http_network', 0)}) "
+              f"query={r.get('db_queries', 0)} cache={r.get('cache_hits', 0)}/{r.get('cache_misses', 0)}  "
+              f"{r['when']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,10 @@ from sqlalchemy.orm import joinedload
 from database import SessionLocal
 from models import Fixture, Feature, Odds
 from predictions_generator import expected_goals_to_prob
+from historical_store import load_dataset
+from metrics import count, instrument
+from model_registry import get_model
+from poisson_kernel import outcome_probs, over_prob, score_tensor
 
 try:
     from lightgbm import LGBMClassifier
@@ -68,16 +72,8 @@ HIST_1X2_PATH = ROOT / "data" / "historical_1x2_enhanced.csv"
 MODEL_DIR = ROOT / "models"
 MODEL_DIR.mkdir(exist_ok=True)
 
-# Modelli ottimizzati (priorità massima se disponibili)
-OU_MODEL_PATH_OPT = MODEL_DIR / "bet_ou25_optimized.joblib"
-OU_IMPUTER_PATH_OPT = MODEL_DIR / "imputer_ou25_optimized.joblib"
-OU_META_PATH_OPT = MODEL_DIR / "meta_ou25_optimized.json"
-
-X2_MODEL_PATH_OPT = MODEL_DIR / "bet_1x2_optimized.joblib"
-X2_IMPUTER_PATH_OPT = MODEL_DIR / "imputer_1x2_optimized.joblib"
-X2_META_PATH_OPT = MODEL_DIR / "meta_1x2_optimized.json"
-
-# Modelli originali (fallback)
+# Modelli base (addestrati da --train). La scelta della variante servita
+# (optimized → retrained → base) è in model_registry.
 OU_MODEL_PATH = MODEL_DIR / "bet_ou25.joblib"
 OU_SCALER_PATH = MODEL_DIR / "scaler_ou25.joblib"
 OU_IMPUTER_PATH = MODEL_DIR / "imputer_ou25.joblib"
@@ -242,29 +238,8 @@ def _normalize_odds_probs(o1: Optional[float], ox: Optional[float], o2: Optional
 
 
 def _prob_from_lambda(lambda_home: float, lambda_away: float, max_goals: int = 8) -> Tuple[float, float, float]:
-    p1 = px = p2 = 0.0
-    for hg in range(max_goals + 1):
-        from math import exp, factorial
-        try:
-            ph = exp(-lambda_home) * (lambda_home ** hg) / factorial(hg)
-        except Exception:
-            ph = 0.0
-        for ag in range(max_goals + 1):
-            try:
-                pa = exp(-lambda_away) * (lambda_away ** ag) / factorial(ag)
-            except Exception:
-                pa = 0.0
-            prob = ph * pa
-            if hg > ag:
-                p1 += prob
-            elif hg == ag:
-                px += prob
-            else:
-                p2 += prob
-    tot = p1 + px + p2
-    if tot > 0:
-        p1, px, p2 = p1 / tot, px / tot, p2 / tot
-    return p1, px, p2
+    p1, px, p2 = outcome_probs(score_tensor(lambda_home, lambda_away, max_goals))
+    return float(p1[0]), float(px[0]), float(p2[0])
 
 # =========================
 # UTILS
@@ -323,13 +298,6 @@ def _encode_1x2_target(y: pd.Series) -> np.ndarray:
     return np.array([mapping.get(str(v).upper(), np.nan) for v in y], dtype=float)
 
 
-def _poisson_prob(lmbd: float, k: int) -> float:
-    """Calcola probabilità Poisson: P(X=k) con lambda lmbd."""
-    from math import exp, factorial
-    if lmbd <= 0: return 0.0
-    try: return exp(-lmbd) * (lmbd ** k) / factorial(k)
-    except: return 0.0
-
 def _build_components(algo: str, task: str):
     """
     Ritorna (model, imputer, scaler) per l'algoritmo richiesto.
@@ -354,13 +322,12 @@ def _build_components(algo: str, task: str):
                 random_state=42,
             )
         elif task == "multiclass":
-            model = LogisticRegression(
-                max_iter=1500,
-                solver="lbfgs",
-                multi_class="multinomial",
-                class_weight="balanced",
-                random_state=42,
-            )
+            params = dict(max_iter=1500, solver="lbfgs", class_weight="balanced", random_state=42)
+            try:
+                model = LogisticRegression(multi_class="multinomial", **params)
+            except TypeError:
+                # scikit-learn >= 1.7: multi_class rimosso, lbfgs è già multinomiale
+                model = LogisticRegression(**params)
         else:
             raise ValueError(f"Task sconosciuto: {task}")
         return model, imputer, scaler
@@ -395,28 +362,6 @@ def _build_components(algo: str, task: str):
     raise ValueError(f"Algoritmo non supportato: {algo}")
 
 
-def _poisson_1x2_probs(lambda_home: float, lambda_away: float, max_goals: int = 8) -> Tuple[float, float, float]:
-    """Calcola probabilità 1X2 usando modello Poisson completo."""
-    p1 = px = p2 = 0.0
-    
-    for hg in range(max_goals + 1):
-        ph = _poisson_prob(lambda_home, hg)
-        for ag in range(max_goals + 1):
-            pa = _poisson_prob(lambda_away, ag)
-            p = ph * pa
-            if hg > ag:
-                p1 += p
-            elif hg == ag:
-                px += p
-            else:
-                p2 += p
-    
-    total = p1 + px + p2
-    if total > 0:
-        return p1/total, px/total, p2/total
-    return 0.33, 0.34, 0.33 # Neutral default if total is zero
-
-
 def _create_dummy_models_from_data(df: pd.DataFrame):
     """Crea modelli dummy intelligenti usando i dati reali disponibili."""
     # Prepara features
@@ -438,17 +383,9 @@ def _create_dummy_models_from_data(df: pd.DataFrame):
         lambda_h = ((xg_h + xga_a) / 2.0 * 1.12).clip(0.3, 4.0) # type: ignore
         lambda_a = ((xg_a + xga_h) / 2.0 * 0.95).clip(0.3, 4.0)
         
-        # Calcola probabilità Over 2.5
-        p_over_list = []
-        for lh, la in zip(lambda_h, lambda_a):
-            p_over = 0.0
-            for hg in range(9):
-                for ag in range(9):
-                    if hg + ag > 2.5:
-                        p_over += _poisson_prob(lh, hg) * _poisson_prob(la, ag)
-            p_over_list.append(1.0 if p_over > 0.5 else 0.0)
-
-        y_ou = np.array(p_over_list)
+        # Calcola probabilità Over 2.5 (tutte le partite in un colpo)
+        score_m = score_tensor(lambda_h.to_numpy(dtype=float), lambda_a.to_numpy(dtype=float))
+        y_ou = (over_prob(score_m, 2.5) > 0.5).astype(float)
         X_ou = df_num[cols].fillna(0)
 
         imputer_ou = SimpleImputer(strategy="median")
@@ -470,17 +407,11 @@ def _create_dummy_models_from_data(df: pd.DataFrame):
         lambda_h = ((xg_h + xga_a) / 2.0 * 1.12).clip(0.3, 4.0) # type: ignore
         lambda_a = ((xg_a + xga_h) / 2.0 * 0.95).clip(0.3, 4.0)
 
-        y_1x2_list = []
-        for lh, la in zip(lambda_h, lambda_a):
-            p1, px, p2 = _poisson_1x2_probs(lh, la)
-            if p1 > px and p1 > p2:
-                y_1x2_list.append(0)  # 1
-            elif px > p1 and px > p2:
-                y_1x2_list.append(1)  # X
-            else:
-                y_1x2_list.append(2)  # 2
-
-        y_1x2 = np.array(y_1x2_list)
+        p1, px, p2 = outcome_probs(
+            score_tensor(lambda_h.to_numpy(dtype=float), lambda_a.to_numpy(dtype=float))
+        )
+        # 0 = 1, 1 = X, 2 = 2
+        y_1x2 = np.where((p1 > px) & (p1 > p2), 0, np.where((px > p1) & (px > p2), 1, 2))
         X_1x2 = df_num[cols].fillna(0)
 
         imputer_1x2 = SimpleImputer(strategy="median")
@@ -529,6 +460,7 @@ def _determine_cv_splits(y: np.ndarray, max_splits: int = 5) -> int:
 # =========================
 # TRAINING
 # =========================
+@instrument("train_ou")
 def train_ou25(algo: str = "logistic"):
     if not HIST_OU_PATH.exists():
         print(f"[ERR] Storico OU non trovato: {HIST_OU_PATH}")
@@ -536,7 +468,7 @@ def train_ou25(algo: str = "logistic"):
         sys.exit(1)
     
     try:
-        df = pd.read_csv(HIST_OU_PATH)
+        df = load_dataset(HIST_OU_PATH)
         df = _standardize_cols(df)
     except Exception as e:
         print(f"[ERR] Errore lettura {HIST_OU_PATH}: {e}")
@@ -598,6 +530,7 @@ def train_ou25(algo: str = "logistic"):
         X_proc = scaler.transform(X_proc)
         X_proc = pd.DataFrame(X_proc, columns=cols)
 
+    count("rows", len(y))
     model.fit(X_proc, y)
 
     try:
@@ -620,11 +553,12 @@ def train_ou25(algo: str = "logistic"):
         sys.exit(1)
 
 
+@instrument("train_1x2")
 def train_1x2(algo: str = "logistic"):
     if not HIST_1X2_PATH.exists():
         print(f"[ERR] Storico 1X2 non trovato: {HIST_1X2_PATH}")
         sys.exit(1)
-    df = pd.read_csv(HIST_1X2_PATH)
+    df = load_dataset(HIST_1X2_PATH)
     df = _standardize_cols(df)
     df = _ensure_target_1x2(df)
 
@@ -679,6 +613,7 @@ def train_1x2(algo: str = "logistic"):
         X_proc = scaler.transform(X_proc)
         X_proc = pd.DataFrame(X_proc, columns=cols)
 
+    count("rows", len(y))
     model.fit(X_proc, y)
 
     joblib.dump(imputer, X2_IMPUTER_PATH)
@@ -699,17 +634,6 @@ def train_1x2(algo: str = "logistic"):
 # =========================
 # PREDICTION
 # =========================
-def _load_model_triplet(
-    model_p: Path, scaler_p: Path, imputer_p: Path
-) -> Tuple[Optional[Any], Optional[Any], Optional[Any]]:
-    model = joblib.load(model_p) if model_p.exists() else None
-    if model is None:
-        return None, None, None
-    imputer = joblib.load(imputer_p) if imputer_p.exists() else None
-    scaler = joblib.load(scaler_p) if scaler_p.exists() else None
-    return imputer, scaler, model
-
-
 def _predict_ou_row(
     r: pd.Series,
     feats: List[str],
@@ -872,125 +796,16 @@ def _predict_1x2_row(
         return _fallback_1x2_prob(r)
 
 
-def load_data_from_db(date_str: str, comps: Optional[List[str]] = None) -> pd.DataFrame:
-    """Carica i dati necessari (fixtures, features, odds) dal database per una data specifica."""
-    db = SessionLocal()
-    try:
-        # Query per fixtures
-        fix_query = db.query(Fixture).filter(Fixture.date == date_str)
-        if comps:
-            fix_query = fix_query.filter(Fixture.league_code.in_(comps))
-        
-        fix_df = pd.read_sql(fix_query.statement, db.bind)
-        if fix_df.empty:
-            print(f"[INFO] Nessuna partita trovata nel DB per il {date_str} con i filtri specificati.")
-            return pd.DataFrame()
-
-        match_ids = fix_df['match_id'].tolist()
-
-        # Query per features e odds
-        fea_df = pd.read_sql(db.query(Feature).filter(Feature.match_id.in_(match_ids)).statement, db.bind)
-        odds_df = pd.read_sql(db.query(Odds).filter(Odds.match_id.in_(match_ids)).statement, db.bind)
-
-        if fea_df.empty:
-            print(f"[WARN] Nessuna feature trovata per le partite del {date_str}. Impossibile procedere.")
-            return pd.DataFrame()
-
-        # Merge dei dati
-        df = pd.merge(fix_df, fea_df, on="match_id", how="inner")
-        if not odds_df.empty:
-            df = pd.merge(df, odds_df, on="match_id", how="left")
-
-        # Carica e merge advanced features dal CSV
-        adv_features_path = Path("data/advanced_features.csv")
-        if adv_features_path.exists():
-            try:
-                adv_df = pd.read_csv(adv_features_path)
-                if not adv_df.empty and 'match_id' in adv_df.columns:
-                    # Merge advanced features
-                    df = pd.merge(df, adv_df, on="match_id", how="left", suffixes=('', '_adv'))
-                    print(f"[INFO] ✅ Caricati dati avanzati da {adv_features_path}")
-            except Exception as e:
-                print(f"[WARN] Errore caricamento advanced_features.csv: {e}")
-
-        return df
-    finally:
-        db.close()
-
-
-def predict_and_report(date_str: str, comps: Optional[List[str]] = None):
-    try:
-        df = load_data_from_db(date_str, comps)
-    except Exception as e:
-        print(f"[ERR] Errore caricamento dati: {e}")
-        sys.exit(1)
-    
-    if df.empty:
-        print("[ERR] Nessun match da predire. Verifica fixtures.csv e features.csv")
-        sys.exit(1)
-
-    # Carica modelli OTTIMIZZATI con priorità (fallback a modelli originali)
-    # Prova prima con modelli ottimizzati
-    if X2_MODEL_PATH_OPT.exists():
-        x2_imputer, _, x2_clf = _load_model_triplet(
-            X2_MODEL_PATH_OPT, Path("dummy"), X2_IMPUTER_PATH_OPT
-        )
-        x2_scaler = None  # I modelli ottimizzati non usano scaler
-        print("[INFO] 🚀 Usando modello 1X2 OTTIMIZZATO")
-    else:
-        x2_imputer, x2_scaler, x2_clf = _load_model_triplet(
-            X2_MODEL_PATH, X2_SCALER_PATH, X2_IMPUTER_PATH
-        )
-
-    if OU_MODEL_PATH_OPT.exists():
-        ou_imputer, _, ou_clf = _load_model_triplet(
-            OU_MODEL_PATH_OPT, Path("dummy"), OU_IMPUTER_PATH_OPT
-        )
-        ou_scaler = None  # I modelli ottimizzati non usano scaler
-        print("[INFO] 🚀 Usando modello OU OTTIMIZZATO")
-    else:
-        ou_imputer, ou_scaler, ou_clf = _load_model_triplet(
-            OU_MODEL_PATH, OU_SCALER_PATH, OU_IMPUTER_PATH
-        )
-
-    if ou_clf is None:
-        print("[WARN] Modello OU 2.5 non trovato. Esegui: python model_pipeline.py --train-ou")
-    if x2_clf is None:
-        print("[WARN] Modello 1X2 non trovato. Uso fallback (quote o xG) per calcolare probabilità 1X2.")
-
-    # Carica feature list dai meta (priorità a meta ottimizzati)
-    ou_feats = FEATURES_OU
-    x2_feats = FEATURES_1X2
-    ou_meta: Dict[str, Any] = {}
-    x2_meta: Dict[str, Any] = {}
-    try:
-        # Carica meta ottimizzati se disponibili, altrimenti originali
-        if OU_META_PATH_OPT.exists():
-            ou_meta = json.loads(OU_META_PATH_OPT.read_text())
-            ou_feats = [c for c in ou_meta.get("features", []) if c in df.columns]
-        elif OU_META_PATH.exists():
-            ou_meta = json.loads(OU_META_PATH.read_text())
-            ou_feats = [c for c in ou_meta.get("features", []) if c in df.columns]
-
-        if X2_META_PATH_OPT.exists():
-            x2_meta = json.loads(X2_META_PATH_OPT.read_text())
-            x2_feats = [c for c in x2_meta.get("features", []) if c in df.columns]
-        elif X2_META_PATH.exists():
-            x2_meta = json.loads(X2_META_PATH.read_text())
-            x2_feats = [c for c in x2_meta.get("features", []) if c in df.columns]
-    except Exception as e:
-        warnings.warn(f"Impossibile leggere meta modelli: {e}")
-
-    if ou_clf is not None and ou_meta.get("algo"):
-        print(
-            f"[INFO] Modello OU: {ou_meta.get('algo')} "
-            f"(n={ou_meta.get('n_samples', '?')}, CV splits={ou_meta.get('cv_splits', '?')})"
-        )
-    if x2_clf is not None and x2_meta.get("algo"):
-        print(
-            f"[INFO] Modello 1X2: {x2_meta.get('algo')} "
-            f"(n={x2_meta.get('n_samples', '?')}, CV splits={x2_meta.get('cv_splits', '?')})"
-        )
+def _build_predictions_rowwise(
+    df: pd.DataFrame,
+    x2_model: Tuple[Optional[Any], Optional[Any], Optional[Any]],
+    x2_feats: List[str],
+    ou_model: Tuple[Optional[Any], Optional[Any], Optional[Any]],
+    ou_feats: List[str],
+) -> pd.DataFrame:
+    """Percorso originale: una predizione (e una chiamata al modello) per match."""
+    x2_imputer, x2_scaler, x2_clf = x2_model
+    ou_imputer, ou_scaler, ou_clf = ou_model
 
     rows = []
     for _, r in df.iterrows():
@@ -1123,8 +938,363 @@ def predict_and_report(date_str: str, comps: Optional[List[str]] = None):
             }
         )
 
-    out = pd.DataFrame(rows)
+    return pd.DataFrame(rows)
+
+
+def _feature_matrix(df: pd.DataFrame, feats: List[str]) -> pd.DataFrame:
+    """
+    Matrice feature (n_match × n_feat) con la stessa coercizione di _predict_*_row:
+    colonne mancanti → 0, valori non numerici → NaN (poi gestiti dall'imputer).
+    """
+    data = {
+        c: pd.to_numeric(df[c], errors="coerce") if c in df.columns else 0
+        for c in feats
+    }
+    return pd.DataFrame(data, index=df.index, columns=feats)
+
+
+def _batch_predict_proba(
+    df: pd.DataFrame,
+    feats: List[str],
+    imputer: Optional[Any],
+    scaler: Optional[Any],
+    clf: Any,
+) -> np.ndarray:
+    """Una sola chiamata imputer → scaler → predict_proba per tutti i match."""
+    x = _feature_matrix(df, feats)
+    if imputer is not None:
+        xs = imputer.transform(x)
+    else:
+        xs = x.to_numpy()
+    if scaler is not None:
+        xs = scaler.transform(xs)
+    return np.asarray(clf.predict_proba(xs), dtype=float)
+
+
+def _predict_ou_batch(
+    df: pd.DataFrame,
+    feats: List[str],
+    imputer: Optional[Any],
+    scaler: Optional[Any],
+    clf: Any,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Versione vettoriale di _predict_ou_row. Ritorna (p_over, p_under)."""
+    try:
+        proba = _batch_predict_proba(df, feats, imputer, scaler, clf)
+    except Exception as e:
+        # Batch fallito: isola le righe problematiche col percorso riga per riga
+        warnings.warn(f"Predizione OU batch fallita ({e}), ripiego riga per riga.")
+        pairs = [_predict_ou_row(r, feats, imputer, scaler, clf) for _, r in df.iterrows()]
+        arr = np.array(pairs, dtype=float).reshape(-1, 2)
+        return arr[:, 0], arr[:, 1]
+
+    if proba.shape[1] == 2:
+        p_over = proba[:, 1]  # class 1 = Over
+    elif proba.shape[1] > 0:
+        p_over = proba[:, 0]
+    else:
+        p_over = np.full(len(df), 0.5)
+    p_over = np.clip(p_over, 0.0, 1.0)
+    p_under = np.clip(1.0 - p_over, 0.0, 1.0)
+    return p_over, p_under
+
+
+def _predict_1x2_batch(
+    df: pd.DataFrame,
+    feats: List[str],
+    imputer: Optional[Any],
+    scaler: Optional[Any],
+    clf: Any,
+) -> np.ndarray:
+    """
+    Versione vettoriale di _predict_1x2_row. Ritorna una matrice (n, 3) [p1, px, p2].
+    Se il modello fallisce, _fallback_1x2_prob viene usato solo sulle righe coinvolte.
+    """
+    try:
+        proba = _batch_predict_proba(df, feats, imputer, scaler, clf)
+    except Exception as e:
+        warnings.warn(f"Predizione 1X2 batch fallita ({e}), ripiego riga per riga.")
+        probs = [_predict_1x2_row(r, feats, imputer, scaler, clf) for _, r in df.iterrows()]
+        return np.array(probs, dtype=float).reshape(-1, 3)
+
+    if proba.shape[1] != 3:
+        # modello non multinomiale? Fail-safe su tutte le righe
+        probs = [_fallback_1x2_prob(r) for _, r in df.iterrows()]
+        return np.array(probs, dtype=float).reshape(-1, 3)
+
+    total = proba[:, 0] + proba[:, 1] + proba[:, 2]
+    ok = total > 0
+    proba[ok] = proba[ok] / total[ok, None]
+    return np.clip(proba, 0.0, 1.0)
+
+
+def _round_or_none(values: np.ndarray, ndigits: int = 4) -> List[Optional[float]]:
+    """round() Python elemento per elemento (NaN → None), identico al percorso riga per riga."""
+    return [None if v != v else round(float(v), ndigits) for v in values]
+
+
+def _value_array(p: np.ndarray, o: np.ndarray) -> np.ndarray:
+    """Value (o-1)*p-(1-p) arrotondato a 4 decimali; NaN dove manca p o la quota."""
+    with np.errstate(invalid="ignore"):
+        v = (o - 1) * p - (1 - p)
+    return np.array([np.nan if x is None else x for x in _round_or_none(v)], dtype=float)
+
+
+def _kelly_array(p: np.ndarray, o: np.ndarray, cut: float = 0.5) -> np.ndarray:
+    """Versione vettoriale di _kelly (stessi bordi e stesso arrotondamento)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        valid = (o > 1.0) & (p > 0) & (p < 1)
+        b = o - 1.0
+        f = (b * p - (1 - p)) / b
+        k = np.where(valid, np.maximum(0.0, f * cut), 0.0)
+    return np.array([round(float(x), 4) for x in k], dtype=float)
+
+
+def _column_or(df: pd.DataFrame, *names: str) -> List[Any]:
+    """Equivalente vettoriale di r.get(a, r.get(b)): prima colonna esistente, altrimenti None."""
+    for name in names:
+        if name in df.columns:
+            return df[name].tolist()
+    return [None] * len(df)
+
+
+def _odds_array(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def _build_predictions_batch(
+    df: pd.DataFrame,
+    x2_model: Tuple[Optional[Any], Optional[Any], Optional[Any]],
+    x2_feats: List[str],
+    ou_model: Tuple[Optional[Any], Optional[Any], Optional[Any]],
+    ou_feats: List[str],
+) -> pd.DataFrame:
+    """
+    Percorso batch: una matrice feature per tutti i match, imputer/scaler/modello
+    chiamati una volta per modello, value/Kelly/pick calcolati come operazioni su array.
+    Produce le stesse colonne (e gli stessi valori) di _build_predictions_rowwise.
+    """
+    x2_imputer, x2_scaler, x2_clf = x2_model
+    ou_imputer, ou_scaler, ou_clf = ou_model
+    n = len(df)
+
+    # --- Probabilità ML ---
+    if x2_clf is not None and x2_feats:
+        P = _predict_1x2_batch(df, x2_feats, x2_imputer, x2_scaler, x2_clf)
+    else:
+        P = np.array([_fallback_1x2_prob(r) for _, r in df.iterrows()], dtype=float).reshape(-1, 3)
+    p1, px, p2 = P[:, 0], P[:, 1], P[:, 2]
+
+    if ou_clf is not None and ou_feats:
+        p_over, p_under = _predict_ou_batch(df, ou_feats, ou_imputer, ou_scaler, ou_clf)
+    else:
+        p_over, p_under = np.full(n, np.nan), np.full(n, np.nan)
+
+    # --- Value & Picks (quote opzionali) ---
+    o1, ox, o2 = _odds_array(df, "odds_1"), _odds_array(df, "odds_x"), _odds_array(df, "odds_2")
+    oo, ou_ = _odds_array(df, "odds_ou25_over"), _odds_array(df, "odds_ou25_under")
+
+    V = np.column_stack([_value_array(p1, o1), _value_array(px, ox), _value_array(p2, o2)])
+    O = np.column_stack([o1, ox, o2])
+    vov = _value_array(p_over, oo)
+    vun = _value_array(p_under, ou_)
+
+    # 1X2: segno con value maggiore (primo in caso di parità) e >= 0
+    has_cand = ~np.isnan(V).all(axis=1)
+    best = np.argmax(np.where(np.isnan(V), -np.inf, V), axis=1)
+    rows_idx = np.arange(n)
+    best_val = V[rows_idx, best]
+    with np.errstate(invalid="ignore"):
+        bet_1x2 = has_cand & (best_val >= 0)
+    kelly_best = _kelly_array(P[rows_idx, best], O[rows_idx, best])
+    pick_1x2 = np.where(bet_1x2, np.array(["1", "X", "2"])[best], "NoBet")
+    kelly_1x2 = np.where(bet_1x2, kelly_best, 0.0)
+
+    # OU 2.5
+    with np.errstate(invalid="ignore"):
+        over = (
+            ~np.isnan(vov)
+            & (np.isnan(vun) | (vov >= vun))
+            & (vov >= 0)
+            & ~np.isnan(p_over)
+            & ~np.isnan(oo) & (oo != 0)
+        )
+        under = ~over & ~np.isnan(vun) & (vun >= 0) & ~np.isnan(p_under) & ~np.isnan(ou_) & (ou_ != 0)
+    pick_ou25 = np.select([over, under], ["Over 2.5", "Under 2.5"], default="NoBet")
+    kelly_ou25 = np.select(
+        [over, under], [_kelly_array(p_over, oo), _kelly_array(p_under, ou_)], default=0.0
+    )
+
+    # Previsione 1X2 leggibile (segno con probabilità maggiore)
+    n1, nx, n2 = np.isnan(p1), np.isnan(px), np.isnan(p2)
+    with np.errstate(invalid="ignore"):
+        c1 = ~n1 & (nx | (p1 >= px)) & (n2 | (p1 >= p2))
+        cx = ~nx & (n1 | (px >= p1)) & (n2 | (px >= p2))
+    prev_1x2 = np.select([n1 & nx & n2, c1, cx, ~n2], ["N/A", "1", "X", "2"], default="N/A")
+
+    def _pct(a: np.ndarray) -> List[str]:
+        return [f"{v*100:.1f}%" if not np.isnan(v) else "N/A" for v in a]
+
+    def _opt(a: np.ndarray) -> List[Optional[float]]:
+        return [None if np.isnan(v) else float(v) for v in a]
+
+    with np.errstate(invalid="ignore"):
+        over_yes = ~np.isnan(p_over) & (p_over > 0.5)
+        under_yes = ~np.isnan(p_under) & (p_under > 0.5)
+
+    return pd.DataFrame(
+        {
+            "match_id": _column_or(df, "match_id"),
+            "date": _column_or(df, "date"),
+            "time": _column_or(df, "time_local", "time"),
+            "league": _column_or(df, "league", "league_code"),
+            "home": _column_or(df, "home"),
+            "away": _column_or(df, "away"),
+            # Previsioni leggibili
+            "Previsione_1X2": prev_1x2.tolist(),
+            "Prob_1": _pct(p1),
+            "Prob_X": _pct(px),
+            "Prob_2": _pct(p2),
+            "Over_2.5": np.where(over_yes, "Sì", "No").tolist(),
+            "Under_2.5": np.where(under_yes, "Sì", "No").tolist(),
+            # Prob 1X2 ML (raw per calcoli)
+            "p1": _round_or_none(p1),
+            "px": _round_or_none(px),
+            "p2": _round_or_none(p2),
+            # Quote 1X2
+            "odds_1": _opt(o1),
+            "odds_x": _opt(ox),
+            "odds_2": _opt(o2),
+            # Value 1X2
+            "value_1": _opt(V[:, 0]),
+            "value_x": _opt(V[:, 1]),
+            "value_2": _opt(V[:, 2]),
+            "pick_1x2": pick_1x2.tolist(),
+            "kelly_1x2": [float(k) for k in kelly_1x2],
+            # Prob OU ML (raw)
+            "p_over_2_5": _round_or_none(p_over),
+            "p_under_2_5": _round_or_none(p_under),
+            # Quote OU
+            "odds_ou25_over": _opt(oo),
+            "odds_ou25_under": _opt(ou_),
+            # Value OU
+            "value_ou_over": _opt(vov),
+            "value_ou_under": _opt(vun),
+            "pick_ou25": pick_ou25.tolist(),
+            "kelly_ou25": [float(k) for k in kelly_ou25],
+        }
+    )
+
+
+def load_data_from_db(date_str: str, comps: Optional[List[str]] = None) -> pd.DataFrame:
+    """Carica i dati necessari (fixtures, features, odds) dal database per una data specifica."""
+    db = SessionLocal()
+    try:
+        # Query per fixtures
+        fix_query = db.query(Fixture).filter(Fixture.date == date_str)
+        if comps:
+            fix_query = fix_query.filter(Fixture.league_code.in_(comps))
+        
+        fix_df = pd.read_sql(fix_query.statement, db.bind)
+        if fix_df.empty:
+            print(f"[INFO] Nessuna partita trovata nel DB per il {date_str} con i filtri specificati.")
+            return pd.DataFrame()
+
+        match_ids = fix_df['match_id'].tolist()
+
+        # Query per features e odds
+        fea_df = pd.read_sql(db.query(Feature).filter(Feature.match_id.in_(match_ids)).statement, db.bind)
+        odds_df = pd.read_sql(db.query(Odds).filter(Odds.match_id.in_(match_ids)).statement, db.bind)
+
+        if fea_df.empty:
+            print(f"[WARN] Nessuna feature trovata per le partite del {date_str}. Impossibile procedere.")
+            return pd.DataFrame()
+
+        # Merge dei dati
+        df = pd.merge(fix_df, fea_df, on="match_id", how="inner")
+        if not odds_df.empty:
+            df = pd.merge(df, odds_df, on="match_id", how="left")
+
+        # Carica e merge advanced features dal CSV
+        adv_features_path = Path("data/advanced_features.csv")
+        if adv_features_path.exists():
+            try:
+                adv_df = pd.read_csv(adv_features_path)
+                if not adv_df.empty and 'match_id' in adv_df.columns:
+                    # Merge advanced features
+                    df = pd.merge(df, adv_df, on="match_id", how="left", suffixes=('', '_adv'))
+                    print(f"[INFO] ✅ Caricati dati avanzati da {adv_features_path}")
+            except Exception as e:
+                print(f"[WARN] Errore caricamento advanced_features.csv: {e}")
+
+        return df
+    finally:
+        db.close()
+
+
+@instrument("predict")
+def predict_and_report(date_str: str, comps: Optional[List[str]] = None, batch: bool = True):
+    """
+    Predizioni 1X2/OU per una data → predictions.csv + report.html.
+    batch=True (default) usa il percorso vettoriale; batch=False il vecchio ciclo per riga.
+    """
+    try:
+        df = load_data_from_db(date_str, comps)
+    except Exception as e:
+        print(f"[ERR] Errore caricamento dati: {e}")
+        sys.exit(1)
+    
+    if df.empty:
+        print("[ERR] Nessun match da predire. Verifica fixtures.csv e features.csv")
+        sys.exit(1)
+
+    # Modelli dal registro: variante optimized → retrained → base, cache di processo
+    x2_art = get_model("1x2")
+    ou_art = get_model("ou")
+    x2_imputer, x2_scaler, x2_clf = x2_art.triplet() if x2_art else (None, None, None)
+    ou_imputer, ou_scaler, ou_clf = ou_art.triplet() if ou_art else (None, None, None)
+
+    if ou_clf is None:
+        print("[WARN] Modello OU 2.5 non trovato. Esegui: python model_pipeline.py --train-ou")
+    if x2_clf is None:
+        print("[WARN] Modello 1X2 non trovato. Uso fallback (quote o xG) per calcolare probabilità 1X2.")
+
+    # Feature list dai meta della variante servita (+ feature derivate che richiede)
+    ou_feats = FEATURES_OU
+    x2_feats = FEATURES_1X2
+    ou_meta: Dict[str, Any] = ou_art.meta if ou_art else {}
+    x2_meta: Dict[str, Any] = x2_art.meta if x2_art else {}
+    if ou_art and ou_art.features:
+        df = ou_art.prepare(df)
+        ou_feats = [c for c in ou_art.features if c in df.columns]
+    if x2_art and x2_art.features:
+        df = x2_art.prepare(df)
+        x2_feats = [c for c in x2_art.features if c in df.columns]
+
+    if ou_clf is not None:
+        print(
+            f"[INFO] Modello OU: {ou_art.version} {ou_meta.get('algo', '')} "
+            f"(n={ou_meta.get('n_samples', '?')}, CV splits={ou_meta.get('cv_splits', '?')})"
+        )
+    if x2_clf is not None:
+        print(
+            f"[INFO] Modello 1X2: {x2_art.version} {x2_meta.get('algo', '')} "
+            f"(n={x2_meta.get('n_samples', '?')}, CV splits={x2_meta.get('cv_splits', '?')})"
+        )
+
+    x2_model = (x2_imputer, x2_scaler, x2_clf)
+    ou_model = (ou_imputer, ou_scaler, ou_clf)
+    if batch:
+        out = _build_predictions_batch(df, x2_model, x2_feats, ou_model, ou_feats)
+    else:
+        out = _build_predictions_rowwise(df, x2_model, x2_feats, ou_model, ou_feats)
+    # Versione del modello che ha servito le probabilità ("fallback" = quote/xG)
+    out["model_1x2"] = x2_art.version if x2_clf is not None and x2_feats else "fallback"
+    out["model_ou"] = ou_art.version if ou_clf is not None and ou_feats else "fallback"
     out.to_csv(PRED_PATH, index=False)
+    count("rows", len(out))
     print(f"[OK] predictions.csv scritto ({len(out)} righe).")
 
     # Report HTML leggibile con colonne principali
@@ -1259,6 +1429,11 @@ def main():
     ap.add_argument(
         "--comps", help="Filtra competizioni per le previsioni, es. 'SA,PL,CL'"
     )
+    ap.add_argument(
+        "--no-batch",
+        action="store_true",
+        help="Predizione riga per riga (percorso originale, più lento) invece del batch vettoriale",
+    )
     ap.add_argument(
         "--algo",
         choices=["logistic", "lgbm"],
@@ -1327,7 +1502,7 @@ def main():
             sys.exit(1)
         
         comps_list = [c.strip().upper() for c in args.comps.split(",")] if args.comps else None
-        predict_and_report(date_str=args.date, comps=comps_list)
+        predict_and_report(date_str=args.date, comps=comps_list, batch=not args.no_batch)
 
 
 
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+model_registry.py
+-----------------
+Registro dei modelli ML (OU 2.5 e 1X2) condiviso da model_pipeline,
+predictions_generator e dall'app Flask.
+
+- un solo punto decide quale variante usare: optimized → retrained → base
+  (la prima con il file del modello presente)
+- ogni variante viene caricata una volta per processo: la chiave della cache è
+  (percorso, mtime, dimensione) di modello, imputer, scaler e meta
+- a ogni richiesta si fa solo stat() dei file: se un artefatto cambia o compare
+  una variante con priorità più alta (es. optimize_models.py appena finito)
+  il registro la ricarica da solo, senza riavviare il processo
+- ogni artefatto ha una versione leggibile "variante:sha1[:10]" da allegare
+  alle predizioni
+
+Le varianti non sono tutte uguali:
+- optimized: niente scaler
+- retrained (retrain_ml_models.py): niente scaler, feature derivate
+  xg_total/xg_diff/xg_ratio/ppda_diff e classi 1X2 {1: casa, 0: pari, 2: ospite}
+Il registro nasconde queste differenze: prepare() aggiunge le feature derivate
+mancanti e il classificatore restituito ha sempre le colonne di predict_proba
+nell'ordine [1, X, 2] (OU: [Under, Over]).
+
+Uso:
+    from model_registry import get_model
+    art = get_model("1x2")          # None se nessuna variante è disponibile
+    art.imputer, art.scaler, art.clf, art.features, art.version
+
+CLI:
+    python model_registry.py          # varianti disponibili e versione servita
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent
+MODEL_DIR = ROOT / "models"
+
+# Ordine di priorità delle varianti, uguale per tutti i consumatori
+VARIANTS = ("optimized", "retrained", "base")
+MARKETS = {"ou": "ou25", "1x2": "1x2"}
+
+# Etichette delle classi nell'ordine canonico delle colonne di predict_proba
+CANONICAL_LABELS = {
+    "ou": {"base": (0, 1), "optimized": (0, 1), "retrained": (0, 1)},          # Under, Over
+    "1x2": {"base": (0, 1, 2), "optimized": (0, 1, 2), "retrained": (1, 0, 2)},  # 1, X, 2
+}
+
+
+class VariantPaths(NamedTuple):
+    model: Path
+    imputer: Path
+    scaler: Optional[Path]
+    meta: Path
+
+
+def variant_paths(market: str, variant: str, model_dir: Path = MODEL_DIR) -> VariantPaths:
+    tag = MARKETS[market]
+    suffix = "" if variant == "base" else f"_{variant}"
+    return VariantPaths(
+        model=model_dir / f"bet_{tag}{suffix}.joblib",
+        imputer=model_dir / f"imputer_{tag}{suffix}.joblib",
+        # solo i modelli base sono addestrati con lo scaler
+        scaler=model_dir / f"scaler_{tag}.joblib" if variant == "base" else None,
+        meta=model_dir / f"meta_{tag}{suffix}.json",
+    )
+
+
+def add_retrained_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Feature derivate di retrain_ml_models.py (stessi default per i valori mancanti)."""
+    out = df.copy()
+
+    def col(name, default):
+        if name in out.columns:
+            return pd.to_numeric(out[name], errors="coerce").fillna(default)
+        return pd.Series(default, index=out.index, dtype="float64")
+
+    xg_h, xg_a = col("xg_for_home", 1.4), col("xg_for_away", 1.4)
+    derived = {
+        "xg_total": xg_h + xg_a,
+        "xg_diff": xg_h - xg_a,
+        "xg_ratio": xg_h / (xg_a + 0.01),
+        "ppda_diff": col("style_ppda_home", 10) - col("style_ppda_away", 10),
+    }
+    for name, values in derived.items():
+        if name not in out.columns:
+            out[name] = values
+    return out
+
+
+DERIVED_FEATURES = {"retrained": add_retrained_features}
+
+
+class _CanonicalClassifier:
+    """Riordina le colonne di predict_proba nell'ordine canonico del mercato."""
+
+    def __init__(self, model, order: List[int]):
+        self.model = model
+        self.order = order
+        self.classes_ = np.arange(len(order))
+
+    def predict_proba(self, X):
+        return np.asarray(self.model.predict_proba(X))[:, self.order]
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def _canonical_clf(model, labels: Tuple[int, ...]):
+    classes = list(getattr(model, "classes_", range(len(labels))))
+    try:
+        order = [classes.index(lbl) for lbl in labels]
+    except ValueError:
+        return model
+    if order == list(range(len(classes))):
+        return model
+    return _CanonicalClassifier(model, order)
+
+
+class ModelArtifact:
+    """Modello caricato con imputer/scaler/meta e la versione che lo identifica."""
+
+    def __init__(self, market: str, variant: str, paths: VariantPaths, model, imputer, scaler,
+                 meta: Dict[str, Any], sha1: str, key: Tuple):
+        self.market = market
+        self.variant = variant
+        self.paths = paths
+        self.model = model
+        self.clf = _canonical_clf(model, CANONICAL_LABELS[market][variant])
+        self.imputer = imputer
+        self.scaler = scaler
+        self.meta = meta
+        self.sha1 = sha1
+        self.key = key
+        self.version = f"{variant}:{sha1[:10]}"
+
+    @property
+    def features(self) -> List[str]:
+        return list(self.meta.get("features", []))
+
+    def triplet(self) -> Tuple[Any, Any, Any]:
+        """(imputer, scaler, clf) nel formato di model_pipeline."""
+        return self.imputer, self.scaler, self.clf
+
+    def prepare(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Aggiunge al frame le feature derivate richieste dalla variante."""
+        fn = DERIVED_FEATURES.get(self.variant)
+        return fn(df) if fn else df
+
+    def prepare_features(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """Come prepare() ma per un singolo match (dict feature → valore)."""
+        fn = DERIVED_FEATURES.get(self.variant)
+        if not fn:
+            return features
+        row = fn(pd.DataFrame([features])).iloc[0].to_dict()
+        return {**row, **features}
+
+
+def _stat_key(paths: VariantPaths) -> Tuple:
+    key = []
+    for p in paths:
+        if p is not None and p.exists():
+            st = p.stat()
+            key.append((str(p), st.st_mtime_ns, st.st_size))
+    return tuple(key)
+
+
+def _sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelRegistry:
+    """Cache di processo degli artefatti, thread-safe, con ricarica a caldo."""
+
+    def __init__(self, model_dir: Path = MODEL_DIR, variants=VARIANTS):
+        self.model_dir = Path(model_dir)
+        self.variants = tuple(variants)
+        self._cache: Dict[Tuple[str, str], ModelArtifact] = {}
+        self._failed: Dict[Tuple[str, str], Tuple] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _load(self, market: str, variant: str, paths: VariantPaths, key: Tuple) -> Optional[ModelArtifact]:
+        try:
+            model = joblib.load(paths.model)
+            imputer = joblib.load(paths.imputer) if paths.imputer.exists() else None
+            scaler = joblib.load(paths.scaler) if paths.scaler is not None and paths.scaler.exists() else None
+            meta = json.loads(paths.meta.read_text(encoding="utf-8")) if paths.meta.exists() else {}
+        except Exception as e:
+            print(f"[WARN] Modello {market}/{variant} non caricabile: {e}")
+            return None
+        self.loads += 1
+        return ModelArtifact(market, variant, paths, model, imputer, scaler, meta, _sha1(paths.model), key)
+
+    def get(self, market: str) -> Optional[ModelArtifact]:
+        """Variante con priorità più alta disponibile per il mercato ("ou" o "1x2")."""
+        if market not in MARKETS:
+            raise ValueError(f"Mercato sconosciuto: {market}")
+        for variant in self.variants:
+            paths = variant_paths(market, variant, self.model_dir)
+            if not paths.model.exists():
+                continue
+            key = _stat_key(paths)
+            with self._lock:
+                cached = self._cache.get((market, variant))
+                if cached is not None and cached.key == key:
+                    return cached
+                if self._failed.get((market, variant)) == key:
+                    continue  # file corrotto e non ancora cambiato: passa alla variante successiva
+                art = self._load(market, variant, paths, key)
+                if art is None:
+                    self._failed[(market, variant)] = key
+                    continue
+                if cached is not None:
+                    print(f"[INFO] Modello {market} ricaricato: {cached.version} → {art.version}")
+                self._cache[(market, variant)] = art
+                self._failed.pop((market, variant), None)
+                return art
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        """Varianti presenti su disco, caricate in memoria e versione servita per mercato."""
+        out = {}
+        for market in MARKETS:
+            served = self.get(market)
+            out[market] = {
+                "served": served.version if served else None,
+                "variants": {
+                    v: {
+                        "available": variant_paths(market, v, self.model_dir).model.exists(),
+                        "loaded": self._cache[(market, v)].version if (market, v) in self._cache else None,
+                    }
+                    for v in self.variants
+                },
+            }
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._failed.clear()
+
+
+_REGISTRY: Optional[ModelRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = ModelRegistry()
+        return _REGISTRY
+
+
+def get_model(market: str) -> Optional[ModelArtifact]:
+    return get_registry().get(market)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Registro modelli ML (optimized → retrained → base)")
+    ap.parse_args()
+    for market, info in get_registry().status().items():
+        print(f"[INFO] {market}: servito {info['served'] or 'nessun modello'}")
+        for variant, v in info["variants"].items():
+            mark = "OK" if v["available"] else "--"
+            print(f"    [{mark}] {variant:<10} {v['loaded'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
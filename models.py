@@ -9,7 +9,9 @@ from sqlalchemy import (
     Float,
     Date,
     ForeignKey,
+    Index,
     UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import relationship
 
@@ -29,11 +31,32 @@ class Fixture(Base):
     away = Column(String)
     result_home_goals = Column(Integer, nullable=True)  # Risultato finale
     result_away_goals = Column(Integer, nullable=True)  # Risultato finale
+    home_team_id = Column(Integer, ForeignKey("teams.id"), nullable=True)  # vedi team_registry.py
+    away_team_id = Column(Integer, ForeignKey("teams.id"), nullable=True)
 
     # Relationships
     feature = relationship("Feature", back_populates="fixture", uselist=False, cascade="all, delete-orphan")
     odds = relationship("Odds", back_populates="fixture", uselist=False, cascade="all, delete-orphan")
 
+    # Indici per i percorsi caldi (creati sui DB esistenti da database.migrate_schema):
+    # - paginazione keyset di /data (date DESC, match_id DESC), con e senza lega
+    # - ultime partite di una squadra per lega (AdvancedFeatureCalculator) e senza lega
+    #   (ContextAnalyzerV2, per team_id o nome esatto): una ricerca sull'indice per lato
+    # - partite giocate in ordine cronologico (team_form_store.load_played, training)
+    __table_args__ = (
+        Index("ix_fixtures_date_match", "date", "match_id"),
+        Index("ix_fixtures_league_date_match", "league_code", "date", "match_id"),
+        Index("ix_fixtures_league_home_date", "league", "home", "date"),
+        Index("ix_fixtures_league_away_date", "league", "away", "date"),
+        Index("ix_fixtures_home_date", "home", "date"),
+        Index("ix_fixtures_away_date", "away", "date"),
+        Index("ix_fixtures_played_date", "date", "match_id",
+              sqlite_where=text("result_home_goals IS NOT NULL"),
+              postgresql_where=text("result_home_goals IS NOT NULL")),
+        Index("ix_fixtures_home_team_date", "home_team_id", "date"),
+        Index("ix_fixtures_away_team_date", "away_team_id", "date"),
+    )
+
 
 class Feature(Base):
     __tablename__ = "features"
@@ -99,6 +122,35 @@ class TeamMapping(Base):
     )
 
 
+class Team(Base):
+    """Identità canonica di una squadra; i nomi delle varie fonti sono in team_aliases."""
+    __tablename__ = "teams"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)  # nome della prima fonte che l'ha vista
+    league_code = Column(String(10), nullable=True, index=True)  # lega domestica, per il fuzzy
+    created_at = Column(Date, default=datetime.utcnow)
+
+
+class TeamAlias(Base):
+    """Nome di una squadra in una fonte (football-data.org, TheOddsAPI, Understat, ...)."""
+    __tablename__ = "team_aliases"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    source = Column(String(30), nullable=False)
+    alias = Column(String, nullable=False)       # nome originale della fonte
+    alias_key = Column(String, nullable=False)   # team_registry.alias_key(alias)
+    team_id = Column(Integer, ForeignKey("teams.id"), nullable=False, index=True)
+    method = Column(String(10), nullable=False, default="seed")  # seed/exact/new/fuzzy/pair
+    score = Column(Float, nullable=True)         # punteggio del match fuzzy
+    created_at = Column(Date, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("source", "alias_key", name="uq_team_alias_source_key"),
+        Index("ix_team_aliases_key", "alias_key"),
+    )
+
+
 class HistoricalMatch(Base):
     """
     Storico partite per training ML (1X2, OU, BTTS).
@@ -112,6 +164,8 @@ class HistoricalMatch(Base):
     league = Column(String, index=True)
     home = Column(String)
     away = Column(String)
+    home_team_id = Column(Integer, ForeignKey("teams.id"), nullable=True)
+    away_team_id = Column(Integer, ForeignKey("teams.id"), nullable=True)
     ft_home_goals = Column(Integer)
     ft_away_goals = Column(Integer)
 
@@ -138,6 +192,11 @@ class HistoricalMatch(Base):
     target_btts = Column(Integer, nullable=True)  # 1=Goal,0=NoGoal
     target_1x2 = Column(Integer, nullable=True)   # 1=home,0=draw,-1=away
 
+    __table_args__ = (
+        Index("ix_historical_home_team_date", "home_team_id", "date"),
+        Index("ix_historical_away_team_date", "away_team_id", "date"),
+    )
+
 
 class Prediction(Base):
     __tablename__ = "predictions"
@@ -176,3 +235,12 @@ class Prediction(Base):
     created_at = Column(Date, default=datetime.utcnow)
 
     fixture = relationship("Fixture")
+
+
+class DataVersion(Base):
+    """Versione dei dati (fixtures/odds/features/risultati) per data, vedi market_cache.py."""
+    __tablename__ = "data_versions"
+
+    date = Column(Date, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(Float, nullable=True)  # epoch dell'ultimo bump
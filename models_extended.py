@@ -10,7 +10,7 @@ SCHEMA DATABASE ESTESO - Tutti i dati possibili
 """
 
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Float, Date, ForeignKey, Text, Boolean
+from sqlalchemy import Column, String, Integer, Float, Date, ForeignKey, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from database import Base, engine
 # Import modelli base per le foreign keys
@@ -169,13 +169,25 @@ class PlayerSeason(Base):
 
 
 class TeamForm(Base):
-    """Form recente squadra (ultimi 5-10 match) - CALCOLATA"""
+    """
+    Form recente squadra (ultimi 5-10 match) - CALCOLATA
+
+    Un'istantanea per (lega, squadra, giorno in cui ha giocato): stato DOPO le
+    partite di as_of_date. Per un match del giorno D si legge l'ultima con
+    as_of_date < D. Riempita da team_form_store.py.
+    """
     __tablename__ = "team_form"
+    __table_args__ = (
+        Index("ix_team_form_lookup", "league", "team_name", "as_of_date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     team_name = Column(String, index=True)
     league_code = Column(String(10), index=True)
+    league = Column(String)  # Nome lega come in fixtures.league
     as_of_date = Column(Date, index=True)  # Data di riferimento
+    match_id = Column(String, nullable=True)  # Ultima partita inclusa
+    source_hash = Column(String(16), nullable=True)  # Hash delle partite incluse (team_form_store)
 
     # Ultimi 5 match (tutti)
     last5_wins = Column(Integer, default=0)
@@ -203,15 +215,52 @@ class TeamForm(Base):
     current_streak = Column(Integer, default=0)  # +3 = 3 vittorie, -2 = 2 sconfitte
     unbeaten_streak = Column(Integer, default=0)
 
+    # Feature AdvancedFeatureCalculator: forma (ultimi 5 con features)
+    form_xg_for = Column(Float, default=1.3)
+    form_xg_against = Column(Float, default=1.3)
+    form_xg_diff = Column(Float, default=0.0)
+    form_wins = Column(Integer, default=0)
+    form_draws = Column(Integer, default=0)
+    form_losses = Column(Integer, default=0)
+    form_goals_for = Column(Float, default=1.0)
+    form_goals_against = Column(Float, default=1.0)
+    form_points = Column(Integer, default=0)
+    form_trend = Column(Float, default=0.0)
+
+    # Momentum (ultimi 10 con risultato); unbeaten_streak è sopra
+    winning_streak = Column(Integer, default=0)
+    losing_streak = Column(Integer, default=0)
+    clean_sheet_streak = Column(Integer, default=0)
+    scoring_streak = Column(Integer, default=0)
+    xg_momentum = Column(Float, default=0.0)
+
+    # Totali stagione (dal 1 agosto) per la classifica stimata
+    season_start = Column(Date, nullable=True)
+    season_played = Column(Integer, default=0)
+    season_points = Column(Integer, default=0)
+    season_gf = Column(Integer, default=0)
+    season_ga = Column(Integer, default=0)
+
 
 class HeadToHead(Base):
-    """Storico scontri diretti tra due squadre"""
+    """
+    Storico scontri diretti tra due squadre
+
+    Un'istantanea per (lega, coppia, giorno dello scontro) sugli ultimi 5
+    scontri giocati. team_home/team_away in ordine alfabetico: le statistiche
+    *_home si riferiscono a team_home, indipendentemente da chi giocava in casa.
+    """
     __tablename__ = "head_to_head"
+    __table_args__ = (
+        Index("ix_h2h_lookup", "league", "team_home", "team_away", "as_of_date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     team_home = Column(String, index=True)
     team_away = Column(String, index=True)
     league_code = Column(String(10), index=True)
+    league = Column(String)  # Nome lega come in fixtures.league
+    as_of_date = Column(Date, nullable=True)  # Data dell'ultimo scontro incluso
 
     # Ultimi N scontri (tutti)
     total_matches = Column(Integer, default=0)
@@ -224,6 +273,10 @@ class HeadToHead(Base):
     avg_goals_away = Column(Float, default=0.0)
     avg_total_goals = Column(Float, default=0.0)
     btts_count = Column(Integer, default=0)  # Both teams to score
+    over25_count = Column(Integer, default=0)
+    avg_xg_home = Column(Float, nullable=True)  # None se nessuno scontro ha features
+    avg_xg_away = Column(Float, nullable=True)
+    source_hash = Column(String(16), nullable=True)  # Hash degli scontri inclusi (team_form_store)
 
     # Last update
     last_updated = Column(Date, default=datetime.utcnow)
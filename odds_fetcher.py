@@ -1,26 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import argparse
-import json
 import math
 import os
 import re
-import subprocess
-import time, json
 from datetime import datetime, timedelta
 from pathlib import Path
-from urllib.parse import urlencode
 
+import numpy as np
 import requests
 from unidecode import unidecode
 
 from database import SessionLocal
 from models import Fixture, Odds
+from http_cache import THE_ODDS_API_QUOTA, QuotaExceeded, get_client
+from market_cache import bump_dates
+from metrics import count, instrument
+from team_registry import SRC_TOA, TeamRegistry, best_pair
 
 ROOT = Path(__file__).resolve().parent
 CFG = ROOT / "config.toml"
-API_USAGE_FILE = ROOT / "data" / "api_usage.json"
-THE_ODDS_API_LIMIT = 500
 
 SPORT_KEYS = {
     "CL": "soccer_uefa_champs_league",
@@ -51,58 +50,6 @@ ALIAS = {
     "fc copenhagen": "copenhagen",
 }
 
-# --- API USAGE COUNTER ---
-
-def get_api_usage() -> dict:
-    """Legge il file di utilizzo dell'API."""
-    if not API_USAGE_FILE.exists():
-        return {"the_odds_api": {"count": 0, "last_reset": datetime.now().strftime("%Y-%m-01")}}
-    try:
-        return json.loads(API_USAGE_FILE.read_text())
-    except (json.JSONDecodeError, FileNotFoundError):
-        return {"the_odds_api": {"count": 0, "last_reset": datetime.now().strftime("%Y-%m-01")}}
-
-def save_api_usage(usage_data: dict):
-    """Salva il file di utilizzo dell'API."""
-    API_USAGE_FILE.parent.mkdir(exist_ok=True)
-    API_USAGE_FILE.write_text(json.dumps(usage_data, indent=2))
-
-def check_and_increment_usage() -> bool:
-    """
-    Controlla l'utilizzo dell'API. Se il limite non è stato raggiunto,
-    incrementa il contatore e ritorna True. Altrimenti, ritorna False.
-    Resetta il contatore se è iniziato un nuovo mese.
-    """
-    usage = get_api_usage()
-    today = datetime.now()
-    
-    odds_api_usage = usage.get("the_odds_api", {})
-    count = odds_api_usage.get("count", 0)
-    last_reset_str = odds_api_usage.get("last_reset", "1970-01-01")
-    
-    try:
-        last_reset_date = datetime.strptime(last_reset_str, "%Y-%m-%d")
-    except ValueError:
-        last_reset_date = datetime(1970, 1, 1)
-
-    if today.year > last_reset_date.year or today.month > last_reset_date.month:
-        print("[API-USAGE] Nuovo mese, resetto il contatore di utilizzo di The-Odds-API.")
-        count = 0
-        odds_api_usage["last_reset"] = today.strftime("%Y-%m-01")
-
-    if count >= THE_ODDS_API_LIMIT:
-        print(f"[ERRORE] Limite API per The-Odds-API raggiunto ({count}/{THE_ODDS_API_LIMIT}). Impossibile continuare.")
-        return False
-    
-    odds_api_usage["count"] = count + 1
-    usage["the_odds_api"] = odds_api_usage
-    save_api_usage(usage)
-    
-    print(f"[API-USAGE] The-Odds-API: {odds_api_usage['count']}/{THE_ODDS_API_LIMIT} utilizzi questo mese.")
-    return True
-
-# --- END API USAGE COUNTER ---
-
 def read_cfg():
     try:
         import tomllib
@@ -121,36 +68,6 @@ def read_cfg():
     max_or = float(settings_cfg.get("max_overround", 0.6))
     return key.strip(), bookmakers, max_or
 
-class CurlResponse:
-    def __init__(self, text: str):
-        self.text = text
-        self.status_code = 200
-
-    def json(self):
-        return json.loads(self.text)
-
-
-def http_get(url: str, headers=None, params=None, timeout=30, desc=""):
-    headers = headers or {}
-    params = params or {}
-    try:
-        r = requests.get(url, headers=headers, params=params, timeout=timeout)
-        return r
-    except requests.exceptions.RequestException as exc:
-        full_url = f"{url}?{urlencode(params)}" if params else url
-        label = desc or url
-        print(f"[HTTP-FALLBACK] {label}: {exc}. Provo con curl…")
-        cmd = ["curl", "-sS", "-m", str(timeout)]
-        for k, v in headers.items():
-            cmd += ["-H", f"{k}: {v}"]
-        cmd.append(full_url)
-        res = subprocess.run(cmd, capture_output=True, text=True)
-        if res.returncode != 0:
-            raise RuntimeError(
-                f"curl fallito per {label} (exit {res.returncode}): {res.stderr.strip()}"
-            )
-        return CurlResponse(res.stdout)
-
 def norm(s: str) -> str:
     """Normalizzazione avanzata nomi squadre per matching robusto."""
     s = unidecode((s or "").lower().strip())
@@ -193,94 +110,211 @@ def best_price(market):
     return prices
 
 def fetch_events_from_api(url: str, params: dict, code: str, delay: float) -> list:
-    """Esegue la chiamata API a TheOddsAPI e gestisce i tentativi."""
-    for attempt in range(3):
+    """
+    Chiamata a TheOddsAPI tramite il livello HTTP condiviso (cache, retry, quota).
+    Solleva QuotaExceeded se la quota mensile è esaurita e non c'è nulla in cache.
+    """
+    try:
+        r = get_client().get(url, params=params, endpoint="toa_odds", quota=THE_ODDS_API_QUOTA,
+                             max_retries=2, delay=delay, desc=f"TOA {code}")
+    except QuotaExceeded:
+        raise
+    except (requests.exceptions.RequestException, RuntimeError) as e:
+        print(f"[TOA] {code}: Errore: {e}")
+        return []
+
+    if r.status_code == 200:
         try:
-            if delay > 0 and attempt > 0:
-                time.sleep(delay)
-            
-            r = http_get(url, params=params, timeout=30, desc=f"TOA {code}")
-            
-            if r.status_code == 200:
-                try:
-                    return r.json()
-                except ValueError:
-                    print(f"[TOA] {code}: JSON non valido")
-                    continue
-            
-            if r.status_code == 429:
-                wait = 60
-                print(f"[TOA] {code}: Rate limit, attendo {wait}s...")
-                time.sleep(wait)
-                continue
-            
-            if r.status_code in (401, 403):
-                print(f"[TOA] {code}: Autenticazione fallita (HTTP {r.status_code})")
-                return []
-            
-            print(f"[TOA] {code}: HTTP {r.status_code}")
-            if attempt < 2:
-                time.sleep(2)
-                continue
-            return []
-            
-        except requests.exceptions.Timeout:
-            if attempt < 2:
-                print(f"[TOA] {code}: Timeout, retry {attempt+1}/3...")
-                time.sleep(5)
-                continue
-            print(f"[TOA] {code}: Timeout dopo 3 tentativi")
-            return []
-        except requests.exceptions.RequestException as e:
-            if attempt < 2:
-                print(f"[TOA] {code}: Errore rete, retry {attempt+1}/3...")
-                time.sleep(2)
-                continue
-            print(f"[TOA] {code}: Errore: {e}")
+            return r.json()
+        except ValueError:
+            print(f"[TOA] {code}: JSON non valido")
             return []
+    if r.status_code in (401, 403):
+        print(f"[TOA] {code}: Autenticazione fallita (HTTP {r.status_code})")
+        return []
+    print(f"[TOA] {code}: HTTP {r.status_code}")
     return []
 
+# --- MATCHING EVENTI ↔ PARTITE ---
+
+FUZZY_THRESHOLD = 85  # soglia similarità media (casa + trasferta) per il match fuzzy
+
+
+def _event_day(ev: dict):
+    """Data (UTC) di inizio evento da commence_time ISO, None se assente/non valida."""
+    raw = (ev.get("commence_time") or "")[:10]
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+class EventIndex:
+    """
+    Indice degli eventi API costruito una sola volta per batch.
+
+    - nomi normalizzati calcolati una volta per evento
+    - match esatto: dizionario (casa, trasferta) → evento, in entrambi i versi;
+      a parità vince il primo evento della lista (come nella scansione lineare)
+    - match per team_id: i nomi TheOddsAPI già noti al registro squadre diventano
+      team_id, dizionario (id casa, id trasferta) → evento
+    - match fuzzy: solo sugli eventi del bucket di data della partita (±1 giorno
+      per il fuso orario), con punteggi calcolati in blocco da rapidfuzz.process.cdist
+    """
+
+    def __init__(self, events: list, registry: "TeamRegistry | None" = None):
+        self.events = events
+        self.homes = [norm(ev.get("home_team", "")) for ev in events]
+        self.aways = [norm(ev.get("away_team", "")) for ev in events]
+        self.by_pair = {}
+        self.by_ids = {}
+        self.by_day = {}
+        for i, ev in enumerate(events):
+            eh, ea = self.homes[i], self.aways[i]
+            self.by_pair.setdefault((eh, ea), i)
+            self.by_pair.setdefault((ea, eh), i)
+            self.by_day.setdefault(_event_day(ev), []).append(i)
+            if registry is not None:
+                hid = registry.lookup(ev.get("home_team", ""), SRC_TOA)
+                aid = registry.lookup(ev.get("away_team", ""), SRC_TOA)
+                if hid is not None and aid is not None:
+                    self.by_ids.setdefault((hid, aid), i)
+                    self.by_ids.setdefault((aid, hid), i)
+
+    def exact(self, h: str, a: str):
+        i = self.by_pair.get((h, a))
+        return None if i is None else self.events[i]
+
+    def by_team_ids(self, home_id, away_id):
+        if home_id is None or away_id is None:
+            return None
+        i = self.by_ids.get((home_id, away_id))
+        return None if i is None else self.events[i]
+
+    def candidates(self, day) -> list:
+        """Indici degli eventi nel bucket di data (tutti se la data non è nota)."""
+        if day is None:
+            return list(range(len(self.events)))
+        idx = []
+        for d in (day - timedelta(days=1), day, day + timedelta(days=1)):
+            idx.extend(self.by_day.get(d, []))
+        # Eventi senza commence_time: sempre candidati
+        idx.extend(self.by_day.get(None, []))
+        return sorted(idx)
+
+    def fuzzy(self, h: str, a: str, day, threshold: float = FUZZY_THRESHOLD):
+        """Miglior evento (score medio casa/trasferta, anche invertito) sopra soglia → (evento, score)."""
+        idx = self.candidates(day)
+        if not idx:
+            return None, 0.0
+        from rapidfuzz import fuzz, process
+
+        n = len(idx)
+        choices = [self.homes[i] for i in idx] + [self.aways[i] for i in idx]
+        sc = process.cdist([h, a], choices, scorer=fuzz.ratio, dtype=np.float64)
+        total = (sc[0, :n] + sc[1, n:]) / 2
+        total_inv = (sc[0, n:] + sc[1, :n]) / 2
+        best = np.maximum(total, total_inv)
+        k = int(np.argmax(best))  # primo massimo, come lo scorrimento con ">" stretto
+        if best[k] < threshold:
+            return None, 0.0
+        return self.events[idx[k]], float(best[k])
+
+
+def _extract_odds(found: dict, h: str, a: str, whitelist: list):
+    """Migliori quote 1X2 e O/U 2.5 tra i bookmaker ammessi → (o1, ox, o2, oo, ou)."""
+    h2h_mk = [b for b in found.get("bookmakers", []) if not whitelist or b["key"] in whitelist]
+    totals_mk = h2h_mk
+
+    o1 = ox = o2 = None
+    for b in h2h_mk:
+        for mk in b.get("markets", []):
+            if mk.get("key") == "h2h":
+                for outc in mk.get("outcomes", []):
+                    if norm(outc["name"]) == h:
+                        o1 = max(o1 or 0.0, float(outc["price"]))
+                    elif norm(outc["name"]) == a:
+                        o2 = max(o2 or 0.0, float(outc["price"]))
+                    elif outc["name"].lower() == "draw":
+                        ox = max(ox or 0.0, float(outc["price"]))
+
+    if o1 == 0: o1 = None
+    if ox == 0: ox = None
+    if o2 == 0: o2 = None
+
+    oo = ou = None
+    for b in totals_mk:
+        for mk in b.get("markets", []):
+            if mk.get("key") == "totals":
+                for outc in mk.get("outcomes", []):
+                    if str(outc.get("point")) == "2.5":
+                        if outc["name"].lower() == "over":
+                            oo = max(oo or 0.0, float(outc["price"]))
+                        else:
+                            ou = max(ou or 0.0, float(outc["price"]))
+    if oo == 0: oo = None
+    if ou == 0: ou = None
+    return o1, ox, o2, oo, ou
+
+
+def upsert_odds(db, rows: list) -> int:
+    """
+    Scrive tutte le quote in un'unica transazione (INSERT ... ON CONFLICT DO UPDATE
+    su SQLite/PostgreSQL, merge riga per riga sugli altri dialetti).
+    """
+    if not rows:
+        return 0
+    cols = ["odds_1", "odds_x", "odds_2", "odds_ou25_over", "odds_ou25_under", "line_ou"]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(Odds.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Odds.__table__.c.match_id],
+            set_={c: stmt.excluded[c] for c in cols},
+        )
+        db.execute(stmt, rows)
+    else:
+        for r in rows:
+            db.merge(Odds(**r))
+    ids = {r["match_id"] for r in rows}
+    bump_dates(db, [d for (d,) in db.query(Fixture.date).filter(Fixture.match_id.in_(ids)).distinct()])
+    db.commit()
+    return len(rows)
+
+
 def process_and_store_odds(events: list, fixtures_to_process: list, whitelist: list, max_or: float, verbose: bool):
     """Esegue il matching tra eventi API e partite DB, e salva le quote."""
     updated_odds_count = 0
     unmatched_fixtures = []
+    rows = []
+
+    db = SessionLocal()
+    registry = TeamRegistry(db)
+    index = EventIndex(events, registry)
+    to_learn = []
 
     for fixture in fixtures_to_process:
         h, a = norm(fixture.home), norm(fixture.away)
-        found = None
+        fuzzy_score = None
 
-        # Tentativo 1: Match esatto normalizzato
-        for ev in events:
-            eh, ea = norm(ev.get("home_team", "")), norm(ev.get("away_team", ""))
-            if (h == eh and a == ea) or (h == ea and a == eh):
-                found = ev
-                break
+        # Tentativo 1: team_id canonici (alias TheOddsAPI già noti al registro)
+        found = index.by_team_ids(fixture.home_team_id, fixture.away_team_id)
+        by_ids = found is not None
 
-        # Tentativo 2: Match fuzzy se Tentativo 1 fallisce
+        # Tentativo 2: Match esatto normalizzato (lookup)
         if not found:
-            from rapidfuzz import fuzz
-            best_match = None
-            best_score = 0
-            for ev in events:
-                eh, ea = norm(ev.get("home_team", "")), norm(ev.get("away_team", ""))
-                # Calcola similarità complessiva match
-                score_h = fuzz.ratio(h, eh)
-                score_a = fuzz.ratio(a, ea)
-                total_score = (score_h + score_a) / 2
-
-                # Match inverso (home/away scambiati)
-                score_h_inv = fuzz.ratio(h, ea)
-                score_a_inv = fuzz.ratio(a, eh)
-                total_score_inv = (score_h_inv + score_a_inv) / 2
-
-                max_score = max(total_score, total_score_inv)
-
-                if max_score > best_score and max_score >= 85:  # Soglia 85% similarità
-                    best_score = max_score
-                    best_match = ev
+            found = index.exact(h, a)
 
+        # Tentativo 3: Match fuzzy, solo tra gli eventi della stessa data
+        if not found:
+            best_match, best_score = index.fuzzy(h, a, fixture.date)
             if best_match:
                 found = best_match
+                fuzzy_score = best_score
                 if verbose:
                     print(f"[FUZZY-MATCH {best_score:.0f}%] {fixture.home} vs {fixture.away} → {best_match.get('home_team')} vs {best_match.get('away_team')}")
 
@@ -290,24 +324,21 @@ def process_and_store_odds(events: list, fixtures_to_process: list, whitelist: l
                 print(f"[MISS] {fixture.league_code} : {fixture.home} vs {fixture.away}")
             continue
 
-        h2h_mk = [b for b in found.get("bookmakers", []) if not whitelist or b["key"] in whitelist]
-        totals_mk = h2h_mk
-
-        o1 = ox = o2 = None
-        for b in h2h_mk:
-            for mk in b.get("markets", []):
-                if mk.get("key") == "h2h":
-                    for outc in mk.get("outcomes", []):
-                        if norm(outc["name"]) == h:
-                            o1 = max(o1 or 0.0, float(outc["price"]))
-                        elif norm(outc["name"]) == a:
-                            o2 = max(o2 or 0.0, float(outc["price"]))
-                        elif outc["name"].lower() == "draw":
-                            ox = max(ox or 0.0, float(outc["price"]))
-
-        if o1 == 0: o1 = None
-        if ox == 0: ox = None
-        if o2 == 0: o2 = None
+        # Nomi dell'evento nel verso della partita: servono per leggere gli esiti 1/2
+        # (trovato per team_id: verso dagli id risolti; altrimenti dalla somiglianza dei nomi)
+        ev_home, ev_away = found.get("home_team", ""), found.get("away_team", "")
+        if by_ids:
+            swapped = registry.lookup(ev_home, SRC_TOA) != fixture.home_team_id
+        else:
+            _i, _score, swapped = best_pair(fixture.home, fixture.away, [(ev_home, ev_away)], threshold=0)
+        if swapped:
+            ev_home, ev_away = ev_away, ev_home
+
+        # Coppia trovata col fuzzy: i nomi TheOddsAPI diventano alias, la prossima volta è un lookup
+        if fuzzy_score is not None:
+            to_learn.append((ev_home, ev_away, fixture.home_team_id, fixture.away_team_id, fuzzy_score))
+
+        o1, ox, o2, oo, ou = _extract_odds(found, norm(ev_home), norm(ev_away), whitelist)
 
         orv = overround(o1, ox, o2)
         if orv != -1.0 and orv > max_or:
@@ -315,42 +346,39 @@ def process_and_store_odds(events: list, fixtures_to_process: list, whitelist: l
                 print(f"[REJECT] Overround alto ({orv:.2f}) per {fixture.home}–{fixture.away}. Scarto quote 1X2.")
             o1 = ox = o2 = None
 
-        oo = ou = None
-        for b in totals_mk:
-            for mk in b.get("markets", []):
-                if mk.get("key") == "totals":
-                    for outc in mk.get("outcomes", []):
-                        if str(outc.get("point")) == "2.5":
-                            if outc["name"].lower() == "over":
-                                oo = max(oo or 0.0, float(outc["price"]))
-                            else:
-                                ou = max(ou or 0.0, float(outc["price"]))
-        if oo == 0: oo = None
-        if ou == 0: ou = None
-
         if any(v is not None for v in [o1, ox, o2, oo, ou]):
-            db = SessionLocal()
-            try:
-                odds_obj = Odds(
-                    match_id=fixture.match_id,
-                    odds_1=o1, odds_x=ox, odds_2=o2,
-                    odds_ou25_over=oo, odds_ou25_under=ou,
-                    line_ou="2.5",
-                )
-                db.merge(odds_obj)
-                db.commit()
-                updated_odds_count += 1
-            except Exception as e:
-                print(f"[DB-ERR] Errore salvataggio quote per {fixture.match_id}: {e}")
-                db.rollback()
-            finally:
-                db.close()
-
+            rows.append({
+                "match_id": fixture.match_id,
+                "odds_1": o1, "odds_x": ox, "odds_2": o2,
+                "odds_ou25_over": oo, "odds_ou25_under": ou,
+                "line_ou": "2.5",
+            })
             if verbose:
                 print(f"[OK] {fixture.home}–{fixture.away} 1X2=({o1},{ox},{o2}) OU=({oo},{ou})")
         elif verbose:
             print(f"[MISS] quote non trovate per {fixture.home}–{fixture.away}")
 
+    # Una sola transazione per tutte le quote (e gli alias imparati): il lock di scrittura SQLite dura il minimo
+    try:
+        before = len(registry.by_source)
+        for ev_home, ev_away, home_id, away_id, score in to_learn:
+            registry.learn_pair(ev_home, ev_away, SRC_TOA, home_id, away_id, score)
+        learned = len(registry.by_source) - before
+        if rows:
+            # Stessa partita trovata più volte nel batch: vale l'ultima, come con merge+commit
+            rows = list({r["match_id"]: r for r in rows}.values())
+            updated_odds_count = upsert_odds(db, rows)
+            count("rows", updated_odds_count)
+        elif learned:
+            db.commit()
+        if learned:
+            print(f"[INFO] {learned} nomi TheOddsAPI aggiunti al registro squadre.")
+    except Exception as e:
+        print(f"[DB-ERR] Errore salvataggio quote ({len(rows)} partite): {e}")
+        db.rollback()
+    finally:
+        db.close()
+
     print(f"\n[OK] Quote aggiornate nel database → {updated_odds_count} partite.")
 
     # Report finale partite non matchate
@@ -420,19 +448,16 @@ def run_daily_fetch(args):
                 print(f"[SKIP] {code}: sport key non mappata.")
                 continue
             
-            if not check_and_increment_usage():
-                print(f"[ERRORE] Limite API raggiunto per {code}. Salto.")
-                continue
-
             url = f"https://api.the-odds-api.com/v4/sports/{sport}/odds"
             params = {"apiKey": key, "regions": "eu,uk", "markets": "h2h,totals"}
-            
-            events_for_sport = fetch_events_from_api(url, params, code, args.delay)
+
+            try:
+                events_for_sport = fetch_events_from_api(url, params, code, args.delay)
+            except QuotaExceeded:
+                print(f"[ERRORE] Limite API raggiunto per {code}. Salto.")
+                continue
             if events_for_sport:
                 all_events.extend(events_for_sport)
-            
-            if args.delay > 0:
-                time.sleep(args.delay)
         
         if not all_events:
             print("[WARN] Nessun evento di quote scaricato durante il daily fetch.")
@@ -461,19 +486,16 @@ def run_bulk_fetch(args):
         all_events = []
         for code, sport in SPORT_KEYS.items():
             print(f"--- Scaricamento quote per {code} ({sport}) ---")
-            if not check_and_increment_usage():
-                print("[ERRORE] Limite API raggiunto. Interrompo il bulk fetch.")
-                break
-            
             url = f"https://api.the-odds-api.com/v4/sports/{sport}/odds"
             params = {"apiKey": key, "regions": "eu,uk", "markets": "h2h,totals"}
-            
-            events_for_sport = fetch_events_from_api(url, params, code, args.delay)
+
+            try:
+                events_for_sport = fetch_events_from_api(url, params, code, args.delay)
+            except QuotaExceeded:
+                print("[ERRORE] Limite API raggiunto. Interrompo il bulk fetch.")
+                break
             if events_for_sport:
                 all_events.extend(events_for_sport)
-            
-            if args.delay > 0:
-                time.sleep(args.delay)
         
         if not all_events:
             print("[WARN] Nessun evento di quote scaricato. Termino.")
@@ -485,6 +507,7 @@ def run_bulk_fetch(args):
     finally:
         db.close()
 
+@instrument("odds")
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--date", help="Data YYYY-MM-DD per cui scaricare le quote (modalità giornaliera)")
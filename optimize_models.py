@@ -26,6 +26,8 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import StratifiedKFold, cross_val_score
 from sklearn.metrics import log_loss, brier_score_loss
 
+from historical_store import load_dataset
+
 try:
     import optuna
     from optuna.samplers import TPESampler
@@ -90,7 +92,8 @@ def load_data(path: Path, target_col: str, is_multiclass: bool = False):
     if not path.exists():
         raise FileNotFoundError(f"File non trovato: {path}")
 
-    df = pd.read_csv(path)
+    # Storico tipizzato (colonne numeriche già float64): niente to_numeric per colonna
+    df = load_dataset(path, columns=ALL_FEATURES + [target_col])
 
     # Seleziona solo le features disponibili
     available_features = [f for f in ALL_FEATURES if f in df.columns]
@@ -102,10 +105,7 @@ def load_data(path: Path, target_col: str, is_multiclass: bool = False):
     if target_col not in df.columns:
         raise ValueError(f"Target {target_col} non trovato in {path}")
 
-    # Converti features in numerico
     X = df[available_features].copy()
-    for col in X.columns:
-        X[col] = pd.to_numeric(X[col], errors='coerce')
 
     # Prepara target
     if is_multiclass:
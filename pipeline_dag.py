@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pipeline_dag.py
+---------------
+Pipeline giornaliera come grafo di dipendenze (usata da app.run_daily_pipeline e `make daily`).
+
+    fixtures ──┬── odds ──────┬── predict
+               └── features ──┘
+
+- gli stadi indipendenti (odds e features dipendono solo da fixtures) girano in parallelo
+- uno stadio viene saltato se i suoi input non sono cambiati dall'ultima esecuzione
+  riuscita: l'impronta è lo sha1 del comando + righe fixtures/odds/features della data
+  (+ versioni dei modelli per predict) e, se lo stadio produce file, lo sha1 dei file
+  prodotti allora (predictions.csv è unico per tutte le date)
+- max_age forza comunque la riesecuzione dopo N secondi (le quote cambiano anche a
+  fixtures invariate); fixtures non ha input locali e gira sempre (le risposte API
+  sono comunque in cache in http_cache)
+- stadio opzionale fallito (odds) → i dipendenti proseguono; stadio obbligatorio
+  fallito → i dipendenti sono "blocked" e i loro output vengono rimossi, così la UI
+  non mostra previsioni di un giro precedente
+- durata e stato di ogni stadio finiscono in cache/pipeline_state.json (last_run)
+
+CLI:
+    python pipeline_dag.py --date 2025-11-05 --comps SA,PL [--no-predict] [--force] [--jobs 3]
+    python pipeline_dag.py --status
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+ROOT = Path(__file__).resolve().parent
+STATE_PATH = ROOT / "cache" / "pipeline_state.json"
+PRED_PATH = ROOT / "predictions.csv"
+REPORT_HTML = ROOT / "report.html"
+
+
+class Stage:
+    """Nodo del grafo: comando da eseguire, dipendenze, input da confrontare, output prodotti."""
+
+    def __init__(self, name: str, cmd: str, deps: Sequence[str] = (), inputs: Sequence[str] = (),
+                 outputs: Sequence[Path] = (), required: bool = True, max_age: Optional[float] = None):
+        self.name = name
+        self.cmd = cmd
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = [Path(p) for p in outputs]
+        self.required = required
+        self.max_age = max_age
+
+
+def daily_stages(d: str, comps: str, delay: str = "0.6", do_predict: bool = True) -> List[Stage]:
+    stages = [
+        Stage("fixtures", f"python fixtures_fetcher.py --date {d} --comps {comps}"),
+        Stage("odds", f"python odds_fetcher.py --date {d} --comps {comps} --delay 0.3",
+              deps=["fixtures"], inputs=["fixtures"], required=False, max_age=1800),
+        Stage("features",
+              f"python features_populator.py --date {d} --comps {comps} --n_recent 5 --delay {delay} --cache 1",
+              deps=["fixtures"], inputs=["fixtures"], max_age=6 * 3600),
+    ]
+    if do_predict:
+        stages.append(Stage("predict", f"python model_pipeline.py --predict --date {d} --comps {comps}",
+                            deps=["odds", "features"], inputs=["fixtures", "odds", "features", "models"],
+                            outputs=[PRED_PATH, REPORT_HTML]))
+    return stages
+
+
+# =========================
+# IMPRONTE DEGLI INPUT
+# =========================
+def _sha1(payload) -> str:
+    return hashlib.sha1(json.dumps(payload, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _file_sha1(path: Path) -> Optional[str]:
+    if not path.exists():
+        return None
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def input_hash(name: str, d: str, comps: str) -> Optional[str]:
+    """Hash del contenuto delle righe DB per la data (None se il DB non è disponibile)."""
+    if name == "models":
+        from model_registry import get_registry
+        return _sha1({m: v["served"] for m, v in get_registry().status().items()})
+    try:
+        from database import SessionLocal
+        from models import Feature, Fixture, Odds
+    except ImportError:
+        return None
+    codes = [c.strip().upper() for c in comps.split(",") if c.strip()]
+    db = SessionLocal()
+    try:
+        day = datetime.strptime(d, "%Y-%m-%d").date()
+        q = db.query(Fixture.match_id).filter(Fixture.date == day)
+        if codes:
+            q = q.filter(Fixture.league_code.in_(codes))
+        ids = q.subquery()
+        if name == "fixtures":
+            cols = [Fixture.match_id, Fixture.date, Fixture.time_local, Fixture.league_code,
+                    Fixture.home, Fixture.away]
+            rows = db.query(*cols).filter(Fixture.match_id.in_(ids.select())).order_by(Fixture.match_id).all()
+        elif name == "odds":
+            cols = [c for c in Odds.__table__.columns]
+            rows = db.query(*cols).filter(Odds.match_id.in_(ids.select())).order_by(Odds.match_id).all()
+        elif name == "features":
+            cols = [c for c in Feature.__table__.columns]
+            rows = db.query(*cols).filter(Feature.match_id.in_(ids.select())).order_by(Feature.match_id).all()
+        else:
+            raise ValueError(f"Input sconosciuto: {name}")
+        return _sha1([list(r) for r in rows])
+    except Exception as e:
+        print(f"[WARN] Impronta '{name}' non calcolabile: {e}")
+        return None
+    finally:
+        db.close()
+
+
+# =========================
+# STATO PERSISTENTE
+# =========================
+_STATE_LOCK = threading.Lock()
+
+
+def load_state(path: Path = STATE_PATH) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"stages": {}, "last_run": None}
+
+
+def _save_state(state: dict, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(state, indent=2, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def last_run(path: Path = STATE_PATH) -> Optional[dict]:
+    """Ultima esecuzione: data, esito e stato/durata di ogni stadio (per la UI)."""
+    return load_state(path).get("last_run")
+
+
+# =========================
+# ESECUZIONE
+# =========================
+def _default_runner(cmd: str, name: str) -> bool:
+    parts = shlex.split(cmd)
+    if parts and parts[0] == "python":
+        parts[0] = sys.executable
+    proc = subprocess.Popen(parts, cwd=str(ROOT), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, encoding="utf-8", errors="replace")
+    for line in proc.stdout:
+        print(f"[{name}] {line.rstrip()}", flush=True)
+    return proc.wait() == 0
+
+
+class PipelineRun:
+    """Esegue gli stadi rispettando le dipendenze, in parallelo dove possibile."""
+
+    def __init__(self, stages: Sequence[Stage], d: str, comps: str,
+                 runner: Optional[Callable[[str], bool]] = None, jobs: int = 3, force: bool = False,
+                 state_path: Path = STATE_PATH, hasher: Callable[[str, str, str], Optional[str]] = input_hash,
+                 log: Callable[[str], None] = print, should_stop: Callable[[], bool] = lambda: False):
+        self.stages = {s.name: s for s in stages}
+        self.d = d
+        self.comps = comps
+        self.runner = runner
+        self.jobs = max(1, jobs)
+        self.force = force
+        self.state_path = Path(state_path)
+        self.hasher = hasher
+        self.log = log
+        self.should_stop = should_stop
+        self.report: Dict[str, dict] = {
+            s.name: {"name": s.name, "status": "pending", "duration": None, "started_at": None}
+            for s in stages
+        }
+        for s in stages:
+            for dep in s.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stadio '{s.name}': dipendenza sconosciuta '{dep}'")
+
+    def _key(self, stage: Stage) -> str:
+        return f"{self.d}|{self.comps}|{stage.name}"
+
+    def _fingerprint(self, stage: Stage) -> Optional[str]:
+        hashes = {}
+        for name in stage.inputs:
+            h = self.hasher(name, self.d, self.comps)
+            if h is None:
+                return None
+            hashes[name] = h
+        return _sha1({"cmd": stage.cmd, "inputs": hashes})
+
+    def _is_fresh(self, stage: Stage, fingerprint: Optional[str]) -> bool:
+        if self.force or not stage.inputs or fingerprint is None:
+            return False
+        with _STATE_LOCK:
+            prev = load_state(self.state_path)["stages"].get(self._key(stage))
+        if not prev or prev.get("fingerprint") != fingerprint:
+            return False
+        if stage.max_age is not None and time.time() - prev.get("finished_at", 0) > stage.max_age:
+            return False
+        return all(_file_sha1(p) == prev.get("outputs", {}).get(p.name) for p in stage.outputs)
+
+    def _record(self, stage: Optional[Stage] = None, fingerprint: Optional[str] = None) -> None:
+        with _STATE_LOCK:
+            state = load_state(self.state_path)
+            if stage is not None and fingerprint is not None:
+                state["stages"][self._key(stage)] = {
+                    "fingerprint": fingerprint,
+                    "finished_at": time.time(),
+                    "outputs": {p.name: _file_sha1(p) for p in stage.outputs},
+                }
+            state["last_run"] = {
+                "date": self.d,
+                "comps": self.comps,
+                "started_at": self.started_at,
+                "stages": [self.report[n] for n in self.stages],
+            }
+            _save_state(state, self.state_path)
+
+    def _run_stage(self, stage: Stage) -> str:
+        info = self.report[stage.name]
+        info["started_at"] = datetime.now().isoformat(timespec="seconds")
+        info["status"] = "running"
+        t0 = time.perf_counter()
+        fingerprint = self._fingerprint(stage)
+        if self._is_fresh(stage, fingerprint):
+            info["status"] = "skipped"
+            self.log(f"[SKIP] {stage.name}: input invariati dall'ultima esecuzione")
+        else:
+            for p in stage.outputs:
+                p.unlink(missing_ok=True)
+            self.log(f"[INFO] {stage.name}: avvio")
+            runner = self.runner or (lambda cmd: _default_runner(cmd, stage.name))
+            ok = bool(runner(stage.cmd))
+            info["status"] = "ok" if ok else "failed"
+            if ok:
+                # impronta dopo l'esecuzione: per gli stadi senza input esterni non cambia
+                self._record(stage, fingerprint or self._fingerprint(stage))
+        info["duration"] = round(time.perf_counter() - t0, 3)
+        self._record()
+        return info["status"]
+
+    def run(self) -> bool:
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        done: Dict[str, str] = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while len(done) < len(self.stages):
+                for name, stage in self.stages.items():
+                    if name in done or name in running.values():
+                        continue
+                    dep_status = [done.get(dep) for dep in stage.deps]
+                    if any(s is None for s in dep_status):
+                        continue
+                    blocked = [dep for dep in stage.deps
+                               if done[dep] in ("failed", "blocked", "stopped") and self.stages[dep].required]
+                    if blocked or self.should_stop():
+                        done[name] = self.report[name]["status"] = "stopped" if not blocked else "blocked"
+                        for p in stage.outputs:
+                            p.unlink(missing_ok=True)
+                        if blocked:
+                            self.log(f"[WARN] {name}: non eseguito ({', '.join(blocked)} fallito)")
+                        continue
+                    running[pool.submit(self._run_stage, stage)] = name
+                if not running:
+                    if len(done) < len(self.stages):
+                        raise ValueError("Grafo degli stadi con dipendenze circolari")
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    try:
+                        done[name] = fut.result()
+                    except Exception as e:
+                        self.log(f"[ERR] {name}: {e}")
+                        done[name] = self.report[name]["status"] = "failed"
+        self._record()
+        ok = all(done[n] in ("ok", "skipped") or (done[n] == "failed" and not self.stages[n].required)
+                 for n in self.stages)
+        total = sum(r["duration"] or 0 for r in self.report.values())
+        self.log(f"[{'OK' if ok else 'ERR'}] Pipeline {self.d}: "
+                 + ", ".join(f"{n}={r['status']}({r['duration'] or 0:.1f}s)" for n, r in self.report.items())
+                 + f" — somma stadi {total:.1f}s")
+        return ok
+
+
+def run_daily(d: str, comps: str, delay: str = "0.6", do_predict: bool = True,
+              runner: Optional[Callable[[str], bool]] = None, jobs: int = 3, force: bool = False,
+              log: Callable[[str], None] = print, should_stop: Callable[[], bool] = lambda: False) -> bool:
+    return PipelineRun(daily_stages(d, comps, delay, do_predict), d, comps, runner=runner, jobs=jobs,
+                       force=force, log=log, should_stop=should_stop).run()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pipeline giornaliera a grafo (stadi indipendenti in parallelo)")
+    ap.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"))
+    ap.add_argument("--comps", default="SA,PL,PD,BL1")
+    ap.add_argument("--delay", default="0.6", help="Ritardo richieste per features_populator")
+    ap.add_argument("--no-predict", action="store_true", help="Salta lo stadio predict")
+    ap.add_argument("--force", action="store_true", help="Esegue tutti gli stadi anche con input invariati")
+    ap.add_argument("--jobs", type=int, default=3, help="Stadi in parallelo al massimo")
+    ap.add_argument("--status", action="store_true", help="Mostra l'ultima esecuzione e termina")
+    args = ap.parse_args()
+
+    if args.status:
+        run = last_run()
+        if not run:
+            print("[INFO] Nessuna esecuzione registrata")
+            return
+        print(f"[INFO] Ultima esecuzione {run['date']} [{run['comps']}] avviata {run['started_at']}")
+        for s in run["stages"]:
+            print(f"    {s['name']:<9} {s['status']:<8} {s['duration'] if s['duration'] is not None else '-'}s")
+        return
+
+    ok = run_daily(args.date, args.comps, args.delay, not args.no_predict, jobs=args.jobs, force=args.force)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pipeline_worker.py
+------------------
+Processo worker residente per i comandi della pipeline (python <script>.py ...).
+
+Il server importa una volta pandas, numpy, sklearn, lightgbm, SQLAlchemy, il
+DB (config.toml) e carica i modelli dal registro; per ogni comando fa fork()
+e il figlio esegue lo script con runpy come "__main__", con sys.argv del
+comando e stdout/stderr rimandati riga per riga al client. Il figlio eredita
+moduli e modelli già caricati (copy-on-write): niente avvio dell'interprete,
+niente import pesanti, niente unpickling dei modelli.
+
+- socket locale: cache/pipeline_worker.sock (AF_UNIX), chiave di autenticazione
+  casuale in cache/pipeline_worker.key (0600)
+- un figlio per comando: più job in parallelo, crash e sys.exit isolati; i figli
+  terminati si raccolgono su SIGCHLD (niente zombie col worker inattivo)
+- la richiesta porta l'ambiente del chiamante, applicato nel figlio come env= del
+  subprocess; se cambia una variabile BET_* (es. BET_DATABASE_URL, letta all'import)
+  i moduli del progetto precaricati si reimportano nel figlio
+- l'exit code è quello del figlio anche dopo uno stop (75 = in pausa, vedi backfill_checkpoint)
+- stop/timeout come run_cmd: SIGTERM al figlio, SIGKILL dopo 5 secondi
+- se cambia un sorgente .py già importato dal server, il server si riavvia
+  (la richiesta in corso torna al client come "restart" → subprocess)
+- worker non raggiungibile o piattaforma senza fork → run_command() ritorna
+  None e il chiamante usa il subprocess come prima
+
+Uso:
+    python pipeline_worker.py --serve                       # avvio standalone
+    BET_RESIDENT_WORKER=1 python app.py                     # avviato da app.py
+    python pipeline_worker.py --ping
+    python pipeline_worker.py --bench -- model_pipeline.py --predict   # latenza subprocess vs worker
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import runpy
+import secrets
+import signal
+import subprocess
+import sys
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent
+SOCKET_PATH = ROOT / "cache" / "pipeline_worker.sock"
+KEY_PATH = ROOT / "cache" / "pipeline_worker.key"
+
+PRELOAD = [
+    "numpy", "pandas", "sklearn.impute", "sklearn.linear_model", "sklearn.preprocessing",
+    "sklearn.model_selection", "sklearn.metrics", "lightgbm", "joblib", "sqlalchemy", "requests",
+    "rapidfuzz", "database", "models", "http_cache", "poisson_kernel", "historical_store",
+    "model_registry",
+]
+STOP_GRACE = 5
+
+
+# =========================
+# SERVER
+# =========================
+class _ConnWriter:
+    """File-like per sys.stdout/sys.stderr del figlio: invia righe complete al client."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.buf = ""
+
+    def write(self, s) -> int:
+        self.buf += str(s)
+        while "\n" in self.buf:
+            line, self.buf = self.buf.split("\n", 1)
+            self.conn.send({"line": line})
+        return len(s)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.buf:
+            self.conn.send({"line": self.buf})
+            self.buf = ""
+
+    def isatty(self) -> bool:
+        return False
+
+
+def _preload() -> List[str]:
+    loaded = []
+    for name in PRELOAD:
+        try:
+            __import__(name)
+            loaded.append(name)
+        except Exception as e:
+            print(f"[WARN] Preload {name} non riuscito: {e}")
+    if "model_registry" in sys.modules:
+        reg = sys.modules["model_registry"].get_registry()
+        for market in ("ou", "1x2"):
+            art = reg.get(market)
+            if art:
+                loaded.append(f"model:{art.version}")
+    return loaded
+
+
+def _source_snapshot() -> dict:
+    """mtime dei moduli del progetto già importati (per riavviarsi se cambiano)."""
+    snap = {}
+    for mod in list(sys.modules.values()):
+        path = getattr(mod, "__file__", None)
+        if path and Path(path).parent == ROOT and path.endswith(".py"):
+            try:
+                snap[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+    return snap
+
+
+def _resolve_script(argv: List[str]) -> Optional[Path]:
+    if not argv:
+        return None
+    script = (ROOT / argv[0]).resolve()
+    if script.parent != ROOT or script.suffix != ".py" or not script.exists():
+        return None
+    return script
+
+
+def _forget_project_modules() -> None:
+    """Toglie da sys.modules i moduli del progetto: il figlio li reimporta con il suo ambiente."""
+    for name, mod in list(sys.modules.items()):
+        path = getattr(mod, "__file__", None)
+        if name != "__main__" and path and Path(path).parent == ROOT:
+            del sys.modules[name]
+
+
+def _apply_env(env: Optional[Dict[str, str]]) -> None:
+    if env is None:
+        return
+    changed = [k for k in set(env) | set(os.environ)
+               if k.startswith("BET_") and env.get(k) != os.environ.get(k)]
+    os.environ.clear()
+    os.environ.update(env)
+    if changed:
+        _forget_project_modules()
+
+
+def _run_child(conn, script: Path, args: List[str], env: Optional[Dict[str, str]] = None) -> None:
+    """Nel figlio: esegue lo script come __main__ e termina senza tornare al server."""
+    code = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)  # i subprocess dello script li attende lo script
+        os.chdir(ROOT)
+        _apply_env(env)
+        conn.send({"pid": os.getpid()})
+        writer = _ConnWriter(conn)
+        sys.stdout = sys.stderr = writer
+        sys.argv = [str(script)] + list(args)
+        try:
+            runpy.run_path(str(script), run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        writer.close()
+        conn.send({"exit": code})
+    except Exception:
+        pass
+    finally:
+        os._exit(code)
+
+
+def serve(socket_path: Path = SOCKET_PATH, key_path: Path = KEY_PATH) -> None:
+    if not hasattr(os, "fork"):
+        print("[ERR] Worker residente non disponibile su questa piattaforma (serve fork)")
+        sys.exit(1)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if not key_path.exists():
+        key_path.write_bytes(secrets.token_bytes(32))
+        key_path.chmod(0o600)
+    authkey = key_path.read_bytes()
+    if socket_path.exists():
+        socket_path.unlink()
+
+    t0 = time.perf_counter()
+    loaded = _preload()
+    print(f"[OK] Worker pronto in {time.perf_counter() - t0:.1f}s (pid {os.getpid()}): {', '.join(loaded)}",
+          flush=True)
+    snapshot = _source_snapshot()
+    started = time.time()
+    children = set()
+
+    def _reap(signum, frame):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            children.discard(pid)
+
+    def _shutdown(signum, frame):
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        socket_path.unlink(missing_ok=True)
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+    signal.signal(signal.SIGCHLD, _reap)
+
+    with Listener(str(socket_path), family="AF_UNIX", authkey=authkey) as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:  # handshake fallito (chiave errata, client interrotto)
+                print(f"[WARN] Connessione rifiutata: {e}", flush=True)
+                continue
+            try:
+                req = conn.recv() if conn.poll(10) else {}
+            except (EOFError, OSError):
+                conn.close()
+                continue
+
+            if req.get("ping"):
+                conn.send({"pong": os.getpid(), "uptime": round(time.time() - started, 1),
+                           "preloaded": loaded, "running": len(children)})
+                conn.close()
+                continue
+
+            script = _resolve_script(req.get("argv", []))
+            if script is None:
+                conn.send({"error": f"script non valido: {req.get('argv')}"})
+                conn.close()
+                continue
+            if _source_snapshot() != snapshot:
+                conn.send({"restart": True})
+                conn.close()
+                print("[INFO] Sorgenti modificati: riavvio del worker", flush=True)
+                listener.close()
+                socket_path.unlink(missing_ok=True)
+                os.execv(sys.executable, [sys.executable, str(Path(__file__).resolve()), "--serve"])
+
+            signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])  # il pid entra in children prima di _reap
+            try:
+                pid = os.fork()
+                if pid == 0:
+                    signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+                    listener.close()
+                    _run_child(conn, script, req["argv"][1:], req.get("env"))
+                children.add(pid)
+            finally:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+            conn.close()
+
+
+# =========================
+# CLIENT
+# =========================
+def _connect(socket_path: Optional[Path] = None, key_path: Optional[Path] = None):
+    socket_path, key_path = socket_path or SOCKET_PATH, key_path or KEY_PATH
+    if not hasattr(os, "fork") or not socket_path.exists() or not key_path.exists():
+        return None
+    try:
+        return Client(str(socket_path), family="AF_UNIX", authkey=key_path.read_bytes())
+    except Exception:
+        return None
+
+
+def ping(socket_path: Optional[Path] = None, key_path: Optional[Path] = None) -> Optional[dict]:
+    conn = _connect(socket_path, key_path)
+    if conn is None:
+        return None
+    try:
+        conn.send({"ping": True})
+        return conn.recv() if conn.poll(5) else None
+    except (EOFError, OSError):
+        return None
+    finally:
+        conn.close()
+
+
+def run_command(argv: List[str], on_line: Callable[[str], None] = print,
+                should_stop: Callable[[], bool] = lambda: False, timeout: float = 3600,
+                env: Optional[Dict[str, str]] = None, socket_path: Optional[Path] = None,
+                key_path: Optional[Path] = None) -> Optional[int]:
+    """
+    Esegue `python <argv...>` nel worker con l'ambiente `env` (default: quello del
+    chiamante, come il subprocess) e ritorna l'exit code del figlio, anche dopo uno
+    stop (negativo se ucciso dal segnale). None = worker non disponibile: usare il subprocess.
+    """
+    conn = _connect(socket_path, key_path)
+    if conn is None:
+        return None
+    try:
+        conn.send({"argv": list(argv), "env": dict(os.environ if env is None else env)})
+        if not conn.poll(10):
+            return None
+        first = conn.recv()
+        if "pid" not in first:
+            if first.get("error"):
+                on_line(f"[WARN] Worker: {first['error']}")
+            return None
+        pid = first["pid"]
+        start = time.time()
+        killed_at = None
+        while True:
+            if conn.poll(0.2):
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    return -signal.SIGTERM if killed_at else 1  # figlio terminato senza exit
+                if "line" in msg:
+                    on_line(msg["line"])
+                elif "exit" in msg:
+                    return msg["exit"]
+                continue
+            stop = should_stop()
+            if killed_at is None and (stop or time.time() - start > timeout):
+                on_line("[WARN] Interruzione richiesta: termino il comando nel worker..." if stop
+                        else f"[ERR] Timeout dopo {timeout}s nel worker")
+                killed_at = time.time()
+                _signal(pid, signal.SIGTERM)
+            elif killed_at is not None and time.time() - killed_at > STOP_GRACE:
+                _signal(pid, signal.SIGKILL)
+                return -signal.SIGKILL
+    except (EOFError, OSError):
+        return None
+    finally:
+        conn.close()
+
+
+def _signal(pid: int, sig: int) -> None:
+    try:
+        os.kill(pid, sig)
+    except OSError:
+        pass
+
+
+def start_background(log_path: Optional[Path] = None) -> Optional[subprocess.Popen]:
+    """Avvia il server in un processo separato (usato da app.py)."""
+    if not hasattr(os, "fork"):
+        return None
+    out = open(log_path, "a", encoding="utf-8") if log_path else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "--serve"], cwd=str(ROOT),
+                            stdout=out, stderr=subprocess.STDOUT)
+
+
+def _bench(argv: List[str], runs: int) -> None:
+    def timed(fn):
+        out = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            rc = fn()
+            out.append(time.perf_counter() - t0)
+            if rc not in (0, True):
+                print(f"[WARN] exit code {rc}")
+        return out
+
+    sub = timed(lambda: subprocess.run([sys.executable] + argv, cwd=str(ROOT), stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL).returncode)
+    if ping() is None:
+        print("[ERR] Worker non attivo: avvia prima python pipeline_worker.py --serve")
+        return
+    res = timed(lambda: run_command(argv, on_line=lambda line: None))
+    med = lambda xs: sorted(xs)[len(xs) // 2]  # noqa: E731
+    print(f"[INFO] {' '.join(argv)} ({runs} esecuzioni)")
+    print(f"    subprocess: mediana {med(sub) * 1000:.0f} ms  min {min(sub) * 1000:.0f} ms")
+    print(f"    worker    : mediana {med(res) * 1000:.0f} ms  min {min(res) * 1000:.0f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Worker residente per i comandi della pipeline")
+    ap.add_argument("--serve", action="store_true", help="Avvia il server (foreground)")
+    ap.add_argument("--ping", action="store_true", help="Stato del worker")
+    ap.add_argument("--bench", action="store_true", help="Confronta latenza subprocess vs worker")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("command", nargs=argparse.REMAINDER, help="-- script.py [argomenti] (con --bench)")
+    args = ap.parse_args()
+
+    if args.serve:
+        serve()
+    elif args.ping:
+        info = ping()
+        print(f"[OK] {info}" if info else "[ERR] Worker non raggiungibile")
+    elif args.bench:
+        argv = [a for a in args.command if a != "--"] or ["model_registry.py"]
+        _bench(argv, args.runs)
+    else:
+        ap.print_help()
+
+
+if __name__ == "__main__":
+    main()
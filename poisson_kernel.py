@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+poisson_kernel.py
+-----------------
+Kernel Poisson vettoriale condiviso da tutti i calcolatori di mercato.
+
+Da array di (λ_home, λ_away) per N partite costruisce il tensore N×G×G delle
+probabilità dei risultati esatti (G = max_goals + 1) con broadcasting, poi
+ricava i mercati come prodotti matrice con maschere precalcolate per G:
+
+    M.reshape(N, G*G) @ maschera(G*G, K)  ->  (N, K)
+
+Mercati: 1X2, doppia chance, Over/Under su qualsiasi linea, GG/NG, multigol,
+risultati esatti, totali squadra e combo (probabilità congiunte esatte).
+
+Convenzioni:
+- griglia troncata a max_goals: le somme sono sulla griglia, come nei vecchi
+  cicli annidati (la massa oltre max_goals è persa, non ridistribuita)
+- λ <= 0 → tutta la massa su 0 gol (P(0) = 1), come scipy.stats.poisson con
+  λ = 0. Cambio voluto rispetto ai vecchi _poisson_prob di predictions_generator
+  e model_pipeline, che davano massa 0 (p1/px/p2 tutti 0, "nessuna partita");
+  quei chiamanti limitano λ a [0.15, 5] (_intuition_adjust) e [0.3, 4]
+  (target dei modelli dummy), quindi i loro risultati non cambiano
+- normalize_1x2: p1/px/p2 divisi per la loro somma sulla griglia
+
+Uso:
+    M = score_tensor([1.6, 0.9], [1.1, 1.4])         # (2, 9, 9)
+    p1, px, p2 = outcome_probs(M)                    # array (2,)
+    mk = compute_markets([1.6, 0.9], [1.1, 1.4])     # dict nome -> array (N,)
+
+Benchmark contro i vecchi cicli: python poisson_kernel.py --bench
+"""
+
+from __future__ import annotations
+
+import math
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAX_GOALS = 8
+
+OU_LINES = (0.5, 1.5, 2.5, 3.5, 4.5, 5.5)
+TEAM_LINES = (0.5, 1.5, 2.5)
+MULTIGOL_RANGES = (
+    ('0-1', 0, 1),
+    ('1-2', 1, 2),
+    ('1-3', 1, 3),
+    ('2-3', 2, 3),
+    ('2-4', 2, 4),
+    ('2-5', 2, 5),
+    ('3-4', 3, 4),
+    ('3-5', 3, 5),
+    ('3-6', 3, 6),
+    ('4-5', 4, 5),
+    ('4-6', 4, 6),
+    ('5-6', 5, 6),
+)
+
+
+# =========================
+# TENSORE
+# =========================
+@lru_cache(maxsize=None)
+def _log_factorials(max_goals: int) -> np.ndarray:
+    return np.array([math.lgamma(k + 1) for k in range(max_goals + 1)])
+
+
+def pmf_table(lam, max_goals: int = MAX_GOALS) -> np.ndarray:
+    """P(X = k), k = 0..max_goals, per ogni λ: array (N, G)."""
+    lam = np.maximum(np.atleast_1d(np.asarray(lam, dtype=float)), 0.0)
+    k = np.arange(max_goals + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_p = k * np.log(lam)[:, None] - lam[:, None] - _log_factorials(max_goals)
+    out = np.exp(log_p)
+    # λ = 0: log(0) = -inf → 0 * -inf = nan su k = 0
+    out[lam == 0.0] = 0.0
+    out[lam == 0.0, 0] = 1.0
+    return out
+
+
+def score_tensor(lam_home, lam_away, max_goals: int = MAX_GOALS) -> np.ndarray:
+    """Tensore (N, G, G): M[n, h, a] = P(home = h) * P(away = a)."""
+    ph = pmf_table(lam_home, max_goals)
+    pa = pmf_table(lam_away, max_goals)
+    return ph[:, :, None] * pa[:, None, :]
+
+
+# =========================
+# MASCHERE (per G, calcolate una volta)
+# =========================
+class _Masks:
+    def __init__(self, max_goals: int):
+        g = np.arange(max_goals + 1)
+        h, a = np.meshgrid(g, g, indexing='ij')
+        self.max_goals = max_goals
+        self.home = h.ravel()
+        self.away = a.ravel()
+        self.total = self.home + self.away
+        # colonne 1, X, 2
+        self.outcome = np.stack(
+            [self.home > self.away, self.home == self.away, self.home < self.away], axis=1
+        ).astype(float)
+        # one-hot del totale gol: (G*G, 2G-1)
+        self.total_onehot = (self.total[:, None] == np.arange(2 * max_goals + 1)).astype(float)
+        self.both_score = ((self.home > 0) & (self.away > 0)).astype(float)
+
+
+@lru_cache(maxsize=None)
+def masks(max_goals: int = MAX_GOALS) -> _Masks:
+    return _Masks(max_goals)
+
+
+def _flat(M: np.ndarray) -> Tuple[np.ndarray, _Masks]:
+    M = np.asarray(M, dtype=float)
+    if M.ndim == 2:
+        M = M[None]
+    return M.reshape(M.shape[0], -1), masks(M.shape[1] - 1)
+
+
+# =========================
+# MERCATI DAL TENSORE
+# =========================
+def outcome_probs(M: np.ndarray, normalize: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """p1, px, p2 (array (N,)); normalize divide per p1+px+p2 sulla griglia."""
+    flat, mk = _flat(M)
+    p = flat @ mk.outcome
+    if normalize:
+        tot = p.sum(axis=1, keepdims=True)
+        p = np.divide(p, tot, out=p.copy(), where=tot > 0)
+    return p[:, 0], p[:, 1], p[:, 2]
+
+
+def total_goals_dist(M: np.ndarray) -> np.ndarray:
+    """P(totale gol = t), t = 0..2*max_goals: array (N, 2G-1)."""
+    flat, mk = _flat(M)
+    return flat @ mk.total_onehot
+
+
+def over_prob(M: np.ndarray, line: float) -> np.ndarray:
+    """P(totale gol > line) sulla griglia."""
+    dist = total_goals_dist(M)
+    return dist[:, np.arange(dist.shape[1]) > line].sum(axis=1)
+
+
+def multigol_prob(M: np.ndarray, lo: int, hi: int) -> np.ndarray:
+    """P(lo <= totale gol <= hi)."""
+    dist = total_goals_dist(M)
+    t = np.arange(dist.shape[1])
+    return dist[:, (t >= lo) & (t <= hi)].sum(axis=1)
+
+
+def btts_prob(M: np.ndarray) -> np.ndarray:
+    """GG sulla griglia: P(home > 0 e away > 0)."""
+    flat, mk = _flat(M)
+    return flat @ mk.both_score
+
+
+def team_over_prob(M: np.ndarray, line: float, side: str = 'home') -> np.ndarray:
+    """P(gol della squadra > line); side = 'home' | 'away'."""
+    M = np.asarray(M, dtype=float)
+    if M.ndim == 2:
+        M = M[None]
+    marginal = M.sum(axis=2) if side == 'home' else M.sum(axis=1)
+    return marginal[:, np.arange(marginal.shape[1]) > line].sum(axis=1)
+
+
+def joint_prob(M: np.ndarray, cond) -> np.ndarray:
+    """
+    Probabilità congiunta esatta di una condizione sui gol, es.
+    joint_prob(M, lambda h, a: (h >= a) & (h + a > 1.5))   # 1X + Over 1.5
+    """
+    flat, mk = _flat(M)
+    return flat @ np.asarray(cond(mk.home, mk.away), dtype=float)
+
+
+def exact_scores(M: np.ndarray, top_n: Optional[int] = None) -> List[List[Tuple[str, float]]]:
+    """
+    Risultati esatti per partita ordinati per probabilità decrescente
+    (a parità, ordine h poi a come nei cicli annidati).
+    """
+    flat, mk = _flat(M)
+    order = np.argsort(-flat, axis=1, kind='stable')
+    if top_n is not None:
+        order = order[:, :top_n]
+    labels = [f"{h}-{a}" for h, a in zip(mk.home, mk.away)]
+    return [[(labels[i], float(row[i])) for i in idx] for row, idx in zip(flat, order)]
+
+
+def compute_markets(
+    lam_home,
+    lam_away,
+    max_goals: int = MAX_GOALS,
+    ou_lines: Sequence[float] = OU_LINES,
+    multigol: Iterable[Tuple[str, int, int]] = MULTIGOL_RANGES,
+    team_lines: Sequence[float] = TEAM_LINES,
+    normalize_1x2: bool = True,
+) -> Dict[str, np.ndarray]:
+    """
+    Tutti i mercati per N partite: dict nome -> array (N,).
+
+    Chiavi: p1/px/p2, dc_1x/dc_12/dc_x2, over_<l>/under_<l>, gg/ng,
+    mg_<a-b>, home_over_<l>/home_under_<l>/away_..., combo_<dc|1|x|2>_<gg|ng>,
+    combo_<dc|1|x|2>_over_2.5/_under_2.5 (congiunte esatte sul tensore).
+    """
+    M = score_tensor(lam_home, lam_away, max_goals)
+    flat, mk = _flat(M)
+    out: Dict[str, np.ndarray] = {}
+
+    p1, px, p2 = outcome_probs(M, normalize=normalize_1x2)
+    out['p1'], out['px'], out['p2'] = p1, px, p2
+    out['dc_1x'] = p1 + px
+    out['dc_12'] = p1 + p2
+    out['dc_x2'] = px + p2
+
+    dist = flat @ mk.total_onehot
+    t = np.arange(dist.shape[1])
+    for line in ou_lines:
+        over = dist[:, t > line].sum(axis=1)
+        out[f'over_{line}'] = over
+        out[f'under_{line}'] = 1 - over
+
+    out['gg'] = flat @ mk.both_score
+    out['ng'] = 1 - out['gg']
+
+    for label, lo, hi in multigol:
+        out[f'mg_{label}'] = dist[:, (t >= lo) & (t <= hi)].sum(axis=1)
+
+    for side in ('home', 'away'):
+        for line in team_lines:
+            over = team_over_prob(M, line, side)
+            out[f'{side}_over_{line}'] = over
+            out[f'{side}_under_{line}'] = 1 - over
+
+    # Combo: esito × GG/NG e × O/U 2.5, congiunte esatte
+    outcomes = {
+        '1': mk.home > mk.away,
+        'x': mk.home == mk.away,
+        '2': mk.home < mk.away,
+        '1x': mk.home >= mk.away,
+        '12': mk.home != mk.away,
+        'x2': mk.home <= mk.away,
+    }
+    goal_conds = {
+        'gg': (mk.home > 0) & (mk.away > 0),
+        'ng': (mk.home == 0) | (mk.away == 0),
+        'over_2.5': mk.total > 2.5,
+        'under_2.5': mk.total < 2.5,
+    }
+    combo_masks = []
+    combo_names = []
+    for o_name, o_mask in outcomes.items():
+        for g_name, g_mask in goal_conds.items():
+            combo_names.append(f'combo_{o_name}_{g_name}')
+            combo_masks.append(o_mask & g_mask)
+    combos = flat @ np.stack(combo_masks, axis=1).astype(float)
+    for j, name in enumerate(combo_names):
+        out[name] = combos[:, j]
+
+    return out
+
+
+# =========================
+# BENCHMARK
+# =========================
+def _loop_markets(lh: float, la: float, max_goals: int = MAX_GOALS) -> Dict[str, float]:
+    """Implementazione a cicli annidati (com'era nei calcolatori), per confronto."""
+    def pmf(lam, k):
+        return math.exp(-lam) * (lam ** k) / math.factorial(k)
+
+    out = {'p1': 0.0, 'px': 0.0, 'p2': 0.0, 'gg': 0.0}
+    for line in OU_LINES:
+        out[f'over_{line}'] = 0.0
+    for label, _, _ in MULTIGOL_RANGES:
+        out[f'mg_{label}'] = 0.0
+    for h in range(max_goals + 1):
+        ph = pmf(lh, h)
+        for a in range(max_goals + 1):
+            p = ph * pmf(la, a)
+            if h > a:
+                out['p1'] += p
+            elif h == a:
+                out['px'] += p
+            else:
+                out['p2'] += p
+            if h > 0 and a > 0:
+                out['gg'] += p
+            for line in OU_LINES:
+                if h + a > line:
+                    out[f'over_{line}'] += p
+            for label, lo, hi in MULTIGOL_RANGES:
+                if lo <= h + a <= hi:
+                    out[f'mg_{label}'] += p
+    tot = out['p1'] + out['px'] + out['p2']
+    out['p1'], out['px'], out['p2'] = out['p1'] / tot, out['px'] / tot, out['p2'] / tot
+    return out
+
+
+def benchmark(n_matches: int = 2000, seed: int = 0) -> None:
+    import time
+
+    rng = np.random.default_rng(seed)
+    lh = rng.uniform(0.3, 3.0, n_matches)
+    la = rng.uniform(0.3, 2.5, n_matches)
+
+    t0 = time.perf_counter()
+    loop = [_loop_markets(h, a) for h, a in zip(lh, la)]
+    t_loop = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    vec = compute_markets(lh, la)
+    t_vec = time.perf_counter() - t0
+
+    max_err = max(
+        abs(vec[key][i] - loop[i][key]) for i in range(n_matches) for key in loop[i]
+    )
+    print(f"[BENCH] {n_matches} partite, griglia {MAX_GOALS + 1}x{MAX_GOALS + 1}")
+    print(f"[BENCH] cicli annidati: {t_loop:.3f}s ({len(loop[0])} mercati)")
+    print(f"[BENCH] kernel vettoriale: {t_vec:.4f}s ({len(vec)} mercati) → x{t_loop / t_vec:.0f}")
+    print(f"[BENCH] differenza massima: {max_err:.2e}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Kernel Poisson vettoriale")
+    ap.add_argument("--bench", action="store_true", help="benchmark contro i cicli annidati")
+    ap.add_argument("--n", type=int, default=2000, help="partite nel benchmark")
+    args = ap.parse_args()
+    if args.bench:
+        benchmark(args.n)
+    else:
+        mk = compute_markets([1.6], [1.2])
+        for key, val in mk.items():
+            print(f"{key:20s} {val[0]:.4f}")
@@ -6,19 +6,26 @@ populate_advanced_features.py
 Popola advanced features per tutte le partite nel database.
 Salva in CSV che verrà mergiato con dataset principale durante training ML.
 
+Di default aggiorna prima team_form/head_to_head (team_form_store.py, solo
+risultati nuovi) e poi legge le feature giornata per giornata con una query
+per tabella. --legacy usa il vecchio calcolo con ~7 query per partita.
+
 Usage:
     python3 populate_advanced_features.py --all
     python3 populate_advanced_features.py --date 2026-01-02
+    python3 populate_advanced_features.py --all --legacy
 """
 
 import argparse
 import pandas as pd
+from collections import defaultdict
 from datetime import datetime, timedelta
 from pathlib import Path
 
 from database import SessionLocal
 from models import Fixture
 from advanced_features import AdvancedFeatureCalculator
+from team_form_store import materialize
 
 ROOT = Path(__file__).resolve().parent
 OUTPUT_FILE = ROOT / "data" / "advanced_features.csv"
@@ -26,7 +33,8 @@ OUTPUT_FILE = ROOT / "data" / "advanced_features.csv"
 
 def populate_advanced_features(
     date_filter: str = None,
-    all_matches: bool = False
+    all_matches: bool = False,
+    legacy: bool = False
 ):
     """
     Popola advanced features per match specificati.
@@ -34,6 +42,7 @@ def populate_advanced_features(
     Args:
         date_filter: Data specifica (YYYY-MM-DD)
         all_matches: Se True, processa TUTTE le partite nel DB
+        legacy: Se True, calcolo per partita invece delle istantanee materializzate
     """
     db = SessionLocal()
     calc = AdvancedFeatureCalculator(db)
@@ -72,39 +81,55 @@ def populate_advanced_features(
 
     # Processa partite
     new_features = []
-    skipped = 0
-
-    for i, fixture in enumerate(fixtures, 1):
-        # Skip se già processata
-        if fixture.match_id in existing_match_ids:
-            skipped += 1
-            continue
-
-        # Progress indicator
-        if i % 10 == 0 or i == len(fixtures):
-            print(f"[PROGRESS] {i}/{len(fixtures)} partite processate...")
-
-        try:
-            features = calc.calculate_all_advanced_features(
-                fixture.match_id,
-                fixture.home,
-                fixture.away,
-                fixture.league,
-                fixture.date
-            )
-
-            # Aggiungi metadati
-            features['match_id'] = fixture.match_id
-            features['date'] = fixture.date.isoformat()
-            features['league'] = fixture.league
-            features['home_team'] = fixture.home
-            features['away_team'] = fixture.away
-
-            new_features.append(features)
-
-        except Exception as e:
-            print(f"\n[ERROR] Match {fixture.match_id}: {e}")
-            continue
+
+    def _with_meta(features, fixture):
+        # Aggiungi metadati
+        features['match_id'] = fixture.match_id
+        features['date'] = fixture.date.isoformat()
+        features['league'] = fixture.league
+        features['home_team'] = fixture.home
+        features['away_team'] = fixture.away
+        return features
+
+    todo = [f for f in fixtures if f.match_id not in existing_match_ids]
+    skipped = len(fixtures) - len(todo)
+
+    if legacy:
+        for i, fixture in enumerate(todo, 1):
+            # Progress indicator
+            if i % 10 == 0 or i == len(todo):
+                print(f"[PROGRESS] {i}/{len(todo)} partite processate...")
+
+            try:
+                features = calc.calculate_all_advanced_features(
+                    fixture.match_id,
+                    fixture.home,
+                    fixture.away,
+                    fixture.league,
+                    fixture.date
+                )
+                new_features.append(_with_meta(features, fixture))
+
+            except Exception as e:
+                print(f"\n[ERROR] Match {fixture.match_id}: {e}")
+                continue
+    elif todo:
+        # Istantanee aggiornate con i soli risultati nuovi, poi 1 lettura per giornata
+        materialize(db)
+        by_date = defaultdict(list)
+        for fixture in todo:
+            by_date[fixture.date].append(fixture)
+        done = 0
+        for day in sorted(by_date):
+            try:
+                day_features = calc.calculate_features_for_date(day, by_date[day])
+            except Exception as e:
+                print(f"\n[ERROR] Giornata {day}: {e}")
+                continue
+            for fixture in by_date[day]:
+                new_features.append(_with_meta(day_features[fixture.match_id], fixture))
+            done += len(by_date[day])
+            print(f"[PROGRESS] {done}/{len(todo)} partite processate...")
 
     db.close()
 
@@ -149,12 +174,18 @@ def main():
         action="store_true",
         help="Processa TUTTE le partite nel database"
     )
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="Calcolo per partita (~7 query ciascuna) invece di team_form/head_to_head"
+    )
 
     args = parser.parse_args()
 
     populate_advanced_features(
         date_filter=args.date,
-        all_matches=args.all
+        all_matches=args.all,
+        legacy=args.legacy
     )
 
 
@@ -10,13 +10,31 @@ Strategy:
 - Load historical CSV
 - For each match, calculate advanced features using rolling windows on CSV data
 - Save enhanced CSV with all features
+- Default: incremental update from the persisted team state (enhanced_incremental.py);
+  --full-rebuild recomputes everything, --verify checks against a full recompute
+- full recomputes (first run, missing/invalid state, --full-rebuild) save each finished
+  league with a checkpoint (backfill_checkpoint.py); populate_enhanced_features (--legacy)
+  saves blocks of rows: an interrupted run resumes from there, --restart discards it
+- --jobs N: full recomputes run one league per process (ProcessPoolExecutor),
+  with output identical to the serial path and the same per-league checkpoint;
+  --legacy stays serial
 """
 
+import argparse
+import sys
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from datetime import datetime, timedelta
 
+from backfill_checkpoint import BackfillCheckpoint, pausable
+from enhanced_incremental import update_enhanced, verify_enhanced
+from historical_store import load_dataset
+from metrics import count, instrument
+from team_state_engine import (
+    ADVANCED_FEATURE_COLS, TeamStateEngine, compute_advanced_features, iter_league_features, league_shards,
+)
+
 ROOT = Path(__file__).resolve().parent
 
 # Input/Output paths
@@ -25,6 +43,10 @@ HIST_1X2_PATH = ROOT / "data" / "historical_1x2.csv"
 HIST_OU_ENHANCED = ROOT / "data" / "historical_dataset_enhanced.csv"
 HIST_1X2_ENHANCED = ROOT / "data" / "historical_1x2_enhanced.csv"
 
+# righe per blocco salvato nello staging (il percorso legacy è ~1000x più lento)
+BLOCK_ROWS = 20_000
+LEGACY_BLOCK_ROWS = 500
+
 
 def calculate_team_form(df, team, league, before_date, n_recent=5):
     """
@@ -357,51 +379,21 @@ def calculate_momentum(df, team, league, before_date, n_recent=10):
     }
 
 
-def populate_enhanced_features(input_csv, output_csv):
+def compute_features_legacy(df, rows=None):
     """
-    Main function: populate advanced features for historical CSV.
+    Percorso originale riga per riga (O(N²)): ogni riga ri-filtra l'intero df.
+    Scrive le advanced features direttamente in df. Tenuto come riferimento
+    per il test di parità con team_state_engine.
+    rows (etichette dell'index): calcola solo queste righe (blocchi del checkpoint).
     """
-    print(f"\n{'='*80}")
-    print(f"POPULATING ADVANCED FEATURES")
-    print(f"Input: {input_csv}")
-    print(f"Output: {output_csv}")
-    print(f"{'='*80}\n")
-
-    # Load historical data
-    df = pd.read_csv(input_csv)
-    df['date'] = pd.to_datetime(df['date']).dt.date
-
-    print(f"Loaded {len(df)} historical matches")
-    print(f"Date range: {df['date'].min()} → {df['date'].max()}")
-    print(f"Leagues: {df['league'].unique().tolist()}\n")
-
-    # Initialize new columns
-    advanced_feature_cols = [
-        'home_form_xg_for', 'home_form_xg_against', 'home_form_xg_diff',
-        'home_form_wins', 'home_form_draws', 'home_form_losses',
-        'home_form_goals_for', 'home_form_goals_against', 'home_form_points', 'home_form_trend',
-        'away_form_xg_for', 'away_form_xg_against', 'away_form_xg_diff',
-        'away_form_wins', 'away_form_draws', 'away_form_losses',
-        'away_form_goals_for', 'away_form_goals_against', 'away_form_points', 'away_form_trend',
-        'h2h_home_wins', 'h2h_draws', 'h2h_away_wins',
-        'h2h_home_goals_avg', 'h2h_away_goals_avg', 'h2h_home_xg_avg', 'h2h_away_xg_avg',
-        'h2h_total_over25',
-        'home_position', 'home_points', 'home_goal_difference', 'home_pressure_top', 'home_pressure_relegation',
-        'away_position', 'away_points', 'away_goal_difference', 'away_pressure_top', 'away_pressure_relegation',
-        'home_winning_streak', 'home_unbeaten_streak', 'home_losing_streak',
-        'home_clean_sheet_streak', 'home_scoring_streak', 'home_xg_momentum',
-        'away_winning_streak', 'away_unbeaten_streak', 'away_losing_streak',
-        'away_clean_sheet_streak', 'away_scoring_streak', 'away_xg_momentum',
-        'position_gap', 'points_gap', 'form_diff', 'momentum_diff',
-    ]
-
-    for col in advanced_feature_cols:
-        df[col] = np.nan
+    for col in ADVANCED_FEATURE_COLS:
+        if rows is None or col not in df.columns:
+            df[col] = np.nan
 
     # Process each match
-    print("Calculating advanced features...")
-    total = len(df)
-    for i, (idx, row) in enumerate(df.iterrows(), 1):
+    target = df if rows is None else df.loc[rows]
+    total = len(target)
+    for i, (idx, row) in enumerate(target.iterrows(), 1):
         if i % 100 == 0 or i == total:
             print(f"  Progress: {i}/{total} ({i/total*100:.1f}%)")
         try:
@@ -453,8 +445,85 @@ def populate_enhanced_features(input_csv, output_csv):
             print(f"\n[ERROR] Row {idx}: {e}")
             continue
 
-    # Save enhanced dataset
-    df.to_csv(output_csv, index=False)
+    return df
+
+
+def _date_blocks(dates: np.ndarray, size: int):
+    """Indici di riga in ordine di data (stabile), a blocchi di ~size che non spezzano una giornata."""
+    order = np.argsort(dates, kind='mergesort')
+    n = len(order)
+    start = 0
+    while start < n:
+        end = min(start + size, n)
+        while end < n and dates[order[end]] == dates[order[end - 1]]:
+            end += 1
+        yield order[start:end]
+        start = end
+
+
+@instrument("enhanced_features")
+def populate_enhanced_features(input_csv, output_csv, legacy=False, restart=False, jobs=1):
+    """
+    Main function: populate advanced features for historical CSV.
+    legacy=True usa il vecchio calcolo riga per riga invece del motore a passaggio singolo.
+    Le feature si salvano a blocchi nello staging di output_csv (backfill_checkpoint),
+    insieme allo stato del motore: un giro interrotto riparte dall'ultimo blocco.
+    jobs > 1 (motore a passaggio singolo): una lega per processo, stesso output del seriale.
+    """
+    print(f"\n{'='*80}")
+    print(f"POPULATING ADVANCED FEATURES")
+    print(f"Input: {input_csv}")
+    print(f"Output: {output_csv}")
+    print(f"{'='*80}\n")
+
+    # Load historical data
+    df = load_dataset(input_csv)
+    df['date'] = pd.to_datetime(df['date']).dt.date
+
+    print(f"Loaded {len(df)} historical matches")
+    print(f"Date range: {df['date'].min()} → {df['date'].max()}")
+    print(f"Leagues: {df['league'].unique().tolist()}\n")
+
+    content = int(pd.util.hash_pandas_object(df, index=False).sum())
+    shards = None if legacy or jobs <= 1 else league_shards(df)
+    by_league = shards is not None and len(shards.rows) > 1
+    ckpt = BackfillCheckpoint(output_csv, {"input": str(input_csv), "content": content, "legacy": legacy,
+                                           "shard": "league" if by_league else "rows"}, restart=restart)
+    if by_league:
+        # una lega per processo; ogni lega completata è un'unità del checkpoint
+        units = [f"league:{'' if lg is None else lg}" for lg in shards.leagues]
+        print(f"Calculating advanced features (single pass), {len(units)} leghe su {jobs} processi...")
+        skip = {k for k, unit in enumerate(units) if ckpt.is_done(unit)}
+        for k, out, _ in iter_league_features(shards, jobs, skip):
+            rows = df.index[shards.rows[k]]
+            ckpt.save_part(units[k], pd.DataFrame(out, index=rows, columns=ADVANCED_FEATURE_COLS))
+            print(f"  {units[k]}: {len(rows)} righe ({len(ckpt.done)}/{len(units)})")
+    else:
+        blocks = list(_date_blocks(pd.to_datetime(df['date']).to_numpy(),
+                                   LEGACY_BLOCK_ROWS if legacy else BLOCK_ROWS))
+        engine = None if legacy else (ckpt.payload() or TeamStateEngine())
+        print(f"Calculating advanced features ({'legacy, row by row' if legacy else 'single pass'}), "
+              f"{len(blocks)} blocchi...")
+        for k, block in enumerate(blocks, 1):
+            unit = f"rows-{k}"
+            if ckpt.is_done(unit):
+                continue
+            rows = df.index[block]
+            if legacy:
+                feats = compute_features_legacy(df, rows=rows).loc[rows, ADVANCED_FEATURE_COLS]
+            else:
+                feats = compute_advanced_features(df.loc[rows], engine)
+            ckpt.save_part(unit, feats, payload=engine)
+            print(f"  Blocco {k}/{len(blocks)}: {len(rows)} righe")
+
+    frames = ckpt.frames()
+    feats = pd.concat(frames) if frames else pd.DataFrame(columns=ADVANCED_FEATURE_COLS)
+    for col in ADVANCED_FEATURE_COLS:
+        df[col] = feats[col].reindex(df.index)
+
+    # Save enhanced dataset (sostituzione atomica, poi via lo staging)
+    ckpt.publish(df, [output_csv])
+    count("rows", len(df))
 
     print(f"\n{'='*80}")
     print(f"[SUCCESS] Enhanced dataset saved: {output_csv}")
@@ -471,17 +540,35 @@ def populate_enhanced_features(input_csv, output_csv):
 
 
 def main():
-    # Process OU dataset
-    if HIST_OU_PATH.exists():
-        populate_enhanced_features(HIST_OU_PATH, HIST_OU_ENHANCED)
-    else:
-        print(f"[WARN] {HIST_OU_PATH} not found")
-
-    # Process 1X2 dataset
-    if HIST_1X2_PATH.exists():
-        populate_enhanced_features(HIST_1X2_PATH, HIST_1X2_ENHANCED)
-    else:
-        print(f"[WARN] {HIST_1X2_PATH} not found")
+    ap = argparse.ArgumentParser(description="Popola advanced features per gli storici CSV")
+    ap.add_argument("--legacy", action="store_true",
+                    help="Usa il vecchio calcolo riga per riga (lento, solo per confronto)")
+    ap.add_argument("--full-rebuild", action="store_true",
+                    help="Ricalcola tutto lo storico invece delle sole partite nuove (e riscrive lo stato)")
+    ap.add_argument("--verify", action="store_true",
+                    help="Confronta gli output con un ricalcolo completo in memoria, senza scrivere")
+    ap.add_argument("--restart", action="store_true",
+                    help="Ricalcolo completo (o --legacy): ignora il checkpoint di un giro interrotto")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Processi per il ricalcolo completo (una lega per processo, ognuna salvata "
+                         "nel checkpoint; 1 = seriale; ignorato con --legacy)")
+    args = ap.parse_args()
+
+    ok = True
+    # Process OU and 1X2 datasets
+    with pausable("Advanced features"):
+        for input_csv, output_csv in ((HIST_OU_PATH, HIST_OU_ENHANCED), (HIST_1X2_PATH, HIST_1X2_ENHANCED)):
+            if not input_csv.exists():
+                print(f"[WARN] {input_csv} not found")
+            elif args.legacy:
+                populate_enhanced_features(input_csv, output_csv, legacy=True, restart=args.restart)
+            elif args.verify:
+                ok = verify_enhanced(input_csv, output_csv) and ok
+            else:
+                update_enhanced(input_csv, output_csv, full_rebuild=args.full_rebuild, jobs=args.jobs,
+                                restart=args.restart)
+    if not ok:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
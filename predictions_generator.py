@@ -25,11 +25,11 @@ from database import SessionLocal
 from models import Fixture, Odds, Feature, Prediction
 import random
 from rapidfuzz import fuzz
-import joblib
-import json
 
 # Neural Reasoning Engine V2 - PESANTE E INTELLIGENTE (applica fino a ±30%)
 from neural_reasoning_engine_v2 import NeuralReasoningEngineV2
+from model_registry import get_model
+from poisson_kernel import exact_scores, joint_prob, outcome_probs, over_prob, score_tensor, total_goals_dist
 
 # Heuristica per fallback quando mancano dati xG
 STRONG_TEAMS = {
@@ -88,36 +88,9 @@ def _clamp(v: float, lo: float, hi: float) -> float:
     return max(lo, min(hi, v))
 
 
-def _load_ml_artifact(model_path: Path, imputer_path: Path, scaler_path: Path, meta_path: Path):
-    if not model_path.exists() or not meta_path.exists():
-        return None
-    try:
-        model = joblib.load(model_path)
-        imputer = joblib.load(imputer_path) if imputer_path.exists() else None
-        scaler = joblib.load(scaler_path) if scaler_path.exists() else None
-        meta = json.loads(meta_path.read_text(encoding="utf-8"))
-        return {"model": model, "imputer": imputer, "scaler": scaler, "meta": meta}
-    except Exception:
-        return None
-
-
-ML_CACHE = {"ou": None, "x2": None}
-MODEL_DIR = ROOT / "models"
-OU_MODEL_PATH = MODEL_DIR / "bet_ou25.joblib"
-OU_IMPUTER_PATH = MODEL_DIR / "imputer_ou25.joblib"
-OU_SCALER_PATH = MODEL_DIR / "scaler_ou25.joblib"
-OU_META_PATH = MODEL_DIR / "meta_ou25.json"
-X2_MODEL_PATH = MODEL_DIR / "bet_1x2.joblib"
-X2_IMPUTER_PATH = MODEL_DIR / "imputer_1x2.joblib"
-X2_SCALER_PATH = MODEL_DIR / "scaler_1x2.joblib"
-X2_META_PATH = MODEL_DIR / "meta_1x2.json"
-
-
 def _load_ml_models():
-    if ML_CACHE["ou"] is None:
-        ML_CACHE["ou"] = _load_ml_artifact(OU_MODEL_PATH, OU_IMPUTER_PATH, OU_SCALER_PATH, OU_META_PATH)
-    if ML_CACHE["x2"] is None:
-        ML_CACHE["x2"] = _load_ml_artifact(X2_MODEL_PATH, X2_IMPUTER_PATH, X2_SCALER_PATH, X2_META_PATH)
+    """Modelli ML serviti dal registro (caricati una volta per processo, ricarica a caldo)."""
+    return {"ou": get_model("ou"), "x2": get_model("1x2")}
 
 
 def _prepare_feature_vector(features: Dict[str, float], cols: List[str]) -> Tuple[Optional[pd.DataFrame], float]:
@@ -139,12 +112,12 @@ def _prepare_feature_vector(features: Dict[str, float], cols: List[str]) -> Tupl
     return df, cov_ratio
 
 
-def _ml_predict(model_blob, df: Optional[pd.DataFrame]) -> Optional[List[float]]:
-    if not model_blob or df is None or df.empty:
+def _ml_predict(art, df: Optional[pd.DataFrame]) -> Optional[List[float]]:
+    if art is None or df is None or df.empty:
         return None
-    model = model_blob.get("model")
-    imputer = model_blob.get("imputer")
-    scaler = model_blob.get("scaler")
+    model = art.clf
+    imputer = art.imputer
+    scaler = art.scaler
     if model is None:
         return None
     arr_df = df.copy()
@@ -267,34 +240,17 @@ def _blend_totals(lambda_home: float, lambda_away: float, target_total: float, i
 
 def _prob_from_lambda(lambda_home: float, lambda_away: float, max_goals: int = 8) -> Tuple[float, float, float, float, str]:
     """Ricalcola p1/px/p2, p_over25 e score più probabile da lambda."""
-    p1 = px = p2 = over25 = 0.0
-    best = (0, 0, 0.0)
-    best_draw = None
-    best_non_draw = None
-    for hg in range(max_goals + 1):
-        ph = _poisson_prob(lambda_home, hg)
-        for ag in range(max_goals + 1):
-            pa = _poisson_prob(lambda_away, ag)
-            prob = ph * pa
-            if hg > ag:
-                p1 += prob
-            elif hg == ag:
-                px += prob
-            else:
-                p2 += prob
-            if hg + ag > 2.5:
-                over25 += prob
-            if prob > best[2]:
-                best = (hg, ag, prob)
-            if hg == ag:
-                if best_draw is None or prob > best_draw[2]:
-                    best_draw = (hg, ag, prob)
-            else:
-                if best_non_draw is None or prob > best_non_draw[2]:
-                    best_non_draw = (hg, ag, prob)
-    tot = p1 + px + p2
-    if tot > 0:
-        p1, px, p2 = p1 / tot, px / tot, p2 / tot
+    m = score_tensor(lambda_home, lambda_away, max_goals)
+    p1, px, p2 = (float(p[0]) for p in outcome_probs(m))
+    over25 = float(over_prob(m, 2.5)[0])
+    m = m[0]
+    # Più probabili: assoluto, pareggio, non pareggio (a parità il primo in ordine h, a)
+    hg, ag = np.unravel_index(int(np.argmax(m)), m.shape)
+    best = (int(hg), int(ag), float(m[hg, ag]))
+    d = int(np.argmax(np.diag(m)))
+    best_draw = (d, d, float(m[d, d]))
+    hg, ag = np.unravel_index(int(np.argmax(np.where(np.eye(m.shape[0], dtype=bool), -np.inf, m))), m.shape)
+    best_non_draw = (int(hg), int(ag), float(m[hg, ag]))
     chosen = best
     if best_draw and best_non_draw and (best_draw[2] - best_non_draw[2]) < 0.025:
         chosen = best_non_draw
@@ -313,15 +269,6 @@ def _normalize_odds_probs(o1: Optional[float], ox: Optional[float], o2: Optional
     return None
 
 
-def _poisson_prob(lam: float, k: int) -> float:
-    if lam <= 0 or k < 0:
-        return 0.0
-    try:
-        return (math.exp(-lam) * (lam ** k)) / math.factorial(k)
-    except Exception:
-        return 0.0
-
-
 def _fatigue_factor(rest_days: Optional[int]) -> float:
     """Attenua/alza l'attacco in base ai giorni di riposo."""
     if rest_days is None:
@@ -527,7 +474,8 @@ def generate_predictions(date_str: Optional[str] = None) -> List[Dict]:
             print(f"[WARN] Could not load advanced features: {e}")
 
     try:
-        _load_ml_models()
+        ml_models = _load_ml_models()
+        ml_version = {k: (a.version if a else None) for k, a in ml_models.items()}
         # Fetch fixtures per la data
         if target_date:
             fixtures = db.query(Fixture).filter(Fixture.date == target_date).all()
@@ -788,16 +736,18 @@ def generate_predictions(date_str: Optional[str] = None) -> List[Dict]:
             ml_ou_prob = None
             ml_1x2_prob = None
             ou_cov = x2_cov = 0.0
-            if ML_CACHE["ou"]:
-                cols_ou = ML_CACHE["ou"]["meta"].get("features", list(features_map.keys()))
-                df_vec, ou_cov = _prepare_feature_vector(features_map, cols_ou)
+            if ml_models["ou"]:
+                art = ml_models["ou"]
+                cols_ou = art.features or list(features_map.keys())
+                df_vec, ou_cov = _prepare_feature_vector(art.prepare_features(features_map), cols_ou)
                 if df_vec is not None:
-                    ml_ou_prob = _ml_predict(ML_CACHE["ou"], df_vec)
-            if ML_CACHE["x2"]:
-                cols_x2 = ML_CACHE["x2"]["meta"].get("features", list(features_map.keys()))
-                df_vec, x2_cov = _prepare_feature_vector(features_map, cols_x2)
+                    ml_ou_prob = _ml_predict(art, df_vec)
+            if ml_models["x2"]:
+                art = ml_models["x2"]
+                cols_x2 = art.features or list(features_map.keys())
+                df_vec, x2_cov = _prepare_feature_vector(art.prepare_features(features_map), cols_x2)
                 if df_vec is not None:
-                    ml_1x2_prob = _ml_predict(ML_CACHE["x2"], df_vec)
+                    ml_1x2_prob = _ml_predict(art, df_vec)
 
             # Merge Poisson + ML + Odds per affidabilità
             reliability_score = 0.3  # base
@@ -857,40 +807,20 @@ def generate_predictions(date_str: Optional[str] = None) -> List[Dict]:
             btts_pred = "GOAL" if prob_btts_yes >= 0.55 else "NOGOAL"
             
             # 3. Multigol Calculation
-            p_goals_exact = {}
-            for g in range(9): # 0-8 goals
-                p_g = 0.0
-                for h in range(g + 1):
-                    a = g - h
-                    p_g += _poisson_prob(lam_home, h) * _poisson_prob(lam_away, a)
-                p_goals_exact[g] = p_g
+            score_m = score_tensor(lam_home, lam_away)  # griglia 0-8 gol
+            goals_dist = total_goals_dist(score_m)[0]
+            p_goals_exact = {g: float(goals_dist[g]) for g in range(9)} # 0-8 goals
             
             prob_mg_1_3 = sum(p_goals_exact.get(g, 0) for g in range(1, 4))
             prob_mg_2_4 = sum(p_goals_exact.get(g, 0) for g in range(2, 5))
             
             # 4. Combo Bets Calculation - Ricalcolo preciso da matrice Poisson
-            p_1_over15 = 0.0
-            p_1x_over15 = 0.0
-            p_x2_under35 = 0.0
-            
-            for h in range(9):
-                ph = _poisson_prob(lam_home, h)
-                for a in range(9):
-                    pa = _poisson_prob(lam_away, a)
-                    p_joint = ph * pa
-                    tot = h + a
-                    
-                    # 1 + Over 1.5
-                    if h > a and tot > 1.5:
-                        p_1_over15 += p_joint
-                    
-                    # 1X + Over 1.5
-                    if h >= a and tot > 1.5:
-                        p_1x_over15 += p_joint
-                        
-                    # X2 + Under 3.5
-                    if a >= h and tot < 3.5:
-                        p_x2_under35 += p_joint
+            # 1 + Over 1.5
+            p_1_over15 = float(joint_prob(score_m, lambda h, a: (h > a) & (h + a > 1.5))[0])
+            # 1X + Over 1.5
+            p_1x_over15 = float(joint_prob(score_m, lambda h, a: (h >= a) & (h + a > 1.5))[0])
+            # X2 + Under 3.5
+            p_x2_under35 = float(joint_prob(score_m, lambda h, a: (a >= h) & (h + a < 3.5))[0])
 
             # 5. Consensus Score
             consensus_points = 0
@@ -925,12 +855,7 @@ def generate_predictions(date_str: Optional[str] = None) -> List[Dict]:
             consensus_score = int((consensus_points / consensus_max) * 100) if consensus_max > 0 else 50
             
             # Top 3 Correct Scores
-            scores_with_prob = []
-            for h in range(7):
-                for a in range(7):
-                    p = _poisson_prob(lam_home, h) * _poisson_prob(lam_away, a)
-                    scores_with_prob.append((f"{h}-{a}", p))
-            scores_with_prob.sort(key=lambda x: x[1], reverse=True)
+            scores_with_prob = exact_scores(score_tensor(lam_home, lam_away, max_goals=6), top_n=3)[0]
             top_3_scores = [f"{s[0]} ({s[1]*100:.1f}%)" for s in scores_with_prob[:3]]
 
             prediction = {
@@ -964,6 +889,8 @@ def generate_predictions(date_str: Optional[str] = None) -> List[Dict]:
                 'ml_prob_1': round(ml_1x2_prob[0] * 100, 1) if ml_1x2_prob else '-',
                 'ml_prob_x': round(ml_1x2_prob[1] * 100, 1) if ml_1x2_prob else '-',
                 'ml_prob_2': round(ml_1x2_prob[2] * 100, 1) if ml_1x2_prob else '-',
+                'ml_model_ou': ml_version["ou"] if ml_ou_prob else '-',
+                'ml_model_1x2': ml_version["x2"] if ml_1x2_prob else '-',
                 'data_reliability': reliability,
                 # New Fields
                 'data_quality': data_quality_label,
@@ -10,8 +10,11 @@ import math
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+
 from database import SessionLocal
 from models import Fixture, Odds, Feature
+from poisson_kernel import exact_scores, score_tensor
 from predictions_generator import (
     expected_goals_to_prob,
     _get_fallback_profile,
@@ -30,22 +33,14 @@ def _poisson_prob(lam: float, k: int) -> float:
 
 def _top_results(lh: float, la: float, top_n: int = 3) -> List[Tuple[str, float]]:
     """Top-N score da Poisson contestualizzato."""
-    results = []
-    best_draw = None
-    best_non_draw = None
-    for hg in range(0, 8):
-        ph = _poisson_prob(lh, hg)
-        for ag in range(0, 8):
-            pa = _poisson_prob(la, ag)
-            prob = ph * pa
-            results.append((f"{hg}-{ag}", prob))
-            if hg == ag:
-                if best_draw is None or prob > best_draw[1]:
-                    best_draw = (f"{hg}-{ag}", prob)
-            else:
-                if best_non_draw is None or prob > best_non_draw[1]:
-                    best_non_draw = (f"{hg}-{ag}", prob)
-    results.sort(key=lambda x: x[1], reverse=True)
+    m = score_tensor(lh, la, max_goals=7)[0]
+    results = exact_scores(m)[0]
+    # Pareggio e non-pareggio più probabili (a parità, il primo in ordine h, a)
+    d = int(np.argmax(np.diag(m)))
+    best_draw = (f"{d}-{d}", float(m[d, d]))
+    off = np.where(np.eye(m.shape[0], dtype=bool), -np.inf, m)
+    h, a = np.unravel_index(int(np.argmax(off)), m.shape)
+    best_non_draw = (f"{h}-{a}", float(m[h, a]))
 
     # MIGLIORAMENTO: Rendo la logica di sostituzione del pareggio più conservativa.
     # Sostituisco il pareggio solo se è il risultato più probabile E un altro risultato
@@ -92,19 +87,20 @@ def generate_proposals(date_str: Optional[str] = None) -> List[Dict]:
     db = SessionLocal()
     
     try:
-        if target_date:
-            fixtures = db.query(Fixture).filter(Fixture.date == target_date).all()
-        else:
-            fixtures = db.query(Fixture).filter(Fixture.date == date_str).all()
+        # Partite con quote e features in un'unica query (niente query per partita)
+        rows = (
+            db.query(Fixture, Odds, Feature)
+            .outerjoin(Odds, Fixture.match_id == Odds.match_id)
+            .outerjoin(Feature, Fixture.match_id == Feature.match_id)
+            .filter(Fixture.date == (target_date or date_str))
+            .all()
+        )
         
         proposals = []
         
-        for fixture in fixtures:
+        for fixture, odds_obj, feature_obj in rows:
             mid = fixture.match_id
             
-            odds_obj = db.query(Odds).filter(Odds.match_id == mid).first()
-            feature_obj = db.query(Feature).filter(Feature.match_id == mid).first()
-            
             # Logica di fallback per xG migliorata per evitare valori identici
             if feature_obj and feature_obj.xg_for_home is not None:
                 xg_for_home = feature_obj.xg_for_home
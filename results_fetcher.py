@@ -2,10 +2,12 @@ import sys
 import argparse
 from datetime import datetime, date
 from pathlib import Path
-import requests
-from database import SessionLocal
+from database import SessionLocal, migrate_schema
 from models import Fixture
+from http_cache import get_client
+from market_cache import bump_dates
 from rapidfuzz import fuzz
+from team_registry import SRC_FD, TeamRegistry
 
 ROOT = Path(__file__).resolve().parent
 
@@ -43,6 +45,7 @@ def fetch_and_store_results(target_date: str):
     """
     Scarica risultati per una data specifica iterando per competizione.
     """
+    migrate_schema()
     db = SessionLocal()
     headers = {"X-Auth-Token": TOKEN}
     
@@ -52,14 +55,24 @@ def fetch_and_store_results(target_date: str):
         # Carica i fixture del nostro DB per quella data
         db_fixtures = db.query(Fixture).filter(Fixture.date == datetime.fromisoformat(target_date).date()).all()
         print(f"[INFO] Trovati {len(db_fixtures)} match nel DB locale per {target_date}.")
-        
+
+        # Partite per coppia di team_id canonici: i nomi API già noti si abbinano con un lookup
+        registry = TeamRegistry(db)
+        by_ids = {
+            (f.home_team_id, f.away_team_id): f
+            for f in db_fixtures
+            if f.home_team_id is not None and f.away_team_id is not None
+        }
+
         updated_count = 0
         
         for code, comp_id in COMP_MAP.items():
-            url = f"https://api.football-data.org/v4/competitions/{comp_id}/matches?dateFrom={target_date}&dateTo={target_date}"
+            url = f"https://api.football-data.org/v4/competitions/{comp_id}/matches"
+            params = {"dateFrom": target_date, "dateTo": target_date}
             
             try:
-                r = requests.get(url, headers=headers, timeout=10)
+                r = get_client().get(url, params=params, headers=headers, endpoint="fd_results",
+                                     timeout=10, desc=f"FD results {code}")
                 if r.status_code == 403: # Free tier limit or restricted comp
                     continue
                 r.raise_for_status()
@@ -85,22 +98,30 @@ def fetch_and_store_results(target_date: str):
                 if h_goals is None or a_goals is None:
                     continue
 
-                # Matching con il DB
-                found_fix = None
+                # Matching con il DB: prima per team_id, poi fuzzy sui nomi
+                found_fix = by_ids.get((registry.lookup(home_api, SRC_FD), registry.lookup(away_api, SRC_FD)))
+                if found_fix is not None and found_fix.result_home_goals is not None:
+                    continue  # Già aggiornato
                 best_score = 0
-                
-                for f in db_fixtures:
-                    if f.result_home_goals is not None: 
-                        continue # Già aggiornato
-
-                    s1 = fuzz.ratio(home_api.lower(), f.home.lower())
-                    s2 = fuzz.ratio(away_api.lower(), f.away.lower())
-                    avg_score = (s1 + s2) / 2
-                    
-                    if avg_score > 80 and avg_score > best_score:
-                        best_score = avg_score
-                        found_fix = f
-                
+
+                if found_fix is None:
+                    for f in db_fixtures:
+                        if f.result_home_goals is not None:
+                            continue # Già aggiornato
+
+                        s1 = fuzz.ratio(home_api.lower(), f.home.lower())
+                        s2 = fuzz.ratio(away_api.lower(), f.away.lower())
+                        avg_score = (s1 + s2) / 2
+
+                        if avg_score > 80 and avg_score > best_score:
+                            best_score = avg_score
+                            found_fix = f
+
+                if found_fix and best_score:
+                    # nomi abbinati col fuzzy: diventano alias per le prossime esecuzioni
+                    registry.learn_pair(home_api, away_api, SRC_FD, found_fix.home_team_id,
+                                        found_fix.away_team_id, best_score)
+
                 if found_fix:
                     found_fix.result_home_goals = h_goals
                     found_fix.result_away_goals = a_goals
@@ -109,6 +130,8 @@ def fetch_and_store_results(target_date: str):
                     updated_count += 1
                     print(f"  ✓ [{code}] {found_fix.home} {h_goals}-{a_goals} {found_fix.away}")
         
+        if updated_count:
+            bump_dates(db, [target_date])
         db.commit()
         print(f"\n[DONE] {updated_count} risultati aggiornati nel DB.")
     
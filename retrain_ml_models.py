@@ -16,6 +16,8 @@ from sklearn.impute import SimpleImputer
 from sklearn.metrics import log_loss, brier_score_loss, accuracy_score
 from lightgbm import LGBMClassifier
 
+from historical_store import load_dataset
+
 warnings.filterwarnings('ignore')
 
 print("=" * 100)
@@ -41,7 +43,7 @@ if not hist_path.exists():
     sys.exit(1)
 
 print(f"📊 Carico {hist_path.name}...")
-df = pd.read_csv(hist_path)
+df = load_dataset(hist_path)
 print(f"✅ {len(df)} partite caricate")
 
 # ========================================
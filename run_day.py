@@ -17,17 +17,15 @@ run_day.py — giornata automatica (fixtures -> features -> predictions)
 
 import argparse
 import json
-import math
 import os
-import random
-import re
 import sys
-import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 
+from poisson_kernel import exact_scores, outcome_probs, over_prob, score_tensor, total_goals_dist
+
 try:
     import requests
 except ImportError:
@@ -127,42 +125,22 @@ def api_token() -> str:
     return tok.strip() if tok and tok.strip() else DEFAULT_API_TOKEN
 
 
-def _sleep_with_msg(seconds: float):
-    secs = max(0.0, float(seconds))
-    print(f"[THROTTLE] Attendo {secs:.1f}s per rispetto rate-limit…", flush=True)
-    time.sleep(secs)
-
-
 def api_get(
     path: str, params: Dict, base_delay: float = 0.0, max_retries: int = 5
 ) -> Dict:
     if requests is None:
         raise RuntimeError("Richiede 'requests'. Installa: pip install requests")
+    from http_cache import get_client
+
     base = "https://api.football-data.org/v4"
     headers = {"X-Auth-Token": api_token()}
-    attempt = 0
-    while True:
-        if base_delay > 0:
-            time.sleep(base_delay)
-        r = requests.get(base + path, headers=headers, params=params, timeout=30)
-        if r.status_code == 200:
-            return r.json()
-        if r.status_code == 429 and attempt < max_retries:
-            retry_after = r.headers.get("Retry-After")
-            if retry_after:
-                wait_s = float(retry_after)
-            else:
-                try:
-                    msg = r.json().get("message", "")
-                except Exception:
-                    msg = r.text
-                m = re.search(r"Wait\s+(\d+)\s+seconds", msg, re.IGNORECASE)
-                wait_s = float(m.group(1)) if m else 60.0
-            wait_s += random.uniform(0.1, 0.6)
-            _sleep_with_msg(wait_s)
-            attempt += 1
-            continue
-        raise RuntimeError(f"API error {r.status_code}: {r.text}")
+    # Cache, retry su 429 (Retry-After / "Wait N seconds") e throttle: http_cache
+    endpoint = "fd_team_history" if path.startswith("/teams/") else "fd"
+    r = get_client().get(base + path, params=params, headers=headers, endpoint=endpoint,
+                         max_retries=max_retries, delay=base_delay, desc=f"FD {path}")
+    if r.status_code == 200:
+        return r.json()
+    raise RuntimeError(f"API error {r.status_code}: {r.text}")
 
 
 # ---------------- DATA ACCESS ----------------
@@ -281,33 +259,14 @@ def fallback_team_strength(team: str, comp_code: str) -> Tuple[float, float]:
 
 
 # ---------------- POISSON ----------------
-def poisson_prob(lmbd: float, k: int) -> float:
-    return (math.exp(-lmbd) * (lmbd**k)) / math.factorial(k)
-
-
 def poisson_match_probs(
     lambda_home: float, lambda_away: float, max_goals: int = 6
 ) -> Tuple[float, float, float, float, float]:
-    p1 = px = p2 = 0.0
-    pover = punder = 0.0
-    for hg in range(max_goals + 1):
-        ph = poisson_prob(lambda_home, hg)
-        for ag in range(max_goals + 1):
-            pa = poisson_prob(lambda_away, ag)
-            p = ph * pa
-            if hg > ag:
-                p1 += p
-            elif hg == ag:
-                px += p
-            else:
-                p2 += p
-            if hg + ag > 2:
-                pover += p
-            else:
-                punder += p
-    tot = p1 + px + p2
-    if tot > 0:
-        p1, px, p2 = p1 / tot, px / tot, p2 / tot
+    m = score_tensor(lambda_home, lambda_away, max_goals)
+    p1, px, p2 = (float(p[0]) for p in outcome_probs(m))
+    dist = total_goals_dist(m)[0]
+    pover = float(dist[3:].sum())
+    punder = float(dist[:3].sum())
     tot2 = pover + punder
     if tot2 > 0:
         pover, punder = pover / tot2, punder / tot2
@@ -520,14 +479,11 @@ def main():
             strong_away=None,
         )
 
-        def _ou_prob(line: float, max_goals: int = 10):
-            over = 0.0
-            for hg in range(max_goals + 1):
-                ph = poisson_prob(lam_home, hg)
-                for ag in range(max_goals + 1):
-                    pa = poisson_prob(lam_away, ag)
-                    if (hg + ag) > line:
-                        over += ph * pa
+        # Matrice punteggi 0-10 calcolata una volta per partita
+        score_m = score_tensor(lam_home, lam_away, 10)
+
+        def _ou_prob(line: float):
+            over = float(over_prob(score_m, line)[0])
             under = 1.0 - over
             return round(over, 4), round(under, 4)
 
@@ -549,14 +505,8 @@ def main():
         p_dnb1 = round(p1, 4)
         p_dnb2 = round(p2, 4)
 
-        grid = []
-        for hg in range(0, 7):
-            ph = poisson_prob(lam_home, hg)
-            for ag in range(0, 7):
-                pa = poisson_prob(lam_away, ag)
-                grid.append((hg, ag, ph * pa))
-        grid.sort(key=lambda x: x[2], reverse=True)
-        cs_top3 = ", ".join([f"{hg}-{ag} ({prob:.3f})" for (hg, ag, prob) in grid[:3]])
+        top3 = exact_scores(score_tensor(lam_home, lam_away, 6), top_n=3)[0]
+        cs_top3 = ", ".join([f"{score} ({prob:.3f})" for (score, prob) in top3])
 
         if p1 >= 0.60:
             pick, conf = "1", "high"
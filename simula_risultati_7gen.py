@@ -8,7 +8,7 @@ Simula i risultati basandosi sulle probabilità Poisson e verifica l'accuratezza
 from database import SessionLocal
 from models import Fixture
 from datetime import date
-from scipy.stats import poisson
+from poisson_kernel import outcome_probs, score_tensor, total_goals_dist
 import random
 import numpy as np
 
@@ -43,9 +43,12 @@ for fix in fixtures:
     gol_casa = np.random.poisson(lam_h)
     gol_trasferta = np.random.poisson(lam_a)
 
+    # Matrice punteggi 0-9
+    M = score_tensor(lam_h, lam_a, 9)
+    m = M[0]
+
     # Probabilità 1X2
-    p_h = sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a) for i in range(10) for j in range(i))
-    p_d = sum(poisson.pmf(i, lam_h) * poisson.pmf(i, lam_a) for i in range(10))
+    p_h, p_d, _ = (float(p[0]) for p in outcome_probs(M, normalize=False))
     p_a = 1 - p_h - p_d
 
     # Determina esito previsto
@@ -69,16 +72,13 @@ for fix in fixtures:
 
     # Verifica Over/Under 2.5
     gol_totali = gol_casa + gol_trasferta
-    p_over25 = 1 - sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a)
-                       for i in range(3) for j in range(3) if i+j <= 2)
+    p_over25 = 1 - float(total_goals_dist(M)[0, :3].sum())
 
     ou25_previsto = 'Over 2.5' if p_over25 > 0.5 else 'Under 2.5'
     ou25_reale = 'Over 2.5' if gol_totali > 2.5 else 'Under 2.5'
 
     # Verifica GG/NG
-    p_gg = 1 - (poisson.pmf(0, lam_h) * sum(poisson.pmf(j, lam_a) for j in range(10)) +
-                sum(poisson.pmf(i, lam_h) for i in range(10)) * poisson.pmf(0, lam_a) -
-                poisson.pmf(0, lam_h) * poisson.pmf(0, lam_a))
+    p_gg = 1 - float(m[0, :].sum() + m[:, 0].sum() - m[0, 0])
 
     gg_previsto = 'GG' if p_gg > 0.5 else 'NG'
     gg_reale = 'GG' if (gol_casa > 0 and gol_trasferta > 0) else 'NG'
@@ -153,7 +153,7 @@ else:
     # ANALIZZA CHAMPIONS
     print("\n🔍 ANALISI PARTITE CHAMPIONS LEAGUE:\n")
 
-    from scipy.stats import poisson
+    from poisson_kernel import outcome_probs, score_tensor, total_goals_dist
 
     for fix in cl_oggi:
         print(f"{'='*100}")
@@ -178,9 +178,12 @@ else:
         print(f"\n📊 Expected Goals:")
         print(f"   Casa: {lam_h:.2f} | Trasferta: {lam_a:.2f}")
 
+        # Matrice punteggi 0-9
+        M = score_tensor(lam_h, lam_a, 9)
+        m = M[0]
+
         # Probabilità 1X2
-        p_h = sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a) for i in range(10) for j in range(i))
-        p_d = sum(poisson.pmf(i, lam_h) * poisson.pmf(i, lam_a) for i in range(10))
+        p_h, p_d, _ = (float(p[0]) for p in outcome_probs(M, normalize=False))
         p_a = 1 - p_h - p_d
 
         print(f"\n🎯 Probabilità 1X2:")
@@ -189,8 +192,7 @@ else:
         print(f"   2 (Trasferta): {p_a*100:5.1f}% | Quota ~{1/p_a:.2f}")
 
         # Over/Under
-        p_over25 = 1 - sum(poisson.pmf(i, lam_h) * poisson.pmf(j, lam_a)
-                          for i in range(3) for j in range(3) if i+j <= 2)
+        p_over25 = 1 - float(total_goals_dist(M)[0, :3].sum())
         p_under25 = 1 - p_over25
 
         print(f"\n⚽ Over/Under 2.5:")
@@ -198,9 +200,7 @@ else:
         print(f"   Under 2.5: {p_under25*100:5.1f}% | Quota ~{1/p_under25:.2f}")
 
         # GG/NG
-        p_gg = 1 - (poisson.pmf(0, lam_h) * sum(poisson.pmf(j, lam_a) for j in range(10)) +
-                    sum(poisson.pmf(i, lam_h) for i in range(10)) * poisson.pmf(0, lam_a) -
-                    poisson.pmf(0, lam_h) * poisson.pmf(0, lam_a))
+        p_gg = 1 - float(m[0, :].sum() + m[:, 0].sum() - m[0, 0])
         p_ng = 1 - p_gg
 
         print(f"\n🥅 Goal/No Goal:")
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+synthetic_data.py
+-----------------
+Dati sintetici riproducibili per i benchmark (bench_suite.py), senza rete.
+
+- campionati con squadre a forza fissa, giornate ogni 3-4 giorni all'indietro dal
+  giorno di benchmark; gol da Poisson sulla forza, xG rumorosi attorno ai gol
+- DB SQLite (schema di models.py via migrate_schema): fixtures giocate con risultati,
+  features e quote, storico (historical_matches), registro squadre con gli alias
+  football-data.org, più le partite del giorno di benchmark (features e quote, senza
+  risultato)
+- storico CSV con le colonne di data/historical_dataset.csv
+- pagine squadra-stagione Understat in cache (datesData in JSON.parse('...') escapato
+  come sul sito), nel formato di features_populator._cache_path
+- eventi TheOddsAPI del giorno: nomi uguali, abbreviati (match fuzzy) o con casa e
+  trasferta invertite, più eventi estranei fino a n_events
+
+Stesso seed e stessi parametri → stessi dati; workdir/meta.json registra i parametri
+e generate() riusa i dati già presenti se coincidono.
+
+Uso:
+    python synthetic_data.py --out /tmp/bet_synth --matches 10000 --fixtures 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import re
+import shutil
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from database import migrate_schema
+from models import Feature, Fixture, HistoricalMatch, Odds, Team, TeamAlias
+from team_registry import SRC_FD, alias_key
+
+GENERATOR_VERSION = 1  # da incrementare quando cambia il contenuto generato
+DEFAULT_DAY = date(2025, 1, 18)
+LEAGUES = (
+    ("SA", "Serie A"),
+    ("PL", "Premier League"),
+    ("PD", "Primera Division"),
+    ("BL1", "Bundesliga"),
+    ("FL1", "Ligue 1"),
+)
+TEAMS_PER_LEAGUE = 20
+ROUND_DAYS = (3, 4)  # giornate alternate a 3 e 4 giorni
+
+_PLACES = (
+    "Alder", "Brook", "Castle", "Dale", "Elm", "Fair", "Glen", "Harbor", "Iron", "Juniper",
+    "Kings", "Lake", "Mill", "North", "Oak", "Pine", "Queens", "River", "Stone", "Thorn",
+    "Upton", "Vale", "West", "York", "Ash", "Birch", "Cedar", "Dover", "East", "Ford",
+)
+_SUFFIXES = ("United", "City", "Rovers", "Athletic", "Wanderers", "Town", "Albion", "County")
+_SHORT = {"United": "Utd", "Athletic": "Athl", "Wanderers": "Wand", "County": "Cty"}
+_BOOKMAKERS = ("pinnacle", "bet365", "unibet")
+
+HISTORY_COLUMNS = [
+    "match_id", "date", "time_local", "league", "home", "away", "ft_home_goals", "ft_away_goals",
+    "odds_1", "odds_x", "odds_2", "xg_for_home", "xg_against_home", "xg_for_away", "xg_against_away",
+    "rest_days_home", "rest_days_away", "derby_flag", "europe_flag_home", "europe_flag_away",
+    "meteo_flag", "style_ppda_home", "style_ppda_away", "travel_km_away",
+    "target_ou25", "target_btts", "target_1x2",
+]
+
+
+class SyntheticSet(NamedTuple):
+    workdir: Path
+    db_path: Path
+    history_csv: Path
+    understat_dir: Path
+    events_path: Path
+    day: date
+    meta: Dict[str, Any]
+
+    @property
+    def db_url(self) -> str:
+        return f"sqlite:///{self.db_path}"
+
+    def events(self) -> List[dict]:
+        return json.loads(self.events_path.read_text(encoding="utf-8"))
+
+
+def team_names(n_leagues: int = len(LEAGUES), per_league: int = TEAMS_PER_LEAGUE) -> List[List[str]]:
+    """Nomi squadra distinti "<Luogo> <Suffisso>" per lega."""
+    names = [f"{p} {s}" for s in _SUFFIXES for p in _PLACES]
+    return [names[i * per_league:(i + 1) * per_league] for i in range(n_leagues)]
+
+
+def _odds(p: np.ndarray, margin: float = 1.05) -> np.ndarray:
+    return np.round(1.0 / np.clip(p * margin, 1e-3, None), 2)
+
+
+def _schedule(rng, n_matches: int, day: date, names: List[List[str]]) -> pd.DataFrame:
+    """Partite giocate (dalla più vecchia) prima di day, n_matches in totale."""
+    per_round = sum(len(t) // 2 for t in names)
+    n_rounds = math.ceil(n_matches / per_round)
+    offsets = np.cumsum([ROUND_DAYS[i % 2] for i in range(n_rounds)])
+    rows = []
+    for r in range(n_rounds):
+        d = day - timedelta(days=int(offsets[n_rounds - 1 - r]))
+        for (code, league), teams in zip(LEAGUES, names):
+            order = rng.permutation(len(teams))
+            for j in range(0, len(order) - 1, 2):
+                rows.append((d, code, league, teams[order[j]], teams[order[j + 1]]))
+    df = pd.DataFrame(rows[:n_matches], columns=["date", "league_code", "league", "home", "away"])
+    return df
+
+
+def _simulate(rng, df: pd.DataFrame, strength: Dict[str, float]) -> pd.DataFrame:
+    """Gol, xG, quote e target per le partite di df (vettoriale)."""
+    sh = df["home"].map(strength).to_numpy()
+    sa = df["away"].map(strength).to_numpy()
+    lam_h = np.exp(0.25 + sh - sa)
+    lam_a = np.exp(0.0 + sa - sh)
+    n = len(df)
+    hg = rng.poisson(lam_h)
+    ag = rng.poisson(lam_a)
+    p_home = 1.0 / (1.0 + np.exp(-(1.4 * (sh - sa) + 0.35)))
+    p_draw = np.full(n, 0.26)
+    p_home = p_home * (1 - p_draw)
+    p_away = 1 - p_home - p_draw
+    df = df.assign(
+        match_id=[f"SYN_{d:%Y%m%d}_{c}_{i:06d}" for i, (d, c) in enumerate(zip(df["date"], df["league_code"]))],
+        time_local="18:00",
+        ft_home_goals=hg, ft_away_goals=ag,
+        odds_1=_odds(p_home), odds_x=_odds(p_draw), odds_2=_odds(p_away),
+        xg_for_home=np.round(lam_h * rng.uniform(0.8, 1.2, n), 2),
+        xg_against_home=np.round(lam_a * rng.uniform(0.8, 1.2, n), 2),
+        xg_for_away=np.round(lam_a * rng.uniform(0.8, 1.2, n), 2),
+        xg_against_away=np.round(lam_h * rng.uniform(0.8, 1.2, n), 2),
+        rest_days_home=rng.integers(3, 8, n), rest_days_away=rng.integers(3, 8, n),
+        derby_flag=0, europe_flag_home=0, europe_flag_away=0, meteo_flag=0,
+        style_ppda_home=np.nan, style_ppda_away=np.nan, travel_km_away=np.nan,
+    )
+    p_over = 1.0 - np.exp(-(lam_h + lam_a)) * (1 + (lam_h + lam_a) + (lam_h + lam_a) ** 2 / 2)
+    df["odds_ou25_over"] = _odds(p_over)
+    df["odds_ou25_under"] = _odds(1 - p_over)
+    df["target_ou25"] = (hg + ag > 2).astype(int)
+    df["target_btts"] = ((hg > 0) & (ag > 0)).astype(int)
+    df["target_1x2"] = np.where(hg > ag, 0, np.where(hg == ag, 1, 2))
+    return df
+
+
+def _upcoming(rng, n_fixtures: int, day: date, names: List[List[str]], strength) -> pd.DataFrame:
+    rows = []
+    for i in range(n_fixtures):
+        (code, league), teams = LEAGUES[i % len(LEAGUES)], names[i % len(LEAGUES)]
+        h, a = rng.choice(len(teams), 2, replace=False)
+        rows.append((day, code, league, teams[h], teams[a]))
+    df = _simulate(rng, pd.DataFrame(rows, columns=["date", "league_code", "league", "home", "away"]), strength)
+    df["match_id"] = [f"SYN_{day:%Y%m%d}_NEXT_{i:05d}" for i in range(n_fixtures)]
+    df["time_local"] = [f"{12 + i % 10:02d}:{(i * 15) % 60:02d}" for i in range(n_fixtures)]
+    return df
+
+
+# =========================
+# DB
+# =========================
+def _write_db(db_path: Path, played: pd.DataFrame, upcoming: pd.DataFrame, names: List[List[str]]) -> None:
+    engine = create_engine(f"sqlite:///{db_path}")
+    migrate_schema(engine)
+    team_id = {}
+    teams, aliases = [], []
+    for (code, _league), league_teams in zip(LEAGUES, names):
+        for name in league_teams:
+            team_id[name] = len(team_id) + 1
+            fd_name = f"{name} FC"
+            teams.append({"id": team_id[name], "name": fd_name, "league_code": code})
+            aliases.append({"source": SRC_FD, "alias": fd_name, "alias_key": alias_key(fd_name),
+                            "team_id": team_id[name], "method": "seed"})
+
+    fixtures, features, odds = [], [], []
+    for df, finished in ((played, True), (upcoming, False)):
+        for r in df.itertuples(index=False):
+            fixtures.append({
+                "match_id": r.match_id, "date": r.date, "time": r.time_local, "time_local": r.time_local,
+                "league": r.league, "league_code": r.league_code,
+                "home": f"{r.home} FC", "away": f"{r.away} FC",
+                "result_home_goals": int(r.ft_home_goals) if finished else None,
+                "result_away_goals": int(r.ft_away_goals) if finished else None,
+                "home_team_id": team_id[r.home], "away_team_id": team_id[r.away],
+            })
+            features.append({
+                "match_id": r.match_id,
+                "xg_for_home": r.xg_for_home, "xg_against_home": r.xg_against_home,
+                "xg_for_away": r.xg_for_away, "xg_against_away": r.xg_against_away,
+                "xg_source_home": "understat", "xg_source_away": "understat", "xg_confidence": 1.0,
+                "rest_days_home": int(r.rest_days_home), "rest_days_away": int(r.rest_days_away),
+                "derby_flag": 0, "europe_flag_home": 0, "europe_flag_away": 0, "meteo_flag": 0,
+            })
+            odds.append({
+                "match_id": r.match_id, "odds_1": r.odds_1, "odds_x": r.odds_x, "odds_2": r.odds_2,
+                "odds_ou25_over": r.odds_ou25_over, "odds_ou25_under": r.odds_ou25_under, "line_ou": "2.5",
+            })
+
+    hist_cols = [c.name for c in HistoricalMatch.__table__.columns]
+    history = played.assign(home_team_id=played["home"].map(team_id), away_team_id=played["away"].map(team_id))
+    history = history[[c for c in hist_cols if c in history.columns]]
+    history = history.astype(object).where(history.notna(), None).to_dict("records")
+
+    with engine.begin() as conn:
+        for table, rows in ((Team, teams), (TeamAlias, aliases), (Fixture, fixtures),
+                            (Feature, features), (Odds, odds), (HistoricalMatch, history)):
+            for i in range(0, len(rows), 5000):
+                conn.execute(table.__table__.insert(), rows[i:i + 5000])
+    engine.dispose()
+
+
+# =========================
+# UNDERSTAT E THEODDSAPI
+# =========================
+def _js_escape(text: str) -> str:
+    """Escape alla Understat: tutto ciò che non è alfanumerico diventa \\xHH."""
+    return "".join(c if c.isalnum() else f"\\x{ord(c):02X}" for c in text)
+
+
+def understat_page(team: str, matches: List[dict]) -> str:
+    return (
+        "<html><head><title>" + team + "</title></head><body>\n"
+        "<div class=\"page-wrapper\">" + "<div class=\"block\"></div>" * 20 + "</div>\n"
+        "<script>\n\tvar datesData\t= JSON.parse('" + _js_escape(json.dumps(matches)) + "');\n</script>\n"
+        "<script>\n\tvar statisticsData = JSON.parse('" + _js_escape(json.dumps({"situation": {}})) + "');\n</script>\n"
+        "</body></html>"
+    )
+
+
+def _write_understat(out_dir: Path, played: pd.DataFrame) -> int:
+    """Una pagina per squadra-stagione (stagione = anno di inizio, da luglio)."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    d = pd.to_datetime(played["date"])
+    season = np.where(d.dt.month >= 7, d.dt.year, d.dt.year - 1)
+    pages: Dict[tuple, List[dict]] = {}
+    for r, s in zip(played.itertuples(index=False), season):
+        dt = f"{r.date:%Y-%m-%d} {r.time_local}:00"
+        xg = {"h": f"{r.xg_for_home:.5f}", "a": f"{r.xg_for_away:.5f}"}
+        goals = {"h": str(r.ft_home_goals), "a": str(r.ft_away_goals)}
+        for team, side in ((r.home, "h"), (r.away, "a")):
+            pages.setdefault((team, int(s)), []).append({
+                "id": r.match_id, "isResult": True, "side": side, "datetime": dt,
+                "h": {"title": r.home}, "a": {"title": r.away}, "goals": goals, "xG": xg,
+            })
+    for (team, s), matches in pages.items():
+        safe = re.sub(r"[^A-Za-z0-9_\-\.]", "_", team.replace(" ", "_"))
+        (out_dir / f"{safe}_{s}.html").write_text(understat_page(team, matches), encoding="utf-8")
+    return len(pages)
+
+
+def _toa_name(rng, name: str) -> str:
+    """Nome "TheOddsAPI": abbreviato nel 40% dei casi (serve il fuzzy), altrimenti uguale."""
+    place, suffix = name.split(" ", 1)
+    if suffix in _SHORT and rng.random() < 0.4:
+        return f"{place} {_SHORT[suffix]}"
+    return name
+
+
+def odds_events(rng, upcoming: pd.DataFrame, n_events: int, names: List[List[str]], day: date) -> List[dict]:
+    """Eventi del giorno per le partite di upcoming (in ordine casuale) più eventi estranei."""
+    def event(i, home, away, o1, ox, o2, oo, ou):
+        commence = f"{day.isoformat()}T{12 + i % 10:02d}:00:00Z"
+        books = []
+        for k, bk in enumerate(_BOOKMAKERS):
+            f = 1.0 + 0.01 * k
+            books.append({"key": bk, "title": bk, "markets": [
+                {"key": "h2h", "outcomes": [{"name": home, "price": round(o1 * f, 2)},
+                                            {"name": away, "price": round(o2 * f, 2)},
+                                            {"name": "Draw", "price": round(ox * f, 2)}]},
+                {"key": "totals", "outcomes": [{"name": "Over", "price": round(oo * f, 2), "point": 2.5},
+                                               {"name": "Under", "price": round(ou * f, 2), "point": 2.5}]},
+            ]})
+        return {"id": f"ev{i:06d}", "sport_key": "soccer", "commence_time": commence,
+                "home_team": home, "away_team": away, "bookmakers": books}
+
+    events = []
+    for i, r in enumerate(upcoming.itertuples(index=False)):
+        # al più un nome abbreviato per evento: la media casa/trasferta resta sopra la soglia fuzzy
+        home = _toa_name(rng, r.home)
+        away = _toa_name(rng, r.away) if home == r.home else r.away
+        odds = (r.odds_1, r.odds_x, r.odds_2, r.odds_ou25_over, r.odds_ou25_under)
+        if rng.random() < 0.2:  # casa/trasferta invertite nella fonte
+            events.append(event(i, away, home, odds[2], odds[1], odds[0], odds[3], odds[4]))
+        else:
+            events.append(event(i, home, away, *odds))
+    flat = [t for teams in names for t in teams]
+    for i in range(len(events), n_events):
+        h, a = rng.choice(len(flat), 2, replace=False)
+        other = day + timedelta(days=int(rng.integers(-3, 4)))
+        ev = event(i, f"{flat[h]} Reserves", f"{flat[a]} Reserves", 2.1, 3.3, 3.4, 1.9, 1.9)
+        ev["commence_time"] = f"{other.isoformat()}T20:00:00Z"
+        events.append(ev)
+    order = rng.permutation(len(events))
+    return [events[i] for i in order]
+
+
+# =========================
+# GENERAZIONE
+# =========================
+def generate(workdir, n_matches: int = 5000, n_fixtures: int = 200, n_events: Optional[int] = None,
+             seed: int = 42, day: date = DEFAULT_DAY, force: bool = False) -> SyntheticSet:
+    """Genera (o riusa, se i parametri coincidono) il set sintetico in workdir."""
+    workdir = Path(workdir).resolve()
+    n_events = max(n_fixtures, n_events if n_events is not None else 2 * n_fixtures)
+    meta = {"version": GENERATOR_VERSION, "matches": n_matches, "fixtures": n_fixtures, "events": n_events, "seed": seed, "day": day.isoformat()}
+    out = SyntheticSet(workdir, workdir / "bet.db", workdir / "historical_dataset.csv",
+                       workdir / "cache" / "understat", workdir / "odds_events.json", day, meta)
+    meta_path = workdir / "meta.json"
+    if not force and meta_path.exists():
+        old = json.loads(meta_path.read_text(encoding="utf-8"))
+        if {k: old.get(k) for k in meta} == meta:
+            out.meta.update(old)
+            return out
+    if workdir.exists():
+        for p in (out.db_path, out.history_csv, out.events_path, meta_path):
+            p.unlink(missing_ok=True)
+        shutil.rmtree(out.understat_dir, ignore_errors=True)
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    names = team_names()
+    strength = {t: float(s) for teams in names for t, s in zip(teams, rng.normal(0, 0.35, len(teams)))}
+    played = _simulate(rng, _schedule(rng, n_matches, day, names), strength)
+    upcoming = _upcoming(rng, n_fixtures, day, names, strength)
+
+    _write_db(out.db_path, played, upcoming, names)
+    played.assign(date=played["date"].map(date.isoformat))[HISTORY_COLUMNS].to_csv(out.history_csv, index=False)
+    meta["understat_pages"] = _write_understat(out.understat_dir, played)
+    out.events_path.write_text(json.dumps(odds_events(rng, upcoming, n_events, names, day)), encoding="utf-8")
+    meta["generated_at"] = datetime.now().isoformat(timespec="seconds")
+    meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Genera DB, storico, cache Understat ed eventi quote sintetici.")
+    ap.add_argument("--out", required=True, help="Cartella di output")
+    ap.add_argument("--matches", type=int, default=5000, help="Partite giocate (storico)")
+    ap.add_argument("--fixtures", type=int, default=200, help="Partite del giorno di benchmark")
+    ap.add_argument("--events", type=int, help="Eventi TheOddsAPI (default 2x fixtures)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--day", default=DEFAULT_DAY.isoformat(), help="Giorno di benchmark (YYYY-MM-DD)")
+    ap.add_argument("--force", action="store_true", help="Rigenera anche se i parametri coincidono")
+    args = ap.parse_args()
+    s = generate(args.out, args.matches, args.fixtures, args.events, args.seed,
+                 date.fromisoformat(args.day), args.force)
+    print(f"[OK] Dati sintetici in {s.workdir}: {s.meta['matches']} partite, {s.meta['fixtures']} "
+          f"fixtures del {s.day}, {s.meta['events']} eventi, {s.meta.get('understat_pages')} pagine Understat")
+
+
+if __name__ == "__main__":
+    main()
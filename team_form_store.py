@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+team_form_store.py
+------------------
+Materializza le tabelle team_form e head_to_head (models_extended) dalle
+partite con risultato in fixtures, così AdvancedFeatureCalculator può leggere
+le feature di un'intera giornata con una query per tabella
+(calculate_features_for_date) invece di ~7 query per partita.
+
+Incrementale: ogni istantanea salva in source_hash un hash cumulativo del
+contenuto delle partite che include (data, squadre, gol, presenza features e
+xG). Ad ogni esecuzione si ricalcolano gli hash e, per le squadre/coppie in
+cui differiscono, si riscrivono le istantanee dal primo giorno diverso in
+avanti: così arrivano anche risultati in ritardo, punteggi corretti, righe
+features/xG aggiunte dopo e storico reimportato, non solo i giorni nuovi. Lo
+stato di una squadra dipende solo dalle sue partite, quindi le altre non si
+toccano. Le istantanee scritte prima di source_hash (NULL) vengono riscritte
+una volta.
+
+Differenza voluta rispetto al calcolo per partita: si usano solo partite con
+risultato (il calcolo originale di forma/H2H conta anche partite passate senza
+risultato, es. rinviate).
+
+Uso:
+    python team_form_store.py            # incrementale
+    python team_form_store.py --rebuild  # svuota e ricostruisce tutto
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import time
+from collections import defaultdict, deque
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from advanced_features import form_from_rows, h2h_from_rows, momentum_from_rows, season_start
+from database import Base, SessionLocal
+from models import Feature, Fixture
+from models_extended import HeadToHead, TeamForm
+
+FORM_WINDOW = 5
+H2H_WINDOW = 5
+MOMENTUM_WINDOW = 10
+
+
+class PlayedMatch(NamedTuple):
+    """Partita con risultato (+ xG se esiste la riga features)."""
+    match_id: str
+    date: date
+    league: str
+    league_code: Optional[str]
+    home: str
+    away: str
+    hg: int
+    ag: int
+    has_feature: bool
+    xg_home: Optional[float]
+    xg_away: Optional[float]
+
+
+# =========================
+# SCHEMA
+# =========================
+def ensure_schema(db: Session) -> None:
+    """Crea le tabelle se mancano e aggiunge colonne/indici nuovi a quelle esistenti."""
+    bind = db.get_bind()
+    tables = [TeamForm.__table__, HeadToHead.__table__]
+    Base.metadata.create_all(bind=bind, tables=tables)
+    insp = inspect(bind)
+    with bind.begin() as conn:
+        for table in tables:
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in existing:
+                    ddl = col.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {ddl}"))
+    for table in tables:
+        for idx in table.indexes:
+            idx.create(bind=bind, checkfirst=True)
+
+
+# =========================
+# CARICAMENTO
+# =========================
+def load_played(db: Session) -> List[PlayedMatch]:
+    """Tutte le partite con risultato, in ordine cronologico (1 query)."""
+    q = (
+        db.query(
+            Fixture.match_id, Fixture.date, Fixture.league, Fixture.league_code,
+            Fixture.home, Fixture.away,
+            Fixture.result_home_goals, Fixture.result_away_goals,
+            Feature.match_id, Feature.xg_for_home, Feature.xg_for_away,
+        )
+        .outerjoin(Feature, Fixture.match_id == Feature.match_id)
+        .filter(
+            Fixture.date.isnot(None),
+            Fixture.result_home_goals.isnot(None),
+            Fixture.result_away_goals.isnot(None),
+        )
+        .order_by(Fixture.date, Fixture.match_id)
+    )
+    return [
+        PlayedMatch(mid, d, lg, lc, h, a, hg, ag, fid is not None, xh, xa)
+        for mid, d, lg, lc, h, a, hg, ag, fid, xh, xa in q
+    ]
+
+
+# =========================
+# ISTANTANEE
+# =========================
+def _wdl(rows) -> Tuple[int, int, int, int, int]:
+    wins = sum(1 for gf, ga in rows if gf > ga)
+    draws = sum(1 for gf, ga in rows if gf == ga)
+    return wins, draws, len(rows) - wins - draws, sum(r[0] for r in rows), sum(r[1] for r in rows)
+
+
+def team_snapshots(league: str, team: str, matches: List[PlayedMatch]) -> List[dict]:
+    """Un'istantanea TeamForm per ogni giorno in cui la squadra ha giocato (partite cronologiche)."""
+    form_w = deque(maxlen=FORM_WINDOW)       # (xg_for, xg_against, gf, ga), solo con features
+    mom_w = deque(maxlen=MOMENTUM_WINDOW)    # (gf, ga, xg_diff)
+    last5 = deque(maxlen=5)
+    home5 = deque(maxlen=5)
+    away5 = deque(maxlen=5)
+    season = None
+    played = points = gf_tot = ga_tot = 0
+    streak = 0
+
+    out = []
+    for i, m in enumerate(matches):
+        is_home = (m.home == team)
+        gf, ga = (m.hg, m.ag) if is_home else (m.ag, m.hg)
+
+        if m.has_feature:
+            xh = m.xg_home or 1.3
+            xa = m.xg_away or 1.3
+            xg_for, xg_against = (xh, xa) if is_home else (xa, xh)
+            form_w.append((xg_for, xg_against, gf, ga))
+            mom_w.append((gf, ga, xg_for - xg_against))
+        else:
+            mom_w.append((gf, ga, None))
+
+        last5.append((gf, ga))
+        (home5 if is_home else away5).append((gf, ga))
+
+        ss = season_start(m.date)
+        if ss != season:
+            season = ss
+            played = points = gf_tot = ga_tot = 0
+        played += 1
+        points += 3 if gf > ga else (1 if gf == ga else 0)
+        gf_tot += gf
+        ga_tot += ga
+
+        if gf > ga:
+            streak = streak + 1 if streak > 0 else 1
+        elif gf < ga:
+            streak = streak - 1 if streak < 0 else -1
+        else:
+            streak = 0
+
+        # Stesso giorno: un'unica istantanea dopo l'ultima partita
+        if i + 1 < len(matches) and matches[i + 1].date == m.date:
+            continue
+
+        w, d, l, sgf, sga = _wdl(last5)
+        hw, hd, hl, hgf, hga = _wdl(home5)
+        aw, ad, al, agf, aga = _wdl(away5)
+        row = {
+            'team_name': team,
+            'league': league,
+            'league_code': m.league_code,
+            'as_of_date': m.date,
+            'match_id': m.match_id,
+            'last5_wins': w, 'last5_draws': d, 'last5_losses': l,
+            'last5_goals_for': sgf, 'last5_goals_against': sga, 'last5_points': w * 3 + d,
+            'last5_home_wins': hw, 'last5_home_draws': hd, 'last5_home_losses': hl,
+            'last5_home_gf': hgf, 'last5_home_ga': hga,
+            'last5_away_wins': aw, 'last5_away_draws': ad, 'last5_away_losses': al,
+            'last5_away_gf': agf, 'last5_away_ga': aga,
+            'current_streak': streak,
+            'season_start': season,
+            'season_played': played,
+            'season_points': points,
+            'season_gf': gf_tot,
+            'season_ga': ga_tot,
+        }
+        # Dalla più recente, come le query ORDER BY date DESC
+        row.update(form_from_rows(list(reversed(form_w))))
+        row.update(momentum_from_rows(list(reversed(mom_w))))
+        out.append(row)
+    return out
+
+
+def pair_snapshots(league: str, team_a: str, team_b: str, matches: List[PlayedMatch]) -> List[dict]:
+    """Un'istantanea HeadToHead per ogni giorno di scontro; statistiche viste da team_a."""
+    window = deque(maxlen=H2H_WINDOW)  # (gol a, gol b, xg a, xg b)
+
+    out = []
+    for i, m in enumerate(matches):
+        a_home = (m.home == team_a)
+        ga_, gb_ = (m.hg, m.ag) if a_home else (m.ag, m.hg)
+        xa = xb = None
+        if m.has_feature:
+            xh = m.xg_home or 1.3
+            xw = m.xg_away or 1.3
+            xa, xb = (xh, xw) if a_home else (xw, xh)
+        window.append((ga_, gb_, xa, xb))
+
+        if i + 1 < len(matches) and matches[i + 1].date == m.date:
+            continue
+
+        st = h2h_from_rows(list(reversed(window)))
+        has_xg = any(r[2] is not None for r in window)
+        out.append({
+            'team_home': team_a,
+            'team_away': team_b,
+            'league': league,
+            'league_code': m.league_code,
+            'as_of_date': m.date,
+            'total_matches': len(window),
+            'home_wins': st['h2h_home_wins'],
+            'draws': st['h2h_draws'],
+            'away_wins': st['h2h_away_wins'],
+            'avg_goals_home': st['h2h_home_goals_avg'],
+            'avg_goals_away': st['h2h_away_goals_avg'],
+            'avg_total_goals': round(sum(r[0] + r[1] for r in window) / len(window), 2),
+            'btts_count': sum(1 for r in window if r[0] > 0 and r[1] > 0),
+            'over25_count': st['h2h_total_over25'],
+            'avg_xg_home': st['h2h_home_xg_avg'] if has_xg else None,
+            'avg_xg_away': st['h2h_away_xg_avg'] if has_xg else None,
+            'last_updated': date.today(),
+        })
+    return out
+
+
+# =========================
+# MATERIALIZZAZIONE
+# =========================
+def day_hashes(matches: List[PlayedMatch]) -> Dict[date, str]:
+    """Hash cumulativo del contenuto delle partite fino a ogni giorno (partite cronologiche)."""
+    h = hashlib.sha1()
+    out = {}
+    for m in matches:
+        h.update(repr(tuple(m)).encode())
+        out[m.date] = h.hexdigest()[:16]
+    return out
+
+
+def _stale_since(hashes: Dict[tuple, Dict[date, str]], stored: Dict[tuple, Dict[date, str]]) -> Dict[tuple, date]:
+    """Per ogni chiave, il primo giorno in cui le istantanee salvate non corrispondono alle partite."""
+    out = {}
+    for key in hashes.keys() | stored.keys():
+        expected, old = hashes.get(key, {}), stored.get(key, {})
+        diff = [d for d in expected.keys() | old.keys() if d is not None and expected.get(d) != old.get(d)]
+        if diff:
+            out[key] = min(diff)
+    return out
+
+
+def materialize(db: Session, rebuild: bool = False, verbose: bool = True) -> Tuple[int, int]:
+    """
+    Aggiorna team_form / head_to_head. Ritorna (istantanee squadra, istantanee coppia) scritte.
+    """
+    t0 = time.time()
+    ensure_schema(db)
+    played = load_played(db)
+
+    by_team: Dict[Tuple[str, str], List[PlayedMatch]] = defaultdict(list)
+    by_pair: Dict[Tuple[str, str, str], List[PlayedMatch]] = defaultdict(list)
+    for m in played:
+        by_team[(m.league, m.home)].append(m)
+        by_team[(m.league, m.away)].append(m)
+        a, b = sorted((m.home, m.away))
+        by_pair[(m.league, a, b)].append(m)
+
+    team_hashes = {k: day_hashes(v) for k, v in by_team.items()}
+    pair_hashes = {k: day_hashes(v) for k, v in by_pair.items()}
+
+    # chiave -> data da cui riscrivere (None = tutto)
+    team_since: Dict[Tuple[str, str], Optional[date]] = {}
+    pair_since: Dict[Tuple[str, str, str], Optional[date]] = {}
+    if rebuild:
+        db.query(TeamForm).delete(synchronize_session=False)
+        db.query(HeadToHead).delete(synchronize_session=False)
+        team_since = {k: None for k in by_team}
+        pair_since = {k: None for k in by_pair}
+    else:
+        stored_team: Dict[Tuple[str, str], Dict[date, str]] = defaultdict(dict)
+        for lg, team, d, h in db.query(
+            TeamForm.league, TeamForm.team_name, TeamForm.as_of_date, TeamForm.source_hash
+        ):
+            stored_team[(lg, team)][d] = h
+        stored_pair: Dict[Tuple[str, str, str], Dict[date, str]] = defaultdict(dict)
+        for lg, a, b, d, h in db.query(
+            HeadToHead.league, HeadToHead.team_home, HeadToHead.team_away,
+            HeadToHead.as_of_date, HeadToHead.source_hash,
+        ):
+            stored_pair[(lg, a, b)][d] = h
+        team_since = _stale_since(team_hashes, stored_team)
+        pair_since = _stale_since(pair_hashes, stored_pair)
+
+    if not team_since and not pair_since:
+        if verbose:
+            print("[INFO] team_form/head_to_head già aggiornate")
+        return (0, 0)
+
+    team_rows = []
+    for (league, team), since in team_since.items():
+        if since is not None:
+            db.query(TeamForm).filter(
+                TeamForm.league == league,
+                TeamForm.team_name == team,
+                TeamForm.as_of_date >= since,
+            ).delete(synchronize_session=False)
+        hashes = team_hashes.get((league, team), {})
+        for r in team_snapshots(league, team, by_team[(league, team)]):
+            if since is None or r['as_of_date'] >= since:
+                r['source_hash'] = hashes[r['as_of_date']]
+                team_rows.append(r)
+
+    pair_rows = []
+    for (league, a, b), since in pair_since.items():
+        if since is not None:
+            db.query(HeadToHead).filter(
+                HeadToHead.league == league,
+                HeadToHead.team_home == a,
+                HeadToHead.team_away == b,
+                HeadToHead.as_of_date >= since,
+            ).delete(synchronize_session=False)
+        hashes = pair_hashes.get((league, a, b), {})
+        for r in pair_snapshots(league, a, b, by_pair[(league, a, b)]):
+            if since is None or r['as_of_date'] >= since:
+                r['source_hash'] = hashes[r['as_of_date']]
+                pair_rows.append(r)
+
+    db.bulk_insert_mappings(TeamForm, team_rows)
+    db.bulk_insert_mappings(HeadToHead, pair_rows)
+    db.commit()
+
+    if verbose:
+        print(
+            f"[OK] team_form: {len(team_rows)} istantanee ({len(team_since)} squadre), "
+            f"head_to_head: {len(pair_rows)} ({len(pair_since)} coppie) in {time.time() - t0:.1f}s"
+        )
+    return (len(team_rows), len(pair_rows))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Materializza team_form / head_to_head dalle partite con risultato")
+    ap.add_argument("--rebuild", action="store_true", help="svuota e ricostruisce tutte le istantanee")
+    args = ap.parse_args()
+
+    db = SessionLocal()
+    try:
+        materialize(db, rebuild=args.rebuild)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+team_registry.py
+----------------
+Registro canonico delle squadre: un team_id intero per squadra (tabella teams) e
+un alias per ogni nome usato dalle fonti (tabella team_aliases):
+
+    football-data.org (fixtures, risultati), TheOddsAPI (quote e fixture di ripiego),
+    football-data.co.uk (storico), Understat, FBRef
+
+- lookup: chiave normalizzata del nome (alias_key) → team_id, in un dizionario
+  caricato una volta dal DB; prima per (fonte, chiave), poi per chiave su tutte le fonti
+- resolve: se l'alias non è noto si fa UNA volta il fuzzy sulle squadre della stessa
+  lega (rapidfuzz) e l'esito viene salvato come alias (method="fuzzy"); se non c'è
+  un candidato abbastanza simile nasce una squadra nuova (method="new")
+- learn: i matcher a coppie (quote, risultati) registrano gli alias scoperti col
+  fuzzy su casa+trasferta+data (method="pair"), così la volta successiva è un lookup
+- fixtures e historical_matches portano home_team_id/away_team_id
+
+Gli alias nuovi vengono aggiunti alla sessione del chiamante (flush): il commit resta
+al chiamante, come per i dati che li hanno prodotti.
+
+Uso:
+    reg = TeamRegistry(db)
+    hid = reg.resolve("FC Internazionale Milano", SRC_FD, league="SA")
+    reg.lookup("Inter Milan", SRC_TOA)          # None se mai visto
+    reg.learn("Inter Milan", SRC_TOA, hid)
+    reg.name_for(hid, SRC_UNDERSTAT)            # "Inter"
+
+CLI:
+    python team_registry.py --backfill          # squadre/alias da fixtures, storico, team_mappings
+    python team_registry.py --lookup "Inter Milan" [--source theoddsapi]
+    python team_registry.py --stats
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from unidecode import unidecode
+
+from models import Fixture, HistoricalMatch, Team, TeamAlias, TeamMapping
+
+ROOT = Path(__file__).resolve().parent
+TEAM_MAP_FILE = ROOT / "data" / "team_map.json"  # mapping nome API → Understat di historical_builder
+
+SRC_FD = "football-data.org"
+SRC_TOA = "theoddsapi"
+SRC_FDCO = "football-data.co.uk"
+SRC_UNDERSTAT = "understat"
+SRC_FBREF = "fbref"
+SOURCES = (SRC_FD, SRC_TOA, SRC_FDCO, SRC_UNDERSTAT, SRC_FBREF)
+
+FUZZY_THRESHOLD = 90  # un solo nome senza contesto: soglia più alta dei matcher a coppie
+PAIR_THRESHOLD = 80   # casa + trasferta nella stessa data: il contesto basta a una soglia più bassa
+# coppe: le squadre arrivano da tutte le leghe, il fuzzy cerca ovunque
+CUP_CODES = {"CL", "EL", "ECL", "UCL", "UEL"}
+# nomi lega dello storico (historical_builder.COMP_MAP) → codice lega delle fixtures
+LEAGUE_NAME_CODES = {
+    "Premier League": "PL",
+    "Serie A": "SA",
+    "Primera Division": "PD",
+    "Bundesliga": "BL1",
+    "Ligue 1": "FL1",
+    "Eredivisie": "DED",
+    "Primeira Liga": "PPL",
+    "Championship (ENG)": "ELC",
+    "Championship": "ELC",
+    "UEFA Champions League": "CL",
+}
+
+# prefissi/suffissi societari e anni di fondazione non distinguono le squadre
+_CLUB_TOKENS = re.compile(r"\b(fc|cf|afc|sc|bc|ac|as|us|ssc|cd|ud|kv|bk|sfp|rcd|calcio)\b")
+
+
+def league_code_of(league: Optional[str]) -> Optional[str]:
+    """Codice lega da codice o nome esteso (lo storico usa i nomi)."""
+    if not isinstance(league, str) or not league:
+        return None
+    return LEAGUE_NAME_CODES.get(league, league)
+
+
+def best_pair(home: str, away: str, candidates: List[Tuple[str, str]],
+              threshold: float = PAIR_THRESHOLD) -> Tuple[Optional[int], float, bool]:
+    """
+    Candidato (casa, trasferta) più simile alla coppia: media di fuzz.WRatio sulle
+    alias_key (regge le abbreviazioni "Man United", "Wolves"), anche a squadre
+    invertite → (indice, punteggio, invertito); (None, 0, False) sotto soglia.
+    """
+    from rapidfuzz import fuzz
+
+    h, a = alias_key(home), alias_key(away)
+    best = (None, 0.0, False)
+    for i, (ch, ca) in enumerate(candidates):
+        ch, ca = alias_key(ch), alias_key(ca)
+        straight = (fuzz.WRatio(h, ch) + fuzz.WRatio(a, ca)) / 2
+        swapped = (fuzz.WRatio(h, ca) + fuzz.WRatio(a, ch)) / 2
+        sc = max(straight, swapped)
+        if sc > best[1]:
+            best = (i, sc, swapped > straight)
+    return best if best[1] >= threshold else (None, 0.0, False)
+
+
+def alias_key(name: str) -> str:
+    """Chiave di confronto di un nome squadra: ascii, minuscole, senza sigle societarie/anni/punteggiatura."""
+    s = unidecode(str(name or "")).lower().strip()
+    s = s.replace("&", " and ")
+    s = _CLUB_TOKENS.sub(" ", s)
+    s = re.sub(r"\b\d{4}\b", " ", s)
+    s = re.sub(r"[^a-z0-9 ]+", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+class TeamRegistry:
+    def __init__(self, db: Session):
+        self.db = db
+        self.by_source: Dict[Tuple[str, str], int] = {}
+        self.by_key: Dict[str, Optional[int]] = {}   # None = chiave ambigua tra fonti
+        self.league_of: Dict[int, Optional[str]] = {}
+        self.names: Dict[Tuple[int, str], str] = {}  # (team_id, fonte) → nome originale
+        self.fuzzy_calls = 0
+        for t_id, lg in db.query(Team.id, Team.league_code):
+            self.league_of[t_id] = lg
+        for src, alias, key, t_id in db.query(TeamAlias.source, TeamAlias.alias, TeamAlias.alias_key,
+                                              TeamAlias.team_id).order_by(TeamAlias.id):
+            self._remember(src, alias, key, t_id)
+
+    def _remember(self, source: str, alias: str, key: str, team_id: int) -> None:
+        self.by_source[(source, key)] = team_id
+        prev = self.by_key.get(key, team_id)
+        self.by_key[key] = team_id if prev == team_id else None
+        self.names.setdefault((team_id, source), alias)
+
+    # ---------- lettura ----------
+    def lookup(self, name: str, source: Optional[str] = None) -> Optional[int]:
+        """team_id di un nome già visto (O(1)), None se sconosciuto o ambiguo."""
+        key = alias_key(name)
+        if not key:
+            return None
+        if source is not None:
+            t_id = self.by_source.get((source, key))
+            if t_id is not None:
+                return t_id
+        return self.by_key.get(key)
+
+    def name_for(self, team_id: Optional[int], source: str) -> Optional[str]:
+        """Nome della squadra nella fonte indicata (es. lo slug Understat), se noto."""
+        if team_id is None:
+            return None
+        return self.names.get((team_id, source))
+
+    # ---------- scrittura ----------
+    def learn(self, name: str, source: str, team_id: int, method: str = "pair",
+              score: Optional[float] = None) -> bool:
+        """Registra name come alias di team_id per la fonte; False se era già noto."""
+        key = alias_key(name)
+        if not key or (source, key) in self.by_source:
+            return False
+        self.db.add(TeamAlias(source=source, alias=name, alias_key=key, team_id=team_id,
+                              method=method, score=score))
+        self.db.flush()
+        self._remember(source, name, key, team_id)
+        return True
+
+    def learn_pair(self, home: str, away: str, source: str, home_id: Optional[int],
+                   away_id: Optional[int], score: Optional[float] = None) -> None:
+        """Alias di casa e trasferta scoperti con un match a coppie (stessa data/partita)."""
+        if home_id is not None:
+            self.learn(home, source, home_id, method="pair", score=score)
+        if away_id is not None:
+            self.learn(away, source, away_id, method="pair", score=score)
+
+    def _fuzzy(self, key: str, league: Optional[str]) -> Tuple[Optional[int], float]:
+        """Miglior squadra per la chiave tra gli alias della lega (tutte per le coppe)."""
+        from rapidfuzz import fuzz, process
+
+        self.fuzzy_calls += 1
+        league = league_code_of(league)
+        scope = None if (not league or league in CUP_CODES) else league
+        choices = {}
+        for k, t_id in self.by_key.items():
+            if t_id is not None and (scope is None or self.league_of.get(t_id) == scope):
+                choices[k] = t_id
+        if not choices:
+            return None, 0.0
+        best = process.extractOne(key, list(choices), scorer=fuzz.ratio, score_cutoff=FUZZY_THRESHOLD)
+        if not best:
+            return None, 0.0
+        return choices[best[0]], float(best[1])
+
+    def resolve(self, name: str, source: str, league: Optional[str] = None,
+                create: bool = True) -> Optional[int]:
+        """
+        team_id del nome: lookup; altrimenti fuzzy una volta (nella lega) e alias salvato;
+        altrimenti squadra nuova (se create).
+        """
+        t_id = self.lookup(name, source)
+        key = alias_key(name)
+        if t_id is not None or not key:
+            if t_id is not None:
+                if (source, key) not in self.by_source:
+                    self.learn(name, source, t_id, method="exact")
+                self._set_league(t_id, league)
+            return t_id
+        t_id, score = self._fuzzy(key, league)
+        if t_id is not None:
+            self.learn(name, source, t_id, method="fuzzy", score=score)
+            self._set_league(t_id, league)
+            return t_id
+        if not create:
+            return None
+        league = league_code_of(league)
+        team = Team(name=name, league_code=None if league in CUP_CODES else league)
+        self.db.add(team)
+        self.db.flush()
+        self.league_of[team.id] = team.league_code
+        self.learn(name, source, team.id, method="new")
+        return team.id
+
+    def _set_league(self, team_id: int, league: Optional[str]) -> None:
+        """Squadra vista prima solo in coppa: la prima lega domestica diventa la sua."""
+        league = league_code_of(league)
+        if league and league not in CUP_CODES and self.league_of.get(team_id) is None:
+            self.db.query(Team).filter(Team.id == team_id).update({"league_code": league})
+            self.league_of[team_id] = league
+
+    def assign(self, row, source: str) -> None:
+        """Imposta home_team_id/away_team_id di una Fixture/HistoricalMatch dai nomi."""
+        league = league_code_of(getattr(row, "league_code", None) or getattr(row, "league", None))
+        row.home_team_id = self.resolve(row.home, source, league) if isinstance(row.home, str) else None
+        row.away_team_id = self.resolve(row.away, source, league) if isinstance(row.away, str) else None
+
+    def stats(self) -> Dict[str, int]:
+        per_source: Dict[str, int] = {}
+        for src, _key in self.by_source:
+            per_source[src] = per_source.get(src, 0) + 1
+        return {"teams": len(self.league_of), "aliases": len(self.by_source),
+                "ambiguous_keys": sum(1 for v in self.by_key.values() if v is None),
+                **{f"aliases_{k}": v for k, v in sorted(per_source.items())}}
+
+
+# =========================
+# BACKFILL
+# =========================
+def _fill_ids(db: Session, reg: TeamRegistry, model, source: str, league_col) -> int:
+    """Risolve le coppie (nome, lega) distinte e aggiorna gli id con un UPDATE per nome."""
+    pairs = set()
+    for col in (model.home, model.away):
+        pairs.update(db.query(col, league_col).filter(col.isnot(None)).distinct())
+    resolved = {}
+    for name, league in sorted(pairs, key=lambda p: (p[0], p[1] or "")):
+        t_id = reg.resolve(name, source, league)
+        if t_id is not None:
+            resolved.setdefault(name, t_id)
+    for name, t_id in resolved.items():
+        db.execute(update(model).where(model.home == name).values(home_team_id=t_id))
+        db.execute(update(model).where(model.away == name).values(away_team_id=t_id))
+    return len(resolved)
+
+
+def _link_history_to_fixtures(db: Session, reg: TeamRegistry) -> int:
+    """
+    Nomi dello storico (football-data.co.uk) collegati alle squadre delle fixtures
+    giocate nella stessa data e lega, con il match a coppie casa+trasferta.
+    """
+    buckets: Dict[tuple, list] = {}
+    for d, code, h, a, hid, aid in db.query(Fixture.date, Fixture.league_code, Fixture.home, Fixture.away,
+                                            Fixture.home_team_id, Fixture.away_team_id):
+        if hid is not None and aid is not None:
+            buckets.setdefault((d, code), []).append((h, a, hid, aid))
+    linked = 0
+    for d, league, h, a in db.query(HistoricalMatch.date, HistoricalMatch.league,
+                                    HistoricalMatch.home, HistoricalMatch.away).distinct():
+        if reg.lookup(h, SRC_FDCO) is not None and reg.lookup(a, SRC_FDCO) is not None:
+            continue
+        cands = buckets.get((d, league_code_of(league)), [])
+        i, score, swapped = best_pair(h, a, [(c[0], c[1]) for c in cands])
+        if i is None:
+            continue
+        _ch, _ca, hid, aid = cands[i]
+        if swapped:
+            hid, aid = aid, hid
+        reg.learn_pair(h, a, SRC_FDCO, hid, aid, score)
+        linked += 1
+    return linked
+
+
+def backfill(db: Session) -> Dict[str, int]:
+    """
+    Popola squadre e alias da ciò che il DB sa già e assegna gli id a fixtures e storico:
+    fixtures (football-data.org), team_mappings (nome fonte → Understat/FBRef),
+    data/team_map.json (nome API → Understat), historical_matches (football-data.co.uk).
+    """
+    reg = TeamRegistry(db)
+    out = {"fixtures": _fill_ids(db, reg, Fixture, SRC_FD, Fixture.league_code)}
+
+    mapped = 0
+    for m in db.query(TeamMapping):
+        src = SRC_FDCO if m.source == "football-data.co.uk" else SRC_FD
+        t_id = reg.resolve(m.source_name, src, m.league_code)
+        if m.understat_name:
+            mapped += reg.learn(m.understat_name, SRC_UNDERSTAT, t_id, method="seed")
+        if m.fbref_name:
+            mapped += reg.learn(m.fbref_name, SRC_FBREF, t_id, method="seed")
+    if TEAM_MAP_FILE.exists():
+        for api_name, us_name in json.loads(TEAM_MAP_FILE.read_text(encoding="utf-8")).items():
+            t_id = reg.lookup(api_name)
+            if t_id is not None and us_name:
+                mapped += reg.learn(us_name, SRC_UNDERSTAT, t_id, method="seed")
+    out["mapped_aliases"] = mapped
+
+    out["linked_history"] = _link_history_to_fixtures(db, reg)
+    out["historical"] = _fill_ids(db, reg, HistoricalMatch, SRC_FDCO, HistoricalMatch.league)
+    out["fuzzy_calls"] = reg.fuzzy_calls
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Registro canonico squadre (teams + team_aliases).")
+    ap.add_argument("--backfill", action="store_true", help="Crea squadre/alias e assegna gli id a fixtures e storico")
+    ap.add_argument("--lookup", metavar="NOME", help="team_id e nomi per fonte di una squadra")
+    ap.add_argument("--source", choices=SOURCES, help="Fonte del nome per --lookup")
+    ap.add_argument("--stats", action="store_true", help="Conteggi di squadre e alias")
+    args = ap.parse_args()
+
+    from database import SessionLocal, migrate_schema
+
+    migrate_schema()
+    db = SessionLocal()
+    try:
+        if args.backfill:
+            out = backfill(db)
+            db.commit()
+            print(f"[OK] Backfill: {out}")
+        if args.lookup:
+            reg = TeamRegistry(db)
+            t_id = reg.lookup(args.lookup, args.source)
+            if t_id is None:
+                print(f"[WARN] '{args.lookup}' non è un alias noto.")
+            else:
+                names = {src: reg.name_for(t_id, src) for src in SOURCES if reg.name_for(t_id, src)}
+                print(f"[INFO] '{args.lookup}' → team_id {t_id} {names}")
+        if args.stats or not (args.backfill or args.lookup):
+            print(f"[INFO] {TeamRegistry(db).stats()}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
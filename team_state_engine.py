@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+team_state_engine.py
+
+Motore a stato "rolling" per le 54 advanced features degli storici CSV.
+
+Al posto di ri-filtrare l'intero DataFrame per ogni riga (O(N²)), le partite
+vengono ordinate per data una sola volta e percorse in avanti, mantenendo:
+- per (lega, squadra): finestra delle ultime 10 partite (forma = ultime 5,
+  momentum/streak = ultime 10) e classifica cumulativa (punti, GF, GS)
+- per (lega, coppia di squadre): finestra degli ultimi 5 scontri diretti
+
+Le partite della stessa data non si "vedono" tra loro (filtro date < data),
+quindi lo stato viene aggiornato solo dopo aver calcolato tutte le righe di
+un giorno. I calcoli sulle finestre replicano esattamente le funzioni
+calculate_* di populate_historical_advanced_features.py, per cui su uno
+storico in ordine cronologico l'output è identico.
+
+compute_advanced_features_parallel divide lo storico per lega (le chiavi dello
+stato includono sempre la lega) e calcola gli shard in un ProcessPoolExecutor,
+spedendo array numpy compatti (date, codici squadra, gol/xG) invece di DataFrame;
+le righe tornano alle posizioni originali, quindi l'output coincide col seriale.
+"""
+
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+FORM_WINDOW = 5
+H2H_WINDOW = 5
+MOMENTUM_WINDOW = 10
+
+# Stesso ordine di FEATURES_ADVANCED in model_pipeline.py
+ADVANCED_FEATURE_COLS: List[str] = [
+    'home_form_xg_for', 'home_form_xg_against', 'home_form_xg_diff',
+    'home_form_wins', 'home_form_draws', 'home_form_losses',
+    'home_form_goals_for', 'home_form_goals_against', 'home_form_points', 'home_form_trend',
+    'away_form_xg_for', 'away_form_xg_against', 'away_form_xg_diff',
+    'away_form_wins', 'away_form_draws', 'away_form_losses',
+    'away_form_goals_for', 'away_form_goals_against', 'away_form_points', 'away_form_trend',
+    'h2h_home_wins', 'h2h_draws', 'h2h_away_wins',
+    'h2h_home_goals_avg', 'h2h_away_goals_avg', 'h2h_home_xg_avg', 'h2h_away_xg_avg',
+    'h2h_total_over25',
+    'home_position', 'home_points', 'home_goal_difference', 'home_pressure_top', 'home_pressure_relegation',
+    'away_position', 'away_points', 'away_goal_difference', 'away_pressure_top', 'away_pressure_relegation',
+    'home_winning_streak', 'home_unbeaten_streak', 'home_losing_streak',
+    'home_clean_sheet_streak', 'home_scoring_streak', 'home_xg_momentum',
+    'away_winning_streak', 'away_unbeaten_streak', 'away_losing_streak',
+    'away_clean_sheet_streak', 'away_scoring_streak', 'away_xg_momentum',
+    'position_gap', 'points_gap', 'form_diff', 'momentum_diff',
+]
+
+# Colonne lette dallo storico (NaN se assenti)
+INPUT_COLS = [
+    'ft_home_goals', 'ft_away_goals',
+    'xg_for_home', 'xg_against_home', 'xg_for_away', 'xg_against_away',
+]
+
+
+class MatchRecord(NamedTuple):
+    """Partita conclusa, così come serve alle finestre rolling."""
+    home: str
+    away: str
+    hg: float
+    ag: float
+    xg_for_home: float
+    xg_against_home: float
+    xg_for_away: float
+    xg_against_away: float
+
+
+# =========================
+# CALCOLI SU FINESTRA
+# (stessa logica e stesso ordine delle operazioni di calculate_*)
+# =========================
+def form_from_window(matches: List[MatchRecord], team: str) -> Dict[str, Any]:
+    if len(matches) == 0:
+        return {
+            'form_xg_for': 1.3,
+            'form_xg_against': 1.3,
+            'form_xg_diff': 0.0,
+            'form_wins': 0,
+            'form_draws': 0,
+            'form_losses': 0,
+            'form_goals_for': 1.0,
+            'form_goals_against': 1.0,
+            'form_points': 0,
+            'form_trend': 0.0,
+        }
+
+    xg_for_list = []
+    xg_against_list = []
+    goals_for_list = []
+    goals_against_list = []
+    wins = draws = losses = 0
+    points = 0
+
+    for m in matches:
+        if m.home == team:
+            xg_for, xg_against = m.xg_for_home, m.xg_against_home
+            goals_for, goals_against = m.hg, m.ag
+        else:
+            xg_for, xg_against = m.xg_for_away, m.xg_against_away
+            goals_for, goals_against = m.ag, m.hg
+
+        xg_for_list.append(xg_for if pd.notna(xg_for) else 1.3)
+        xg_against_list.append(xg_against if pd.notna(xg_against) else 1.3)
+        goals_for_list.append(goals_for if pd.notna(goals_for) else 1)
+        goals_against_list.append(goals_against if pd.notna(goals_against) else 1)
+
+        if pd.notna(goals_for) and pd.notna(goals_against):
+            if goals_for > goals_against:
+                wins += 1
+                points += 3
+            elif goals_for == goals_against:
+                draws += 1
+                points += 1
+            else:
+                losses += 1
+
+    if len(xg_for_list) >= 2:
+        trend = np.mean(xg_for_list[-2:]) - np.mean(xg_for_list[:2]) if len(xg_for_list) >= 4 else 0.0
+    else:
+        trend = 0.0
+
+    return {
+        'form_xg_for': np.mean(xg_for_list),
+        'form_xg_against': np.mean(xg_against_list),
+        'form_xg_diff': np.mean(xg_for_list) - np.mean(xg_against_list),
+        'form_wins': wins,
+        'form_draws': draws,
+        'form_losses': losses,
+        'form_goals_for': np.mean(goals_for_list),
+        'form_goals_against': np.mean(goals_against_list),
+        'form_points': points,
+        'form_trend': trend,
+    }
+
+
+def h2h_from_window(matches: List[MatchRecord], home_team: str) -> Dict[str, Any]:
+    if len(matches) == 0:
+        return {
+            'h2h_home_wins': 0,
+            'h2h_draws': 0,
+            'h2h_away_wins': 0,
+            'h2h_home_goals_avg': 1.0,
+            'h2h_away_goals_avg': 1.0,
+            'h2h_home_xg_avg': 1.3,
+            'h2h_away_xg_avg': 1.3,
+            'h2h_total_over25': 0,
+        }
+
+    home_wins = draws = away_wins = 0
+    home_goals = []
+    away_goals = []
+    home_xg = []
+    away_xg = []
+    over25_count = 0
+
+    for m in matches:
+        h_goals, a_goals = m.hg, m.ag
+        h_xg, a_xg = m.xg_for_home, m.xg_for_away
+        regular = m.home == home_team
+
+        # Dal punto di vista di home_team
+        mine_g, other_g = (h_goals, a_goals) if regular else (a_goals, h_goals)
+        mine_xg, other_xg = (h_xg, a_xg) if regular else (a_xg, h_xg)
+        home_goals.append(mine_g if pd.notna(mine_g) else 1)
+        away_goals.append(other_g if pd.notna(other_g) else 1)
+        home_xg.append(mine_xg if pd.notna(mine_xg) else 1.3)
+        away_xg.append(other_xg if pd.notna(other_xg) else 1.3)
+
+        if pd.notna(h_goals) and pd.notna(a_goals):
+            if h_goals + a_goals > 2.5:
+                over25_count += 1
+            if mine_g > other_g:
+                home_wins += 1
+            elif h_goals == a_goals:
+                draws += 1
+            else:
+                away_wins += 1
+
+    return {
+        'h2h_home_wins': home_wins,
+        'h2h_draws': draws,
+        'h2h_away_wins': away_wins,
+        'h2h_home_goals_avg': np.mean(home_goals),
+        'h2h_away_goals_avg': np.mean(away_goals),
+        'h2h_home_xg_avg': np.mean(home_xg),
+        'h2h_away_xg_avg': np.mean(away_xg),
+        'h2h_total_over25': over25_count,
+    }
+
+
+def standings_from_table(row: Optional[List[Any]]) -> Dict[str, Any]:
+    """row = [partite, punti, gol fatti, gol subiti] cumulativi (None = nessuna partita)."""
+    if not row or row[0] == 0:
+        return {
+            'position': 10,
+            'points': 0,
+            'goal_difference': 0,
+            'pressure_top': 0.0,
+            'pressure_relegation': 0.0,
+        }
+    _, points, gf, ga = row
+    return {
+        'position': 10,  # Approssimazione come in calculate_standings
+        'points': points,
+        'goal_difference': gf - ga,
+        'pressure_top': max(0, (25 - points) / 25) if points < 25 else 0.0,
+        'pressure_relegation': max(0, (15 - points) / 15) if points < 15 else 0.0,
+    }
+
+
+def momentum_from_window(matches: List[MatchRecord], team: str) -> Dict[str, Any]:
+    if len(matches) == 0:
+        return {
+            'winning_streak': 0,
+            'unbeaten_streak': 0,
+            'losing_streak': 0,
+            'clean_sheet_streak': 0,
+            'scoring_streak': 0,
+            'xg_momentum': 0.0,
+        }
+
+    win_streak = unbeaten_streak = lose_streak = 0
+    clean_sheet_streak = scoring_streak = 0
+    xg_diffs = []
+
+    for m in reversed(matches):  # dalla più recente
+        if not (pd.notna(m.hg) and pd.notna(m.ag)):
+            continue
+        if m.home == team:
+            gf, ga = m.hg, m.ag
+            xg_diff = m.xg_for_home - m.xg_against_home
+        else:
+            gf, ga = m.ag, m.hg
+            xg_diff = m.xg_for_away - m.xg_against_away
+
+        xg_diffs.append(xg_diff if pd.notna(xg_diff) else 0)
+
+        if gf > ga:
+            if win_streak >= 0:
+                win_streak += 1
+                unbeaten_streak += 1
+        elif gf == ga:
+            if win_streak == 0:
+                unbeaten_streak += 1
+            win_streak = -999
+        else:
+            win_streak = -999
+            unbeaten_streak = -999
+            if lose_streak >= 0:
+                lose_streak += 1
+
+        if ga == 0:
+            if clean_sheet_streak >= 0:
+                clean_sheet_streak += 1
+        else:
+            clean_sheet_streak = -999
+
+        if gf > 0:
+            if scoring_streak >= 0:
+                scoring_streak += 1
+        else:
+            scoring_streak = -999
+
+    return {
+        'winning_streak': max(0, win_streak),
+        'unbeaten_streak': max(0, unbeaten_streak),
+        'losing_streak': max(0, lose_streak),
+        'clean_sheet_streak': max(0, clean_sheet_streak),
+        'scoring_streak': max(0, scoring_streak),
+        'xg_momentum': np.mean(xg_diffs) if len(xg_diffs) > 0 else 0.0,
+    }
+
+
+# =========================
+# ENGINE
+# =========================
+class TeamStateEngine:
+    """
+    Stato rolling per squadra e per coppia, aggiornato partita dopo partita.
+    Le chiavi includono sempre la lega (le funzioni originali filtrano per lega).
+    """
+
+    def __init__(self):
+        self.recent: Dict[Tuple[str, str], Deque[MatchRecord]] = {}
+        self.pairs: Dict[Tuple[str, frozenset], Deque[MatchRecord]] = {}
+        self.table: Dict[Tuple[str, str], List[Any]] = {}
+
+    @staticmethod
+    def _valid(*keys: Any) -> bool:
+        return all(isinstance(k, str) or (k is not None and not pd.isna(k)) for k in keys)
+
+    def _window(self, league: Any, team: Any, n: int) -> List[MatchRecord]:
+        if not self._valid(league, team):
+            return []
+        dq = self.recent.get((league, team))
+        if not dq:
+            return []
+        return list(dq)[-n:]
+
+    def features_for(self, league: Any, home: Any, away: Any) -> Dict[str, Any]:
+        """Le 54 advanced features per una partita, dato lo stato attuale."""
+        out: Dict[str, Any] = {}
+
+        home_form = form_from_window(self._window(league, home, FORM_WINDOW), home)
+        away_form = form_from_window(self._window(league, away, FORM_WINDOW), away)
+        for key, val in home_form.items():
+            out[f'home_{key}'] = val
+        for key, val in away_form.items():
+            out[f'away_{key}'] = val
+
+        h2h_matches: List[MatchRecord] = []
+        if self._valid(league, home, away):
+            h2h_matches = list(self.pairs.get((league, frozenset((home, away))), ()))
+        out.update(h2h_from_window(h2h_matches, home))
+
+        home_st = standings_from_table(self.table.get((league, home)) if self._valid(league, home) else None)
+        away_st = standings_from_table(self.table.get((league, away)) if self._valid(league, away) else None)
+        for key, val in home_st.items():
+            out[f'home_{key}'] = val
+        for key, val in away_st.items():
+            out[f'away_{key}'] = val
+
+        home_mom = momentum_from_window(self._window(league, home, MOMENTUM_WINDOW), home)
+        away_mom = momentum_from_window(self._window(league, away, MOMENTUM_WINDOW), away)
+        for key, val in home_mom.items():
+            out[f'home_{key}'] = val
+        for key, val in away_mom.items():
+            out[f'away_{key}'] = val
+
+        out['position_gap'] = home_st['position'] - away_st['position']
+        out['points_gap'] = home_st['points'] - away_st['points']
+        out['form_diff'] = home_form['form_xg_diff'] - away_form['form_xg_diff']
+        out['momentum_diff'] = home_mom['xg_momentum'] - away_mom['xg_momentum']
+        return out
+
+    def update(self, league: Any, rec: MatchRecord) -> None:
+        """Registra una partita giocata nello stato di entrambe le squadre e della coppia."""
+        if not self._valid(league):
+            return
+        for team, gf, ga in ((rec.home, rec.hg, rec.ag), (rec.away, rec.ag, rec.hg)):
+            if not self._valid(team):
+                continue
+            key = (league, team)
+            dq = self.recent.get(key)
+            if dq is None:
+                dq = self.recent[key] = deque(maxlen=MOMENTUM_WINDOW)
+            dq.append(rec)
+
+            row = self.table.get(key)
+            if row is None:
+                row = self.table[key] = [0, 0, 0, 0]
+            row[0] += 1
+            if pd.notna(gf) and pd.notna(ga):
+                row[2] += gf
+                row[3] += ga
+                if gf > ga:
+                    row[1] += 3
+                elif gf == ga:
+                    row[1] += 1
+
+        if self._valid(rec.home, rec.away):
+            pkey = (league, frozenset((rec.home, rec.away)))
+            dq = self.pairs.get(pkey)
+            if dq is None:
+                dq = self.pairs[pkey] = deque(maxlen=H2H_WINDOW)
+            dq.append(rec)
+
+
+def _records(df: pd.DataFrame) -> List[MatchRecord]:
+    cols = {}
+    for c in INPUT_COLS:
+        if c in df.columns:
+            cols[c] = pd.to_numeric(df[c], errors='coerce').to_numpy(dtype=float)
+        else:
+            cols[c] = np.full(len(df), np.nan)
+    return [
+        MatchRecord(h, a, *vals)
+        for h, a, *vals in zip(
+            df['home'].tolist(), df['away'].tolist(), *(cols[c] for c in INPUT_COLS)
+        )
+    ]
+
+
+def _compute(dates: np.ndarray, leagues: List[Any], records: List[MatchRecord],
+             engine: TeamStateEngine, only: Optional[np.ndarray]) -> np.ndarray:
+    n = len(records)
+    out = np.full((n, len(ADVANCED_FEATURE_COLS)), np.nan)
+
+    # Ordinamento stabile: a parità di data resta l'ordine del file
+    order = np.argsort(dates, kind='mergesort')
+    col_idx = {c: j for j, c in enumerate(ADVANCED_FEATURE_COLS)}
+
+    start = 0
+    while start < n:
+        d = dates[order[start]]
+        if pd.isna(d):
+            # Date mancanti: nessuno storico (come il confronto date < NaT)
+            for i in order[start:]:
+                if only is not None and not only[i]:
+                    continue
+                feats = TeamStateEngine().features_for(leagues[i], records[i].home, records[i].away)
+                for key, val in feats.items():
+                    out[i, col_idx[key]] = val
+            break
+        end = start
+        while end < n and dates[order[end]] == d:
+            end += 1
+        block = order[start:end]
+        for i in block:
+            if only is not None and not only[i]:
+                continue
+            feats = engine.features_for(leagues[i], records[i].home, records[i].away)
+            for key, val in feats.items():
+                out[i, col_idx[key]] = val
+        for i in block:
+            engine.update(leagues[i], records[i])
+        start = end
+    return out
+
+
+def compute_advanced_features(df: pd.DataFrame, engine: Optional[TeamStateEngine] = None,
+                              only: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Calcola le 54 advanced features per tutte le righe di df in un solo passaggio.
+
+    df deve avere 'date' (date o stringhe ISO), 'league', 'home', 'away' e i gol FT.
+    Ritorna un DataFrame (stesso index di df) con le colonne ADVANCED_FEATURE_COLS.
+    Se viene passato un engine già "caldo", il calcolo riparte dal suo stato.
+    only (maschera booleana sulle righe): feature solo per queste righe, le altre
+    aggiornano lo stato e restano NaN (replay parziali di enhanced_incremental).
+    """
+    engine = engine if engine is not None else TeamStateEngine()
+    if len(df) == 0:
+        return pd.DataFrame(np.full((0, len(ADVANCED_FEATURE_COLS)), np.nan), index=df.index,
+                            columns=ADVANCED_FEATURE_COLS)
+    out = _compute(pd.to_datetime(df['date']).to_numpy(), df['league'].tolist(), _records(df), engine, only)
+    return pd.DataFrame(out, index=df.index, columns=ADVANCED_FEATURE_COLS)
+
+
+# =========================
+# PARALLELO PER LEGA
+# (lo stato ha sempre la lega nella chiave: ogni lega è un calcolo indipendente)
+# =========================
+class LeagueShards(NamedTuple):
+    """Storico in array compatti da spedire ai processi, più le righe di ogni lega."""
+    dates: np.ndarray        # datetime64[ns]
+    home: np.ndarray         # codici squadra int32 (-1 = mancante)
+    away: np.ndarray
+    values: np.ndarray       # float64 (n, len(INPUT_COLS))
+    teams: np.ndarray        # nomi per codice
+    leagues: List[Any]       # nome della lega di ogni shard (None = lega mancante)
+    rows: List[np.ndarray]   # posizioni di riga di ogni shard, in ordine di file
+
+
+def league_shards(df: pd.DataFrame) -> LeagueShards:
+    """Divide lo storico per lega; shard più grandi per primi (bilanciamento del pool)."""
+    n = len(df)
+    lcodes, lnames = pd.factorize(df['league'])
+    tcodes, teams = pd.factorize(pd.concat([df['home'], df['away']], ignore_index=True))
+    values = np.column_stack([
+        pd.to_numeric(df[c], errors='coerce').to_numpy(dtype=float) if c in df.columns else np.full(n, np.nan)
+        for c in INPUT_COLS
+    ]) if n else np.empty((0, len(INPUT_COLS)))
+    groups = [(lnames[k], np.flatnonzero(lcodes == k)) for k in range(len(lnames))]
+    if (lcodes < 0).any():
+        groups.append((None, np.flatnonzero(lcodes < 0)))
+    groups.sort(key=lambda g: -len(g[1]))
+    return LeagueShards(
+        pd.to_datetime(df['date']).to_numpy(), tcodes[:n].astype(np.int32), tcodes[n:].astype(np.int32),
+        values, np.asarray(teams, dtype=object), [g[0] for g in groups], [g[1] for g in groups],
+    )
+
+
+def _shard_features(dates: np.ndarray, home: np.ndarray, away: np.ndarray, values: np.ndarray,
+                    has_league: bool, with_engine: bool):
+    """Worker: feature di una lega con le squadre come codici (stesso _compute del seriale)."""
+    hs = [None if c < 0 else c for c in home.tolist()]
+    aw = [None if c < 0 else c for c in away.tolist()]
+    records = [MatchRecord(h, a, *vals) for h, a, *vals in zip(hs, aw, *values.T)]
+    engine = TeamStateEngine()
+    out = _compute(dates, [0 if has_league else None] * len(records), records, engine, None)
+    return out, (engine if with_engine else None)
+
+
+def _named_engine(engine: TeamStateEngine, league: Any, teams: np.ndarray, into: TeamStateEngine) -> None:
+    """Riporta lo stato di uno shard (lega 0, squadre per codice) sui nomi veri in `into`."""
+    def name(c):
+        return teams[c] if c is not None else np.nan
+
+    def rec(r: MatchRecord) -> MatchRecord:
+        return r._replace(home=name(r.home), away=name(r.away))
+
+    for (_, team), dq in engine.recent.items():
+        into.recent[(league, teams[team])] = deque((rec(r) for r in dq), maxlen=dq.maxlen)
+    for (_, team), row in engine.table.items():
+        into.table[(league, teams[team])] = row
+    for (_, pair), dq in engine.pairs.items():
+        into.pairs[(league, frozenset(teams[c] for c in pair))] = deque((rec(r) for r in dq), maxlen=dq.maxlen)
+
+
+def merge_shard_state(shards: LeagueShards, k: int, shard_engine: TeamStateEngine,
+                      into: TeamStateEngine) -> None:
+    """Aggiunge a `into` lo stato finale dello shard k (da iter_league_features con with_engine)."""
+    _named_engine(shard_engine, shards.leagues[k], shards.teams, into)
+
+
+def iter_league_features(shards: LeagueShards, jobs: int, skip: Optional[set] = None,
+                         with_engine: bool = False):
+    """
+    Calcola gli shard (tranne quelli in skip) in un ProcessPoolExecutor con `jobs`
+    processi e produce (indice shard, feature, engine) man mano che finiscono;
+    con jobs <= 1 uno dopo l'altro nel processo corrente.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    todo = [k for k in range(len(shards.rows)) if not skip or k not in skip]
+    if not todo:
+        return
+    if jobs <= 1:
+        for k in todo:
+            idx = shards.rows[k]
+            out, engine = _shard_features(shards.dates[idx], shards.home[idx], shards.away[idx],
+                                          shards.values[idx], shards.leagues[k] is not None, with_engine)
+            yield k, out, engine
+        return
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(todo)))) as ex:
+        futures = {}
+        for k in todo:
+            idx = shards.rows[k]
+            futures[ex.submit(_shard_features, shards.dates[idx], shards.home[idx], shards.away[idx],
+                              shards.values[idx], shards.leagues[k] is not None, with_engine)] = k
+        try:
+            for fut in as_completed(futures):
+                out, engine = fut.result()
+                yield futures[fut], out, engine
+        except BaseException:
+            ex.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def compute_advanced_features_parallel(df: pd.DataFrame, jobs: int,
+                                       engine: Optional[TeamStateEngine] = None) -> pd.DataFrame:
+    """
+    Come compute_advanced_features, con una lega per processo (jobs processi).
+    L'output è identico al seriale: ogni lega esegue lo stesso _compute e le righe
+    tornano alle loro posizioni. Un engine passato (vuoto) riceve lo stato finale;
+    con jobs <= 1, una sola lega o un engine già caldo si usa il percorso seriale.
+    """
+    if engine is not None and (engine.recent or engine.table or engine.pairs):
+        return compute_advanced_features(df, engine)
+    shards = league_shards(df)
+    if jobs <= 1 or len(shards.rows) <= 1:
+        return compute_advanced_features(df, engine)
+    out = np.full((len(df), len(ADVANCED_FEATURE_COLS)), np.nan)
+    for k, feats, shard_engine in iter_league_features(shards, jobs, with_engine=engine is not None):
+        out[shards.rows[k]] = feats
+        if shard_engine is not None:
+            merge_shard_state(shards, k, shard_engine, engine)
+    return pd.DataFrame(out, index=df.index, columns=ADVANCED_FEATURE_COLS)
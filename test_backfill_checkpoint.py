@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di backfill_checkpoint: ripresa dalle unità completate, reset con parametri
+diversi, publish atomico; populate_enhanced_features interrotto e ripreso identico
+al calcolo completo (anche con una lega per processo); job ripristinabili in
+pausa nella coda.
+
+Uso: python -m pytest -q test_backfill_checkpoint.py
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import populate_historical_advanced_features as pop
+from backfill_checkpoint import BackfillCheckpoint, staging_dir
+from historical_store import load_dataset, save_dataset
+from job_queue import JobQueue, current_job
+from team_state_engine import ADVANCED_FEATURE_COLS, compute_advanced_features
+from test_team_state_engine import _synthetic_history
+
+
+def test_checkpoint_resumes_and_resets_on_new_params(tmp_path):
+    out = tmp_path / "hist.csv"
+    params = {"from": "2024-07-01", "comps": ["SA", "PL"]}
+    ckpt = BackfillCheckpoint(out, params)
+    ckpt.save_part("SA-2024", pd.DataFrame({"match_id": ["a", "b"]}), payload={"n": 1})
+    ckpt.save_part("PL-2024", None, payload={"n": 2})
+    ckpt.save_part("SA-2025", pd.DataFrame({"match_id": ["c"]}))
+
+    again = BackfillCheckpoint(out, params)
+    assert again.done == ["SA-2024", "PL-2024", "SA-2025"] and again.is_done("PL-2024")
+    assert again.payload() == {"n": 2} and not (staging_dir(out) / "payload-00001.pkl").exists()
+    assert list(again.combined()["match_id"]) == ["a", "b", "c"]
+
+    again.publish(again.combined())
+    assert list(load_dataset(out)["match_id"]) == ["a", "b", "c"]
+    assert not staging_dir(out).exists()
+
+    BackfillCheckpoint(out, params).save_part("SA-2024", None)
+    assert BackfillCheckpoint(out, dict(params, comps=["SA"])).done == []
+    assert BackfillCheckpoint(out, params, restart=True).done == []
+
+
+def test_populate_enhanced_resumes_after_interrupt(tmp_path, monkeypatch):
+    monkeypatch.setenv("BET_METRICS_PATH", str(tmp_path / "metrics.jsonl"))
+    monkeypatch.setattr(pop, "BLOCK_ROWS", 50)
+    inp, out = tmp_path / "hist.csv", tmp_path / "hist_enhanced.csv"
+    save_dataset(_synthetic_history(300), inp)
+
+    calls, fail_at = [], [3]
+
+    class Stop(Exception):
+        pass
+
+    def flaky(df, engine=None, only=None):
+        calls.append(len(df))
+        if len(calls) == fail_at[0]:
+            raise Stop  # crash (o stop del job) a metà del terzo blocco
+        return compute_advanced_features(df, engine, only)
+
+    monkeypatch.setattr(pop, "compute_advanced_features", flaky)
+    with pytest.raises(Stop):
+        pop.populate_enhanced_features(inp, out)
+    assert not out.exists() and (staging_dir(out) / "checkpoint.json").exists()
+    first = sum(calls[:2])
+
+    calls.clear()
+    fail_at[0] = 0
+    pop.populate_enhanced_features(inp, out)  # riprende dal terzo blocco
+    assert sum(calls) == 300 - first and not staging_dir(out).exists()
+
+    base = load_dataset(inp)
+    expected = compute_advanced_features(base).to_numpy(dtype=float)
+    got = load_dataset(out)[ADVANCED_FEATURE_COLS].to_numpy(dtype=float)
+    assert np.array_equal(got, expected, equal_nan=True)
+
+
+def test_populate_enhanced_parallel_output_is_identical(tmp_path, monkeypatch):
+    monkeypatch.setenv("BET_METRICS_PATH", str(tmp_path / "metrics.jsonl"))
+    inp = tmp_path / "hist.csv"
+    save_dataset(_synthetic_history(300), inp)
+    pop.populate_enhanced_features(inp, tmp_path / "serial.csv")
+    pop.populate_enhanced_features(inp, tmp_path / "parallel.csv", jobs=2)
+    assert (tmp_path / "serial.csv").read_bytes() == (tmp_path / "parallel.csv").read_bytes()
+    assert not staging_dir(tmp_path / "parallel.csv").exists()
+
+
+def test_stopped_resumable_job_is_paused_and_requeued(tmp_path):
+    q = JobQueue(tmp_path / "jobs.db", log=lambda m: None)
+    runs = []
+
+    def backfill(tag):
+        runs.append(tag)
+        job = current_job()
+        while len(runs) == 1 and not job.stop_requested():
+            time.sleep(0.01)
+        return len(runs) > 1
+
+    q.register("history", backfill, resumable=True)
+    job_id = q.submit("history", ("2024",))
+    q.start(workers=1)
+    time.sleep(0.1)
+    assert q.cancel(job_id) == "stop_requested"
+    deadline = time.time() + 5
+    while time.time() < deadline and q.list_jobs()["running"]:
+        time.sleep(0.02)
+    assert q.last_finished()["status"] == "paused"
+
+    new_id = q.resume(job_id)
+    assert new_id and new_id != job_id
+    while time.time() < deadline and len(runs) < 2:
+        time.sleep(0.02)
+    assert runs == ["2024", "2024"]
+    assert q.resume(new_id) is None  # completato: niente da riprendere
+    q.shutdown()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di backtester: fold walk-forward senza dati futuri nel training, stake e P&L
+vettoriali uguali al calcolo riga per riga, stessi risultati con fold in parallelo,
+su uno storico sintetico.
+
+Uso: python -m pytest -q test_backtester.py
+"""
+
+import numpy as np
+import pandas as pd
+
+from backtester import MARKETS, make_folds, run_backtest, select_bets
+from model_pipeline import _kelly
+
+CFG = {"staking": {"flat_pct": 0.01, "kelly_fraction": 0.5, "kelly_min_edge": 0.06},
+       "thresholds": {"edge_1x2": 0.03, "edge_totals": 0.03}}
+
+
+def _history(n=600, seed=7):
+    rng = np.random.default_rng(seed)
+    strength = rng.normal(0, 0.6, n)
+    hg = rng.poisson(np.exp(0.3 + strength / 2))
+    ag = rng.poisson(np.exp(0.1 - strength / 2))
+    p_home = 1 / (1 + np.exp(-1.2 * strength))
+    return pd.DataFrame({
+        "match_id": [f"m{i:04d}" for i in range(n)],
+        "date": pd.Timestamp("2023-08-01") + pd.to_timedelta(np.arange(n) // 6, unit="D"),
+        "league": np.where(np.arange(n) % 2, "Serie A", "Premier League"),
+        "home": "H", "away": "A",
+        "ft_home_goals": hg, "ft_away_goals": ag,
+        "xg_for_home": np.exp(0.3 + strength / 2) + rng.normal(0, 0.2, n),
+        "xg_for_away": np.exp(0.1 - strength / 2) + rng.normal(0, 0.2, n),
+        "odds_1": (1 / (0.75 * p_home + 0.05)).round(2),
+        "odds_x": 3.4,
+        "odds_2": (1 / (0.75 * (1 - p_home) + 0.05)).round(2),
+    })
+
+
+def test_folds_are_walk_forward_without_leakage():
+    dates = np.sort(np.array(pd.to_datetime(_history()["date"]), dtype="datetime64[D]"))
+    folds = make_folds(dates, step_days=10, train_days=30, min_train=60)
+    assert len(folds) > 3
+    for tr, te in folds:
+        assert dates[tr].max() < dates[te].min()
+        assert dates[te].min() - dates[tr].min() <= np.timedelta64(30, "D")
+    # le finestre di test sono consecutive e non si sovrappongono
+    assert all(a[1].stop == b[1].start for a, b in zip(folds, folds[1:]))
+    expanding = make_folds(dates, step_days=10, train_days=0, min_train=60)
+    assert all(tr.start == 0 for tr, _te in expanding)
+
+
+def test_stakes_and_pnl_match_row_by_row():
+    df = _history(40)
+    y = np.where(df["ft_home_goals"] > df["ft_away_goals"], 0,
+                 np.where(df["ft_home_goals"] == df["ft_away_goals"], 1, 2))
+    P = np.random.default_rng(1).dirichlet([2, 1, 2], size=len(df))
+    bets = select_bets(df, P, y, MARKETS["1x2"], "config", CFG)
+    assert len(bets) > 0
+    odds = df[["odds_1", "odds_x", "odds_2"]].to_numpy(dtype=float)
+    pos = {m: i for i, m in enumerate(df["match_id"])}
+    for b in bets.itertuples():
+        i = pos[b.match_id]
+        implied = (1 / odds[i]) / (1 / odds[i]).sum()
+        k = int(np.argmax(P[i] - implied))
+        assert b.pick == "1X2"[k] and abs(b.edge - (P[i, k] - implied[k])) < 1e-12
+        stake = 0.01
+        if b.edge >= 0.06:
+            stake = max(stake, _kelly(P[i, k], odds[i, k], cut=0.5))
+        pnl = stake * (odds[i, k] - 1) if y[i] == k else -stake
+        assert abs(b.stake - stake) < 1e-12 and abs(b.pnl - pnl) < 1e-12
+
+
+def test_parallel_folds_match_serial():
+    df = _history()
+    kwargs = dict(cfg=CFG, stake="kelly", step_days=14, train_days=0, min_train=120)
+    serial = run_backtest(df, "1x2", jobs=1, **kwargs)
+    parallel = run_backtest(df, "1x2", jobs=2, **kwargs)
+    assert serial["folds"] > 1
+    pd.testing.assert_frame_equal(serial["summary"], parallel["summary"])
+    summary = serial["summary"].set_index("league")
+    assert summary.loc["ALL", "matches"] == summary.drop("ALL")["matches"].sum()
+    assert abs(summary.loc["ALL", "pnl"] - serial["bets"]["pnl"].sum()) < 1e-3
+    curve = serial["curves"]
+    total = curve[curve["league"] == "ALL"]["cum_pnl"].iloc[-1]
+    assert abs(total - serial["bets"]["pnl"].sum()) < 1e-9
+    # ou25 senza quote nello storico: solo metriche, nessuna puntata
+    ou = run_backtest(df, "ou25", **kwargs)
+    assert ou["bets"].empty and ou["summary"]["brier"].notna().all()
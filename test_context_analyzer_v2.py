@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di ContextAnalyzerV2: squadre per chiave esatta (niente "Inter" dentro
+"Internacional"), stessi risultati tra analyze_match e analyze_matches, storico per
+team_id anche con nomi diversi tra le fonti, su un DB SQLite temporaneo.
+
+Uso: python -m pytest -q test_context_analyzer_v2.py
+"""
+
+import sqlite3
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from context_analyzer_v2 import ContextAnalyzerV2
+from database import Base
+from models import Feature, Fixture
+from team_registry import backfill
+
+TEAMS = ["Inter", "Internacional", "Milan", "Roma", "Lazio", "Napoli"]
+
+
+def _db(tmp_path, with_ids=False):
+    path = tmp_path / "ctx.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    n = 0
+    for week in range(12):
+        day = date(2024, 9, 1) + timedelta(days=7 * week)
+        order = TEAMS[week % 6:] + TEAMS[:week % 6]
+        for j in range(3):
+            n += 1
+            home, away = order[2 * j], order[2 * j + 1]
+            db.add(Fixture(match_id=f"m{n:03d}", date=day, league="Serie A", league_code="SA",
+                           home=home, away=away, result_home_goals=(n * 7) % 4,
+                           result_away_goals=(n * 3) % 3))
+            db.add(Feature(match_id=f"m{n:03d}", xg_for_home=1.0 + j / 10, xg_for_away=0.8,
+                           rest_days_home=3 + j, rest_days_away=6))
+    db.add(Fixture(match_id="next1", date=date(2024, 12, 1), league="Serie A", league_code="SA",
+                   home="Inter", away="Milan"))
+    db.add(Fixture(match_id="next2", date=date(2024, 12, 1), league="Serie A", league_code="SA",
+                   home="Roma", away="Internacional"))
+    db.commit()
+    if with_ids:
+        backfill(db)
+        db.commit()
+    db.close()
+    return str(path)
+
+
+def _analyzer(path):
+    analyzer = ContextAnalyzerV2(path)
+    analyzer.debug = False
+    return analyzer
+
+
+def test_exact_team_keys_and_batch_matches_single(tmp_path):
+    path = _db(tmp_path)
+    day = datetime(2024, 12, 1)
+    todo = [("next1", "Inter", "Milan", "SA", day), ("next2", "Roma", "Internacional", "SA", day)]
+    with _analyzer(path) as analyzer:
+        batch = analyzer.analyze_matches(todo)
+        single = [analyzer.analyze_match(*t) for t in todo]
+        history = analyzer._fetch_history(analyzer.conn, [(("name", "Inter"), day)], 10)[0]
+    assert batch == single
+    # ogni squadra gioca una volta a settimana: 10 partite, nessuna di "Internacional"
+    assert len(history) == 10 and all(m["opponent"] != "Inter" for m in history)
+    assert batch[0]["form_details"]["home_matches"] == 5
+    assert batch[0]["fatigue_details"] == {}  # next1 senza features
+
+
+def test_team_ids_follow_renamed_teams(tmp_path):
+    path = _db(tmp_path, with_ids=True)
+    day = datetime(2024, 12, 1)
+    with _analyzer(path) as analyzer:
+        by_name = analyzer.analyze_match("next1", "Inter", "Milan", "SA", day)
+        # nome di un'altra fonte non presente in fixtures: la partita porta i team_id
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE fixtures SET home = 'FC Internazionale Milano' WHERE match_id = 'next1'")
+        conn.commit()
+        conn.close()
+        by_id = analyzer.analyze_match("next1", "FC Internazionale Milano", "Milan", "SA", day)
+    assert by_id == by_name and by_id["form_details"]["home_matches"] == 5
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di data_browser: la paginazione keyset avanti/indietro copre tutte le righe
+una sola volta nell'ordine della vecchia vista, con filtri e partite senza data,
+su un DB SQLite in memoria.
+
+Uso: python -m pytest -q test_data_browser.py
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from data_browser import DataFilters, fetch_page, parse_filters, summary
+from database import Base
+from models import Feature, Fixture, Odds
+
+
+def _session():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    for i in range(23):
+        league = "SA" if i % 2 else "PL"
+        day = None if i >= 21 else date(2025, 1, 1) + timedelta(days=i // 3)
+        mid = f"{league}-{i:03d}"
+        db.add(Fixture(match_id=mid, date=day, league_code=league, home=f"H{i}", away=f"A{i}"))
+        if i % 3:
+            db.add(Odds(match_id=mid, odds_1=2.0, odds_x=3.1, odds_2=3.5))
+        if i % 4 == 0:
+            db.add(Feature(match_id=mid, xg_for_home=1.4, xg_for_away=1.1))
+    db.commit()
+    return db
+
+
+def _expected(db, league=None):
+    q = db.query(Fixture)
+    if league:
+        q = q.filter(Fixture.league_code == league)
+    return [f.match_id for f in q.order_by(Fixture.date.desc(), Fixture.match_id.desc())]
+
+
+def _walk(db, filters, limit):
+    pages, after = [], None
+    while True:
+        page = fetch_page(db, filters, after=after, limit=limit)
+        pages.append(page)
+        if not page["next"]:
+            return pages
+        after = page["next"]
+
+
+def test_forward_and_backward_pages_cover_all_rows():
+    db = _session()
+    for filters in (DataFilters(), DataFilters(league="SA")):
+        pages = _walk(db, filters, limit=4)
+        ids = [r["match_id"] for p in pages for r in p["rows"]]
+        assert ids == _expected(db, filters.league)
+        assert pages[0]["prev"] is None and all(len(p["rows"]) <= 4 for p in pages)
+
+        # a ritroso dall'ultima pagina si ritrovano le stesse pagine
+        for prev_page, page in zip(reversed(pages[:-1]), reversed(pages[1:])):
+            back = fetch_page(db, filters, before=page["prev"], limit=4)
+            assert back["rows"] == prev_page["rows"]
+
+
+def test_filters_and_summary():
+    db = _session()
+    filters = parse_filters({"date_from": "2025-01-02", "date_to": "2025-01-03", "has_odds": "1"})
+    rows = fetch_page(db, filters, limit=100)["rows"]
+    assert rows and all(r["odds_1"] == 2.0 and r["date"] in ("2025-01-02", "2025-01-03") for r in rows)
+
+    no_xg = fetch_page(db, parse_filters({"has_features": "0"}), limit=100)["rows"]
+    assert all(r["xg_for_home"] is None for r in no_xg)
+    assert summary(db) == {"total": 23, "with_odds": 15, "with_xg": 6}
+    assert summary(db, DataFilters(has_features=False))["total"] == len(no_xg) == 17
+
+
+def test_page_query_uses_index():
+    db = _session()
+    plan = " ".join(str(r) for r in db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT match_id FROM fixtures WHERE league_code='SA' "
+        "AND (date < '2025-01-05' OR (date = '2025-01-05' AND match_id < 'SA-013')) "
+        "ORDER BY date DESC, match_id DESC LIMIT 5"
+    )))
+    assert "ix_fixtures_league_date_match" in plan and "TEMP B-TREE" not in plan
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di enhanced_incremental: giro incrementale (partite in coda e risultati in
+ritardo) identico alla ricostruzione completa, giro a vuoto, ricostruzione quando
+l'output o righe già elaborate cambiano, ricostruzione interrotta ripresa dalle
+leghe nel checkpoint, ricostruzione con una lega per processo identica alla seriale.
+
+Uso: python -m pytest -q test_enhanced_incremental.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import team_state_engine
+from backfill_checkpoint import staging_dir
+from enhanced_incremental import state_path, update_enhanced
+from historical_store import load_dataset, save_dataset
+from team_state_engine import ADVANCED_FEATURE_COLS, compute_advanced_features
+from test_team_state_engine import _synthetic_history
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("BET_METRICS_PATH", str(tmp_path / "metrics.jsonl"))
+    return tmp_path / "hist.csv", tmp_path / "hist_enhanced.csv"
+
+
+def _assert_matches_full(inp, out):
+    base = load_dataset(inp)
+    expected = compute_advanced_features(base).set_axis(base["match_id"])
+    got = load_dataset(out).set_index("match_id")[ADVANCED_FEATURE_COLS].reindex(expected.index)
+    assert np.array_equal(got.to_numpy(dtype=float), expected.to_numpy(dtype=float), equal_nan=True)
+
+
+def test_tail_append_and_late_results_match_full_rebuild(paths):
+    inp, out = paths
+    hist = _synthetic_history(300)
+    dates = pd.to_datetime(hist["date"])
+    last = dates.max()
+
+    save_dataset(hist[dates < last], inp)
+    assert update_enhanced(inp, out)["mode"] == "full"
+    assert state_path(out).exists()
+
+    save_dataset(hist, inp)
+    summary = update_enhanced(inp, out)
+    assert summary["mode"] == "incremental" and summary["new"] == (dates == last).sum()
+    assert summary["recomputed"] == 0
+    _assert_matches_full(inp, out)
+    assert len(pd.read_csv(out)) == len(hist)  # righe aggiunte in coda al CSV
+
+    assert update_enhanced(inp, out)["mode"] == "noop"
+
+    # risultati arrivati in ritardo: righe già elaborate ricalcolate solo dove servono
+    late = hist.index[[40, 150, 220]]
+    save_dataset(hist.drop(late), inp)
+    update_enhanced(inp, out, full_rebuild=True)
+    save_dataset(hist, inp)
+    summary = update_enhanced(inp, out)
+    assert summary["mode"] == "incremental" and summary["new"] == 3
+    assert 0 < summary["recomputed"] < len(hist) - 40
+    _assert_matches_full(inp, out)
+
+
+def test_changed_rows_or_output_force_full_rebuild(paths):
+    inp, out = paths
+    hist = _synthetic_history(120)
+    save_dataset(hist, inp)
+    update_enhanced(inp, out)
+
+    enhanced = load_dataset(out)
+    enhanced.loc[3, "home_form_points"] = 99
+    save_dataset(enhanced, out)
+    assert update_enhanced(inp, out)["mode"] == "full"
+    _assert_matches_full(inp, out)
+
+    hist.loc[10, "ft_home_goals"] = 7
+    save_dataset(hist, inp)
+    assert update_enhanced(inp, out)["mode"] == "full"
+    _assert_matches_full(inp, out)
+
+
+def test_interrupted_full_rebuild_resumes_from_league_checkpoint(paths, monkeypatch):
+    inp, out = paths
+    hist = _synthetic_history(300)
+    dates = pd.to_datetime(hist["date"])
+    head = hist[dates < dates.max()]
+    save_dataset(head, inp)
+    calls, fail_at = [], [2]
+    real = team_state_engine._shard_features
+
+    class Stop(Exception):
+        pass
+
+    def flaky(dates, *args):
+        calls.append(len(dates))
+        if len(calls) == fail_at[0]:
+            raise Stop  # crash (o stop del job) nella seconda lega
+        return real(dates, *args)
+
+    monkeypatch.setattr(team_state_engine, "_shard_features", flaky)
+    with pytest.raises(Stop):
+        update_enhanced(inp, out)
+    assert not out.exists() and not state_path(out).exists()
+    assert (staging_dir(out) / "checkpoint.json").exists()
+    first = calls[0]
+
+    calls.clear()
+    fail_at[0] = 0
+    assert update_enhanced(inp, out)["mode"] == "full"  # riprende dalla seconda lega
+    assert sum(calls) == len(head) - first and not staging_dir(out).exists()
+    _assert_matches_full(inp, out)
+
+    save_dataset(hist, inp)  # lo stato ricomposto dal checkpoint regge il giro incrementale
+    assert update_enhanced(inp, out)["mode"] == "incremental"
+    _assert_matches_full(inp, out)
+
+
+def test_parallel_full_rebuild_is_identical(paths, tmp_path):
+    inp, out = paths
+    save_dataset(_synthetic_history(300), inp)
+    update_enhanced(inp, out)
+    parallel = tmp_path / "parallel.csv"
+    assert update_enhanced(inp, parallel, jobs=2)["mode"] == "full"
+    assert out.read_bytes() == parallel.read_bytes() and not staging_dir(parallel).exists()
+    assert update_enhanced(inp, parallel, jobs=2)["mode"] == "noop"
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di fetch_scheduler: concorrenza e intervallo minimo per host, retry con
+backoff (5xx, 429 con Retry-After, errori di rete; 404 definitivo), richieste in
+coda annullate su Ctrl-C. Una sessione finta sostituisce requests.
+
+Uso: python -m pytest -q test_fetch_scheduler.py
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+import pytest
+import requests
+
+from fetch_scheduler import FetchJob, FetchScheduler, HostLimit
+
+
+class FakeResponse:
+    def __init__(self, status, body=b"", headers=None):
+        self.status_code = status
+        self.content = body
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """get(url) → risposte programmate per URL (l'ultima si ripete); registra tempi e concorrenza."""
+
+    def __init__(self, script=None, latency=0.0):
+        self.script = script or {}
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = []
+        self.active, self.peak = {}, {}
+
+    def get(self, url, params=None, timeout=None):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.calls.append((url, time.monotonic()))
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+            steps = self.script.get(url, [200])
+            n = sum(1 for u, _ in self.calls if u == url)
+            step = steps[min(n, len(steps)) - 1]
+        try:
+            time.sleep(self.latency)
+            if isinstance(step, BaseException):
+                raise step
+            if isinstance(step, tuple):
+                return FakeResponse(step[0], headers=step[1])
+            return FakeResponse(step, body=url.encode())
+        finally:
+            with self.lock:
+                self.active[host] -= 1
+
+
+def _scheduler(session, **kw):
+    sched = FetchScheduler(verbose=False, **kw)
+    sched._session = lambda: session
+    return sched
+
+
+def test_per_host_concurrency_and_min_interval():
+    session = FakeSession(latency=0.03)
+    sched = _scheduler(session, workers=8, backoff=0.001,
+                       host_limits={"slow.test": HostLimit(2, 0.02)}, default_limit=HostLimit(3))
+    jobs = [FetchJob(("slow", i), f"http://slow.test/{i}") for i in range(8)]
+    jobs += [FetchJob(("fast", i), f"http://fast.test/{i}") for i in range(9)]
+    jobs.append(FetchJob(("slow", 0), "http://slow.test/dup"))  # stessa key: deduplicato
+    out = sched.run(jobs)
+
+    assert len(out) == 17 and all(r.ok and r.attempts == 1 for r in out.values())
+    assert out[("slow", 3)].value == b"http://slow.test/3"
+    assert session.peak["slow.test"] == 2 and session.peak["fast.test"] == 3
+    starts = sorted(t for u, t in session.calls if "slow.test" in u)
+    assert min(b - a for a, b in zip(starts, starts[1:])) >= 0.02 - 0.002
+
+
+def test_retries_backoff_and_final_statuses():
+    script = {
+        "http://h.test/flaky": [503, 502, 200],
+        "http://h.test/limited": [(429, {"Retry-After": "0.05"}), 200],
+        "http://h.test/net": [requests.exceptions.ConnectionError("reset"), 200],
+        "http://h.test/missing": [404],
+        "http://h.test/down": [500],
+    }
+    session = FakeSession(script)
+    sched = _scheduler(session, workers=4, retries=2, backoff=0.001)
+    out = sched.run([FetchJob(u.rsplit("/", 1)[1], u, sink=lambda r: r.status_code) for u in script])
+
+    assert (out["flaky"].ok, out["flaky"].attempts, out["flaky"].value) == (True, 3, 200)
+    assert out["limited"].ok and out["net"].ok and out["net"].attempts == 2
+    assert (out["missing"].status, out["missing"].attempts, out["missing"].error) == (404, 1, "HTTP 404")
+    assert (out["down"].ok, out["down"].attempts, out["down"].error) == (False, 3, "HTTP 500")
+    limited = [t for u, t in session.calls if u.endswith("/limited")]
+    assert limited[1] - limited[0] >= 0.05 - 0.005  # Retry-After più lungo del backoff
+
+
+def test_interrupt_cancels_queued_requests():
+    script = {"http://h.test/0": [KeyboardInterrupt()]}
+    session = FakeSession(script, latency=0.01)
+    sched = _scheduler(session, workers=2, default_limit=HostLimit(2))
+    jobs = [FetchJob(i, f"http://h.test/{i}") for i in range(50)]
+    t0 = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        sched.run(jobs)
+    time.sleep(0.1)
+    assert time.monotonic() - t0 < 1.0
+    assert len(session.calls) < 10  # le richieste in coda non partono più
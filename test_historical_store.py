@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di historical_store: round trip CSV ↔ .arrow, filtri e fallback al CSV.
+
+Uso: python -m pytest -q test_historical_store.py
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import historical_store as hs
+
+
+def _frame():
+    return pd.DataFrame({
+        "match_id": ["m1", "m2", "m3", "m4"],
+        "date": ["2024-08-17", "2024-09-01", "2024-10-05", "2025-01-12"],
+        "league": ["Serie A", "Premier League", "Serie A", "Serie A"],
+        "home": ["Genoa", "Arsenal", "Inter", "Roma"],
+        "away": ["Inter", "Chelsea", "Milan", ""],
+        "ft_home_goals": [2, 1, np.nan, 0],
+        "ft_away_goals": [2, 0, 1, 3],
+        "xg_for_home": [1.2, "1.7", None, 0.9],
+        "derby_flag": [0, 0, 1, 0],
+        "target_1x2": [1, 0, 2, 2],
+    })
+
+
+def test_roundtrip_matches_csv(tmp_path):
+    csv = tmp_path / "historical_dataset.csv"
+    hs.save_dataset(_frame(), csv)
+    fast = hs.load_dataset(csv)
+    slow = hs.coerce_schema(pd.read_csv(csv))
+
+    pd.testing.assert_frame_equal(fast, slow, check_dtype=False)
+    assert fast["xg_for_home"].dtype == np.float64 and fast["derby_flag"].dtype == np.float64
+    # target completo resta intero (astype(str) → "1"), gol con buchi diventano float
+    assert fast["target_1x2"].astype(str).tolist() == ["1", "0", "2", "2"]
+    assert np.isnan(fast.loc[2, "ft_home_goals"]) and pd.isna(fast.loc[3, "away"])
+
+
+def test_columns_and_row_filters(tmp_path):
+    csv = tmp_path / "historical_dataset.csv"
+    hs.save_dataset(_frame(), csv)
+    df = hs.load_dataset(csv, columns=["match_id", "xg_for_home", "missing"],
+                         leagues=["Serie A"], date_from="2024-09-01", date_to="2024-12-31")
+    assert list(df.columns) == ["match_id", "xg_for_home"]
+    assert df["match_id"].tolist() == ["m3"]
+
+
+def test_newer_csv_wins_over_stale_arrow(tmp_path):
+    if hs.pa is None:
+        pytest.skip("pyarrow non installato")
+    csv = tmp_path / "historical_dataset.csv"
+    hs.save_dataset(_frame(), csv)
+    edited = _frame().assign(xg_for_home=[9.9, 9.9, 9.9, 9.9])
+    edited.to_csv(csv, index=False)
+    st = hs.arrow_path(csv).stat()
+    os.utime(csv, (st.st_atime, st.st_mtime + 10))
+
+    assert hs.load_dataset(csv)["xg_for_home"].tolist() == [9.9] * 4
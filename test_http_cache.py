@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test del livello HTTP condiviso (http_cache): cache con TTL, rivalidazione
+ETag, modalità replay e quota, con una sessione finta al posto della rete;
+fallback curl (subprocess.run finto) solo dopo i retry, con lo stato vero della
+risposta: un 304 rivalida, un errore non entra in cache.
+
+Uso: python -m pytest -q test_http_cache.py
+"""
+
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import http_cache
+from http_cache import HttpClient, MonthlyQuota, QuotaExceeded, ReplayMiss, cache_key
+
+
+class _FakeResponse:
+    def __init__(self, status_code, payload=None, headers=None, url=""):
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode() if payload is not None else b""
+        self.text = self.content.decode()
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.url = url
+
+
+class _FakeSession:
+    """Risponde con le risposte in coda e registra le richieste ricevute."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.calls.append({"url": url, "headers": dict(headers or {}), "params": dict(params or {})})
+        r = self.responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+def _client(tmp_path, mode="live", *responses):
+    client = HttpClient(cache_dir=tmp_path / "http", mode=mode, curl_fallback=False)
+    fake = _FakeSession(*responses)
+    client.session = lambda: fake
+    return client, fake
+
+
+URL = "https://api.example.org/v4/matches"
+
+
+def test_fresh_hit_skips_network_and_hides_secrets(tmp_path):
+    client, fake = _client(tmp_path, "live", _FakeResponse(200, {"matches": [1, 2]}, {"ETag": '"v1"'}))
+    params = {"date": "2025-01-01", "apiKey": "SEGRETO"}
+
+    r1 = client.get(URL, params=params, endpoint="fd")
+    r2 = client.get(URL, params={"date": "2025-01-01", "apiKey": "ALTRA"}, endpoint="fd")
+
+    assert not r1.from_cache and r2.from_cache
+    assert r2.json() == {"matches": [1, 2]}
+    assert len(fake.calls) == 1
+    stored = "".join(p.read_text(errors="ignore") for p in (tmp_path / "http").rglob("*") if p.is_file())
+    assert "SEGRETO" not in stored
+    assert cache_key(URL, params) == cache_key(URL, {"date": "2025-01-01"})
+
+
+def test_expired_entry_is_revalidated_with_etag(tmp_path):
+    client, fake = _client(
+        tmp_path, "live",
+        _FakeResponse(200, {"v": 1}, {"ETag": '"v1"'}),
+        _FakeResponse(304),
+    )
+    client.get(URL, endpoint="fd", ttl=0)
+    r = client.get(URL, endpoint="fd", ttl=0)
+
+    assert fake.calls[1]["headers"].get("If-None-Match") == '"v1"'
+    assert r.status_code == 200 and r.from_cache and r.json() == {"v": 1}
+
+
+def test_replay_serves_recordings_and_never_hits_network(tmp_path):
+    rec, _ = _client(tmp_path, "record", _FakeResponse(200, {"v": 2}))
+    rec.get(URL, params={"date": "2025-01-02"}, endpoint="fd")
+
+    replay, fake = _client(tmp_path, "replay")
+    assert replay.get(URL, params={"date": "2025-01-02"}, endpoint="fd").json() == {"v": 2}
+    with pytest.raises(ReplayMiss):
+        replay.get(URL, params={"date": "2025-01-03"}, endpoint="fd")
+    assert fake.calls == []
+
+
+def test_quota_only_counts_network_requests(tmp_path):
+    quota = MonthlyQuota("test_api", limit=1, path=tmp_path / "usage.json")
+    client, fake = _client(tmp_path, "live", _FakeResponse(200, {"odds": []}))
+
+    client.get(URL, params={"sport": "a"}, endpoint="toa_odds", quota=quota)
+    client.get(URL, params={"sport": "a"}, endpoint="toa_odds", quota=quota)  # cache
+    assert quota.count() == 1 and len(fake.calls) == 1
+
+    with pytest.raises(QuotaExceeded):
+        client.get(URL, params={"sport": "b"}, endpoint="toa_odds", quota=quota)
+
+
+class _FakeCurl:
+    """subprocess.run finto: scrive header (-D) e corpo (-o) e stampa lo stato (-w) come curl."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)  # (stato, corpo, header)
+        self.cmds = []
+
+    def __call__(self, cmd, capture_output=True):
+        self.cmds.append(cmd)
+        status, body, headers = self.replies.pop(0)
+        head = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        Path(cmd[cmd.index("-D") + 1]).write_text(f"HTTP/1.1 {status} X\r\n{head}\r\n", encoding="latin-1")
+        Path(cmd[cmd.index("-o") + 1]).write_bytes(body)
+        return subprocess.CompletedProcess(cmd, 0, stdout=str(status).encode(), stderr=b"")
+
+
+def _curl_client(tmp_path, monkeypatch, curl, *responses):
+    client, fake = _client(tmp_path, "live", *responses)
+    client.curl_fallback = True
+    monkeypatch.setattr(http_cache.subprocess, "run", curl)
+    monkeypatch.setattr(http_cache.time, "sleep", lambda s: None)
+    return client, fake
+
+
+def test_curl_fallback_uses_real_status_and_never_caches_errors(tmp_path, monkeypatch):
+    down = requests.exceptions.ConnectionError("reset")
+    curl = _FakeCurl(
+        (200, b'{"v": 1}', {"ETag": '"v1"', "Content-Type": "application/json"}),
+        (304, b"", {}),
+        (503, b"<html>errore</html>", {}),
+    )
+    client, fake = _curl_client(tmp_path, monkeypatch, curl, down, down, down, down, down, down)
+
+    r = client.get(URL, endpoint="fd", ttl=0, max_retries=1)
+    assert len(fake.calls) == 2 and len(curl.cmds) == 1  # curl solo dopo i retry
+    assert (r.status_code, r.json(), r.headers["etag"]) == (200, {"v": 1}, '"v1"')
+
+    r = client.get(URL, endpoint="fd", ttl=0, max_retries=0)  # rivalidazione via curl
+    assert 'If-None-Match: "v1"' in curl.cmds[1]
+    assert r.status_code == 200 and r.from_cache and r.json() == {"v": 1}
+
+    r = client.get(URL, endpoint="fd", ttl=0, max_retries=0)  # pagina d'errore: non va in cache
+    assert r.status_code == 503 and not r.from_cache
+    fake.responses[:] = [_FakeResponse(304)]  # la voce buona è ancora lì da rivalidare
+    r = client.get(URL, endpoint="fd", ttl=0, max_retries=0)
+    assert r.from_cache and r.json() == {"v": 1}
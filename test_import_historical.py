@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test dei caricatori bulk dello storico: import_historical (tipi per colonna, team_id
+per coppia distinta, upsert a blocchi idempotente) e append_db_to_history (SELECT
+unica e anti-join sui match_id già presenti), su un DB SQLite in memoria.
+
+Uso: python -m pytest -q test_import_historical.py
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import append_db_to_history
+from database import Base
+from historical_store import load_dataset, save_dataset
+from import_historical import resolve_team_ids, to_db_frame, upsert_history
+from models import Feature, Fixture, HistoricalMatch, Odds, Team
+from team_registry import TeamRegistry
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def test_import_upsert_is_idempotent_with_team_ids():
+    db = sessionmaker(bind=_engine(), autoflush=False)()
+    df = pd.DataFrame({
+        "match_id": [f"m{i}" for i in range(25)],
+        "date": ["2024-09-01"] * 24 + ["bad"],
+        "league": ["Serie A"] * 25,
+        "home": ["Inter", "Roma", "Lazio", "Milan", "Napoli"] * 5,
+        "away": ["Roma", "Lazio", "Milan", "Napoli", "Inter"] * 5,
+        "ft_home_goals": [2.0] * 24 + [np.nan],
+        "odds_1": ["1.9"] * 24 + [""],
+    })
+    frame = to_db_frame(df)
+    resolve_team_ids(TeamRegistry(db), frame)
+    assert upsert_history(db, frame, chunk=10) == 25
+    db.commit()
+
+    frame.loc[0, "ft_home_goals"] = 3
+    assert upsert_history(db, frame, chunk=7) == 25
+    db.commit()
+
+    assert db.query(HistoricalMatch).count() == 25 and db.query(Team).count() == 5
+    m0 = db.get(HistoricalMatch, "m0")
+    assert (m0.date, m0.ft_home_goals, m0.odds_1) == (date(2024, 9, 1), 3, 1.9)
+    assert m0.home_team_id == db.get(HistoricalMatch, "m5").home_team_id != m0.away_team_id
+    last = db.get(HistoricalMatch, "m24")
+    assert last.date is None and last.ft_home_goals is None and last.odds_1 is None
+
+
+def test_append_adds_only_new_finished_matches(tmp_path, monkeypatch):
+    monkeypatch.setenv("BET_METRICS_PATH", str(tmp_path / "metrics.jsonl"))
+    engine = _engine()
+    Session = sessionmaker(bind=engine, autoflush=False)
+    db = Session()
+    for i, (hg, ag) in enumerate([(2, 1), (0, 0), (1, 3), (None, None)]):
+        db.add(Fixture(match_id=f"f{i}", date=date(2024, 10, 1 + i), league="Serie A", home="A", away="B",
+                       result_home_goals=hg, result_away_goals=ag))
+        db.add(Feature(match_id=f"f{i}", xg_for_home=1.1, derby_flag=0))
+    db.add(Odds(match_id="f1", odds_1=2.5, odds_x=3.1, odds_2=2.9))
+    db.commit()
+
+    hist = tmp_path / "historical_dataset.csv"
+    save_dataset(pd.DataFrame({"match_id": ["f0"], "date": ["2024-10-01"], "home": ["A"], "away": ["B"],
+                               "ft_home_goals": [2], "ft_away_goals": [1], "target_1x2": [0]}), hist)
+    monkeypatch.setattr(append_db_to_history, "SessionLocal", Session)
+    monkeypatch.setattr(append_db_to_history, "HISTORICAL_CSV", hist)
+    monkeypatch.setattr(append_db_to_history, "HISTORICAL_1X2_CSV", tmp_path / "historical_1x2.csv")
+
+    append_db_to_history.append_matches()
+    out = load_dataset(hist).set_index("match_id")
+    assert list(out.index) == ["f0", "f1", "f2"]
+    assert list(out["target_1x2"]) == [0, 1, 2] and list(out.columns)[:4] == ["date", "home", "away", "ft_home_goals"]
+
+    append_db_to_history.append_matches()  # niente di nuovo
+    assert len(load_dataset(tmp_path / "historical_1x2.csv")) == 3
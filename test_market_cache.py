@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di market_cache: riuso per versione invariata, invalidazione con bump_dates
+solo per la data toccata, eviction LRU e calcolo unico con thread concorrenti,
+su un DB SQLite in memoria.
+
+Uso: python -m pytest -q test_market_cache.py
+"""
+
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from market_cache import MarketCache, bump_dates, data_version
+
+
+def _factory():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False)
+
+
+def _bump(factory, *days):
+    db = factory()
+    bump_dates(db, days)
+    db.commit()
+    db.close()
+
+
+def test_reuse_and_invalidation_per_date():
+    factory = _factory()
+    cache = MarketCache(maxsize=8, session_factory=factory)
+    calls = []
+
+    def compute(tag):
+        calls.append(tag)
+        return {"tag": tag, "n": len(calls)}
+
+    a = cache.get("proposals", "2025-01-01", lambda: compute("a"))
+    assert cache.get("proposals", "2025-01-01", lambda: compute("a")) is a
+    b = cache.get("proposals", "2025-01-02", lambda: compute("b"))
+    assert calls == ["a", "b"]
+
+    _bump(factory, "2025-01-01", "2025-01-01")  # la stessa data conta una volta per transazione
+    _bump(factory, "2025-01-01")
+    db = factory()
+    assert data_version(db, "2025-01-01") == 2 and data_version(db, "2025-01-02") == 0
+    db.close()
+
+    assert cache.get("proposals", "2025-01-01", lambda: compute("a"))["n"] == 3
+    assert cache.get("proposals", "2025-01-02", lambda: compute("b")) is b
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 3
+
+
+def test_lru_eviction_and_single_flight():
+    factory = _factory()
+    cache = MarketCache(maxsize=2, session_factory=factory)
+    for day in ("2025-01-01", "2025-01-02"):
+        cache.get("v", day, lambda: day)
+    cache.get("v", "2025-01-01", lambda: "x")          # 01 diventa la più recente
+    cache.get("v", "2025-01-03", lambda: "2025-01-03")  # esce 02
+    assert [k["date"] for k in cache.stats()["keys"]] == ["2025-01-01", "2025-01-03"]
+    assert cache.stats()["evictions"] == 1
+
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "payload"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("slow", "2025-02-01", slow)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1] and results == ["payload"] * 4
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di metrics: record degli stadi con differenze dei contatori (query DB contate dal
+listener SQLAlchemy), esito di sys.exit, lettura incrementale del file, testo
+Prometheus e hook Flask delle viste.
+
+Uso: python -m pytest -q test_metrics.py
+"""
+
+import json
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+import metrics
+
+
+@pytest.fixture
+def mpath(tmp_path, monkeypatch):
+    path = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv("BET_METRICS_PATH", str(path))
+    monkeypatch.setattr(metrics, "STAGE_LOG", metrics.StageLog())
+    return path
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_stage_records_counter_deltas_and_status(mpath):
+    engine = create_engine("sqlite://")
+
+    @metrics.instrument("fixtures")
+    def run(n):
+        with engine.connect() as conn:
+            for _ in range(n):
+                conn.execute(text("SELECT 1"))
+        metrics.count("rows", 7)
+        metrics.count("cache_hits", 2)
+        raise SystemExit(0)
+
+    with pytest.raises(SystemExit):
+        run(3)
+    with pytest.raises(SystemExit), metrics.stage("odds", day="2025-01-18"):
+        raise SystemExit(1)
+    with pytest.raises(ValueError), metrics.stage("predict"):
+        raise ValueError("x")
+
+    fx, odds, pred = _records(mpath)
+    assert (fx["name"], fx["status"], fx["rows"], fx["cache_hits"], fx["http_calls"]) == ("fixtures", "ok", 7, 2, 0)
+    assert fx["db_queries"] >= 3 and fx["wall_s"] >= 0
+    assert (odds["status"], odds["labels"], odds["rows"]) == ("error", {"day": "2025-01-18"}, 0)
+    assert pred["status"] == "error"
+
+    slow = metrics.slowest_stages()
+    assert {r["name"] for r in slow} == {"fixtures", "odds", "predict"}
+    assert [r["wall_s"] for r in slow] == sorted((r["wall_s"] for r in slow), reverse=True)
+
+
+def test_stage_log_reads_only_complete_new_lines(mpath):
+    rec = {"kind": "stage", "name": "features", "status": "ok", "wall_s": 2.0, "rows": 10, "ts": 1}
+    line = json.dumps(rec) + "\n"
+    mpath.write_text(line + line[:20])
+    log = metrics.StageLog(mpath).refresh()
+    assert log.runs == {("features", "ok"): 1} and log.offset == len(line)
+
+    mpath.write_text(line * 2 + json.dumps({"kind": "view", "name": "index"}) + "\n")
+    log.refresh()
+    assert log.runs == {("features", "ok"): 2} and log.totals["features"]["rows"] == 20
+
+    mpath.write_text(line)  # troncato: si riparte da capo
+    assert log.refresh().runs == {("features", "ok"): 1}
+
+
+def test_prometheus_text_and_flask_views(mpath):
+    with metrics.stage("train_ou"):
+        metrics.count("rows", 5)
+
+    app = Flask(__name__)
+    metrics.install_flask(app)
+
+    @app.get("/slow")
+    def slow_view():
+        create_engine("sqlite://").connect().execute(text("SELECT 1"))
+        return "ok"
+
+    @app.get("/ping")
+    def ping():
+        return "pong"
+
+    client = app.test_client()
+    assert client.get("/slow").status_code == 200
+    assert client.get("/ping").status_code == 200
+    assert client.get("/missing").status_code == 404
+
+    views = [r for r in _records(mpath) if r["kind"] == "view"]
+    assert [(r["name"], r["status"]) for r in views] == [("slow_view", 200), ("not_found", 404)]
+    assert views[0]["db_queries"] >= 1
+
+    body = metrics.render_prometheus()
+    assert 'bet_stage_runs_total{stage="train_ou",status="ok"} 1' in body
+    assert 'bet_stage_rows_total{stage="train_ou"} 5' in body
+    assert "# TYPE bet_view_duration_seconds histogram" in body
+    assert 'bet_view_duration_seconds_bucket{view="ping",le="+Inf"}' in body
+    assert 'bet_view_requests_total{view="slow_view",method="GET",status="200"}' in body
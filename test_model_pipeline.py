@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di model_pipeline: il percorso batch di predict_and_report produce lo stesso
+DataFrame del vecchio ciclo riga per riga, con feature mancanti o non numeriche,
+quote assenti, modelli assenti (fallback xG/quote) e modelli che falliscono.
+
+Uso: python -m pytest -q test_model_pipeline.py
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+from model_pipeline import _build_predictions_batch, _build_predictions_rowwise
+
+FEATS = ["xg_for_home", "xg_against_home", "xg_for_away", "xg_against_away", "rest_days_home"]
+MISSING_FEAT = "style_ppda_home"  # richiesta dal modello ma assente dal frame → 0
+
+
+def _fixtures(n=40, seed=3):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "match_id": [f"m{i}" for i in range(n)],
+        "date": "2025-11-05",
+        "time_local": "20:45",
+        "league": rng.choice(["SA", "PL"], n),
+        "home": [f"H{i}" for i in range(n)],
+        "away": [f"A{i}" for i in range(n)],
+        "xg_for_home": rng.uniform(0.6, 2.4, n),
+        "xg_against_home": rng.uniform(0.6, 2.0, n),
+        "xg_for_away": rng.uniform(0.5, 2.2, n),
+        "xg_against_away": rng.uniform(0.6, 2.0, n),
+        "rest_days_home": rng.integers(2, 9, n).astype(object),
+        "odds_1": rng.uniform(1.4, 5.0, n),
+        "odds_x": rng.uniform(2.8, 4.2, n),
+        "odds_2": rng.uniform(1.6, 7.0, n),
+        "odds_ou25_over": rng.uniform(1.5, 2.6, n),
+        "odds_ou25_under": rng.uniform(1.4, 2.6, n),
+    })
+    df.loc[[1, 7, 12], "xg_for_home"] = np.nan  # feature mancanti (imputer / fallback su quote)
+    df.loc[[4, 9], "rest_days_home"] = "n/d"     # non numerica → NaN
+    df.loc[[2, 7], ["odds_1", "odds_x", "odds_2"]] = np.nan
+    df.loc[[3, 12], ["odds_ou25_over", "odds_ou25_under"]] = np.nan
+    df.loc[5, "odds_ou25_under"] = np.nan
+    return df
+
+
+def _model(classes, imputer=True, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(120, len(FEATS) + 1))
+    y = np.array([classes[i % len(classes)] for i in range(len(X))])
+    imp = SimpleImputer(strategy="median").fit(X) if imputer else None
+    scaler = StandardScaler().fit(X)
+    return imp, scaler, LogisticRegression(max_iter=500).fit(X, y)
+
+
+NONE = (None, None, None)
+CASES = {
+    "modelli": (_model([0, 1, 2]), _model([0, 1], seed=1)),
+    "fallback": (NONE, NONE),
+    "1x2_binario": (_model([0, 1]), _model([0, 1], seed=1)),   # non multinomiale → fallback per riga
+    "senza_imputer": (_model([0, 1, 2], imputer=False), _model([0, 1], imputer=False, seed=1)),  # NaN → errore
+}
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_batch_matches_rowwise(case):
+    x2_model, ou_model = CASES[case]
+    df = _fixtures()
+    feats = FEATS + [MISSING_FEAT]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        rowwise = _build_predictions_rowwise(df, x2_model, feats, ou_model, feats)
+        batch = _build_predictions_batch(df, x2_model, feats, ou_model, feats)
+    assert len(batch) == len(df)
+    pd.testing.assert_frame_equal(batch, rowwise)
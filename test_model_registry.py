@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di model_registry: un caricamento per processo, ricarica a caldo,
+priorità optimized → retrained → base e ordine canonico delle classi 1X2.
+
+Uso: python -m pytest -q test_model_registry.py
+"""
+
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+
+from model_registry import ModelRegistry, add_retrained_features, variant_paths
+
+
+def _fit(labels):
+    X = np.array([[0.0], [1.0], [2.0], [3.0], [4.0], [5.0]])
+    y = np.array([labels[i % len(labels)] for i in range(len(X))])
+    return LogisticRegression().fit(X, y)
+
+
+def _write(tmp_path, market, variant, labels, features=("xg_for_home",)):
+    paths = variant_paths(market, variant, tmp_path)
+    joblib.dump(_fit(labels), paths.model)
+    paths.meta.write_text(json.dumps({"features": list(features)}), encoding="utf-8")
+    return paths
+
+
+def test_loads_once_and_reloads_on_change(tmp_path):
+    paths = _write(tmp_path, "ou", "base", [0, 1])
+    reg = ModelRegistry(tmp_path)
+
+    first = reg.get("ou")
+    assert reg.get("ou") is first and reg.loads == 1
+    assert first.version.startswith("base:")
+
+    joblib.dump(_fit([1, 0, 0]), paths.model)
+    st = paths.model.stat()
+    os.utime(paths.model, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    second = reg.get("ou")
+    assert second is not first and reg.loads == 2
+
+
+def test_higher_priority_variant_wins_when_it_appears(tmp_path):
+    _write(tmp_path, "1x2", "base", [0, 1, 2])
+    reg = ModelRegistry(tmp_path)
+    assert reg.get("1x2").variant == "base"
+
+    _write(tmp_path, "1x2", "retrained", [1, 0, 2])
+    assert reg.get("1x2").variant == "retrained"
+    _write(tmp_path, "1x2", "optimized", [0, 1, 2])
+    assert reg.get("1x2").variant == "optimized"
+    assert reg.get("ou") is None
+
+
+def test_retrained_1x2_is_served_in_canonical_order(tmp_path):
+    _write(tmp_path, "1x2", "retrained", [1, 0, 2], features=("xg_for_home", "xg_total"))
+    art = ModelRegistry(tmp_path).get("1x2")
+    X = np.array([[0.5], [4.5]])
+
+    raw = art.model.predict_proba(X)            # classi [0=pari, 1=casa, 2=ospite]
+    canon = art.clf.predict_proba(X)            # [1, X, 2]
+    np.testing.assert_allclose(canon, raw[:, [1, 0, 2]])
+
+    df = art.prepare(pd.DataFrame({"xg_for_home": [1.0], "xg_for_away": [None]}))
+    assert df["xg_total"].tolist() == [2.4]
+    feats = art.prepare_features({"xg_for_home": 2.0, "xg_for_away": 1.0, "xg_total": 9.0})
+    assert feats["xg_total"] == 9.0 and feats["xg_diff"] == 1.0
+    assert add_retrained_features(pd.DataFrame({"x": [1]}))["ppda_diff"].tolist() == [0.0]
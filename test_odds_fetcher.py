@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di odds_fetcher: EventIndex (match esatto e fuzzy) contro la vecchia
+scansione lineare degli eventi, upsert delle quote in un'unica transazione,
+verso casa/trasferta degli eventi trovati per team_id (dagli id risolti, non
+dalla somiglianza dei nomi), su un DB SQLite in memoria.
+
+Uso: python -m pytest -q test_odds_fetcher.py
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+from rapidfuzz import fuzz
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import odds_fetcher
+from database import Base
+from models import Fixture, Odds
+from market_cache import data_version
+from odds_fetcher import FUZZY_THRESHOLD, EventIndex, norm, upsert_odds
+from team_registry import SRC_FD, SRC_TOA, TeamRegistry, best_pair
+
+DAY = date(2025, 11, 23)
+
+
+def _session_factory():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False)
+
+
+def _event(home, away, prices, day=DAY):
+    """Evento TheOddsAPI con un bookmaker: prices = (casa, pareggio, trasferta)."""
+    p1, px, p2 = prices
+    return {
+        "home_team": home, "away_team": away, "commence_time": f"{day:%Y-%m-%d}T19:45:00Z",
+        "bookmakers": [{"key": "bk", "markets": [{"key": "h2h", "outcomes": [
+            {"name": home, "price": p1}, {"name": "Draw", "price": px}, {"name": away, "price": p2},
+        ]}]}],
+    }
+
+
+TEAMS = ["FC Internazionale Milano", "AC Milan", "Juventus FC", "SSC Napoli", "AS Roma",
+         "SS Lazio", "Atalanta BC", "ACF Fiorentina", "Torino FC", "Bologna FC 1909",
+         "Genoa CFC", "Udinese Calcio", "Hellas Verona FC", "Cagliari Calcio"]
+TOA_NAMES = ["Inter Milan", "AC Milan", "Juventus", "Napoli", "AS Roma", "Lazio", "Atalanta BC",
+             "Fiorentina", "Torino", "Bologna", "Genoa", "Udinese", "Hellas Verona", "Cagliari"]
+
+
+def _linear_exact(events, h, a):
+    for ev in events:
+        eh, ea = norm(ev.get("home_team", "")), norm(ev.get("away_team", ""))
+        if (h == eh and a == ea) or (h == ea and a == eh):
+            return ev
+    return None
+
+
+def _linear_fuzzy(events, h, a):
+    best_match, best_score = None, 0
+    for ev in events:
+        eh, ea = norm(ev.get("home_team", "")), norm(ev.get("away_team", ""))
+        score = max((fuzz.ratio(h, eh) + fuzz.ratio(a, ea)) / 2, (fuzz.ratio(h, ea) + fuzz.ratio(a, eh)) / 2)
+        if score > best_score and score >= FUZZY_THRESHOLD:
+            best_match, best_score = ev, score
+    return best_match, (float(best_score) if best_match else 0.0)
+
+
+def test_event_index_matches_linear_scan():
+    rng = np.random.default_rng(7)
+    events = []
+    for k in range(60):
+        i, j = rng.choice(len(TEAMS), 2, replace=False)
+        names = TEAMS if rng.random() < 0.3 else TOA_NAMES  # a volte i nomi coincidono già
+        day = DAY + timedelta(days=int(rng.integers(-1, 2)))
+        events.append(_event(names[i], names[j], (2.0, 3.2, 3.5), day))
+    events.append(dict(events[3], bookmakers=[]))  # duplicato: vince il primo
+    index = EventIndex(events)
+
+    for i in range(len(TEAMS)):
+        for j in range(len(TEAMS)):
+            if i == j:
+                continue
+            h, a = norm(TEAMS[i]), norm(TEAMS[j])
+            assert index.exact(h, a) is _linear_exact(events, h, a)
+            found, score = index.fuzzy(h, a, DAY)
+            ref, ref_score = _linear_fuzzy(events, h, a)
+            assert found is ref and abs(score - ref_score) < 1e-9, (TEAMS[i], TEAMS[j])
+
+    # Fuzzy solo tra gli eventi entro ±1 giorno dalla partita
+    far = [_event("Juventus", "Napoli", (2.0, 3.2, 3.5), DAY + timedelta(days=3))]
+    assert EventIndex(far).fuzzy(norm(TEAMS[2]), norm(TEAMS[3]), DAY) == (None, 0.0)
+    assert EventIndex(far).fuzzy(norm(TEAMS[2]), norm(TEAMS[3]), DAY + timedelta(days=2))[0] is far[0]
+
+
+def test_upsert_single_transaction(monkeypatch):
+    factory = _session_factory()
+    monkeypatch.setattr(odds_fetcher, "SessionLocal", factory)
+    db = factory()
+    fixtures = [Fixture(match_id=f"m{k}", date=DAY + timedelta(days=k % 2), league="Serie A", league_code="SA",
+                        home=TEAMS[2 * k + 2], away=TEAMS[2 * k + 3]) for k in range(4)]
+    db.add_all(fixtures)
+    db.add(Odds(match_id="m0", odds_1=9.0, odds_x=9.0, odds_2=9.0, line_ou="2.5"))
+    db.commit()
+
+    commits = []
+    event.listen(db.get_bind(), "commit", lambda conn: commits.append(1))
+    events = [_event(TOA_NAMES[2 * k + 2], TOA_NAMES[2 * k + 3], (1.9 + k, 3.3, 4.1)) for k in range(3)]
+    odds_fetcher.process_and_store_odds(events, fixtures, [], 1.0, verbose=False)
+
+    assert len(commits) == 1  # quote (3 partite) e versioni delle date in un solo commit
+    got = {o.match_id: (o.odds_1, o.odds_x, o.odds_2) for o in db.query(Odds)}
+    assert got == {"m0": (1.9, 3.3, 4.1), "m1": (2.9, 3.3, 4.1), "m2": (3.9, 3.3, 4.1)}
+    assert data_version(db, DAY) == 1 and data_version(db, DAY + timedelta(days=1)) == 1
+
+    # Stessa partita due volte nello stesso batch: vale l'ultima riga
+    rows = [{"match_id": "m3", "odds_1": p, "odds_x": 3.0, "odds_2": 3.0, "odds_ou25_over": None,
+             "odds_ou25_under": None, "line_ou": "2.5"} for p in (2.0, 2.5)]
+    assert upsert_odds(db, list({r["match_id"]: r for r in rows}.values())) == 1
+    assert db.get(Odds, "m3").odds_1 == 2.5 and len(commits) == 2
+    db.close()
+
+
+def test_team_id_match_oriented_by_ids(monkeypatch):
+    factory = _session_factory()
+    monkeypatch.setattr(odds_fetcher, "SessionLocal", factory)
+    db = factory()
+    reg = TeamRegistry(db)
+    milan = reg.resolve("AC Milan", SRC_FD, league="SA")
+    inter = reg.resolve("FC Internazionale Milano", SRC_FD, league="SA")
+    reg.learn_pair("Milan", "Inter Milan", SRC_TOA, milan, inter)
+    fx = Fixture(match_id="m1", date=DAY, league="Serie A", league_code="SA",
+                 home="AC Milan", away="FC Internazionale Milano",
+                 home_team_id=milan, away_team_id=inter)
+    db.add(fx)
+    db.commit()
+
+    # I nomi ingannano il fuzzy: "Inter Milan" somiglia a "AC Milan" più di "Milan"
+    assert best_pair(fx.home, fx.away, [("Milan", "Inter Milan")], threshold=0)[2]
+
+    odds_fetcher.process_and_store_odds(
+        [_event("Milan", "Inter Milan", (2.4, 3.3, 2.9))], [fx], [], 1.0, verbose=False)
+    row = db.query(Odds).filter(Odds.match_id == "m1").one()
+    assert (row.odds_1, row.odds_x, row.odds_2) == (2.4, 3.3, 2.9)
+    db.close()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di pipeline_dag: parallelismo degli stadi indipendenti, salto con input
+invariati, blocco dei dipendenti dopo un fallimento. Runner e impronte finti.
+
+Uso: python -m pytest -q test_pipeline_dag.py
+"""
+
+import threading
+import time
+
+from pipeline_dag import PipelineRun, Stage, last_run
+
+
+class _Runner:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, cmd):
+        with self.lock:
+            self.calls.append(cmd)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return cmd not in self.fail
+
+
+def _stages(out):
+    return [
+        Stage("fixtures", "fixtures"),
+        Stage("odds", "odds", deps=["fixtures"], inputs=["fixtures"], required=False),
+        Stage("features", "features", deps=["fixtures"], inputs=["fixtures"]),
+        Stage("predict", "predict", deps=["odds", "features"], inputs=["fixtures", "odds", "features"],
+              outputs=[out]),
+    ]
+
+
+def _run(tmp_path, runner, hashes, out):
+    def predict_runner(cmd):
+        ok = runner(cmd)
+        if ok and cmd == "predict":
+            out.write_text("preds")
+        return ok
+
+    return PipelineRun(_stages(out), "2025-01-01", "SA", runner=predict_runner,
+                       state_path=tmp_path / "state.json", hasher=lambda n, d, c: hashes[n],
+                       log=lambda msg: None).run()
+
+
+def test_independent_stages_run_concurrently_and_unchanged_are_skipped(tmp_path):
+    out = tmp_path / "predictions.csv"
+    hashes = {"fixtures": "f1", "odds": "o1", "features": "x1"}
+    runner = _Runner()
+    assert _run(tmp_path, runner, hashes, out)
+    assert runner.calls[0] == "fixtures" and runner.calls[-1] == "predict"
+    assert runner.max_active == 2  # odds ∥ features
+
+    runner = _Runner()
+    assert _run(tmp_path, runner, hashes, out)
+    assert runner.calls == ["fixtures"]
+    stages = {s["name"]: s for s in last_run(tmp_path / "state.json")["stages"]}
+    assert stages["predict"]["status"] == "skipped" and stages["fixtures"]["duration"] >= 0.05
+
+    hashes["odds"] = "o2"
+    runner = _Runner()
+    assert _run(tmp_path, runner, hashes, out)
+    assert runner.calls == ["fixtures", "predict"]
+
+
+def test_failed_required_stage_blocks_dependents_and_clears_outputs(tmp_path):
+    out = tmp_path / "predictions.csv"
+    out.write_text("vecchie previsioni")
+    runner = _Runner(fail={"features"})
+    assert not _run(tmp_path, runner, {"fixtures": "f", "odds": "o", "features": "x"}, out)
+    assert "predict" not in runner.calls and not out.exists()
+    status = {s["name"]: s["status"] for s in last_run(tmp_path / "state.json")["stages"]}
+    assert status == {"fixtures": "ok", "odds": "ok", "features": "failed", "predict": "blocked"}
+
+    # odds è opzionale: se fallisce predict gira comunque
+    runner = _Runner(fail={"odds"})
+    assert _run(tmp_path, runner, {"fixtures": "f", "odds": "o", "features": "x"}, out)
+    assert "predict" in runner.calls
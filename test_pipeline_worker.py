@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di pipeline_worker: ping, esecuzione con righe di output ed exit code,
+ambiente del chiamante (anche per i moduli precaricati), stop con l'exit code
+del figlio, niente zombie col worker inattivo, fallback senza socket. Il server
+gira in un processo a parte con ROOT su una cartella temporanea e script finti.
+
+Uso: python -m pytest -q test_pipeline_worker.py
+"""
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import pipeline_worker as pw
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="il worker residente richiede fork")
+
+SCRIPTS = {
+    "cfgmod.py": 'import os\nURL = os.getenv("BET_DATABASE_URL", "default")\n',
+    "echo.py": (
+        "import sys\nimport cfgmod\n"
+        "print('args', *sys.argv[1:])\nprint('url', cfgmod.URL)\nsys.exit(3)\n"
+    ),
+    "pausable.py": (
+        "import signal, sys, time\n"
+        "def stop(signum, frame):\n    raise KeyboardInterrupt\n"
+        "signal.signal(signal.SIGTERM, stop)\n"
+        "print('ready', flush=True)\n"
+        "try:\n    time.sleep(30)\nexcept KeyboardInterrupt:\n    sys.exit(75)\n"
+    ),
+}
+
+
+@pytest.fixture
+def worker(tmp_path):
+    for name, src in SCRIPTS.items():
+        (tmp_path / name).write_text(src, encoding="utf-8")
+    sock, key = tmp_path / "w.sock", tmp_path / "w.key"
+    boot = (
+        "import sys; from pathlib import Path; import pipeline_worker as pw; "
+        f"root = Path({str(tmp_path)!r}); sys.path.insert(0, str(root)); "
+        "pw.ROOT = root; pw.PRELOAD = ['cfgmod']; "
+        f"pw.serve(Path({str(sock)!r}), Path({str(key)!r}))"
+    )
+    proc = subprocess.Popen([sys.executable, "-c", boot], cwd=str(Path(pw.__file__).parent),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline and pw.ping(sock, key) is None:
+        time.sleep(0.05)
+    try:
+        yield proc, {"socket_path": sock, "key_path": key}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def _zombies(ppid):
+    out = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if fields[0] == "Z" and int(fields[1]) == ppid:
+            out.append(stat.parent.name)
+    return out
+
+
+def test_ping_run_exit_code_and_caller_env(worker):
+    proc, paths = worker
+    info = pw.ping(**paths)
+    assert info["pong"] == proc.pid and info["preloaded"] == ["cfgmod"]
+
+    lines = []
+    env = dict(os.environ, BET_DATABASE_URL="sqlite:///job.db")
+    rc = pw.run_command(["echo.py", "a", "b"], on_line=lines.append, env=env, **paths)
+    assert rc == 3 and lines == ["args a b", "url sqlite:///job.db"]
+
+    lines.clear()
+    env.pop("BET_DATABASE_URL")
+    assert pw.run_command(["echo.py"], on_line=lines.append, env=env, **paths) == 3
+    assert lines[-1] == "url default"
+
+    if Path("/proc").is_dir():  # figli raccolti senza nuove connessioni
+        deadline = time.time() + 5
+        while time.time() < deadline and _zombies(proc.pid):
+            time.sleep(0.05)
+        assert _zombies(proc.pid) == []
+
+
+def test_stop_returns_child_exit_code(worker):
+    _, paths = worker
+    lines = []
+    rc = pw.run_command(["pausable.py"], on_line=lines.append,
+                        should_stop=lambda: "ready" in lines, **paths)
+    assert rc == 75  # in pausa (come il subprocess), non ucciso
+    assert lines[0] == "ready"
+
+
+def test_missing_socket_falls_back(tmp_path):
+    assert pw.ping(tmp_path / "none.sock", tmp_path / "none.key") is None
+    assert pw.run_command(["echo.py"], socket_path=tmp_path / "none.sock", key_path=tmp_path / "none.key") is None
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di parità: poisson_kernel (tensore N×G×G) vs cicli annidati originali,
+più la convenzione λ <= 0 (massa tutta su 0 gol) e il clamp dei chiamanti.
+
+Uso: python -m pytest -q test_poisson_kernel.py   (oppure python test_poisson_kernel.py)
+"""
+
+import numpy as np
+
+from poisson_kernel import _loop_markets, compute_markets, exact_scores, pmf_table, score_tensor
+
+
+def test_markets_match_loops():
+    rng = np.random.default_rng(3)
+    lam_h = rng.uniform(0.15, 3.5, 200)
+    lam_a = rng.uniform(0.15, 3.5, 200)
+    fast = compute_markets(lam_h, lam_a)
+    for i in range(len(lam_h)):
+        ref = _loop_markets(float(lam_h[i]), float(lam_a[i]))
+        for k, v in ref.items():
+            assert abs(fast[k][i] - v) < 1e-12, k
+
+
+def test_exact_scores_tie_order():
+    # λ uguali: 1-0 e 0-1 hanno la stessa probabilità, vince l'ordine dei cicli (h poi a)
+    top = exact_scores(score_tensor(1.0, 1.0, 6), top_n=3)[0]
+    assert [s for s, _ in top] == ["0-0", "0-1", "1-0"]
+
+
+def test_nonpositive_lambda_point_mass_at_zero():
+    pmf = pmf_table([0.0, -0.5], max_goals=4)
+    assert np.array_equal(pmf, [[1, 0, 0, 0, 0], [1, 0, 0, 0, 0]])
+    # casa a 0 gol: niente 1, pareggio = P(trasferta = 0) normalizzata sulla griglia
+    mk = compute_markets([0.0], [1.2])
+    away = pmf_table(1.2)[0]
+    assert mk['p1'][0] == 0.0 and mk['gg'][0] == 0.0
+    assert abs(mk['px'][0] - away[0] / away.sum()) < 1e-12
+
+
+def test_callers_clamp_lambda():
+    # i vecchi _poisson_prob davano massa 0 per λ <= 0: i chiamanti non ci arrivano mai
+    from predictions_generator import _blend_totals, _intuition_adjust
+
+    assert _intuition_adjust(-1.0, 0.0, "low", None, None, None, 0.0) == (0.15, 0.15)
+    assert min(_blend_totals(0.0, 0.0, 2.5, "low")) > 0
+    assert min(_blend_totals(1e-6, 0.0, 2.5, "high")) >= 0.15
+
+
+if __name__ == "__main__":
+    test_markets_match_loops()
+    test_exact_scores_tie_order()
+    test_nonpositive_lambda_point_mass_at_zero()
+    test_callers_clamp_lambda()
+    print("OK")
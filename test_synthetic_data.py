@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di synthetic_data e bench_suite: dati riproducibili e riusati a parità di
+parametri, pagine Understat leggibili dal parser, eventi quote abbinabili alle
+partite del giorno, e un giro ridotto della suite in un processo separato.
+
+Uso: python -m pytest -q test_synthetic_data.py
+"""
+
+import json
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+from odds_fetcher import EventIndex, norm
+from synthetic_data import generate
+from understat_cache import parse_team_page
+
+ROOT = Path(__file__).resolve().parent
+
+
+def test_generate_is_reproducible_and_reused(tmp_path):
+    syn = generate(tmp_path / "a", n_matches=400, n_fixtures=12, seed=3)
+    conn = sqlite3.connect(syn.db_path)
+    played, upcoming = conn.execute(
+        "SELECT SUM(result_home_goals IS NOT NULL), SUM(result_home_goals IS NULL) FROM fixtures").fetchone()
+    n_odds, n_hist, n_alias = (conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                               for t in ("odds", "historical_matches", "team_aliases"))
+    day_rows = conn.execute("SELECT home, away FROM fixtures WHERE date = ?", (syn.day.isoformat(),)).fetchall()
+    conn.close()
+    assert (played, upcoming, n_odds, n_hist) == (400, 12, 412, 400) and n_alias == 100
+
+    other = generate(tmp_path / "b", n_matches=400, n_fixtures=12, seed=3)
+    assert syn.history_csv.read_text() == other.history_csv.read_text()
+    assert syn.events() == other.events() and len(syn.events()) == 24
+
+    # stessi parametri: nessuna rigenerazione
+    mtime = syn.db_path.stat().st_mtime_ns
+    assert generate(tmp_path / "a", n_matches=400, n_fixtures=12, seed=3).db_path.stat().st_mtime_ns == mtime
+
+    page = sorted(syn.understat_dir.glob("*.html"))[0]
+    assert len(parse_team_page(page.read_text())) > 0
+
+    # ogni partita del giorno ha il suo evento, esatto o sopra la soglia fuzzy
+    index = EventIndex(syn.events())
+    for home, away in day_rows:
+        h, a = norm(home), norm(away)
+        assert index.exact(h, a) or index.fuzzy(h, a, syn.day)[0]
+
+
+def test_bench_suite_runs_offline(tmp_path):
+    out = tmp_path / "res.json"
+    cmd = [sys.executable, str(ROOT / "bench_suite.py"), "--matches", "300", "--fixtures", "10",
+           "--repeat", "1", "--stages", "markets_batch,odds_cold,odds_warm",
+           "--workdir", str(tmp_path / "syn"), "--out", str(out)]
+    proc = subprocess.run(cmd, cwd=tmp_path, capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    result = json.loads(out.read_text())
+    assert result["scale"]["matches"] == 300
+    for stage in ("markets_batch", "odds_cold", "odds_warm"):
+        assert result["stages"][stage]["median_s"] > 0
+    assert result["stages"]["odds_cold"]["size"] == "10x20"
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di parità: feature avanzate lette da team_form/head_to_head
+(calculate_features_for_date) vs calcolo per partita
+(calculate_all_advanced_features), su un DB SQLite in memoria.
+
+Uso: python -m pytest -q test_team_form_store.py   (oppure python test_team_form_store.py)
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from advanced_features import AdvancedFeatureCalculator
+from database import Base
+from models import Feature, Fixture
+from models_extended import HeadToHead, TeamForm
+from team_form_store import materialize
+
+
+def _session():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False)()
+
+
+def _fill(db, seed=3, n_rounds=30):
+    """Due leghe, un turno ogni 4 giorni a cavallo del 1 agosto; ogni squadra gioca una volta per giornata."""
+    rng = np.random.default_rng(seed)
+    leagues = {"Serie A": [f"SA{i}" for i in range(6)], "Premier League": [f"PL{i}" for i in range(4)]}
+    day = date(2024, 5, 1)
+    fixtures = []
+    for rnd in range(n_rounds):
+        day += timedelta(days=4)
+        for league, teams in leagues.items():
+            order = rng.permutation(teams)
+            for k in range(0, len(order), 2):
+                home, away = order[k], order[k + 1]
+                mid = f"{day:%Y%m%d}_{home}_{away}"
+                fixtures.append(Fixture(
+                    match_id=mid, date=day, league=league, league_code=league[:2].upper(),
+                    home=home, away=away,
+                    result_home_goals=int(rng.poisson(1.4)), result_away_goals=int(rng.poisson(1.1)),
+                ))
+                if rng.random() < 0.85:
+                    xh = 0.0 if rng.random() < 0.05 else round(float(rng.gamma(3, 0.5)), 2)
+                    db.add(Feature(match_id=mid, xg_for_home=xh, xg_for_away=round(float(rng.gamma(3, 0.4)), 2)))
+    db.add_all(fixtures)
+    db.commit()
+    return fixtures
+
+
+def _assert_day_parity(db, calc, day):
+    fixtures = db.query(Fixture).filter(Fixture.date == day).order_by(Fixture.match_id).all()
+    np.random.seed(11)
+    legacy = {
+        f.match_id: calc.calculate_all_advanced_features(f.match_id, f.home, f.away, f.league, f.date)
+        for f in fixtures
+    }
+    np.random.seed(11)
+    bulk = calc.calculate_features_for_date(day, fixtures)
+    assert bulk.keys() == legacy.keys()
+    for mid in legacy:
+        assert bulk[mid].keys() == legacy[mid].keys()
+        for key, val in legacy[mid].items():
+            assert bulk[mid][key] == val, (day, mid, key, bulk[mid][key], val)
+
+
+def test_bulk_matches_per_fixture():
+    db = _session()
+    fixtures = _fill(db)
+    materialize(db, verbose=False)
+    calc = AdvancedFeatureCalculator(db)
+    for day in sorted({f.date for f in fixtures}):
+        _assert_day_parity(db, calc, day)
+    db.close()
+
+
+def _snapshot_rows(db):
+    skip = {"id", "last_updated"}
+    tf = [tuple(getattr(r, c.name) for c in TeamForm.__table__.columns if c.name not in skip)
+          for r in db.query(TeamForm).all()]
+    h2h = [tuple(getattr(r, c.name) for c in HeadToHead.__table__.columns if c.name not in skip)
+           for r in db.query(HeadToHead).all()]
+    return sorted(tf, key=repr), sorted(h2h, key=repr)
+
+
+def test_incremental_equals_rebuild():
+    db = _session()
+    fixtures = _fill(db)
+    cut = fixtures[len(fixtures) // 2].date
+    saved = {}
+    for f in fixtures:
+        # seconda metà senza risultato, più un risultato "in ritardo" nella prima metà
+        if f.date >= cut or f is fixtures[5]:
+            saved[f.match_id] = (f.result_home_goals, f.result_away_goals)
+            f.result_home_goals = f.result_away_goals = None
+    db.commit()
+    materialize(db, verbose=False)
+
+    for f in fixtures:
+        if f.match_id in saved:
+            f.result_home_goals, f.result_away_goals = saved[f.match_id]
+    db.commit()
+    written = materialize(db, verbose=False)
+    assert written[0] > 0
+    assert materialize(db, verbose=False) == (0, 0)
+    incremental = _snapshot_rows(db)
+
+    materialize(db, rebuild=True, verbose=False)
+    assert _snapshot_rows(db) == incremental
+    db.close()
+
+
+def test_incremental_picks_up_changed_matches():
+    """Features/xG arrivate dopo, punteggio corretto e partita rimossa: niente --rebuild."""
+    db = _session()
+    fixtures = _fill(db)
+    late = [f for f in fixtures if db.get(Feature, f.match_id) is None][:3]
+    materialize(db, verbose=False)
+    before = _snapshot_rows(db)
+
+    for f in late:
+        db.add(Feature(match_id=f.match_id, xg_for_home=2.1, xg_for_away=0.4))
+    fixtures[10].result_home_goals += 3
+    db.delete(fixtures[20])
+    db.commit()
+    written = materialize(db, verbose=False)
+    assert written[0] > 0 and written[1] > 0
+    assert materialize(db, verbose=False) == (0, 0)
+    incremental = _snapshot_rows(db)
+    assert incremental != before
+
+    materialize(db, rebuild=True, verbose=False)
+    assert _snapshot_rows(db) == incremental
+    db.close()
+
+
+if __name__ == "__main__":
+    test_bulk_matches_per_fixture()
+    test_incremental_equals_rebuild()
+    test_incremental_picks_up_changed_matches()
+    print("OK")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di team_registry: lookup per alias, fuzzy eseguito una sola volta per nome
+nuovo e salvato, alias imparati dai match a coppie e backfill di fixtures/storico,
+su un DB SQLite in memoria.
+
+Uso: python -m pytest -q test_team_registry.py
+"""
+
+from datetime import date
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Fixture, HistoricalMatch, TeamAlias, TeamMapping
+from team_registry import (SRC_FD, SRC_FDCO, SRC_TOA, SRC_UNDERSTAT, TeamRegistry, alias_key,
+                           backfill, best_pair)
+
+
+def _session():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False)()
+
+
+def test_alias_key_and_best_pair():
+    assert alias_key("FC Internazionale Milano") == alias_key("Internazionale Milano FC")
+    assert alias_key("Atlético Madrid") == "atletico madrid"
+    i, score, swapped = best_pair("Inter Milan", "AC Milan",
+                                  [("Roma", "Lazio"), ("Milan", "Internazionale")], threshold=50)
+    assert i == 1 and swapped and score >= 50
+
+
+def test_resolve_fuzzy_once_and_persisted():
+    db = _session()
+    reg = TeamRegistry(db)
+    inter = reg.resolve("FC Internazionale Milano", SRC_FD, league="SA")
+    roma = reg.resolve("AS Roma", SRC_FD, league="SA")
+    assert inter != roma and reg.fuzzy_calls == 2  # registro vuoto: due squadre nuove
+
+    # nome nuovo ma simile nella stessa lega: fuzzy una volta, poi lookup
+    assert reg.resolve("Internazionale Milan", SRC_TOA, league="SA") == inter
+    calls = reg.fuzzy_calls
+    assert reg.resolve("Internazionale Milan", SRC_TOA, league="SA") == inter
+    assert reg.fuzzy_calls == calls
+    db.commit()
+
+    # un registro nuovo rilegge gli alias dal DB senza fuzzy
+    reg2 = TeamRegistry(db)
+    assert reg2.lookup("Internazionale Milan", SRC_TOA) == inter
+    assert reg2.lookup("Roma") == roma and reg2.fuzzy_calls == 0
+    methods = {a.alias: a.method for a in db.query(TeamAlias)}
+    assert methods["Internazionale Milan"] == "fuzzy" and methods["AS Roma"] == "new"
+
+    # fuori lega il fuzzy non cerca: nasce una squadra nuova
+    assert reg2.resolve("Roma", SRC_FDCO, league="PL") == roma  # stessa chiave: lookup
+    assert reg2.resolve("Internacional", SRC_FD, league="PL") not in (inter, roma)
+
+
+def test_learn_pair_and_name_for():
+    db = _session()
+    reg = TeamRegistry(db)
+    hid = reg.resolve("Wolverhampton Wanderers FC", SRC_FD, league="PL")
+    aid = reg.resolve("Brighton & Hove Albion FC", SRC_FD, league="PL")
+    reg.learn_pair("Wolves", "Brighton and Hove Albion", SRC_TOA, hid, aid, score=82.0)
+    assert reg.lookup("Wolves", SRC_TOA) == hid and reg.lookup("Brighton and Hove Albion") == aid
+    assert not reg.learn("Wolves", SRC_TOA, hid)  # già noto
+    reg.learn("Wolverhampton Wanderers", SRC_UNDERSTAT, hid, method="seed")
+    assert reg.name_for(hid, SRC_UNDERSTAT) == "Wolverhampton Wanderers"
+    assert reg.name_for(aid, SRC_UNDERSTAT) is None
+
+
+def test_backfill_assigns_ids_to_fixtures_and_history():
+    db = _session()
+    day = date(2024, 3, 2)
+    db.add_all([
+        Fixture(match_id="m1", date=day, league_code="PL",
+                home="Manchester United FC", away="Nottingham Forest FC"),
+        Fixture(match_id="m2", date=date(2024, 3, 9), league_code="PL",
+                home="Nottingham Forest FC", away="Arsenal FC"),
+        HistoricalMatch(match_id="h1", date=day, league="Premier League",
+                        home="Man United", away="Nott'm Forest"),
+        HistoricalMatch(match_id="h2", date=date(2023, 8, 12), league="Premier League",
+                        home="Nott'm Forest", away="Arsenal"),
+        TeamMapping(source_name="Manchester United FC", league_code="PL",
+                    understat_name="Manchester_United", source="football-data.org"),
+    ])
+    db.commit()
+
+    out = backfill(db)
+    db.commit()
+    assert out["fixtures"] == 3 and out["linked_history"] == 1
+
+    reg = TeamRegistry(db)
+    mu, forest, arsenal = (reg.lookup(n, SRC_FD) for n in
+                           ("Manchester United FC", "Nottingham Forest FC", "Arsenal FC"))
+    m1 = db.get(Fixture, "m1")
+    assert (m1.home_team_id, m1.away_team_id) == (mu, forest)
+    # nomi dello storico collegati alle fixtures della stessa data, poi per lookup
+    assert reg.lookup("Man United", SRC_FDCO) == mu and reg.lookup("Nott'm Forest", SRC_FDCO) == forest
+    h2 = db.get(HistoricalMatch, "h2")
+    assert (h2.home_team_id, h2.away_team_id) == (forest, arsenal)
+    assert reg.name_for(mu, SRC_UNDERSTAT) == "Manchester_United"
+
+    # rieseguire il backfill non duplica alias né squadre
+    n_alias = db.query(TeamAlias).count()
+    backfill(db)
+    db.commit()
+    assert db.query(TeamAlias).count() == n_alias
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di understat_cache: stesse medie xG/xGA e ultima data del vecchio calcolo
+su _extract_json_from_understat (ricerca lineare sulle partite), riuso di
+memoria e .npz, rigenerazione quando l'HTML in cache cambia.
+
+Uso: python -m pytest -q test_understat_cache.py
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import understat_cache as uc
+from features_populator import _extract_json_from_understat
+
+
+def _page(matches):
+    """Pagina squadra con matchesData in JSON.parse('...') escapato come su Understat."""
+    raw = json.dumps(matches).replace("'", "\\x27").replace('"', "\\x22")
+    return f"<html><script>\n var matchesData = JSON.parse('{raw}');\n</script></html>"
+
+
+def _matches(seed, n=40):
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 8, 17, 18, 0)
+    days = np.sort(rng.choice(300, n, replace=False))  # date distinte, ordine mescolato nella pagina
+    out = [{"date": (start + timedelta(days=int(d))).strftime("%Y-%m-%d %H:%M:%S"),
+            "xG": f"{rng.gamma(3, 0.45):.4f}", "xGA": f"{rng.gamma(3, 0.4):.4f}"} for d in days]
+    out.append({"date": "n/d", "xG": "1.0", "xGA": "1.0"})  # data non valida: scartata
+    return [out[i] for i in rng.permutation(len(out))]
+
+
+def _legacy_recent_xg(html, date_iso, n, default=uc.DEFAULT_XG_VALUE):
+    """Il vecchio compute_xg_and_rest dopo il download: filtro, ordinamento e media su ogni chiamata."""
+    data = _extract_json_from_understat(html, "matchesData")
+    if not data:
+        return (default, default, None)
+    cut = datetime.fromisoformat(date_iso[:10])
+    rows = []
+    for m in data:
+        try:
+            dt = datetime.strptime(m.get("date"), "%Y-%m-%d %H:%M:%S")
+        except Exception:
+            continue
+        if dt.date() > cut.date():
+            continue
+        rows.append((dt, float(m.get("xG", 0.0) or 0.0), float(m.get("xGA", 0.0) or 0.0)))
+    rows.sort(key=lambda r: r[0], reverse=True)
+    last_dt = rows[0][0] if rows else None
+    rows = rows[: max(1, n)]
+    if not rows:
+        return (default, default, last_dt)
+    weights = list(range(len(rows), 0, -1))
+    total = sum(weights)
+    xg = sum(r[1] * w for r, w in zip(rows, weights)) / total
+    xga = sum(r[2] * w for r, w in zip(rows, weights)) / total
+    return (round(xg, 3), round(xga, 3), last_dt)
+
+
+def test_recent_xg_matches_legacy(tmp_path):
+    uc.clear_memory_cache()
+    html = _page(_matches(seed=5))
+    path = tmp_path / "Inter_2024.html"
+    path.write_text(html, encoding="utf-8")
+    tm = uc.team_matches(path)
+    assert len(tm) == 40 and np.all(np.diff(tm.ts) > 0)
+
+    day = datetime(2024, 8, 10)
+    for _ in range(320):
+        for n in (0, 1, 5, 8):
+            date_iso = f"{day:%Y-%m-%d}"
+            assert uc.recent_xg(tm, date_iso, n) == _legacy_recent_xg(html, date_iso, n), (date_iso, n)
+        day += timedelta(days=1)
+
+
+def test_parsed_cache_reused_and_invalidated(tmp_path, monkeypatch):
+    uc.clear_memory_cache()
+    parses = []
+    real_parse = uc.parse_team_page
+    monkeypatch.setattr(uc, "parse_team_page", lambda html: parses.append(1) or real_parse(html))
+
+    path = tmp_path / "Milan_2024.html"
+    path.write_text(_page(_matches(seed=1, n=10)), encoding="utf-8")
+    first = uc.team_matches(path)
+    assert len(first) == 10 and len(parses) == 1
+    assert uc.team_matches(path) is first                 # memoria
+    uc.clear_memory_cache()
+    assert np.array_equal(uc.team_matches(path).ts, first.ts) and len(parses) == 1  # .npz
+
+    # HTML riscaricato con una partita in più: memoria e .npz non valgono più
+    html = _page(_matches(seed=2, n=11))
+    path.write_text(html, encoding="utf-8")
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    changed = uc.team_matches(path)
+    assert len(changed) == 11 and len(parses) == 2
+    uc.clear_memory_cache()
+    assert len(uc.team_matches(path)) == 11 and len(parses) == 2  # .npz rigenerato
+    assert uc.recent_xg(changed, "2025-12-31", 5) == _legacy_recent_xg(html, "2025-12-31", 5)
+    assert uc.team_matches(tmp_path / "missing.html") is None
@@ -73,14 +73,99 @@ def check_features(date_str: str) -> int:
     except Exception:
         return 1
 
+# Query calde (stessa forma di quelle nel codice) per db-explain
+HOT_QUERIES = [
+    ("advanced_features.get_team_form: ultime N della squadra nella lega",
+     "SELECT f.match_id FROM fixtures f JOIN features ft ON f.match_id = ft.match_id "
+     "WHERE f.league = :league AND f.date < :date AND (f.home = :team OR f.away = :team) "
+     "ORDER BY f.date DESC LIMIT 5"),
+    ("advanced_features.get_head_to_head: scontri diretti",
+     "SELECT f.match_id FROM fixtures f LEFT JOIN features ft ON f.match_id = ft.match_id "
+     "WHERE f.league = :league AND f.date < :date "
+     "AND ((f.home = :team AND f.away = :opp) OR (f.home = :opp AND f.away = :team)) "
+     "ORDER BY f.date DESC LIMIT 5"),
+    ("advanced_features.get_league_standings: partite giocate della stagione",
+     "SELECT f.match_id FROM fixtures f WHERE f.league = :league AND f.date < :date "
+     "AND f.date >= :season AND (f.home = :team OR f.away = :team) AND f.result_home_goals IS NOT NULL"),
+    ("context_analyzer_v2._fetch_history: ultime N giocate per team_id (ramo casa)",
+     "SELECT f.date FROM fixtures f WHERE f.home_team_id = :team_id AND f.date < :date "
+     "AND f.result_home_goals IS NOT NULL ORDER BY f.date DESC LIMIT 10"),
+    ("context_analyzer_v2._fetch_history: ultime N giocate per nome esatto (ramo trasferta)",
+     "SELECT f.date FROM fixtures f WHERE f.away = :team AND f.date < :date "
+     "AND f.result_home_goals IS NOT NULL ORDER BY f.date DESC LIMIT 10"),
+    ("team_form_store.load_played: partite con risultato in ordine cronologico",
+     "SELECT f.match_id FROM fixtures f LEFT JOIN features ft ON f.match_id = ft.match_id "
+     "WHERE f.date IS NOT NULL AND f.result_home_goals IS NOT NULL AND f.result_away_goals IS NOT NULL "
+     "ORDER BY f.date, f.match_id"),
+    ("data_browser.fetch_page: pagina /data per lega",
+     "SELECT f.match_id FROM fixtures f LEFT JOIN odds o ON f.match_id = o.match_id "
+     "LEFT JOIN features ft ON f.match_id = ft.match_id WHERE f.league_code = :code "
+     "AND (f.date < :date OR (f.date = :date AND f.match_id < :mid)) "
+     "ORDER BY f.date DESC, f.match_id DESC LIMIT 101"),
+    ("proposal_generator / predictions: partite di una data",
+     "SELECT f.match_id FROM fixtures f LEFT JOIN odds o ON f.match_id = o.match_id "
+     "LEFT JOIN features ft ON f.match_id = ft.match_id WHERE f.date = :date"),
+]
+
+
+def db_explain() -> int:
+    """Stampa pragma attivi, indici mancanti e piano di esecuzione delle query calde."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sqlalchemy import inspect, text
+    from database import Base, engine
+    import models  # noqa: F401
+
+    if engine.dialect.name != "sqlite":
+        print(f"[ERR] db-explain supporta solo SQLite (motore: {engine.dialect.name})")
+        return 2
+    insp = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        have = {ix["name"] for ix in insp.get_indexes(table.name)}
+        missing += [ix.name for ix in table.indexes if ix.name not in have]
+
+    with engine.connect() as conn:
+        print(f"[INFO] DB: {engine.url.database}")
+        for p in ("journal_mode", "synchronous", "busy_timeout", "mmap_size", "cache_size"):
+            print(f"       {p} = {conn.execute(text(f'PRAGMA {p}')).scalar()}")
+        if missing:
+            print(f"[WARN] Indici mancanti ({len(missing)}): {', '.join(missing)} -> python init_db.py")
+
+        # parametri realistici presi dal DB (l'ultima partita giocata)
+        row = conn.execute(text(
+            "SELECT league, league_code, home, away, date, match_id FROM fixtures "
+            "WHERE result_home_goals IS NOT NULL ORDER BY date DESC LIMIT 1"
+        )).first() or conn.execute(text(
+            "SELECT league, league_code, home, away, date, match_id FROM fixtures ORDER BY date DESC LIMIT 1"
+        )).first()
+        league, code, team, opp, day, mid = row if row else ("Serie A", "SA", "Inter", "Milan", "2025-01-01", "x")
+        params = {"league": league, "code": code, "team": team, "opp": opp, "date": str(day),
+                  "season": f"{str(day)[:4]}-07-01", "mid": mid, "team_id": 1}
+
+        slow = 0
+        for label, sql in HOT_QUERIES:
+            plan = [r[-1] for r in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params)]
+            scans = [p for p in plan if p.startswith("SCAN") and "COVERING INDEX" not in p and "USING INDEX" not in p]
+            flag = "[WARN]" if scans else "[OK]"
+            slow += bool(scans)
+            print(f"\n{flag} {label}")
+            for p in plan:
+                print(f"       {p}")
+    return 1 if (slow or missing) else 0
+
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("what", choices=["config","fixtures","odds","features"])
+    ap.add_argument("what", choices=["config","fixtures","odds","features","db-explain"])
     ap.add_argument("--date", help="YYYY-MM-DD (per fixtures/odds/features)")
     args = ap.parse_args()
 
     if args.what == "config":
         code = check_config()
+    elif args.what == "db-explain":
+        code = db_explain()
     elif args.what == "fixtures":
         if not args.date: 
             print("[ERR] --date richiesto"); sys.exit(2)
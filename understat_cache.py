@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+understat_cache.py
+------------------
+Secondo livello di cache per le pagine squadra Understat.
+
+L'HTML in cache/understat/*.html resta la fonte di verità. Da ogni pagina
+squadra-stagione si estraggono una sola volta le partite come array
+compatti ordinati per data (timestamp, xG, xGA), salvati in
+cache/understat/parsed/<nome>.npz e tenuti in memoria per tutto il processo.
+Quando cambia l'mtime (o la dimensione) del file HTML, la versione parsata
+viene rigenerata automaticamente.
+
+"Ultime N partite prima della data" diventa una ricerca binaria sui
+timestamp più una media pesata sulla fetta risultante.
+
+Formati pagina supportati:
+- matchesData: [{"date": "YYYY-mm-dd HH:MM:SS", "xG": .., "xGA": ..}, ...]
+- datesData (formato attuale delle pagine squadra): [{"datetime": ..,
+  "side": "h"|"a", "isResult": bool, "xG": {"h": .., "a": ..}}, ...]
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import count
+
+PARSED_SUBDIR = "parsed"
+DEFAULT_XG_VALUE = 1.2
+
+_EPOCH = datetime(1970, 1, 1)
+_DATE_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+class TeamMatches:
+    """Partite di una squadra-stagione, ordinate per data (timestamp naive in secondi)."""
+    __slots__ = ("ts", "xg", "xga")
+
+    def __init__(self, ts: np.ndarray, xg: np.ndarray, xga: np.ndarray):
+        self.ts = ts    # int64
+        self.xg = xg    # float64
+        self.xga = xga  # float64
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+
+_EMPTY = TeamMatches(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+
+# path HTML -> ((mtime_ns, size), TeamMatches)
+_MEMO: Dict[str, Tuple[Tuple[int, int], TeamMatches]] = {}
+
+
+# -------------- PARSER HTML --------------
+def extract_json_from_understat(html: str, varname: str) -> Optional[list]:
+    """
+    Estrae un oggetto JSON da una variabile JavaScript all'interno di un tag <script> nel codice HTML.
+    È progettato per essere robusto a cambiamenti minori nel formato della pagina.
+    """
+    # Cerca il tag <script> che contiene la variabile per restringere la ricerca
+    script_tag_pattern = re.compile(rf"<script>.*?\b{re.escape(varname)}\b.*?</script>", re.DOTALL)
+    match = script_tag_pattern.search(html)
+
+    if not match:
+        return None
+
+    script_content = match.group(0)
+
+    # Cerca il pattern di assegnazione della variabile. Questo gestisce:
+    # 1. var/let/const nome_variabile = JSON.parse('stringa_json_escapata')
+    # 2. var/let/const nome_variabile = [{...}] o {{...}} (JSON letterale)
+    data_pattern = re.search(
+        rf"\b{re.escape(varname)}\s*=\s*(?:JSON\.parse\(\s*'((?:\\.|[^'])*)'\s*\)|(\[.*?\]|\{{.*?\}}))\s*;?",
+        script_content,
+        re.DOTALL
+    )
+
+    if not data_pattern:
+        return None
+
+    escaped_json_str = data_pattern.group(1)
+    literal_json_str = data_pattern.group(2)
+
+    json_to_parse = None
+    if escaped_json_str:
+        try:
+            # La stringa è escapata per JavaScript. `unicode_escape` è un buon metodo per decodificarla.
+            json_to_parse = bytes(escaped_json_str, "utf-8").decode("unicode_escape")
+        except Exception:
+            return None
+    elif literal_json_str:
+        json_to_parse = literal_json_str
+
+    if json_to_parse:
+        try:
+            return json.loads(json_to_parse)
+        except json.JSONDecodeError:
+            return None
+
+    return None
+
+
+def _to_ts(dt: datetime) -> int:
+    return int((dt - _EPOCH).total_seconds())
+
+
+def _from_ts(ts: int) -> datetime:
+    return _EPOCH + timedelta(seconds=int(ts))
+
+
+def _rows_from_matches_data(data: list) -> List[Tuple[int, float, float]]:
+    rows = []
+    for m in data:
+        try:
+            dt = datetime.strptime(m.get("date"), _DATE_FMT)
+        except Exception:
+            continue
+        xg = float(m.get("xG", 0.0) or 0.0)
+        xga = float(m.get("xGA", 0.0) or 0.0)
+        rows.append((_to_ts(dt), xg, xga))
+    return rows
+
+
+def _rows_from_dates_data(data: list) -> List[Tuple[int, float, float]]:
+    rows = []
+    for m in data:
+        if not m.get("isResult"):
+            continue  # partita non ancora giocata: xG assenti
+        side = m.get("side")
+        other = {"h": "a", "a": "h"}.get(side)
+        xg_map = m.get("xG") or {}
+        if other is None or not isinstance(xg_map, dict):
+            continue
+        try:
+            dt = datetime.strptime(m.get("datetime"), _DATE_FMT)
+            xg = float(xg_map.get(side) or 0.0)
+            xga = float(xg_map.get(other) or 0.0)
+        except Exception:
+            continue
+        rows.append((_to_ts(dt), xg, xga))
+    return rows
+
+
+def parse_team_page(html: str) -> TeamMatches:
+    """Estrae le partite dalla pagina squadra (matchesData o datesData) come array ordinati."""
+    rows: List[Tuple[int, float, float]] = []
+    data = extract_json_from_understat(html, "matchesData")
+    if data:
+        rows = _rows_from_matches_data(data)
+    else:
+        data = extract_json_from_understat(html, "datesData")
+        if data and isinstance(data, list):
+            rows = _rows_from_dates_data(data)
+    if not rows:
+        return _EMPTY
+    ts = np.array([r[0] for r in rows], dtype=np.int64)
+    order = np.argsort(ts, kind="mergesort")
+    return TeamMatches(
+        ts[order],
+        np.array([r[1] for r in rows], dtype=float)[order],
+        np.array([r[2] for r in rows], dtype=float)[order],
+    )
+
+
+# -------------- CACHE A DUE LIVELLI --------------
+def _parsed_path(html_path: Path) -> Path:
+    return html_path.parent / PARSED_SUBDIR / f"{html_path.stem}.npz"
+
+
+def team_matches(html_path: Path, html: Optional[str] = None) -> Optional[TeamMatches]:
+    """
+    Partite parsate per una pagina HTML in cache (None se il file non esiste).
+
+    Ordine di lookup: memoria del processo → .npz su disco → parsing dell'HTML.
+    Memoria e .npz sono validi solo se (mtime_ns, size) dell'HTML coincidono.
+    `html` evita di rileggere il file quando il chiamante l'ha appena scaricato.
+    """
+    html_path = Path(html_path)
+    try:
+        st = html_path.stat()
+    except OSError:
+        return None
+    sig = (st.st_mtime_ns, st.st_size)
+    key = str(html_path.resolve())
+
+    hit = _MEMO.get(key)
+    if hit and hit[0] == sig:
+        count("cache_hits")
+        return hit[1]
+
+    parsed_p = _parsed_path(html_path)
+    tm: Optional[TeamMatches] = None
+    if parsed_p.exists():
+        try:
+            with np.load(parsed_p) as z:
+                if tuple(int(v) for v in z["sig"]) == sig:
+                    tm = TeamMatches(z["ts"], z["xg"], z["xga"])
+        except Exception:
+            tm = None
+
+    if tm is not None:
+        count("cache_hits")
+    else:
+        count("cache_misses")
+        if html is None:
+            try:
+                html = html_path.read_text(encoding="utf-8", errors="ignore")
+            except Exception:
+                return None
+        tm = parse_team_page(html)
+        try:
+            parsed_p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = parsed_p.with_name(parsed_p.name + ".tmp.npz")
+            np.savez(tmp, sig=np.array(sig, dtype=np.int64), ts=tm.ts, xg=tm.xg, xga=tm.xga)
+            tmp.replace(parsed_p)
+        except Exception:
+            pass
+
+    _MEMO[key] = (sig, tm)
+    return tm
+
+
+def recent_xg(
+    tm: TeamMatches, date_iso: str, n: int, default: float = DEFAULT_XG_VALUE
+) -> Tuple[float, float, Optional[datetime]]:
+    """
+    Media pesata xG/xGA delle ultime N partite giocate entro date_iso (giorno incluso)
+    + datetime dell'ultima partita. Stessi pesi e arrotondamento di compute_xg_and_rest.
+    """
+    cut = datetime.fromisoformat(date_iso[:10]) + timedelta(days=1)
+    idx = int(np.searchsorted(tm.ts, _to_ts(cut), side="left"))
+    if idx == 0:
+        return (default, default, None)
+
+    last_dt = _from_ts(tm.ts[idx - 1])
+    k = min(max(1, n), idx)
+    # Dalla più recente: pesi k, k-1, ..., 1
+    xg = tm.xg[idx - k:idx][::-1].tolist()
+    xga = tm.xga[idx - k:idx][::-1].tolist()
+    weights = list(range(k, 0, -1))
+    total_weight = sum(weights)
+    xg_avg = sum(x * w for x, w in zip(xg, weights)) / total_weight
+    xga_avg = sum(x * w for x, w in zip(xga, weights)) / total_weight
+    return (round(xg_avg, 3), round(xga_avg, 3), last_dt)
+
+
+def clear_memory_cache() -> None:
+    """Svuota la cache in memoria (il livello .npz su disco resta)."""
+    _MEMO.clear()
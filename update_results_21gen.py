@@ -6,6 +6,7 @@ Aggiorna database con risultati Champions 21 gennaio 2026
 
 from datetime import date
 from database import SessionLocal
+from market_cache import bump_dates
 from models import Fixture
 
 print("=" * 100)
@@ -61,6 +62,8 @@ for home, away, hg, ag in results:
             print(f"❌ NON TROVATA: {home} vs {away}")
             not_found.append((home, away))
 
+if updated:
+    bump_dates(db, [match_date])
 db.commit()
 db.close()
 
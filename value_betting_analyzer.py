@@ -14,10 +14,10 @@ from datetime import date
 import joblib
 import numpy as np
 import pandas as pd
-from scipy.stats import poisson
 
 from database import SessionLocal
 from models import Fixture
+from poisson_kernel import score_tensor
 
 # ========================================
 # CARICA MODELLI ML (STESSI DI PRIMA)
@@ -223,9 +223,8 @@ for fix in fixtures:
         lam_h = (X_dict['xg_for_home'] + X_dict['xg_against_away']) / 2
         lam_a = (X_dict['xg_for_away'] + X_dict['xg_against_home']) / 2
 
-        p_gg = 1 - (poisson.pmf(0, lam_h) * sum(poisson.pmf(j, lam_a) for j in range(10)) +
-                    sum(poisson.pmf(i, lam_h) for i in range(10)) * poisson.pmf(0, lam_a) -
-                    poisson.pmf(0, lam_h) * poisson.pmf(0, lam_a))
+        m = score_tensor(lam_h, lam_a, 9)[0]
+        p_gg = 1 - float(m[0, :].sum() + m[:, 0].sum() - m[0, 0])
         p_ng = 1 - p_gg
 
         # DC